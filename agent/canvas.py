@@ -19,13 +19,15 @@ import inspect
 import binascii
 import json
 import logging
+import os
 import re
 import time
 from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
-from functools import partial
+from functools import lru_cache, partial
 from typing import Any, Union, Tuple
 
+from agent.compiled_canvas import CompiledCanvas
 from agent.component import component_class
 from agent.component.base import ComponentBase
 from api.db.services.file_service import FileService
@@ -37,6 +39,39 @@ from common.exceptions import TaskCanceledException
 from rag.prompts.generator import chunks_format
 from rag.utils.redis_conn import REDIS_CONN
 
+# Components of a batch running at once, and per component type (e.g. "retrieval:4,invoke:2,agent:2").
+AGENT_MAX_CONCURRENT_COMPONENTS = int(os.environ.get("AGENT_MAX_CONCURRENT_COMPONENTS", "5"))
+AGENT_COMPONENT_CONCURRENCY = {
+    k.strip().lower(): int(v)
+    for k, v in (kv.split(":") for kv in os.environ.get("AGENT_COMPONENT_CONCURRENCY", "").split(",") if ":" in kv)
+}
+
+_VARIABLE_REF_PATT = re.compile(r"\{* *\{([a-zA-Z:0-9]+@[A-Za-z0-9_.-]+|sys\.[A-Za-z0-9_.]+|env\.[A-Za-z0-9_.]+)\} *\}*")
+# Longer texts are split into literals and variable references without caching them.
+_TEMPLATE_CACHE_MAX_LEN = 8192
+
+
+def _split_template(value: str) -> tuple[tuple[str, ...], tuple[str, ...]]:
+    literals, keys = [], []
+    last = 0
+    for m in _VARIABLE_REF_PATT.finditer(value):
+        literals.append(value[last:m.start()])
+        keys.append(m.group(1))
+        last = m.end()
+    literals.append(value[last:])
+    return tuple(literals), tuple(keys)
+
+
+_split_template_cached = lru_cache(maxsize=4096)(_split_template)
+
+
+def compile_template(value: str) -> tuple[tuple[str, ...], tuple[str, ...]]:
+    """The literal parts and variable references of `value`; `literals[i]` precedes `keys[i]`."""
+    if len(value) > _TEMPLATE_CACHE_MAX_LEN:
+        return _split_template(value)
+    return _split_template_cached(value)
+
+
 class Graph:
     """
         dsl = {
@@ -78,11 +113,12 @@ class Graph:
         }
         """
 
-    def __init__(self, dsl: str, tenant_id=None, task_id=None, custom_header=None):
+    def __init__(self, dsl: str, tenant_id=None, task_id=None, custom_header=None, compiled: CompiledCanvas = None):
         self.path = []
         self.components = {}
         self.error = ""
-        self.dsl = json.loads(dsl)
+        self._compiled = compiled
+        self.dsl = compiled.new_dsl() if compiled else json.loads(dsl)
         self._tenant_id = tenant_id
         self.task_id = task_id if task_id else get_uuid()
         self.custom_header = custom_header
@@ -90,6 +126,12 @@ class Graph:
         self.load()
 
     def load(self):
+        if self._compiled:
+            self._names = self._compiled.names
+            self.components = self._compiled.instantiate(self, self.custom_header)
+            self.path = self.dsl["path"]
+            return
+        self._names = {n["id"]: n["data"]["name"] for n in self.dsl.get("graph", {}).get("nodes", [])}
         self.components = self.dsl["components"]
         cpn_nms = set([])
         for k, cpn in self.components.items():
@@ -138,10 +180,7 @@ class Graph:
             logging.exception(e)
 
     def get_component_name(self, cid):
-        for n in self.dsl.get("graph", {}).get("nodes", []):
-            if cid == n["id"]:
-                return n["data"]["name"]
-        return ""
+        return self._names.get(cid, "")
 
     def run(self, **kwargs):
         raise NotImplementedError()
@@ -162,13 +201,13 @@ class Graph:
         return self._tenant_id
 
     def get_value_with_variable(self,value: str) -> Any:
-        pat = re.compile(r"\{* *\{([a-zA-Z:0-9]+@[A-Za-z0-9_.-]+|sys\.[A-Za-z0-9_.]+|env\.[A-Za-z0-9_.]+)\} *\}*")
+        literals, keys = compile_template(value)
+        if not keys:
+            return value
         out_parts = []
-        last = 0
 
-        for m in pat.finditer(value):
-            out_parts.append(value[last:m.start()])
-            key = m.group(1)
+        for literal, key in zip(literals, keys):
+            out_parts.append(literal)
             v = self.get_variable_value(key)
             if v is None:
                 rep = ""
@@ -183,9 +222,8 @@ class Graph:
                 rep = json.dumps(v, ensure_ascii=False)
 
             out_parts.append(rep)
-            last = m.end()
 
-        out_parts.append(value[last:])
+        out_parts.append(literals[-1])
         return("".join(out_parts))
 
     def get_variable_value(self, exp: str) -> Any:
@@ -280,7 +318,7 @@ class Graph:
 
 class Canvas(Graph):
 
-    def __init__(self, dsl: str, tenant_id=None, task_id=None, canvas_id=None, custom_header=None):
+    def __init__(self, dsl: str, tenant_id=None, task_id=None, canvas_id=None, custom_header=None, compiled: CompiledCanvas = None):
         self.globals = {
             "sys.query": "",
             "sys.user_id": tenant_id,
@@ -289,7 +327,7 @@ class Canvas(Graph):
             "sys.history": []
         }
         self.variables = {}
-        super().__init__(dsl, tenant_id, task_id, custom_header=custom_header)
+        super().__init__(dsl, tenant_id, task_id, custom_header=custom_header, compiled=compiled)
         self._id = canvas_id
 
     def load(self):
@@ -321,6 +359,24 @@ class Canvas(Graph):
         self.dsl["memory"] = self.memory
         return super().__str__()
 
+    def get_state(self) -> dict:
+        """The runtime state of a canvas instantiated from a compiled canvas, as a diff against it."""
+        assert self._compiled, "Only canvases instantiated from a compiled canvas have a separate state."
+        return self._compiled.diff_state(self)
+
+    def set_state(self, state: dict):
+        self.path = self.dsl["path"] = state.get("path", self.path)
+        self.history = self.dsl["history"] = state.get("history", self.history)
+        self.retrieval = self.dsl["retrieval"] = state.get("retrieval", self.retrieval)
+        self.memory = self.dsl["memory"] = state.get("memory", self.memory)
+        if "globals" in state:
+            self.globals = self.dsl["globals"] = state["globals"]
+        if "variables" in state:
+            self.variables = self.dsl["variables"] = state["variables"]
+        for cid, params in state.get("components", {}).items():
+            if cid in self.components:
+                self.components[cid]["obj"]._param.update(params)
+
     def reset(self, mem=False):
         super().reset()
         if not mem:
@@ -419,54 +475,120 @@ class Canvas(Graph):
         yield decorate("workflow_started", {"inputs": kwargs.get("inputs")})
         self.retrieval.append({"chunks": {}, "doc_aggs": {}})
 
-        async def _run_batch(f, t):
-            if self.is_canceled():
-                msg = f"Task {self.task_id} has been canceled during batch execution."
-                logging.info(msg)
-                raise TaskCanceledException(msg)
-
-            loop = asyncio.get_running_loop()
-            tasks = []
-            max_concurrency = getattr(self._thread_pool, "_max_workers", 5)
-            sem = asyncio.Semaphore(max_concurrency)
-
-            async def _invoke_one(cpn_obj, sync_fn, call_kwargs, use_async: bool):
-                async with sem:
-                    if use_async:
-                        await cpn_obj.invoke_async(**(call_kwargs or {}))
-                        return
-                    await loop.run_in_executor(self._thread_pool, partial(sync_fn, **(call_kwargs or {})))
-
-            i = f
-            while i < t:
-                cpn = self.get_component_obj(self.path[i])
-                task_fn = None
-                call_kwargs = None
-
-                if cpn.component_name.lower() in ["begin", "userfillup"]:
-                    call_kwargs = {"inputs": kwargs.get("inputs", {})}
-                    task_fn = cpn.invoke
-                    i += 1
-                else:
-                    for _, ele in cpn.get_input_elements().items():
-                        if isinstance(ele, dict) and ele.get("_cpn_id") and ele.get("_cpn_id") not in self.path[:i] and self.path[0].lower().find("userfillup") < 0:
-                            self.path.pop(i)
-                            t -= 1
-                            break
-                    else:
-                        call_kwargs = cpn.get_input()
-                        task_fn = cpn.invoke
-                        i += 1
-
-                if task_fn is None:
-                    continue
-
-                fn_invoke_async = getattr(cpn, "_invoke_async", None)
-                use_async = (fn_invoke_async and asyncio.iscoroutinefunction(fn_invoke_async)) or asyncio.iscoroutinefunction(getattr(cpn, "_invoke", None))
-                tasks.append(asyncio.create_task(_invoke_one(cpn, task_fn, call_kwargs, use_async)))
+        # Timing of the components run in this round: when they became ready, started and finished,
+        # and the longest chain of dependencies ending with them.
+        timing = {}
+        sems = {"": asyncio.Semaphore(AGENT_MAX_CONCURRENT_COMPONENTS)}
 
-            if tasks:
-                await asyncio.gather(*tasks)
+        def _semaphore(component_name):
+            name = component_name.lower()
+            if name not in AGENT_COMPONENT_CONCURRENCY:
+                return None
+            if name not in sems:
+                sems[name] = asyncio.Semaphore(max(1, AGENT_COMPONENT_CONCURRENCY[name]))
+            return sems[name]
+
+        def _dependencies(cpn_id, cpn_obj):
+            deps = set(self.get_component(cpn_id).get("upstream", []))
+            for _, ele in cpn_obj.get_input_elements().items():
+                if isinstance(ele, dict) and ele.get("_cpn_id"):
+                    deps.add(ele["_cpn_id"])
+            deps.discard(cpn_id)
+            return deps
+
+        # Components started in this round and not post-processed yet, each with the event set once it
+        # is; and the running tasks. A component waits for the events of the active components it depends
+        # on, so its successors are started by the post-processing before it counts as done.
+        active = {}
+        running = {}
+        started = []
+        deferred = []
+        loop = asyncio.get_running_loop()
+        from_user_inputs = self.path[0].lower().find("userfillup") >= 0
+
+        async def _invoke_one(cpn_id, cpn_obj, deps, waits, use_async: bool):
+            if waits:
+                await asyncio.gather(*(ev.wait() for ev in waits))
+            timing[cpn_id] = {"ready": time.perf_counter(), "deps": deps}
+            type_sem = _semaphore(cpn_obj.component_name)
+            # The type's limit first: components waiting for it must not hold slots of the round.
+            if type_sem:
+                await type_sem.acquire()
+            try:
+                async with sems[""]:
+                    timing[cpn_id]["start"] = time.perf_counter()
+                    try:
+                        if cpn_obj.component_name.lower() in ["begin", "userfillup"]:
+                            call_kwargs = {"inputs": kwargs.get("inputs", {})}
+                        else:
+                            call_kwargs = cpn_obj.get_input()
+                        if use_async:
+                            await cpn_obj.invoke_async(**(call_kwargs or {}))
+                        else:
+                            await loop.run_in_executor(self._thread_pool, partial(cpn_obj.invoke, **(call_kwargs or {})))
+                    finally:
+                        timing[cpn_id]["end"] = time.perf_counter()
+            finally:
+                if type_sem:
+                    type_sem.release()
+            _critical_path(cpn_id)
+
+        def _start(cpn_id):
+            """
+            Appends cpn_id to the path and starts it as soon as the active components it depends on
+            (upstream or referenced by its inputs) are done, whatever level of the graph they are on.
+            A component referencing the output of one which has not run is dropped.
+            """
+            if cpn_id in active:
+                return
+            cpn_obj = self.get_component_obj(cpn_id)
+            if cpn_obj.component_name.lower() not in ["begin", "userfillup"] and not from_user_inputs and any(
+                    isinstance(ele, dict) and ele.get("_cpn_id") and ele.get("_cpn_id") not in self.path
+                    for ele in cpn_obj.get_input_elements().values()):
+                return
+            deps = _dependencies(cpn_id, cpn_obj)
+            waits = [active[d] for d in deps if d in active]
+            self.path.append(cpn_id)
+            active[cpn_id] = asyncio.Event()
+            fn_invoke_async = getattr(cpn_obj, "_invoke_async", None)
+            use_async = (fn_invoke_async and asyncio.iscoroutinefunction(fn_invoke_async)) or asyncio.iscoroutinefunction(getattr(cpn_obj, "_invoke", None))
+            running[asyncio.create_task(_invoke_one(cpn_id, cpn_obj, deps, waits, use_async))] = cpn_id
+            started.append(decorate("node_started", {
+                "inputs": None, "created_at": int(time.time()),
+                "component_id": cpn_id,
+                "component_name": self.get_component_name(cpn_id),
+                "component_type": self.get_component_type(cpn_id),
+                "thoughts": self.get_component_thoughts(cpn_id)
+            }))
+
+        def _schedule(cpn_id):
+            # Once a UserFillUp is reached, what follows waits for the user's inputs.
+            if deferred or self.get_component_obj(cpn_id).component_name.lower() == "userfillup":
+                if cpn_id not in deferred:
+                    deferred.append(cpn_id)
+                return
+            _start(cpn_id)
+
+        def _critical_path(cpn_id):
+            me = timing[cpn_id]
+            me["critical_path"], me["critical_path_time"] = [], 0
+            for d in me["deps"]:
+                dt = timing.get(d)
+                if dt and "critical_path_time" in dt and dt["end"] <= me["start"] and dt["critical_path_time"] > me["critical_path_time"]:
+                    me["critical_path"], me["critical_path_time"] = dt["critical_path"], dt["critical_path_time"]
+            me["critical_path"] = me["critical_path"] + [cpn_id]
+            me["critical_path_time"] += me["end"] - me["start"]
+
+        def _timing(cpn_id):
+            tm = timing.get(cpn_id)
+            if not tm or "end" not in tm:
+                return None
+            return {
+                "queued_time": tm["start"] - tm["ready"],
+                "run_time": tm["end"] - tm["start"],
+                "critical_path": tm.get("critical_path", []),
+                "critical_path_time": tm.get("critical_path_time", 0),
+            }
 
         def _node_finished(cpn_obj):
             return decorate("node_finished",{
@@ -478,178 +600,199 @@ class Canvas(Graph):
                            "error": cpn_obj.error(),
                            "elapsed_time": time.perf_counter() - cpn_obj.output("_created_time"),
                            "created_at": cpn_obj.output("_created_time"),
+                           "timing": _timing(cpn_obj._id),
                        })
 
         self.error = ""
-        idx = len(self.path) - 1
         partials = []
         tts_mdl = None
-        while idx < len(self.path):
-            to = len(self.path)
-            for i in range(idx, to):
-                yield decorate("node_started", {
-                    "inputs": None, "created_at": int(time.time()),
-                    "component_id": self.path[i],
-                    "component_name": self.get_component_name(self.path[i]),
-                    "component_type": self.get_component_type(self.path[i]),
-                    "thoughts": self.get_component_thoughts(self.path[i])
-                })
-            await _run_batch(idx, to)
-            to = len(self.path)
-            # post-processing of components invocation
-            for i in range(idx, to):
-                cpn = self.get_component(self.path[i])
-                cpn_obj = self.get_component_obj(self.path[i])
-                if cpn_obj.component_name.lower() == "message":
-                    if cpn_obj.get_param("auto_play"):
-                        tts_mdl = LLMBundle(self._tenant_id, LLMType.TTS)
-                    if isinstance(cpn_obj.output("content"), partial):
-                        _m = ""
-                        buff_m = ""
-                        stream = cpn_obj.output("content")()
-                        async def _process_stream(m):
-                            nonlocal buff_m, _m, tts_mdl
-                            if not m:
-                                return
-                            if m == "<think>":
-                                return decorate("message", {"content": "", "start_to_think": True})
-
-                            elif m == "</think>":
-                                return decorate("message", {"content": "", "end_to_think": True})
-
-                            buff_m += m
-                            _m += m
-
-                            if len(buff_m) > 16:
-                                ev = decorate(
-                                    "message",
-                                    {
-                                        "content": m,
-                                        "audio_binary": self.tts(tts_mdl, buff_m)
-                                    }
-                                )
-                                buff_m = ""
-                                return ev
-
-                            return decorate("message", {"content": m})
-
-                        if inspect.isasyncgen(stream):
-                            async for m in stream:
-                                ev= await _process_stream(m)
-                                if ev:
-                                    yield ev
-                        else:
-                            for m in stream:
-                                ev= await _process_stream(m)
-                                if ev:
-                                    yield ev
-                        if buff_m:
-                            yield decorate("message", {"content": "", "audio_binary": self.tts(tts_mdl, buff_m)})
+        async def _post_process(cpn_id):
+            """Streams the outputs of a finished component and schedules what comes next."""
+            nonlocal tts_mdl
+            cpn = self.get_component(cpn_id)
+            cpn_obj = self.get_component_obj(cpn_id)
+            if cpn_obj.component_name.lower() == "message":
+                if cpn_obj.get_param("auto_play"):
+                    tts_mdl = LLMBundle(self._tenant_id, LLMType.TTS)
+                if isinstance(cpn_obj.output("content"), partial):
+                    _m = ""
+                    buff_m = ""
+                    stream = cpn_obj.output("content")()
+                    async def _process_stream(m):
+                        nonlocal buff_m, _m, tts_mdl
+                        if not m:
+                            return
+                        if m == "<think>":
+                            return decorate("message", {"content": "", "start_to_think": True})
+
+                        elif m == "</think>":
+                            return decorate("message", {"content": "", "end_to_think": True})
+
+                        buff_m += m
+                        _m += m
+
+                        if len(buff_m) > 16:
+                            ev = decorate(
+                                "message",
+                                {
+                                    "content": m,
+                                    "audio_binary": self.tts(tts_mdl, buff_m)
+                                }
+                            )
                             buff_m = ""
-                        cpn_obj.set_output("content", _m)
-                        cite = re.search(r"\[ID:[ 0-9]+\]", _m)
-                    else:
-                        yield decorate("message", {"content": cpn_obj.output("content")})
-                        cite = re.search(r"\[ID:[ 0-9]+\]",  cpn_obj.output("content"))
-
-                    message_end = {}
-                    if cpn_obj.get_param("status"):
-                        message_end["status"] = cpn_obj.get_param("status")
-                    if isinstance(cpn_obj.output("attachment"), dict):
-                        message_end["attachment"] = cpn_obj.output("attachment")
-                    if cite:
-                        message_end["reference"] = self.get_reference()
-                    yield decorate("message_end", message_end)
-
-                    while partials:
-                        _cpn_obj = self.get_component_obj(partials[0])
-                        if isinstance(_cpn_obj.output("content"), partial):
-                            break
-                        yield _node_finished(_cpn_obj)
-                        partials.pop(0)
-
-                other_branch = False
-                if cpn_obj.error():
-                    ex = cpn_obj.exception_handler()
-                    if ex and ex["goto"]:
-                        self.path.extend(ex["goto"])
-                        other_branch = True
-                    elif ex and ex["default_value"]:
-                        yield decorate("message", {"content": ex["default_value"]})
-                        yield decorate("message_end", {})
-                    else:
-                        self.error = cpn_obj.error()
+                            return ev
 
-                if cpn_obj.component_name.lower() not in ("iteration","loop"):
-                    if isinstance(cpn_obj.output("content"), partial):
-                        if self.error:
-                            cpn_obj.set_output("content", None)
-                            yield _node_finished(cpn_obj)
-                        else:
-                            partials.append(self.path[i])
+                        return decorate("message", {"content": m})
+
+                    if inspect.isasyncgen(stream):
+                        async for m in stream:
+                            ev= await _process_stream(m)
+                            if ev:
+                                yield ev
                     else:
-                        yield _node_finished(cpn_obj)
+                        for m in stream:
+                            ev= await _process_stream(m)
+                            if ev:
+                                yield ev
+                    if buff_m:
+                        yield decorate("message", {"content": "", "audio_binary": self.tts(tts_mdl, buff_m)})
+                        buff_m = ""
+                    cpn_obj.set_output("content", _m)
+                    cite = re.search(r"\[ID:[ 0-9]+\]", _m)
+                else:
+                    yield decorate("message", {"content": cpn_obj.output("content")})
+                    cite = re.search(r"\[ID:[ 0-9]+\]",  cpn_obj.output("content"))
+
+                message_end = {}
+                if cpn_obj.get_param("status"):
+                    message_end["status"] = cpn_obj.get_param("status")
+                if isinstance(cpn_obj.output("attachment"), dict):
+                    message_end["attachment"] = cpn_obj.output("attachment")
+                if cite:
+                    message_end["reference"] = self.get_reference()
+                yield decorate("message_end", message_end)
+
+                while partials:
+                    _cpn_obj = self.get_component_obj(partials[0])
+                    if isinstance(_cpn_obj.output("content"), partial):
+                        break
+                    yield _node_finished(_cpn_obj)
+                    partials.pop(0)
+
+            other_branch = False
+            if cpn_obj.error():
+                ex = cpn_obj.exception_handler()
+                if ex and ex["goto"]:
+                    for c in ex["goto"]:
+                        _schedule(c)
+                    other_branch = True
+                elif ex and ex["default_value"]:
+                    yield decorate("message", {"content": ex["default_value"]})
+                    yield decorate("message_end", {})
+                else:
+                    self.error = cpn_obj.error()
 
-                def _append_path(cpn_id):
-                    nonlocal other_branch
-                    if other_branch:
-                        return
-                    if self.path[-1] == cpn_id:
-                        return
-                    self.path.append(cpn_id)
-
-                def _extend_path(cpn_ids):
-                    nonlocal other_branch
-                    if other_branch:
-                        return
-                    for cpn_id in cpn_ids:
-                        _append_path(cpn_id)
-
-                if cpn_obj.component_name.lower() in ("iterationitem","loopitem") and cpn_obj.end():
-                    iter = cpn_obj.get_parent()
-                    yield _node_finished(iter)
-                    _extend_path(self.get_component(cpn["parent_id"])["downstream"])
-                elif cpn_obj.component_name.lower() in ["categorize", "switch"]:
-                    _extend_path(cpn_obj.output("_next"))
-                elif cpn_obj.component_name.lower() in ("iteration", "loop"):
-                    _append_path(cpn_obj.get_start())
-                elif cpn_obj.component_name.lower() == "exitloop" and cpn_obj.get_parent().component_name.lower() == "loop":
-                    _extend_path(self.get_component(cpn["parent_id"])["downstream"])
-                elif not cpn["downstream"] and cpn_obj.get_parent():
-                    _append_path(cpn_obj.get_parent().get_start())
+            if cpn_obj.component_name.lower() not in ("iteration","loop"):
+                if isinstance(cpn_obj.output("content"), partial):
+                    if self.error:
+                        cpn_obj.set_output("content", None)
+                        yield _node_finished(cpn_obj)
+                    else:
+                        partials.append(cpn_id)
                 else:
-                    _extend_path(cpn["downstream"])
+                    yield _node_finished(cpn_obj)
+
+            def _append_path(cpn_id):
+                nonlocal other_branch
+                if other_branch:
+                    return
+                _schedule(cpn_id)
+
+            def _extend_path(cpn_ids):
+                nonlocal other_branch
+                if other_branch:
+                    return
+                for cpn_id in cpn_ids:
+                    _append_path(cpn_id)
+
+            if cpn_obj.component_name.lower() in ("iterationitem","loopitem") and cpn_obj.end():
+                iter = cpn_obj.get_parent()
+                yield _node_finished(iter)
+                _extend_path(self.get_component(cpn["parent_id"])["downstream"])
+            elif cpn_obj.component_name.lower() in ["categorize", "switch"]:
+                _extend_path(cpn_obj.output("_next"))
+            elif cpn_obj.component_name.lower() in ("iteration", "loop"):
+                _append_path(cpn_obj.get_start())
+            elif cpn_obj.component_name.lower() == "exitloop" and cpn_obj.get_parent().component_name.lower() == "loop":
+                _extend_path(self.get_component(cpn["parent_id"])["downstream"])
+            elif not cpn["downstream"] and cpn_obj.get_parent():
+                _append_path(cpn_obj.get_parent().get_start())
+            else:
+                _extend_path(cpn["downstream"])
+
+        idx = len(self.path) - 1
+        initial = self.path[idx:]
+        del self.path[idx:]
+        for cpn_id in initial:
+            _start(cpn_id)
+        last = None
+        while running:
+            for ev in started:
+                yield ev
+            started.clear()
+            if self.is_canceled():
+                for task in running:
+                    task.cancel()
+                msg = f"Task {self.task_id} has been canceled during component execution."
+                logging.info(msg)
+                raise TaskCanceledException(msg)
+
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            # post-processing of components invocation, in the order they were started
+            for task in [t for t in running if t in done]:
+                cpn_id = running.pop(task)
+                if task.exception():
+                    for t in running:
+                        t.cancel()
+                    raise task.exception()
+                async for ev in _post_process(cpn_id):
+                    yield ev
+                active.pop(cpn_id).set()
+                last = cpn_id
+                if self.error:
+                    break
 
             if self.error:
                 logging.error(f"Runtime Error: {self.error}")
+                await asyncio.gather(*running, return_exceptions=True)
                 break
-            idx = to
-
-            if any([self.get_component_obj(c).component_name.lower() == "userfillup" for c in self.path[idx:]]):
-                path = [c for c in self.path[idx:] if self.get_component(c)["obj"].component_name.lower() == "userfillup"]
-                path.extend([c for c in self.path[idx:] if self.get_component(c)["obj"].component_name.lower() != "userfillup"])
-                another_inputs = {}
-                tips = ""
-                for c in path:
-                    o = self.get_component_obj(c)
-                    if o.component_name.lower() == "userfillup":
-                        o.invoke()
-                        another_inputs.update(o.get_input_elements())
-                        if o.get_param("enable_tips"):
-                            tips = o.output("tips")
-                self.path = path
-                yield decorate("user_inputs", {"inputs": another_inputs, "tips": tips})
-                return
-        self.path = self.path[:idx]
+
+        if deferred and not self.error:
+            path = [c for c in deferred if self.get_component(c)["obj"].component_name.lower() == "userfillup"]
+            path.extend([c for c in deferred if self.get_component(c)["obj"].component_name.lower() != "userfillup"])
+            another_inputs = {}
+            tips = ""
+            for c in path:
+                o = self.get_component_obj(c)
+                if o.component_name.lower() == "userfillup":
+                    o.invoke()
+                    another_inputs.update(o.get_input_elements())
+                    if o.get_param("enable_tips"):
+                        tips = o.output("tips")
+            self.path = path
+            yield decorate("user_inputs", {"inputs": another_inputs, "tips": tips})
+            return
         if not self.error:
             yield decorate("workflow_finished",
                        {
                            "inputs": kwargs.get("inputs"),
-                           "outputs": self.get_component_obj(self.path[-1]).output(),
+                           "outputs": self.get_component_obj(last).output(),
                            "elapsed_time": time.perf_counter() - st,
                            "created_at": st,
+                           "critical_path": max((_timing(c) for c in timing if _timing(c)),
+                                                key=lambda tm: tm["critical_path_time"], default=None),
                        })
-            self.history.append(("assistant", self.get_component_obj(self.path[-1]).output()))
+            self.history.append(("assistant", self.get_component_obj(last).output()))
             self.globals["sys.history"].append(f"{self.history[-1][0]}: {self.history[-1][1]}")
         elif "Task has been canceled" in self.error:
             yield decorate("workflow_finished",
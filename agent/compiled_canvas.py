@@ -0,0 +1,114 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Compiled agent canvases.
+
+Building a canvas from its DSL parses the JSON, then builds, fills and checks the parameters of every
+component. A `CompiledCanvas` does this once per agent and DSL version and is cached; canvases are
+instantiated from it with copies of the checked parameters.
+
+The runtime state of a session (globals, history, path, references, memory, and the parameters its
+components changed, such as their inputs and outputs) is kept apart from it. `diff_state` records it
+as a diff against the compiled canvas and `Canvas.set_state` applies it back.
+"""
+
+import json
+import os
+from copy import deepcopy
+
+from agent.component import component_class
+from common.cache_utils import LRUCache
+
+AGENT_CANVAS_CACHE_SIZE = int(os.environ.get("AGENT_CANVAS_CACHE_SIZE", "128"))
+
+# Canvas attributes holding the runtime state of a session, besides the components.
+RUNTIME_KEYS = ["history", "path", "retrieval", "memory", "globals", "variables"]
+# Parameters set per request rather than per session.
+_REQUEST_PARAMS = {"custom_header"}
+
+_cache = LRUCache(maxsize=AGENT_CANVAS_CACHE_SIZE)
+
+
+class CompiledCanvas:
+    def __init__(self, dsl: dict):
+        self.names = {n["id"]: n["data"]["name"] for n in dsl.get("graph", {}).get("nodes", [])}
+        self.dsl = {k: v for k, v in dsl.items() if k != "components"}
+        self.components = {}
+        self.component_names = {}
+        self.params = {}
+        self.param_dicts = {}
+        for cid, cpn in dsl["components"].items():
+            name = cpn["obj"]["component_name"]
+            param = component_class(name + "Param")()
+            param.update(cpn["obj"]["params"])
+            try:
+                param.check()
+            except Exception as e:
+                raise ValueError(self.names.get(cid, "") + f": {e}")
+            self.components[cid] = {k: v for k, v in cpn.items() if k != "obj"}
+            self.component_names[cid] = name
+            self.params[cid] = param
+            self.param_dicts[cid] = json.loads(str(param))
+
+    def new_dsl(self) -> dict:
+        """The top-level DSL of a new canvas; the UI graph is shared as it is only read."""
+        dsl = {k: deepcopy(v) for k, v in self.dsl.items() if k != "graph"}
+        if "graph" in self.dsl:
+            dsl["graph"] = self.dsl["graph"]
+        return dsl
+
+    def instantiate(self, canvas, custom_header=None) -> dict:
+        components = {}
+        for cid, cpn in self.components.items():
+            param = deepcopy(self.params[cid])
+            param.custom_header = custom_header
+            components[cid] = deepcopy(cpn)
+            components[cid]["obj"] = component_class(self.component_names[cid])(canvas, cid, param)
+        return components
+
+    def diff_state(self, canvas) -> dict:
+        state = {k: deepcopy(getattr(canvas, k)) for k in RUNTIME_KEYS}
+        state["components"] = {}
+        for cid, cpn in canvas.components.items():
+            base = self.param_dicts[cid]
+            params = json.loads(str(cpn["obj"]._param))
+            changed = {k: v for k, v in params.items() if k not in _REQUEST_PARAMS and base.get(k) != v}
+            if changed:
+                state["components"][cid] = changed
+        return state
+
+
+def get_compiled_canvas(canvas_id: str, version, dsl) -> CompiledCanvas:
+    """The compiled `dsl` of agent `canvas_id`, which must be the same for the same `version`."""
+    key = (canvas_id, version)
+    compiled = _cache.get(key)
+    if compiled is None:
+        compiled = CompiledCanvas(json.loads(dsl) if isinstance(dsl, str) else dsl)
+        _cache.set(key, compiled)
+    return compiled
+
+
+def apply_state(dsl, state: dict) -> dict:
+    """`dsl` with the runtime state of a session applied, as the session's canvas would serialize it."""
+    dsl = json.loads(dsl) if isinstance(dsl, str) else deepcopy(dsl)
+    for k in RUNTIME_KEYS:
+        if k in state:
+            dsl[k] = state[k]
+    for cid, params in state.get("components", {}).items():
+        if cid in dsl.get("components", {}):
+            dsl["components"][cid]["obj"]["params"].update(params)
+    return dsl
@@ -43,7 +43,7 @@ from api.db.db_models import APIToken, Task
 import time
 
 from rag.flow.pipeline import Pipeline
-from rag.nlp import search
+from rag.nlp import retrieval_cache, search
 from rag.utils.redis_conn import REDIS_CONN
 from common import settings
 from api.apps import login_required, current_user
@@ -244,6 +244,7 @@ async def rerun():
 
     if settings.docStoreConn.index_exist(search.index_name(current_user.id), doc["kb_id"]):
         settings.docStoreConn.delete({"doc_id": doc["id"]}, search.index_name(current_user.id), doc["kb_id"])
+        retrieval_cache.invalidate_kbs(doc["kb_id"])
     doc["progress_msg"] = ""
     doc["chunk_num"] = 0
     doc["token_num"] = 0
@@ -634,7 +635,7 @@ def get_session(canvas_id, session_id):
             data=False, message='Only owner of canvas authorized for this operation.',
             code=RetCode.OPERATING_ERROR)
     _, conv = API4ConversationService.get_by_id(session_id)
-    return get_json_result(data=conv.to_dict())
+    return get_json_result(data=API4ConversationService.merge_state(conv.to_dict()))
 
 
 @manager.route('/<canvas_id>/sessions/<session_id>', methods=['DELETE'])  # noqa: F821
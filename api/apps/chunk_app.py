@@ -38,7 +38,7 @@ from api.utils.api_utils import (
 from common.misc_utils import thread_pool_exec
 from rag.app.qa import beAdoc, rmPrefix
 from rag.app.tag import label_question
-from rag.nlp import rag_tokenizer, search
+from rag.nlp import rag_tokenizer, retrieval_cache, search
 from rag.prompts.generator import cross_languages, keyword_extraction
 from common.string_utils import remove_redundant_spaces
 from common.constants import RetCode, LLMType, ParserType, PAGERANK_FLD
@@ -186,6 +186,7 @@ async def set():
             v = 0.1 * v[0] + 0.9 * v[1] if doc.parser_id != ParserType.QA else v[1]
             _d["q_%d_vec" % len(v)] = v.tolist()
             settings.docStoreConn.update({"id": req["chunk_id"]}, _d, search.index_name(tenant_id), doc.kb_id)
+            retrieval_cache.invalidate_kbs(doc.kb_id)
 
             # update image
             image_base64 = req.get("image_base64", None)
@@ -217,6 +218,7 @@ async def switch():
                                                     search.index_name(DocumentService.get_tenant_id(req["doc_id"])),
                                                     doc.kb_id):
                     return get_data_error_result(message="Index updating failure")
+            retrieval_cache.invalidate_kbs(doc.kb_id)
             return get_json_result(data=True)
 
         return await thread_pool_exec(_switch_sync)
@@ -255,10 +257,9 @@ async def rm():
                                                               search.index_name(DocumentService.get_tenant_id(req["doc_id"])),
                                                               doc.kb_id)
             chunk_number = deleted_count
+            retrieval_cache.invalidate_kbs(doc.kb_id)
             DocumentService.decrement_chunk_num(doc.id, doc.kb_id, 1, chunk_number, 0)
-            for cid in deleted_chunk_ids:
-                if settings.STORAGE_IMPL.obj_exist(doc.kb_id, cid):
-                    settings.STORAGE_IMPL.rm(doc.kb_id, cid)
+            settings.STORAGE_IMPL.rm_many([(doc.kb_id, cid) for cid in deleted_chunk_ids])
             return get_json_result(data=True)
 
         return await thread_pool_exec(_rm_sync)
@@ -331,6 +332,7 @@ async def create():
             v = 0.1 * v[0] + 0.9 * v[1]
             d["q_%d_vec" % len(v)] = v.tolist()
             settings.docStoreConn.insert([d], search.index_name(tenant_id), doc.kb_id)
+            retrieval_cache.invalidate_kbs(doc.kb_id)
 
             DocumentService.increment_chunk_num(
                 doc.id, doc.kb_id, c, 1, 0)
@@ -22,7 +22,7 @@ import tempfile
 from quart import Response, request
 from api.apps import current_user, login_required
 from api.db.db_models import APIToken
-from api.db.services.conversation_service import ConversationService, structure_answer
+from api.db.services.conversation_service import MESSAGE_KINDS, ConversationService, structure_answer
 from api.db.services.dialog_service import DialogService, async_ask, async_chat, gen_mindmap
 from api.db.services.llm_service import LLMBundle
 from api.db.services.search_service import SearchService
@@ -107,6 +107,33 @@ async def get():
         return server_error_response(e)
 
 
+@manager.route("/messages", methods=["GET"])  # noqa: F821
+@login_required
+async def messages():
+    conv_id = request.args["conversation_id"]
+    page_number = int(request.args.get("page", 1))
+    items_per_page = int(request.args.get("page_size", 30))
+    kind = request.args.get("kind", "message")
+    if kind not in MESSAGE_KINDS:
+        return get_data_error_result(message=f"`kind` should be one of {MESSAGE_KINDS}.")
+    try:
+        e, conv = ConversationService.get_by_id(conv_id, with_messages=False)
+        if not e:
+            return get_data_error_result(message="Conversation not found!")
+        tenants = UserTenantService.query(user_id=current_user.id)
+        if not any(DialogService.query(tenant_id=tenant.tenant_id, id=conv.dialog_id) for tenant in tenants):
+            return get_json_result(data=False, message="Only owner of conversation authorized for this operation.", code=RetCode.OPERATING_ERROR)
+
+        total, items = ConversationService.get_messages(conv_id, page_number, items_per_page, kind)
+        if kind == "reference":
+            for ref in items:
+                if isinstance(ref, dict):
+                    ref["chunks"] = chunks_format(ref)
+        return get_json_result(data={"total": total, kind: items})
+    except Exception as e:
+        return server_error_response(e)
+
+
 @manager.route("/getsse/<dialog_id>", methods=["GET"])  # type: ignore # noqa: F821
 def getsse(dialog_id):
     token = request.headers.get("Authorization").split()
@@ -40,13 +40,14 @@ from api.utils.api_utils import (
     server_error_response,
     validate_request,
     get_request_json,
+    storage_response,
 )
 from api.utils.file_utils import filename_type, thumbnail
 from common.file_utils import get_project_base_directory
 from common.constants import RetCode, VALID_TASK_STATUS, ParserType, TaskStatus
 from api.utils.web_utils import CONTENT_TYPE_MAP, html2pdf, is_valid_url
 from deepdoc.parser.html_parser import RAGFlowHtmlParser
-from rag.nlp import search, rag_tokenizer
+from rag.nlp import search, rag_tokenizer, retrieval_cache
 from common import settings
 
 
@@ -546,6 +547,7 @@ async def change_status():
                         search.index_name(kb.tenant_id),
                         doc.kb_id,
                     )
+                    retrieval_cache.invalidate_kbs(doc.kb_id)
                 except Exception as exc:
                     msg = str(exc)
                     if "3022" in msg:
@@ -631,6 +633,7 @@ async def run():
                     TaskService.filter_delete([Task.doc_id == id])
                     if settings.docStoreConn.index_exist(search.index_name(tenant_id), doc.kb_id):
                         settings.docStoreConn.delete({"doc_id": id}, search.index_name(tenant_id), doc.kb_id)
+                        retrieval_cache.invalidate_kbs(doc.kb_id)
 
                 if str(req["run"]) == TaskStatus.RUNNING.value:
                     if req.get("apply_kb"):
@@ -696,6 +699,7 @@ async def rename():
                     search.index_name(tenant_id),
                     doc.kb_id,
                 )
+                retrieval_cache.invalidate_kbs(doc.kb_id)
             return get_json_result(data=True)
 
         return await thread_pool_exec(_rename_sync)
@@ -712,19 +716,20 @@ async def get(doc_id):
         if not e:
             return get_data_error_result(message="Document not found!")
 
-        b, n = File2DocumentService.get_storage_address(doc_id=doc_id)
-        data = await thread_pool_exec(settings.STORAGE_IMPL.get, b, n)
-        response = await make_response(data)
-
         ext = re.search(r"\.([^.]+)$", doc.name.lower())
         ext = ext.group(1) if ext else None
+        content_type = None
         if ext:
             if doc.type == FileType.VISUAL.value:
 
                 content_type = CONTENT_TYPE_MAP.get(ext, f"image/{ext}")
             else:
                 content_type = CONTENT_TYPE_MAP.get(ext, f"application/{ext}")
-            response.headers.set("Content-Type", content_type)
+
+        b, n = File2DocumentService.get_storage_address(doc_id=doc_id)
+        response = await storage_response(b, n, content_type)
+        if response is None:
+            return get_data_error_result(message="This file is empty.")
         return response
     except Exception as e:
         return server_error_response(e)
@@ -735,10 +740,9 @@ async def get(doc_id):
 async def download_attachment(attachment_id):
     try:
         ext = request.args.get("ext", "markdown")
-        data = await thread_pool_exec(settings.STORAGE_IMPL.get, current_user.id, attachment_id)
-        response = await make_response(data)
-        response.headers.set("Content-Type", CONTENT_TYPE_MAP.get(ext, f"application/{ext}"))
-
+        response = await storage_response(current_user.id, attachment_id, CONTENT_TYPE_MAP.get(ext, f"application/{ext}"))
+        if response is None:
+            return get_data_error_result(message="This file is empty.")
         return response
 
     except Exception as e:
@@ -773,6 +777,7 @@ async def change_parser():
             DocumentService.delete_chunk_images(doc, tenant_id)
             if settings.docStoreConn.index_exist(search.index_name(tenant_id), doc.kb_id):
                 settings.docStoreConn.delete({"doc_id": doc.id}, search.index_name(tenant_id), doc.kb_id)
+                retrieval_cache.invalidate_kbs(doc.kb_id)
         return None
 
     try:
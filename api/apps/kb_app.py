@@ -44,8 +44,10 @@ from api.db import VALID_FILE_TYPES
 from api.db.services.knowledgebase_service import KnowledgebaseService
 from api.db.db_models import File
 from api.utils.api_utils import get_json_result
-from rag.nlp import search
+from rag.graphrag.utils import assemble_graph_data
+from rag.nlp import retrieval_cache, search
 from api.constants import DATASET_NAME_LIMIT
+from rag.utils import raptor_tree
 from rag.utils.redis_conn import REDIS_CONN
 from common.constants import RetCode, PipelineTaskType, StatusEnum, VALID_TASK_STATUS, FileSource, LLMType, PAGERANK_FLD
 from common import settings
@@ -158,6 +160,7 @@ async def update():
                     search.index_name(kb.tenant_id),
                     kb.id,
                 )
+                retrieval_cache.invalidate_kbs(kb.id)
             else:
                 # Elasticsearch requires PAGERANK_FLD be non-zero!
                 await thread_pool_exec(
@@ -167,6 +170,7 @@ async def update():
                     search.index_name(kb.tenant_id),
                     kb.id,
                 )
+                retrieval_cache.invalidate_kbs(kb.id)
 
         e, kb = KnowledgebaseService.get_by_id(kb.id)
         if not e:
@@ -320,6 +324,7 @@ async def rm():
             for kb in kbs:
                 if hasattr(settings.STORAGE_IMPL, 'remove_bucket'):
                     settings.STORAGE_IMPL.remove_bucket(kb.id)
+                raptor_tree.delete(kb.id, GRAPH_RAPTOR_FAKE_DOC_ID)
             return get_json_result(data=True)
 
         return await thread_pool_exec(_rm_sync)
@@ -380,6 +385,7 @@ async def rm_tags(kb_id):
                                      {"remove": {"tag_kwd": t}},
                                      search.index_name(kb.tenant_id),
                                      kb_id)
+    retrieval_cache.invalidate_kbs(kb_id)
     return get_json_result(data=True)
 
 
@@ -399,6 +405,7 @@ async def rename_tags(kb_id):
                                      {"remove": {"tag_kwd": req["from_tag"].strip()}, "add": {"tag_kwd": req["to_tag"]}},
                                      search.index_name(kb.tenant_id),
                                      kb_id)
+    retrieval_cache.invalidate_kbs(kb_id)
     return get_json_result(data=True)
 
 
@@ -431,6 +438,8 @@ async def knowledge_graph(kb_id):
         except Exception:
             continue
 
+        if ty == "graph":
+            content_json = await assemble_graph_data(kb.tenant_id, kb_id, content_json)
         obj[ty] = content_json
 
     if "nodes" in obj["graph"]:
@@ -452,7 +461,7 @@ def delete_knowledge_graph(kb_id):
             code=RetCode.AUTHENTICATION_ERROR
         )
     _, kb = KnowledgebaseService.get_by_id(kb_id)
-    settings.docStoreConn.delete({"knowledge_graph_kwd": ["graph", "subgraph", "entity", "relation"]}, search.index_name(kb.tenant_id), kb_id)
+    settings.docStoreConn.delete({"knowledge_graph_kwd": ["graph", "graph_shard", "subgraph", "entity", "relation"]}, search.index_name(kb.tenant_id), kb_id)
 
     return get_json_result(data=True)
 
@@ -826,13 +835,15 @@ def delete_kb_task():
             task_id = kb.graphrag_task_id
             kb_task_finish_at = "graphrag_task_finish_at"
             cancel_task(task_id)
-            settings.docStoreConn.delete({"knowledge_graph_kwd": ["graph", "subgraph", "entity", "relation"]}, search.index_name(kb.tenant_id), kb_id)
+            settings.docStoreConn.delete({"knowledge_graph_kwd": ["graph", "graph_shard", "subgraph", "entity", "relation"]}, search.index_name(kb.tenant_id), kb_id)
         case PipelineTaskType.RAPTOR:
             kb_task_id_field = "raptor_task_id"
             task_id = kb.raptor_task_id
             kb_task_finish_at = "raptor_task_finish_at"
             cancel_task(task_id)
             settings.docStoreConn.delete({"raptor_kwd": ["raptor"]}, search.index_name(kb.tenant_id), kb_id)
+            doc_ids = [d["id"] for d in DocumentService.get_all_doc_ids_by_kb_ids([kb_id])]
+            raptor_tree.delete(kb_id, [GRAPH_RAPTOR_FAKE_DOC_ID] + doc_ids)
         case PipelineTaskType.MINDMAP:
             kb_task_id_field = "mindmap_task_id"
             task_id = kb.mindmap_task_id
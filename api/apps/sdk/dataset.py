@@ -47,7 +47,9 @@ from api.utils.validation_utils import (
     validate_and_parse_json_request,
     validate_and_parse_request_args,
 )
-from rag.nlp import search
+from rag.graphrag.utils import assemble_graph_data
+from rag.nlp import retrieval_cache, search
+from rag.utils import raptor_tree
 from common.constants import PAGERANK_FLD
 from common import settings
 
@@ -245,6 +247,7 @@ async def delete(tenant_id):
             if not KnowledgebaseService.delete_by_id(kb_id):
                 errors.append(f"Delete dataset error for {kb_id}")
                 continue
+            raptor_tree.delete(kb_id, GRAPH_RAPTOR_FAKE_DOC_ID)
             success_count += 1
 
         if not errors:
@@ -373,10 +376,12 @@ async def update(tenant_id, dataset_id):
             if req["pagerank"] > 0:
                 settings.docStoreConn.update({"kb_id": kb.id}, {PAGERANK_FLD: req["pagerank"]},
                                              search.index_name(kb.tenant_id), kb.id)
+                retrieval_cache.invalidate_kbs(kb.id)
             else:
                 # Elasticsearch requires PAGERANK_FLD be non-zero!
                 settings.docStoreConn.update({"exists": PAGERANK_FLD}, {"remove": PAGERANK_FLD},
                                              search.index_name(kb.tenant_id), kb.id)
+                retrieval_cache.invalidate_kbs(kb.id)
 
         if not KnowledgebaseService.update_by_id(kb.id, req):
             return get_error_data_result(message="Update dataset error.(Database error)")
@@ -517,6 +522,8 @@ async def knowledge_graph(tenant_id, dataset_id):
         except Exception:
             continue
 
+        if ty == "graph":
+            content_json = await assemble_graph_data(kb.tenant_id, dataset_id, content_json)
         obj[ty] = content_json
 
     if "nodes" in obj["graph"]:
@@ -539,7 +546,7 @@ def delete_knowledge_graph(tenant_id, dataset_id):
             code=RetCode.AUTHENTICATION_ERROR
         )
     _, kb = KnowledgebaseService.get_by_id(dataset_id)
-    settings.docStoreConn.delete({"knowledge_graph_kwd": ["graph", "subgraph", "entity", "relation"]},
+    settings.docStoreConn.delete({"knowledge_graph_kwd": ["graph", "graph_shard", "subgraph", "entity", "relation"]},
                                  search.index_name(kb.tenant_id), dataset_id)
 
     return get_result(data=True)
@@ -18,10 +18,9 @@ import json
 import logging
 import pathlib
 import re
-from io import BytesIO
 
 import xxhash
-from quart import request, send_file
+from quart import request
 from peewee import OperationalError
 from pydantic import BaseModel, Field, validator
 
@@ -38,11 +37,12 @@ from api.db.services.tenant_llm_service import TenantLLMService
 from api.db.services.task_service import TaskService, queue_tasks, cancel_all_task_of
 from common.metadata_utils import meta_filter, convert_conditions
 from api.utils.api_utils import check_duplicate_ids, construct_json_result, get_error_data_result, get_parser_config, get_result, server_error_response, token_required, \
-    get_request_json
+    get_request_json, storage_response
 from rag.app.qa import beAdoc, rmPrefix
 from rag.app.tag import label_question
-from rag.nlp import rag_tokenizer, search
+from rag.nlp import rag_tokenizer, retrieval_cache, search
 from rag.prompts.generator import cross_languages, keyword_extraction
+from common.misc_utils import thread_pool_exec
 from common.string_utils import remove_redundant_spaces
 from common.constants import RetCode, LLMType, ParserType, TaskStatus, FileSource
 from common import settings
@@ -317,6 +317,7 @@ async def update_doc(tenant_id, dataset_id, document_id):
             if not e:
                 return get_error_data_result(message="Document not found!")
             settings.docStoreConn.delete({"doc_id": doc.id}, search.index_name(tenant_id), dataset_id)
+            retrieval_cache.invalidate_kbs(dataset_id)
 
     if "enabled" in req:
         status = int(req["enabled"])
@@ -325,6 +326,7 @@ async def update_doc(tenant_id, dataset_id, document_id):
                 if not DocumentService.update_by_id(doc.id, {"status": str(status)}):
                     return get_error_data_result(message="Database error (Document update)!")
                 settings.docStoreConn.update({"doc_id": doc.id}, {"available_int": status}, search.index_name(kb.tenant_id), doc.kb_id)
+                retrieval_cache.invalidate_kbs(doc.kb_id)
             except Exception as e:
                 return server_error_response(e)
 
@@ -406,17 +408,10 @@ async def download(tenant_id, dataset_id, document_id):
         return get_error_data_result(message=f"The dataset not own the document {document_id}.")
     # The process of downloading
     doc_id, doc_location = File2DocumentService.get_storage_address(doc_id=document_id)  # minio address
-    file_stream = settings.STORAGE_IMPL.get(doc_id, doc_location)
-    if not file_stream:
+    response = await storage_response(doc_id, doc_location, "application/octet-stream", attachment_filename=doc[0].name)
+    if response is None:
         return construct_json_result(message="This file is empty.", code=RetCode.DATA_ERROR)
-    file = BytesIO(file_stream)
-    # Use send_file with a proper filename and MIME type
-    return await send_file(
-        file,
-        as_attachment=True,
-        attachment_filename=doc[0].name,
-        mimetype="application/octet-stream",  # Set a default MIME type
-    )
+    return response
 
 
 @manager.route("/documents/<document_id>", methods=["GET"])  # noqa: F821
@@ -436,17 +431,10 @@ async def download_doc(document_id):
         return get_error_data_result(message=f"The dataset not own the document {document_id}.")
     # The process of downloading
     doc_id, doc_location = File2DocumentService.get_storage_address(doc_id=document_id)  # minio address
-    file_stream = settings.STORAGE_IMPL.get(doc_id, doc_location)
-    if not file_stream:
+    response = await storage_response(doc_id, doc_location, "application/octet-stream", attachment_filename=doc[0].name)
+    if response is None:
         return construct_json_result(message="This file is empty.", code=RetCode.DATA_ERROR)
-    file = BytesIO(file_stream)
-    # Use send_file with a proper filename and MIME type
-    return await send_file(
-        file,
-        as_attachment=True,
-        attachment_filename=doc[0].name,
-        mimetype="application/octet-stream",  # Set a default MIME type
-    )
+    return response
 
 
 @manager.route("/datasets/<dataset_id>/documents", methods=["GET"])  # noqa: F821
@@ -762,34 +750,39 @@ async def delete(tenant_id, dataset_id):
     errors = ""
     not_found = []
     success_count = 0
-    for doc_id in doc_list:
-        try:
-            e, doc = DocumentService.get_by_id(doc_id)
-            if not e:
-                not_found.append(doc_id)
-                continue
-            tenant_id = DocumentService.get_tenant_id(doc_id)
-            if not tenant_id:
-                return get_error_data_result(message="Tenant not found!")
-
-            b, n = File2DocumentService.get_storage_address(doc_id=doc_id)
-
-            if not DocumentService.remove_document(doc, tenant_id):
-                return get_error_data_result(message="Database error (Document removal)!")
-
-            f2d = File2DocumentService.get_by_document_id(doc_id)
-            FileService.filter_delete(
-                [
-                    File.source_type == FileSource.KNOWLEDGEBASE,
-                    File.id == f2d[0].file_id,
-                ]
-            )
-            File2DocumentService.delete_by_document_id(doc_id)
-
-            settings.STORAGE_IMPL.rm(b, n)
-            success_count += 1
-        except Exception as e:
-            errors += str(e)
+    # The stored files, deleted together once their documents are gone.
+    files = []
+    try:
+        for doc_id in doc_list:
+            try:
+                e, doc = DocumentService.get_by_id(doc_id)
+                if not e:
+                    not_found.append(doc_id)
+                    continue
+                tenant_id = DocumentService.get_tenant_id(doc_id)
+                if not tenant_id:
+                    return get_error_data_result(message="Tenant not found!")
+
+                b, n = File2DocumentService.get_storage_address(doc_id=doc_id)
+
+                if not DocumentService.remove_document(doc, tenant_id):
+                    return get_error_data_result(message="Database error (Document removal)!")
+
+                f2d = File2DocumentService.get_by_document_id(doc_id)
+                FileService.filter_delete(
+                    [
+                        File.source_type == FileSource.KNOWLEDGEBASE,
+                        File.id == f2d[0].file_id,
+                    ]
+                )
+                File2DocumentService.delete_by_document_id(doc_id)
+
+                files.append((b, n))
+                success_count += 1
+            except Exception as e:
+                errors += str(e)
+    finally:
+        settings.STORAGE_IMPL.rm_many(files)
 
     if not_found:
         return get_result(message=f"Documents not found: {not_found}", code=RetCode.DATA_ERROR)
@@ -857,39 +850,43 @@ async def parse(tenant_id, dataset_id):
     unique_doc_ids, duplicate_messages = check_duplicate_ids(doc_list, "document")
     doc_list = unique_doc_ids
 
-    not_found = []
-    success_count = 0
-    for id in doc_list:
-        doc = DocumentService.query(id=id, kb_id=dataset_id)
-        if not doc:
-            not_found.append(id)
-            continue
-        if not doc:
-            return get_error_data_result(message=f"You don't own the document {id}.")
-        if 0.0 < doc[0].progress < 1.0:
-            return get_error_data_result("Can't parse document that is currently being processed")
-        info = {"run": "1", "progress": 0, "progress_msg": "", "chunk_num": 0, "token_num": 0}
-        DocumentService.update_by_id(id, info)
-        settings.docStoreConn.delete({"doc_id": id}, search.index_name(tenant_id), dataset_id)
-        TaskService.filter_delete([Task.doc_id == id])
-        e, doc = DocumentService.get_by_id(id)
-        doc = doc.to_dict()
-        doc["tenant_id"] = tenant_id
-        bucket, name = File2DocumentService.get_storage_address(doc_id=doc["id"])
-        queue_tasks(doc, bucket, name, 0)
-        success_count += 1
-    if not_found:
-        return get_result(message=f"Documents not found: {not_found}", code=RetCode.DATA_ERROR)
-    if duplicate_messages:
-        if success_count > 0:
-            return get_result(
-                message=f"Partially parsed {success_count} documents with {len(duplicate_messages)} errors",
-                data={"success_count": success_count, "errors": duplicate_messages},
-            )
-        else:
-            return get_error_data_result(message=";".join(duplicate_messages))
+    def _parse_sync():
+        not_found = []
+        success_count = 0
+        for id in doc_list:
+            doc = DocumentService.query(id=id, kb_id=dataset_id)
+            if not doc:
+                not_found.append(id)
+                continue
+            if not doc:
+                return get_error_data_result(message=f"You don't own the document {id}.")
+            if 0.0 < doc[0].progress < 1.0:
+                return get_error_data_result("Can't parse document that is currently being processed")
+            info = {"run": "1", "progress": 0, "progress_msg": "", "chunk_num": 0, "token_num": 0}
+            DocumentService.update_by_id(id, info)
+            settings.docStoreConn.delete({"doc_id": id}, search.index_name(tenant_id), dataset_id)
+            retrieval_cache.invalidate_kbs(dataset_id)
+            TaskService.filter_delete([Task.doc_id == id])
+            e, doc = DocumentService.get_by_id(id)
+            doc = doc.to_dict()
+            doc["tenant_id"] = tenant_id
+            bucket, name = File2DocumentService.get_storage_address(doc_id=doc["id"])
+            queue_tasks(doc, bucket, name, 0)
+            success_count += 1
+        if not_found:
+            return get_result(message=f"Documents not found: {not_found}", code=RetCode.DATA_ERROR)
+        if duplicate_messages:
+            if success_count > 0:
+                return get_result(
+                    message=f"Partially parsed {success_count} documents with {len(duplicate_messages)} errors",
+                    data={"success_count": success_count, "errors": duplicate_messages},
+                )
+            else:
+                return get_error_data_result(message=";".join(duplicate_messages))
 
-    return get_result()
+        return get_result()
+
+    return await thread_pool_exec(_parse_sync)
 
 
 @manager.route("/datasets/<dataset_id>/chunks", methods=["DELETE"])  # noqa: F821
@@ -953,6 +950,7 @@ async def stop_parsing(tenant_id, dataset_id):
         info = {"run": "2", "progress": 0, "chunk_num": 0}
         DocumentService.update_by_id(id, info)
         settings.docStoreConn.delete({"doc_id": doc[0].id}, search.index_name(tenant_id), dataset_id)
+        retrieval_cache.invalidate_kbs(dataset_id)
         success_count += 1
     if duplicate_messages:
         if success_count > 0:
@@ -1238,6 +1236,7 @@ async def add_chunk(tenant_id, dataset_id, document_id):
     v = 0.1 * v[0] + 0.9 * v[1]
     d["q_%d_vec" % len(v)] = v.tolist()
     settings.docStoreConn.insert([d], search.index_name(tenant_id), dataset_id)
+    retrieval_cache.invalidate_kbs(dataset_id)
 
     DocumentService.increment_chunk_num(doc.id, doc.kb_id, c, 1, 0)
     # rename keys
@@ -1322,6 +1321,7 @@ async def rm_chunk(tenant_id, dataset_id, document_id):
         unique_chunk_ids = []
         duplicate_messages = []
     chunk_number = settings.docStoreConn.delete(condition, search.index_name(tenant_id), dataset_id)
+    retrieval_cache.invalidate_kbs(dataset_id)
     if chunk_number != 0:
         DocumentService.decrement_chunk_num(document_id, dataset_id, 1, chunk_number, 0)
     if "chunk_ids" in req and chunk_number != len(unique_chunk_ids):
@@ -1439,6 +1439,7 @@ async def update_chunk(tenant_id, dataset_id, document_id, chunk_id):
     v = 0.1 * v[0] + 0.9 * v[1] if doc.parser_id != ParserType.QA else v[1]
     d["q_%d_vec" % len(v)] = v.tolist()
     settings.docStoreConn.update({"id": chunk_id}, d, search.index_name(tenant_id), dataset_id)
+    retrieval_cache.invalidate_kbs(dataset_id)
     return get_result()
 
 
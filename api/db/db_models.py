@@ -977,6 +977,19 @@ class Conversation(DataBaseModel):
         db_table = "conversation"
 
 
+class ConversationMessage(DataBaseModel):
+    id = CharField(max_length=32, primary_key=True)
+    conversation_id = CharField(max_length=32, null=False, index=True)
+    kind = CharField(max_length=16, null=False, default="message", help_text="message|reference")
+    seq = IntegerField(null=False, default=0, help_text="position in the conversation's message or reference list")
+    content = JSONField(null=True)
+    digest = CharField(max_length=32, null=False, default="", help_text="digest of content")
+
+    class Meta:
+        db_table = "conversation_message"
+        indexes = ((("conversation_id", "kind", "seq"), True),)
+
+
 class APIToken(DataBaseModel):
     tenant_id = CharField(max_length=32, null=False, index=True)
     token = CharField(max_length=255, null=False, index=True)
@@ -1000,6 +1013,7 @@ class API4Conversation(DataBaseModel):
     tokens = IntegerField(default=0)
     source = CharField(max_length=16, null=True, help_text="none|agent|dialog", index=True)
     dsl = JSONField(null=True, default={})
+    canvas_state = JSONField(null=True, help_text="runtime state of the agent session, as a diff against dsl")
     duration = FloatField(default=0, index=True)
     round = IntegerField(default=0, index=True)
     thumb_up = IntegerField(default=0, index=True)
@@ -1380,6 +1394,7 @@ def migrate_db():
     alter_db_add_column(migrator, "llm_factories", "rank", IntegerField(default=0, index=False))
     alter_db_add_column(migrator, "api_4_conversation", "name", CharField(max_length=255, null=True, help_text="conversation name", index=False))
     alter_db_add_column(migrator, "api_4_conversation", "exp_user_id", CharField(max_length=255, null=True, help_text="exp_user_id", index=True))
+    alter_db_add_column(migrator, "api_4_conversation", "canvas_state", JSONField(null=True, help_text="runtime state of the agent session, as a diff against dsl"))
     # Migrate system_settings.value from CharField to TextField for longer sandbox configs
     alter_db_column_type(migrator, "system_settings", "value", TextField(null=False, help_text="Configuration value (JSON, string, etc.)"))
     logging.disable(logging.NOTSET)
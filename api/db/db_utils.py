@@ -24,8 +24,10 @@ from api.db.db_models import DB, DataBaseModel
 
 
 @DB.connection_context()
-def bulk_insert_into_db(model, data_source, replace_on_conflict=False):
-    DB.create_tables([model])
+def bulk_insert_into_db(model, data_source, replace_on_conflict=False, create_table=True):
+    # create_table=False within a transaction, where DDL would commit it on MySQL.
+    if create_table:
+        DB.create_tables([model])
 
     for i, data in enumerate(data_source):
         current_time = current_timestamp() + i
@@ -31,13 +31,14 @@ from api.db.services.llm_service import get_init_tenant_llm
 from api.db.services.file_service import FileService
 from api.db.services.mcp_server_service import MCPServerService
 from api.db.services.search_service import SearchService
-from api.db.services.task_service import TaskService
+from api.db.services.task_service import GRAPH_RAPTOR_FAKE_DOC_ID, TaskService
 from api.db.services.tenant_llm_service import TenantLLMService
 from api.db.services.user_canvas_version import UserCanvasVersionService
 from api.db.services.user_service import TenantService, UserService, UserTenantService
 from api.db.services.memory_service import MemoryService
 from memory.services.messages import MessageService
 from rag.nlp import search
+from rag.utils import raptor_tree
 from common.constants import ActiveEnum
 from common import settings
 
@@ -167,6 +168,8 @@ def delete_user_data(user_id: str) -> dict:
                 for kb_id in kb_ids:
                     if settings.STORAGE_IMPL.bucket_exists(kb_id):
                         settings.STORAGE_IMPL.remove_bucket(kb_id)
+                    kb_doc_ids = [d["id"] for d in DocumentService.get_all_doc_ids_by_kb_ids([kb_id])]
+                    raptor_tree.delete(kb_id, [GRAPH_RAPTOR_FAKE_DOC_ID] + kb_doc_ids)
                 done_msg += f"- Removed {len(kb_ids)} dataset's buckets.\n"
                 # step1.1.2 delete file and document info in db
                 doc_ids = DocumentService.get_all_doc_ids_by_kb_ids(kb_ids)
@@ -54,7 +54,7 @@ class API4ConversationService(CommonService):
         if include_dsl:
             sessions = cls.model.select().where(cls.model.dialog_id == dialog_id)
         else:
-            fields = [field for field in cls.model._meta.fields.values() if field.name != 'dsl']
+            fields = [field for field in cls.model._meta.fields.values() if field.name not in ['dsl', 'canvas_state']]
             sessions = cls.model.select(*fields).where(cls.model.dialog_id == dialog_id)
         if id:
             sessions = sessions.where(cls.model.id == id)
@@ -75,7 +75,21 @@ class API4ConversationService(CommonService):
         count = sessions.count()
         sessions = sessions.paginate(page_number, items_per_page)
 
-        return count, list(sessions.dicts())
+        sessions = list(sessions.dicts())
+        if include_dsl:
+            for s in sessions:
+                cls.merge_state(s)
+        return count, sessions
+
+    @staticmethod
+    def merge_state(session: dict) -> dict:
+        """Replaces the `canvas_state` diff of a session dict by the runtime DSL it stands for."""
+        state = session.pop("canvas_state", None)
+        if state:
+            from agent.compiled_canvas import apply_state
+
+            session["dsl"] = apply_state(session["dsl"], state["state"])
+        return session
     
     @classmethod
     @DB.connection_context()
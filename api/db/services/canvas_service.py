@@ -18,6 +18,7 @@ import logging
 import time
 from uuid import uuid4
 from agent.canvas import Canvas
+from agent.compiled_canvas import get_compiled_canvas
 from api.db import CanvasCategory, TenantPermission
 from api.db.db_models import DB, CanvasTemplate, User, UserCanvas, API4Conversation
 from api.db.services.api_service import API4ConversationService
@@ -196,22 +197,31 @@ async def completion(tenant_id, agent_id, session_id=None, **kwargs):
     user_id = kwargs.get("user_id", "")
     custom_header = kwargs.get("custom_header", "")
 
+    # Sessions started from a compiled canvas keep the agent DSL they started with in `dsl` and their
+    # runtime state in `canvas_state`; older sessions keep both in `dsl`.
+    version = None
     if session_id:
         e, conv = API4ConversationService.get_by_id(session_id)
         assert e, "Session not found!"
         if not conv.message:
             conv.message = []
-        if not isinstance(conv.dsl, str):
-            conv.dsl = json.dumps(conv.dsl, ensure_ascii=False)
-        canvas = Canvas(conv.dsl, tenant_id, agent_id, canvas_id=agent_id, custom_header=custom_header)
+        if conv.canvas_state:
+            version = conv.canvas_state["version"]
+            compiled = get_compiled_canvas(agent_id, version, conv.dsl)
+            canvas = Canvas(None, tenant_id, agent_id, canvas_id=agent_id, custom_header=custom_header, compiled=compiled)
+            canvas.set_state(conv.canvas_state["state"])
+        else:
+            if not isinstance(conv.dsl, str):
+                conv.dsl = json.dumps(conv.dsl, ensure_ascii=False)
+            canvas = Canvas(conv.dsl, tenant_id, agent_id, canvas_id=agent_id, custom_header=custom_header)
     else:
         e, cvs = UserCanvasService.get_by_id(agent_id)
         assert e, "Agent not found."
         assert cvs.user_id == tenant_id, "You do not own the agent."
-        if not isinstance(cvs.dsl, str):
-            cvs.dsl = json.dumps(cvs.dsl, ensure_ascii=False)
         session_id=get_uuid()
-        canvas = Canvas(cvs.dsl, tenant_id, agent_id, canvas_id=cvs.id, custom_header=custom_header)
+        version = cvs.update_time or get_uuid()
+        compiled = get_compiled_canvas(cvs.id, version, cvs.dsl)
+        canvas = Canvas(None, tenant_id, agent_id, canvas_id=cvs.id, custom_header=custom_header, compiled=compiled)
         canvas.reset()
         conv = {
             "id": session_id,
@@ -220,6 +230,7 @@ async def completion(tenant_id, agent_id, session_id=None, **kwargs):
             "message": [],
             "source": "agent",
             "dsl": cvs.dsl,
+            "canvas_state": {"version": version, "state": canvas.get_state()},
             "reference": []
         }
         API4ConversationService.save(**conv)
@@ -246,8 +257,13 @@ async def completion(tenant_id, agent_id, session_id=None, **kwargs):
     conv.message.append({"role": "assistant", "content": txt, "created_at": time.time(), "id": message_id})
     conv.reference = canvas.get_reference()
     conv.errors = canvas.error
-    conv.dsl = str(canvas)
-    conv = conv.to_dict()
+    if version is None:
+        conv.dsl = str(canvas)
+        conv = conv.to_dict()
+    else:
+        conv.canvas_state = {"version": version, "state": canvas.get_state()}
+        conv = conv.to_dict()
+        conv.pop("dsl", None)
     API4ConversationService.append_message(conv["id"], conv)
 
 
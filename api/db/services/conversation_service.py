@@ -13,10 +13,14 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
+import os
 import time
 from uuid import uuid4
+
+import xxhash
+
 from common.constants import StatusEnum
-from api.db.db_models import Conversation, DB
+from api.db.db_models import Conversation, ConversationMessage, DB
 from api.db.services.api_service import API4ConversationService
 from api.db.services.common_service import CommonService
 from api.db.services.dialog_service import DialogService, async_chat
@@ -25,10 +29,186 @@ import json
 
 from rag.prompts.generator import chunks_format
 
+# Number of latest turns loaded as history when answering in an existing session.
+CONVERSATION_HISTORY_TURNS = int(os.environ.get("CONVERSATION_HISTORY_TURNS", "32"))
+
+MESSAGE_KINDS = ("message", "reference")
+
+
+def _digest(content):
+    return xxhash.xxh128(json.dumps(content, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
 
 class ConversationService(CommonService):
+    """
+    Conversations keep their messages and references in `conversation_message`, one row per list item,
+    so that a turn only writes the rows it adds or changes. The `message` and `reference` columns of
+    `conversation` hold the lists of conversations written before, until their first update.
+
+    Loaded conversations carry `message` and `reference` as lists, as before. A conversation loaded
+    with `last_turns` carries only the tail of them; the positions of their first items are kept as
+    `message_offset` and `reference_offset` so that it is written back in place.
+    """
     model = Conversation
 
+    @classmethod
+    def _rows(cls, conv_ids, kind, start=None):
+        rows = ConversationMessage.select(ConversationMessage.conversation_id, ConversationMessage.seq,
+                                          ConversationMessage.content, ConversationMessage.digest).where(
+            ConversationMessage.conversation_id.in_(conv_ids), ConversationMessage.kind == kind)
+        if start is not None:
+            rows = rows.where(ConversationMessage.seq >= start)
+        return rows.order_by(ConversationMessage.seq.asc())
+
+    @classmethod
+    def _last_seq(cls, conv_id, kind):
+        row = ConversationMessage.select(ConversationMessage.seq).where(
+            ConversationMessage.conversation_id == conv_id, ConversationMessage.kind == kind
+        ).order_by(ConversationMessage.seq.desc()).first()
+        return None if row is None else row.seq
+
+    @classmethod
+    def _hydrate(cls, convs, last_turns=None):
+        """Replaces the legacy lists of `convs` (models or dicts) by their stored rows."""
+        if not convs:
+            return convs
+        by_id = {(c["id"] if isinstance(c, dict) else c.id): c for c in convs}
+
+        def setter(c, k, v):
+            if isinstance(c, dict):
+                c[k] = v
+            else:
+                c.__data__[k] = v
+
+        for kind in MESSAGE_KINDS:
+            start = None
+            if last_turns is not None and len(by_id) == 1:
+                # A turn adds a user and an assistant message, but only one reference.
+                last = cls._last_seq(next(iter(by_id)), kind)
+                if last is not None:
+                    start = max(0, last + 1 - last_turns * (2 if kind == "message" else 1))
+            items = {next(iter(by_id)): []} if start is not None else {}
+            for r in cls._rows(list(by_id.keys()), kind, start):
+                items.setdefault(r.conversation_id, []).append(r.content)
+            for conv_id, c in by_id.items():
+                if conv_id in items:
+                    setter(c, kind, items[conv_id])
+                    if start is not None:
+                        setter(c, f"{kind}_offset", start)
+                    continue
+                legacy = (c[kind] if isinstance(c, dict) else getattr(c, kind)) or []
+                if last_turns is not None:
+                    start = max(0, len(legacy) - last_turns * (2 if kind == "message" else 1))
+                    setter(c, kind, legacy[start:])
+                    setter(c, f"{kind}_offset", start)
+        return convs
+
+    @classmethod
+    def _sync(cls, conv_id, kind, items, offset=0):
+        """Stores `items` as the list of `kind` from position `offset` on, rewriting only the rows that changed."""
+        items = list(items or [])
+        stored = [r.digest for r in cls._rows([conv_id], kind, offset)]
+        if not stored and cls._last_seq(conv_id, kind) is None:
+            # First write of a conversation stored as a blob: its head becomes rows below, then the blob is cleared.
+            conv = cls.model.get_or_none(cls.model.id == conv_id)
+            legacy = (getattr(conv, kind) or []) if conv else []
+            if legacy:
+                cls.model.update({kind: None if kind == "message" else []}).where(cls.model.id == conv_id).execute()
+            items, offset = legacy[:offset] + items, 0
+        digests = [_digest(it) for it in items]
+
+        same = 0
+        while same < min(len(stored), len(digests)) and stored[same] == digests[same]:
+            same += 1
+        if same < len(stored):
+            ConversationMessage.delete().where(ConversationMessage.conversation_id == conv_id,
+                                               ConversationMessage.kind == kind,
+                                               ConversationMessage.seq >= offset + same).execute()
+        rows = [{"id": get_uuid(), "conversation_id": conv_id, "kind": kind, "seq": offset + i,
+                 "content": items[i], "digest": digests[i]} for i in range(same, len(items))]
+        for i in range(0, len(rows), 100):
+            ConversationMessage.insert_many(rows[i:i + 100]).execute()
+
+    @classmethod
+    def _split(cls, data):
+        lists = {}
+        for kind in MESSAGE_KINDS:
+            offset = data.pop(f"{kind}_offset", 0) or 0
+            if kind in data:
+                lists[kind] = (data.pop(kind), offset)
+        return lists
+
+    @classmethod
+    @DB.connection_context()
+    def query(cls, cols=None, reverse=None, order_by=None, **kwargs):
+        return cls._hydrate(super().query(cols=cols, reverse=reverse, order_by=order_by, **kwargs))
+
+    @classmethod
+    @DB.connection_context()
+    def get_by_id(cls, pid, last_turns=None, with_messages=True):
+        """
+        A conversation with all its messages and references, or with their last `last_turns` turns.
+
+        With `with_messages=False` neither the rows nor the legacy lists are read, for callers that
+        only need the conversation itself.
+        """
+        if not with_messages:
+            fields = [f for f in cls.model._meta.sorted_fields if f.name not in MESSAGE_KINDS]
+            conv = cls.model.select(*fields).where(cls.model.id == pid).first()
+            return conv is not None, conv
+        e, conv = super().get_by_id(pid)
+        if e:
+            cls._hydrate([conv], last_turns)
+        return e, conv
+
+    @classmethod
+    @DB.connection_context()
+    def save(cls, **kwargs):
+        lists = cls._split(kwargs)
+        with DB.atomic():
+            obj = super().save(**kwargs)
+            for kind, (items, offset) in lists.items():
+                cls._sync(kwargs["id"], kind, items, offset)
+        return obj
+
+    @classmethod
+    @DB.connection_context()
+    def update_by_id(cls, pid, data):
+        data = dict(data)
+        lists = cls._split(data)
+        with DB.atomic():
+            num = super().update_by_id(pid, data)
+            if num:
+                for kind, (items, offset) in lists.items():
+                    cls._sync(pid, kind, items, offset)
+        return num
+
+    @classmethod
+    @DB.connection_context()
+    def delete_by_id(cls, pid):
+        ConversationMessage.delete().where(ConversationMessage.conversation_id == pid).execute()
+        return super().delete_by_id(pid)
+
+    @classmethod
+    @DB.connection_context()
+    def delete_by_ids(cls, pids):
+        ConversationMessage.delete().where(ConversationMessage.conversation_id.in_(pids)).execute()
+        return super().delete_by_ids(pids)
+
+    @classmethod
+    @DB.connection_context()
+    def get_messages(cls, conv_id, page_number=1, items_per_page=30, kind="message"):
+        """A page of the messages (or references) of a conversation, oldest first, and their total count."""
+        total = ConversationMessage.select().where(ConversationMessage.conversation_id == conv_id,
+                                                   ConversationMessage.kind == kind).count()
+        if total:
+            rows = cls._rows([conv_id], kind).paginate(page_number, items_per_page)
+            return total, [r.content for r in rows]
+        conv = cls.model.get_or_none(cls.model.id == conv_id)
+        legacy = (getattr(conv, kind) or []) if conv else []
+        start = (page_number - 1) * items_per_page
+        return len(legacy), legacy[start:start + items_per_page]
+
     @classmethod
     @DB.connection_context()
     def get_list(cls, dialog_id, page_number, items_per_page, orderby, desc, id, name, user_id=None):
@@ -46,7 +226,7 @@ class ConversationService(CommonService):
 
         sessions = sessions.paginate(page_number, items_per_page)
 
-        return list(sessions.dicts())
+        return cls._hydrate(list(sessions.dicts()))
 
     @classmethod
     @DB.connection_context()
@@ -60,7 +240,7 @@ class ConversationService(CommonService):
             _temp = list(s_batch.dicts())
             if not _temp:
                 break
-            res.extend(_temp)
+            res.extend(cls._hydrate(_temp))
             offset += limit
         return res
 
@@ -147,11 +327,12 @@ async def async_completion(tenant_id, chat_id, question, name="New session", ses
             yield answer
             return
 
-    conv = ConversationService.query(id=session_id, dialog_id=chat_id)
-    if not conv:
+    e, conv = ConversationService.get_by_id(session_id, last_turns=CONVERSATION_HISTORY_TURNS)
+    if not e or conv.dialog_id != chat_id:
         raise LookupError("Session does not exist")
 
-    conv = conv[0]
+    if not conv.message:
+        conv.message = []
     msg = []
     question = {
         "content": question,
@@ -18,19 +18,35 @@ Document Metadata Service
 
 Manages document-level metadata storage in ES/Infinity.
 This is the SOLE source of truth for document metadata - MySQL meta_fields column has been removed.
+
+The flattened metadata of a knowledge base is served from an inverted index cached per process.
+Each write bumps a version of the knowledge base in Redis; a process applies its own writes to its
+cached index and rebuilds the index when the version shows writes from another process.
 """
 
 import json
 import logging
+import os
 import re
+import threading
 from copy import deepcopy
 from typing import Dict, List, Optional
 
 from api.db.db_models import DB, Document
 from common import settings
-from common.metadata_utils import dedupe_list
+from common.cache_utils import LRUCache
+from common.metadata_utils import FlattenedMeta, MetadataIndex, dedupe_list
 from api.db.db_models import Knowledgebase
 from common.doc_store.doc_store_base import OrderByExpr
+from rag.utils.redis_conn import REDIS_CONN
+
+DOC_META_INDEX_CACHE_SIZE = int(os.environ.get("DOC_META_INDEX_CACHE_SIZE", "64"))
+DOC_META_INDEX_TTL = int(os.environ.get("DOC_META_INDEX_TTL", "600"))
+DOC_META_SCAN_SIZE = 1000
+
+# kb_id -> (version, MetadataIndex)
+_meta_indexes = LRUCache(maxsize=DOC_META_INDEX_CACHE_SIZE, ttl=DOC_META_INDEX_TTL)
+_meta_indexes_lock = threading.Lock()
 
 
 class DocMetadataService:
@@ -194,6 +210,115 @@ class DocMetadataService:
             knowledgebase_ids=[kb_id]
         )
 
+    @staticmethod
+    def _search_client():
+        """The Elasticsearch or OpenSearch client of the doc store; None for the other engines."""
+        engine = settings.DOC_ENGINE.lower()
+        if engine == "elasticsearch":
+            return settings.docStoreConn.es
+        if engine == "opensearch":
+            return settings.docStoreConn.os
+        return None
+
+    @classmethod
+    def _scan_metadata(cls, kb_id: str):
+        """
+        Iterate over all metadata documents of a knowledge base, without the limit of a search.
+
+        Yields:
+            Tuple of (doc_id, metadata) for each document
+        """
+        kb = Knowledgebase.get_or_none(Knowledgebase.id == kb_id)
+        if not kb:
+            return
+        index_name = cls._get_doc_meta_index_name(kb.tenant_id)
+        if not settings.docStoreConn.index_exist(index_name, ""):
+            return
+
+        client = cls._search_client()
+        if client is not None:
+            # Paged searches stop at the index's max_result_window: scroll instead.
+            if settings.DOC_ENGINE.lower() == "opensearch":
+                from opensearchpy.helpers import scan
+            else:
+                from elasticsearch.helpers import scan
+            for hit in scan(client, index=index_name, size=DOC_META_SCAN_SIZE,
+                            query={"query": {"term": {"kb_id": kb_id}}}):
+                yield hit["_id"], cls._extract_metadata(hit.get("_source", {}))
+            return
+
+        offset = 0
+        while True:
+            results = settings.docStoreConn.search(
+                select_fields=["*"],
+                highlight_fields=[],
+                condition={"kb_id": kb_id},
+                match_expressions=[],
+                order_by=OrderByExpr(),
+                offset=offset,
+                limit=DOC_META_SCAN_SIZE,
+                index_names=index_name,
+                knowledgebase_ids=[kb_id]
+            )
+            page = list(cls._iter_search_results(results))
+            for doc_id, doc in page:
+                yield doc_id, cls._extract_metadata(doc)
+            if len(page) < DOC_META_SCAN_SIZE:
+                return
+            offset += DOC_META_SCAN_SIZE
+
+    @staticmethod
+    def _meta_version_key(kb_id: str) -> str:
+        return f"doc_meta_version:{kb_id}"
+
+    @classmethod
+    def _get_meta_index(cls, kb_id: str) -> MetadataIndex:
+        """The cached metadata index of a knowledge base, rebuilt if another process changed its metadata."""
+        version = REDIS_CONN.get(cls._meta_version_key(kb_id)) or "0"
+        with _meta_indexes_lock:
+            cached = _meta_indexes.get(kb_id)
+        if cached and cached[0] == version:
+            return cached[1]
+
+        index = MetadataIndex()
+        for doc_id, meta in cls._scan_metadata(kb_id):
+            index.add(doc_id, meta)
+        with _meta_indexes_lock:
+            _meta_indexes.set(kb_id, (version, index))
+        return index
+
+    @classmethod
+    def _index_changed(cls, kb_id: str, doc_id: str, meta_fields: Optional[Dict], merge: bool = False):
+        """
+        Record a metadata write: apply it to the cached index, or drop the index if it is behind.
+
+        Args:
+            kb_id: Knowledge base ID
+            doc_id: Document ID
+            meta_fields: The written metadata, None if it was deleted
+            merge: Whether meta_fields was merged into the stored metadata, as an ES partial update does
+        """
+        try:
+            version = str(REDIS_CONN.incrby(cls._meta_version_key(kb_id), 1))
+        except Exception as e:
+            logging.warning(f"Failed to bump metadata version of KB {kb_id}: {e}")
+            version = None
+        with _meta_indexes_lock:
+            cached = _meta_indexes.get(kb_id)
+            if not cached:
+                return
+            if version is None or str(int(cached[0]) + 1) != version:
+                _meta_indexes.pop(kb_id)
+                return
+            index = cached[1]
+            if meta_fields is None:
+                index.remove(doc_id)
+            elif merge:
+                index.add(doc_id, {**index.docs.get(doc_id, {}), **meta_fields})
+            else:
+                index.add(doc_id, meta_fields)
+            _meta_indexes.set(kb_id, (version, index))
+
     @classmethod
     def _split_combined_values(cls, meta_fields: Dict) -> Dict:
         """
@@ -313,13 +438,17 @@ class DocMetadataService:
                 logging.error(f"Failed to insert metadata for document {doc_id}: {result}")
                 return False
             # Force ES refresh to make metadata immediately available for search
-            if not settings.DOC_ENGINE_INFINITY:
+            client = cls._search_client()
+            if client is not None:
                 try:
-                    settings.docStoreConn.es.indices.refresh(index=index_name)
+                    client.indices.refresh(index=index_name)
                     logging.debug(f"Refreshed metadata index: {index_name}")
                 except Exception as e:
                     logging.warning(f"Failed to refresh metadata index {index_name}: {e}")
-            
+            # Only once the write is searchable: another process rebuilding its index at the new
+            # version must see it.
+            cls._index_changed(kb_id, doc_id, doc_meta["meta_fields"])
+
             logging.debug(f"Successfully inserted metadata for document {doc_id}")
             return True
 
@@ -375,6 +504,7 @@ class DocMetadataService:
                         refresh=True,  # Make changes immediately visible
                         doc={"meta_fields": processed_meta}
                     )
+                    cls._index_changed(kb_id, doc_id, processed_meta, merge=True)
                     logging.debug(f"Successfully updated metadata for document {doc_id} using ES partial update")
                     return True
                 except Exception as e:
@@ -459,6 +589,7 @@ class DocMetadataService:
                 kb_id  # Pass actual kb_id (delete() will handle metadata tables correctly)
             )
             logging.debug(f"[METADATA DELETE] Deleted count: {deleted_count}")
+            cls._index_changed(kb_id, doc_id, None)
 
             # Only check if table should be dropped if not skipped (for bulk operations)
             # Note: delete operation already uses refresh=True, so data is immediately available
@@ -693,6 +824,9 @@ class DocMetadataService:
             meta["tags"]["foo"] = [doc_id], meta["tags"]["bar"] = [doc_id], meta["author"]["alice"] = [doc_id]
         Prefer for metadata_condition filtering and scenarios that must respect list semantics.
 
+        Served from the cached metadata index of each knowledge base. The result is shared and must not
+        be modified; it speeds up range filters in `meta_filter`.
+
         Args:
             kb_ids: List of knowledge base IDs
 
@@ -700,55 +834,18 @@ class DocMetadataService:
             Metadata dictionary in format: {field_name: {value: [doc_ids]}}
         """
         try:
-            # Get tenant_id from first KB
-            kb = Knowledgebase.get_by_id(kb_ids[0])
-            if not kb:
-                return {}
-
-            tenant_id = kb.tenant_id
-            index_name = cls._get_doc_meta_index_name(tenant_id)
-
-            condition = {"kb_id": kb_ids}
-            order_by = OrderByExpr()
-
-            # Query with large limit
-            results = settings.docStoreConn.search(
-                select_fields=["*"],  # Get all fields
-                highlight_fields=[],
-                condition=condition,
-                match_expressions=[],
-                order_by=order_by,
-                offset=0,
-                limit=10000,
-                index_names=index_name,
-                knowledgebase_ids=kb_ids
-            )
-
-            logging.debug(f"[get_flatted_meta_by_kbs] index_name: {index_name}, kb_ids: {kb_ids}")
-            logging.debug(f"[get_flatted_meta_by_kbs] results type: {type(results)}")
-
-            # Aggregate metadata
-            meta = {}
-
-            # Use helper to iterate over results in any format
-            for doc_id, doc in cls._iter_search_results(results):
-                # Extract metadata fields (exclude system fields)
-                doc_meta = cls._extract_metadata(doc)
-
-                for k, v in doc_meta.items():
-                    if k not in meta:
-                        meta[k] = {}
-
-                    values = v if isinstance(v, list) else [v]
-                    for vv in values:
-                        if vv is None:
-                            continue
-                        sv = str(vv)
-                        if sv not in meta[k]:
-                            meta[k][sv] = []
-                        meta[k][sv].append(doc_id)
-
-            logging.debug(f"[get_flatted_meta_by_kbs] KBs: {kb_ids}, Returning metadata: {meta}")
+            if len(kb_ids) == 1:
+                meta = cls._get_meta_index(kb_ids[0]).flatted()
+            else:
+                merged = {}
+                for kb_id in dict.fromkeys(kb_ids):
+                    for k, v2docs in cls._get_meta_index(kb_id).flatted().items():
+                        values = merged.setdefault(k, {})
+                        for v, doc_ids in v2docs.items():
+                            values.setdefault(v, []).extend(doc_ids)
+                meta = FlattenedMeta(merged)
+
+            logging.debug(f"[get_flatted_meta_by_kbs] KBs: {kb_ids}, Returning metadata of {len(meta)} fields")
             return meta
 
         except Exception as e:
@@ -1016,26 +1113,20 @@ class DocMetadataService:
             return changed
 
         try:
-            results = cls._search_metadata(kb_id, condition=None)
-            if not results:
-                results = []  # Treat as empty list if None
-
             updated_docs = 0
             doc_ids_set = set(doc_ids)
             found_doc_ids = set()
 
             logging.debug(f"[batch_update_metadata] Searching for doc_ids: {doc_ids}")
 
-            # Use helper to iterate over results in any format
-            for doc_id, doc in cls._iter_search_results(results):
+            # Scan all metadata rows of the KB, beyond the limit of a single search
+            for doc_id, current_meta in list(cls._scan_metadata(kb_id)):
                 # Filter to only process requested doc_ids
                 if doc_id not in doc_ids_set:
                     continue
 
                 found_doc_ids.add(doc_id)
 
-                # Get current metadata
-                current_meta = cls._extract_metadata(doc)
                 meta = _normalize_meta(current_meta)
                 original_meta = deepcopy(meta)
 
@@ -37,7 +37,8 @@ from api.db.services.doc_metadata_service import DocMetadataService
 from common.misc_utils import get_uuid
 from common.time_utils import current_timestamp, get_format_time
 from common.constants import LLMType, ParserType, StatusEnum, TaskStatus, SVR_CONSUMER_GROUP_NAME
-from rag.nlp import rag_tokenizer, search
+from rag.nlp import rag_tokenizer, retrieval_cache, search
+from rag.utils import raptor_tree
 from rag.utils.redis_conn import REDIS_CONN
 from common.doc_store.doc_store_base import OrderByExpr
 from common import settings
@@ -393,8 +394,10 @@ class DocumentService(CommonService):
         # Delete chunks from doc store - this is critical, log errors
         try:
             settings.docStoreConn.delete({"doc_id": doc.id}, search.index_name(tenant_id), doc.kb_id)
+            retrieval_cache.invalidate_kbs(doc.kb_id)
         except Exception as e:
             logging.error(f"Failed to delete chunks from doc store for document {doc.id}: {e}")
+        raptor_tree.delete(doc.kb_id, doc.id)
 
         # Delete document metadata (non-critical, log and continue)
         try:
@@ -407,7 +410,8 @@ class DocumentService(CommonService):
             graph_source = settings.docStoreConn.get_fields(
                 settings.docStoreConn.search(["source_id"], [], {"kb_id": doc.kb_id, "knowledge_graph_kwd": ["graph"]}, [], OrderByExpr(), 0, 1, search.index_name(tenant_id), [doc.kb_id]), ["source_id"]
             )
-            if len(graph_source) > 0 and doc.id in list(graph_source.values())[0]["source_id"]:
+            graph_sources = list(graph_source.values())[0]["source_id"] if len(graph_source) > 0 else []
+            if doc.id in graph_sources:
                 settings.docStoreConn.update({"kb_id": doc.kb_id, "knowledge_graph_kwd": ["entity", "relation", "graph", "subgraph", "community_report"], "source_id": doc.id},
                                              {"remove": {"source_id": doc.id}},
                                              search.index_name(tenant_id), doc.kb_id)
@@ -416,6 +420,10 @@ class DocumentService(CommonService):
                                              search.index_name(tenant_id), doc.kb_id)
                 settings.docStoreConn.delete({"kb_id": doc.kb_id, "knowledge_graph_kwd": ["entity", "relation", "graph", "subgraph", "community_report"], "must_not": {"exists": "source_id"}},
                                              search.index_name(tenant_id), doc.kb_id)
+                # Graph shards have no source_id of their own: they go with the graph's last source.
+                if set(graph_sources) <= {doc.id}:
+                    settings.docStoreConn.delete({"kb_id": doc.kb_id, "knowledge_graph_kwd": ["graph_shard"]},
+                                                 search.index_name(tenant_id), doc.kb_id)
         except Exception as e:
             logging.warning(f"Failed to cleanup knowledge graph for document {doc.id}: {e}")
 
@@ -433,9 +441,8 @@ class DocumentService(CommonService):
             chunk_ids = settings.docStoreConn.get_doc_ids(chunks)
             if not chunk_ids:
                 break
-            for cid in chunk_ids:
-                if settings.STORAGE_IMPL.obj_exist(doc.kb_id, cid):
-                    settings.STORAGE_IMPL.rm(doc.kb_id, cid)
+            # Chunks without an image have nothing stored: deleting a missing object is a no-op.
+            settings.STORAGE_IMPL.rm_many([(doc.kb_id, cid) for cid in chunk_ids])
             page += 1
 
     @classmethod
@@ -721,9 +728,8 @@ class DocumentService(CommonService):
             Knowledgebase.tenant_id == tenant_id)
         return len(docs)
 
-    @classmethod
-    @DB.connection_context()
-    def begin2parse(cls, doc_id, keep_progress=False):
+    @staticmethod
+    def begin2parse_info(keep_progress=False) -> dict:
         info = {
             "progress_msg": "Task is queued...",
             "process_begin_at": get_format_time(),
@@ -732,8 +738,12 @@ class DocumentService(CommonService):
             info["progress"] = random.random() * 1 / 100.
             info["run"] = TaskStatus.RUNNING.value
             # keep the doc in DONE state when keep_progress=True for GraphRAG, RAPTOR and Mindmap tasks
+        return info
 
-        cls.update_by_id(doc_id, info)
+    @classmethod
+    @DB.connection_context()
+    def begin2parse(cls, doc_id, keep_progress=False):
+        cls.update_by_id(doc_id, cls.begin2parse_info(keep_progress))
 
     @classmethod
     @DB.connection_context()
@@ -1113,6 +1123,7 @@ def doc_upload_and_parse(conversation_id, file_objs, user_id):
                     settings.docStoreConn.create_idx(idxnm, kb_id, len(vectors[0]), kb.parser_id)
                 try_create_idx = False
             settings.docStoreConn.insert(cks[b:b + es_bulk_size], idxnm, kb_id)
+        retrieval_cache.invalidate_kbs(kb_id)
 
         DocumentService.increment_chunk_num(
             doc_id, kb.id, token_counts[doc_id], chunk_counts[doc_id], 0)
@@ -565,6 +565,8 @@ class FileService(CommonService):
         FileService.init_knowledgebase_docs(pf_id, tenant_id)
         errors = ""
         kb_table_num_map = {}
+        # The stored files, deleted together once their documents are gone.
+        files = []
         for doc_id in doc_ids:
             try:
                 e, doc = DocumentService.get_by_id(doc_id)
@@ -586,7 +588,7 @@ class FileService(CommonService):
                     deleted_file_count = FileService.filter_delete([File.source_type == FileSource.KNOWLEDGEBASE, File.id == f2d[0].file_id])
                 File2DocumentService.delete_by_document_id(doc_id)
                 if deleted_file_count > 0:
-                    settings.STORAGE_IMPL.rm(b, n)
+                    files.append((b, n))
 
                 doc_parser = doc.parser_id
                 if doc_parser == ParserType.TABLE:
@@ -600,6 +602,7 @@ class FileService(CommonService):
             except Exception as e:
                 errors += str(e)
 
+        settings.STORAGE_IMPL.rm_many(files)
         return errors
 
     @staticmethod
@@ -28,15 +28,18 @@ from api.db.db_models import Task, Document, Knowledgebase, Tenant
 from api.db.services.common_service import CommonService
 from api.db.services.document_service import DocumentService
 from common.misc_utils import get_uuid
-from common.time_utils import current_timestamp
+from common.time_utils import current_timestamp, datetime_format
 from common.constants import StatusEnum, TaskStatus
 from deepdoc.parser.excel_parser import RAGFlowExcelParser
+from rag.utils.page_count import pdf_page_number, xlsx_row_number
 from rag.utils.redis_conn import REDIS_CONN
 from common import settings
-from rag.nlp import search
+from rag.nlp import retrieval_cache, search
 
 CANVAS_DEBUG_DOC_ID = "dataflow_x"
 GRAPH_RAPTOR_FAKE_DOC_ID = "graph_raptor_x"
+# Files from this size on are counted from ranged reads when the storage supports them, not downloaded.
+PAGE_COUNT_RANGED_MIN_SIZE = int(os.environ.get("PAGE_COUNT_RANGED_MIN_SIZE", str(1024 * 1024)))
 
 def trim_header_by_lines(text: str, max_length) -> str:
     # Trim header text to maximum length while preserving line breaks
@@ -71,26 +74,8 @@ class TaskService(CommonService):
     model = Task
 
     @classmethod
-    @DB.connection_context()
-    def get_task(cls, task_id, doc_ids=[]):
-        """Retrieve detailed task information by task ID.
-
-        This method fetches comprehensive task details including associated document,
-        dataset, and tenant information. It also handles task retry logic and
-        progress updates.
-
-        Args:
-            task_id (str): The unique identifier of the task to retrieve.
-
-        Returns:
-            dict: Task details dictionary containing all task information and related metadata.
-                 Returns None if task is not found or has exceeded retry limit.
-        """
-        doc_id = cls.model.doc_id
-        if doc_id == CANVAS_DEBUG_DOC_ID and doc_ids:
-            doc_id = doc_ids[0]
-
-        fields = [
+    def _task_info_fields(cls):
+        return [
             cls.model.id,
             cls.model.doc_id,
             cls.model.from_page,
@@ -113,6 +98,67 @@ class TaskService(CommonService):
             Tenant.llm_id,
             cls.model.update_time,
         ]
+
+    @classmethod
+    @DB.connection_context()
+    def get_tasks_by_ids(cls, task_ids: list[str]) -> dict:
+        """Retrieve the details of several tasks in one query, as `get_task` does for one.
+
+        The tasks are marked as received and their retry counts incremented in at most two updates.
+
+        Args:
+            task_ids (list[str]): The identifiers of the tasks to retrieve.
+
+        Returns:
+            dict: Task details by task ID. Tasks not found or over the retry limit are left out.
+        """
+        if not task_ids:
+            return {}
+        docs = (
+            cls.model.select(*cls._task_info_fields())
+                .join(Document, on=(cls.model.doc_id == Document.id))
+                .join(Knowledgebase, on=(Document.kb_id == Knowledgebase.id))
+                .join(Tenant, on=(Knowledgebase.tenant_id == Tenant.id))
+                .where(cls.model.id.in_(list(set(task_ids))))
+        )
+        docs = list(docs.dicts())
+        received = [d["id"] for d in docs if d["retry_count"] < 3]
+        abandoned = [d["id"] for d in docs if d["retry_count"] >= 3]
+        if received:
+            cls.model.update(
+                progress_msg=cls.model.progress_msg + f"\n{datetime.now().strftime('%H:%M:%S')} Task has been received.",
+                progress=random.random() / 10.0,
+                retry_count=cls.model.retry_count + 1,
+            ).where(cls.model.id.in_(received)).execute()
+        if abandoned:
+            cls.model.update(
+                progress_msg=cls.model.progress_msg + "\nERROR: Task is abandoned after 3 times attempts.",
+                progress=-1,
+                retry_count=cls.model.retry_count + 1,
+            ).where(cls.model.id.in_(abandoned)).execute()
+        return {d["id"]: d for d in docs if d["retry_count"] < 3}
+
+    @classmethod
+    @DB.connection_context()
+    def get_task(cls, task_id, doc_ids=[]):
+        """Retrieve detailed task information by task ID.
+
+        This method fetches comprehensive task details including associated document,
+        dataset, and tenant information. It also handles task retry logic and
+        progress updates.
+
+        Args:
+            task_id (str): The unique identifier of the task to retrieve.
+
+        Returns:
+            dict: Task details dictionary containing all task information and related metadata.
+                 Returns None if task is not found or has exceeded retry limit.
+        """
+        doc_id = cls.model.doc_id
+        if doc_id == CANVAS_DEBUG_DOC_ID and doc_ids:
+            doc_id = doc_ids[0]
+
+        fields = cls._task_info_fields()
         docs = (
             cls.model.select(*fields)
                 .join(Document, on=(doc_id == Document.id))
@@ -172,6 +218,25 @@ class TaskService(CommonService):
             return None
         return tasks
 
+    @classmethod
+    @DB.connection_context()
+    def replace_doc_tasks(cls, doc_id: str, tasks: list[dict], doc_info: dict):
+        """Replace the tasks of a document and update the document in one transaction.
+
+        Args:
+            doc_id (str): The unique identifier of the document.
+            tasks (list[dict]): The new tasks of the document.
+            doc_info (dict): Field values to update on the document.
+        """
+        doc_info = dict(doc_info)
+        doc_info["update_time"] = current_timestamp()
+        doc_info["update_date"] = datetime_format(datetime.now())
+        with DB.atomic():
+            cls.model.delete().where(cls.model.doc_id == doc_id).execute()
+            if tasks:
+                bulk_insert_into_db(cls.model, tasks, True, create_table=False)
+            Document.update(doc_info).where(Document.id == doc_id).execute()
+
     @classmethod
     @DB.connection_context()
     def get_tasks_progress_by_doc_ids(cls, doc_ids: list[str]):
@@ -391,9 +456,8 @@ def queue_tasks(doc: dict, bucket: str, name: str, priority: int):
     parse_task_array = []
 
     if doc["type"] == FileType.PDF.value:
-        file_bin = settings.STORAGE_IMPL.get(bucket, name)
         do_layout = doc["parser_config"].get("layout_recognize", "DeepDOC")
-        pages = PdfParser.total_page_number(doc["name"], file_bin)
+        pages = _count(doc, bucket, name, pdf_page_number, PdfParser.total_page_number)
         if pages is None:
             pages = 0
         page_size = doc["parser_config"].get("task_page_size") or 12
@@ -413,8 +477,8 @@ def queue_tasks(doc: dict, bucket: str, name: str, priority: int):
                 parse_task_array.append(task)
 
     elif doc["parser_id"] == "table":
-        file_bin = settings.STORAGE_IMPL.get(bucket, name)
-        rn = RAGFlowExcelParser.row_number(doc["name"], file_bin)
+        ranged = xlsx_row_number if doc["name"].split(".")[-1].lower().find("xls") >= 0 else None
+        rn = _count(doc, bucket, name, ranged, RAGFlowExcelParser.row_number)
         for i in range(0, rn, 3000):
             task = new_task()
             task["from_page"] = i
@@ -424,14 +488,15 @@ def queue_tasks(doc: dict, bucket: str, name: str, priority: int):
         parse_task_array.append(new_task())
 
     chunking_config = DocumentService.get_chunking_config(doc["id"])
+    config_hasher = xxhash.xxh64()
+    for field in sorted(chunking_config.keys()):
+        if field == "parser_config":
+            for k in ["raptor", "graphrag"]:
+                if k in chunking_config[field]:
+                    del chunking_config[field][k]
+        config_hasher.update(str(chunking_config[field]).encode("utf-8"))
     for task in parse_task_array:
-        hasher = xxhash.xxh64()
-        for field in sorted(chunking_config.keys()):
-            if field == "parser_config":
-                for k in ["raptor", "graphrag"]:
-                    if k in chunking_config[field]:
-                        del chunking_config[field][k]
-            hasher.update(str(chunking_config[field]).encode("utf-8"))
+        hasher = config_hasher.copy()
         for field in ["doc_id", "from_page", "to_page"]:
             hasher.update(str(task.get(field, "")).encode("utf-8"))
         task_digest = hasher.hexdigest()
@@ -444,7 +509,6 @@ def queue_tasks(doc: dict, bucket: str, name: str, priority: int):
     if prev_tasks:
         for task in parse_task_array:
             ck_num += reuse_prev_task_chunks(task, prev_tasks, chunking_config)
-        TaskService.filter_delete([Task.doc_id == doc["id"]])
         pre_chunk_ids = []
         for pre_task in prev_tasks:
             if pre_task["chunk_ids"]:
@@ -452,16 +516,30 @@ def queue_tasks(doc: dict, bucket: str, name: str, priority: int):
         if pre_chunk_ids:
             settings.docStoreConn.delete({"id": pre_chunk_ids}, search.index_name(chunking_config["tenant_id"]),
                                          chunking_config["kb_id"])
-    DocumentService.update_by_id(doc["id"], {"chunk_num": ck_num})
-
-    bulk_insert_into_db(Task, parse_task_array, True)
-    DocumentService.begin2parse(doc["id"])
+            retrieval_cache.invalidate_kbs(chunking_config["kb_id"])
+    TaskService.replace_doc_tasks(doc["id"], parse_task_array,
+                                  {"chunk_num": ck_num, **DocumentService.begin2parse_info()})
 
     unfinished_task_array = [task for task in parse_task_array if task["progress"] < 1.0]
-    for unfinished_task in unfinished_task_array:
-        assert REDIS_CONN.queue_product(
-            settings.get_svr_queue_name(priority), message=unfinished_task
-        ), "Can't access Redis. Please check the Redis' status."
+    assert REDIS_CONN.queue_product_batch(
+        settings.get_svr_queue_name(priority), unfinished_task_array
+    ), "Can't access Redis. Please check the Redis' status."
+
+
+def _count(doc: dict, bucket: str, name: str, ranged, parser_count):
+    """The page or row count of a stored file, from ranged reads if possible, else from the whole file."""
+    storage = settings.STORAGE_IMPL
+    if ranged and storage.ranged_reads and (doc.get("size") or 0) >= PAGE_COUNT_RANGED_MIN_SIZE:
+        def read(offset, length):
+            data = storage.get_range(bucket, name, offset, length)
+            if data is None:
+                raise IOError(f"Can't read {bucket}/{name}")
+            return data
+
+        count = ranged(read)
+        if count is not None:
+            return count
+    return parser_count(doc["name"], storage.get(bucket, name))
 
 
 def reuse_prev_task_chunks(task: dict, prev_tasks: list[dict], chunking_config: dict):
@@ -529,6 +607,19 @@ def has_canceled(task_id):
     return False
 
 
+def canceled_tasks(task_ids: list[str]) -> set[str]:
+    """The canceled ones among `task_ids`, checked in one round trip."""
+    try:
+        flags = REDIS_CONN.mget_bin([f"{task_id}-cancel" for task_id in task_ids])
+        canceled = {task_id for task_id, flag in zip(task_ids, flags) if flag}
+        for task_id in canceled:
+            logging.info(f"Task: {task_id} has been canceled")
+        return canceled
+    except Exception as e:
+        logging.exception(e)
+    return set()
+
+
 def queue_dataflow(tenant_id:str, flow_id:str, task_id:str, doc_id:str=CANVAS_DEBUG_DOC_ID, file:dict=None, priority: int=0, rerun:bool=False) -> tuple[bool, str]:
 
     task = dict(
@@ -384,6 +384,10 @@ class LLM4Tenant:
         assert self.mdl, "Can't find model for {}/{}/{}".format(tenant_id, llm_type, llm_name)
         model_config = TenantLLMService.get_model_config(tenant_id, llm_type, llm_name)
         self.max_length = model_config.get("max_tokens", 8192)
+        self.llm_factory = model_config.get("llm_factory")
+        self.api_base = model_config.get("api_base")
+        # Dimension of the embeddings, once the model has encoded.
+        self.vector_size = None
 
         self.is_tools = model_config.get("is_tools", False)
         self.verbose_tool_use = kwargs.get("verbose_tool_use")
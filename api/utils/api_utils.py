@@ -24,6 +24,7 @@ import time
 from copy import deepcopy
 from functools import wraps
 from typing import Any
+from urllib.parse import quote
 
 import requests
 from quart import (
@@ -733,3 +734,40 @@ def get_allowed_llm_factories() -> list:
         return factories
 
     return [factory for factory in factories if factory.name in settings.ALLOWED_LLM_FACTORIES]
+
+
+async def storage_response(bucket, fnm, mimetype=None, attachment_filename=None, chunk_size=1024 * 1024):
+    """
+    A response streaming a stored object through `STORAGE_IMPL.open_stream`, so the server never holds
+    the whole file; None if the object can't be read or is empty.
+    """
+    stream = await thread_pool_exec(settings.STORAGE_IMPL.open_stream, bucket, fnm)
+    if stream is None:
+        return None
+    try:
+        first = await thread_pool_exec(stream.read, chunk_size)
+    except Exception:
+        stream.close()
+        raise
+    if not first:
+        stream.close()
+        return None
+
+    async def chunks():
+        try:
+            data = first
+            while data:
+                yield data
+                data = await thread_pool_exec(stream.read, chunk_size)
+        finally:
+            stream.close()
+
+    response = Response(chunks(), mimetype=mimetype)
+    if attachment_filename:
+        try:
+            attachment_filename.encode("ascii")
+            options = {"filename": attachment_filename}
+        except UnicodeEncodeError:
+            options = {"filename*": f"UTF-8''{quote(attachment_filename)}"}
+        response.headers.set("Content-Disposition", "attachment", **options)
+    return response
@@ -14,9 +14,11 @@
 #  limitations under the License.
 #
 
+import logging
 import os
-import queue
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from typing import Any, Callable, Coroutine, Optional, Type, Union
 import asyncio
 from functools import wraps
@@ -26,6 +28,108 @@ from common.constants import RetCode
 TimeoutException = Union[Type[BaseException], BaseException]
 OnTimeoutCallback = Union[Callable[..., Any], Coroutine[Any, Any, Any]]
 
+# Workers shared by every sync function decorated with @timeout while ENABLE_TIMEOUT_ASSERTION is set.
+TIMEOUT_POOL_MAX_WORKERS = int(os.environ.get("TIMEOUT_POOL_MAX_WORKERS", "32"))
+
+_timeout_pool = None
+_timeout_pool_lock = threading.Lock()
+_timeout_local = threading.local()
+_timeout_stats_lock = threading.Lock()
+_timeout_stats = {"calls": 0, "timeouts": 0, "abandoned": 0, "abandoned_running": 0}
+
+
+class CancelToken:
+    """
+    Handed to a sync call running under @timeout. Code doing blocking I/O, typically an HTTP client,
+    registers callbacks here (e.g. closing its session) so that an abandoned call is actually interrupted.
+    """
+
+    def __init__(self, deadline: Optional[float] = None):
+        # time.monotonic() by which the call must be done.
+        self.deadline = deadline
+        self.cancelled = False
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def add_callback(self, callback: Callable[[], Any]):
+        with self._lock:
+            if not self.cancelled:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def cancel(self):
+        with self._lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logging.warning(f"Timeout cancel callback got exception: {e}")
+
+
+def current_cancel_token() -> Optional[CancelToken]:
+    """The cancel token of the @timeout call running in this thread, if any."""
+    return getattr(_timeout_local, "token", None)
+
+
+def _incr_timeout_stat(name: str, n: int = 1):
+    with _timeout_stats_lock:
+        _timeout_stats[name] += n
+
+
+def get_timeout_stats() -> dict:
+    with _timeout_stats_lock:
+        return dict(_timeout_stats)
+
+
+def _get_timeout_pool() -> ThreadPoolExecutor:
+    global _timeout_pool
+    if _timeout_pool is None:
+        with _timeout_pool_lock:
+            if _timeout_pool is None:
+                _timeout_pool = ThreadPoolExecutor(max_workers=TIMEOUT_POOL_MAX_WORKERS, thread_name_prefix="timeout")
+    return _timeout_pool
+
+
+def _run_nested(parent: CancelToken, func, args, kwargs, budget: float):
+    """
+    Runs a @timeout function called from inside a pooled call in the calling thread, since nested waits
+    could exhaust the pool. Its own token is cancelled at the earlier of both deadlines, or with the parent's.
+    """
+    now = time.monotonic()
+    deadline = now + budget
+    if parent.deadline is not None:
+        deadline = min(deadline, parent.deadline)
+    budget = deadline - now
+    if budget <= 0:
+        _incr_timeout_stat("timeouts")
+        raise TimeoutError(f"Function '{func.__name__}' timed out: no time left in the enclosing call.")
+
+    token = CancelToken(deadline)
+    parent.add_callback(token.cancel)
+    timer = threading.Timer(budget, token.cancel)
+    timer.daemon = True
+    timer.start()
+    _timeout_local.token = token
+    try:
+        result = func(*args, **kwargs)
+    except Exception as e:
+        if token.cancelled:
+            _incr_timeout_stat("timeouts")
+            raise TimeoutError(f"Function '{func.__name__}' timed out after {budget:.2f} seconds.") from e
+        raise
+    finally:
+        timer.cancel()
+        _timeout_local.token = parent
+    if token.cancelled:
+        _incr_timeout_stat("timeouts")
+        raise TimeoutError(f"Function '{func.__name__}' timed out after {budget:.2f} seconds.")
+    return result
+
 
 def timeout(seconds: float | int | str = None, attempts: int = 2, *, exception: Optional[TimeoutException] = None,
             on_timeout: Optional[OnTimeoutCallback] = None):
@@ -35,30 +139,37 @@ def timeout(seconds: float | int | str = None, attempts: int = 2, *, exception:
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
-            result_queue = queue.Queue(maxsize=1)
+            if seconds is None or not os.environ.get("ENABLE_TIMEOUT_ASSERTION"):
+                return func(*args, **kwargs)
+
+            parent = current_cancel_token()
+            if parent is not None:
+                return _run_nested(parent, func, args, kwargs, seconds * attempts)
+
+            _incr_timeout_stat("calls")
+            token = CancelToken(time.monotonic() + seconds * attempts)
 
             def target():
+                _timeout_local.token = token
                 try:
-                    result = func(*args, **kwargs)
-                    result_queue.put(result)
-                except Exception as e:
-                    result_queue.put(e)
-
-            thread = threading.Thread(target=target)
-            thread.daemon = True
-            thread.start()
+                    return func(*args, **kwargs)
+                finally:
+                    _timeout_local.token = None
 
+            future = _get_timeout_pool().submit(target)
             for a in range(attempts):
                 try:
-                    if os.environ.get("ENABLE_TIMEOUT_ASSERTION"):
-                        result = result_queue.get(timeout=seconds)
-                    else:
-                        result = result_queue.get()
-                    if isinstance(result, Exception):
-                        raise result
-                    return result
-                except queue.Empty:
+                    return future.result(timeout=seconds)
+                except FutureTimeoutError:
                     pass
+
+            _incr_timeout_stat("timeouts")
+            token.cancel()
+            if not future.cancel():
+                # Already running: it can't be stopped, only abandoned.
+                _incr_timeout_stat("abandoned")
+                _incr_timeout_stat("abandoned_running")
+                future.add_done_callback(lambda _: _incr_timeout_stat("abandoned_running", -1))
             raise TimeoutError(f"Function '{func.__name__}' timed out after {seconds} seconds and {attempts} attempts.")
 
         @wraps(func)
@@ -75,6 +186,7 @@ def timeout(seconds: float | int | str = None, attempts: int = 2, *, exception:
                 except asyncio.TimeoutError:
                     if a < attempts - 1:
                         continue
+                    _incr_timeout_stat("timeouts")
                     if on_timeout is not None:
                         if callable(on_timeout):
                             result = on_timeout()
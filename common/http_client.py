@@ -19,6 +19,7 @@ from typing import Any, Dict, Optional
 from urllib.parse import urlparse, urlunparse
 
 from common import settings
+from common.connection_utils import current_cancel_token
 import httpx
 
 logger = logging.getLogger(__name__)
@@ -217,6 +218,10 @@ def sync_request(
         max_redirects=max_redirects,
         proxy=proxy,
     ) as client:
+        # Closing the client aborts an in-flight request once an enclosing @timeout gives up on us.
+        cancel_token = current_cancel_token()
+        if cancel_token:
+            cancel_token.add_callback(client.close)
         last_exc: Exception | None = None
         for attempt in range(retries + 1):
             try:
@@ -231,7 +236,7 @@ def sync_request(
                 return response
             except httpx.RequestError as exc:
                 last_exc = exc
-                if attempt >= retries:
+                if attempt >= retries or (cancel_token and cancel_token.cancelled):
                     logger.warning(
                         f"sync_request exhausted retries for {method} {url}: {exc}"
                     )
@@ -14,6 +14,7 @@
 #  limitations under the License.
 #
 import ast
+import bisect
 import logging
 from typing import Any, Callable, Dict
 
@@ -39,6 +40,127 @@ def convert_conditions(metadata_condition):
     ]
 
 
+def _is_date(s: str) -> bool:
+    return len(s) == 10 and s[4] == '-' and s[7] == '-' and s[:4].isdigit() and s[5:7].isdigit() and s[8:10].isdigit()
+
+
+class FlattenedMeta(dict):
+    """
+    Flattened metadata, `{field: {value: [doc_ids]}}`, with sorted views of the values of each field
+    for range filters. The views are built on first use, so an instance must not be modified afterwards.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._ranges = {}
+
+    def range_index(self, key: str) -> tuple[tuple[list, list], tuple[list, list]]:
+        """
+        The numeric and the YYYY-MM-DD values of `key`, each as a pair of lists: the sorted numbers or
+        dates, and the values they were parsed from.
+        """
+        if key not in self._ranges:
+            numbers, dates = [], []
+            for v in self.get(key, {}):
+                s = str(v).strip()
+                if _is_date(s):
+                    dates.append((s, v))
+                    continue
+                try:
+                    n = ast.literal_eval(v)
+                except Exception:
+                    continue
+                if isinstance(n, (int, float)):
+                    numbers.append((n, v))
+            numbers.sort(key=lambda x: x[0])
+            dates.sort(key=lambda x: x[0])
+            self._ranges[key] = tuple(([x[0] for x in xs], [x[1] for x in xs]) for xs in [numbers, dates])
+        return self._ranges[key]
+
+
+class MetadataIndex:
+    """Inverted metadata index of a knowledge base, maintained document by document."""
+
+    def __init__(self):
+        self.docs = {}
+        self.postings = {}
+        self._fields = {}
+        self._flatted = None
+
+    def add(self, doc_id: str, meta: dict):
+        self.remove(doc_id)
+        if not isinstance(meta, dict) or not meta:
+            return
+        self.docs[doc_id] = meta
+        for k, v in meta.items():
+            self._fields[k] = self._fields.get(k, 0) + 1
+            postings = self.postings.setdefault(k, {})
+            for vv in v if isinstance(v, list) else [v]:
+                if vv is None:
+                    continue
+                postings.setdefault(str(vv), {})[doc_id] = None
+        self._flatted = None
+
+    def remove(self, doc_id: str):
+        meta = self.docs.pop(doc_id, None)
+        if meta is None:
+            return
+        for k, v in meta.items():
+            postings = self.postings.get(k, {})
+            for vv in v if isinstance(v, list) else [v]:
+                ids = postings.get(str(vv))
+                if ids is not None:
+                    ids.pop(doc_id, None)
+                    if not ids:
+                        del postings[str(vv)]
+            self._fields[k] -= 1
+            if not self._fields[k]:
+                del self._fields[k]
+                self.postings.pop(k, None)
+        self._flatted = None
+
+    def flatted(self) -> FlattenedMeta:
+        """The index as `{field: {value: [doc_ids]}}`; it is shared, so callers must not modify it."""
+        if self._flatted is None:
+            self._flatted = FlattenedMeta({k: {v: list(ids) for v, ids in postings.items()}
+                                           for k, postings in self.postings.items()})
+        return self._flatted
+
+
+def _range_filter(metas: FlattenedMeta, key: str, operator: str, value):
+    """
+    Doc ids of `key` matching a range filter, by bisecting the sorted values; None if the value is
+    neither a date nor a number. Numeric filters only match numeric values.
+    """
+    value_str = str(value).strip()
+    numbers, dates = metas.range_index(key)
+    if _is_date(value_str):
+        (values, keys), target = dates, value_str
+    else:
+        target = value
+        if isinstance(value, str):
+            try:
+                target = ast.literal_eval(value)
+            except Exception:
+                return None
+        if not isinstance(target, (int, float)):
+            return None
+        values, keys = numbers
+    if operator == ">":
+        matched = keys[bisect.bisect_right(values, target):]
+    elif operator == "≥":
+        matched = keys[bisect.bisect_left(values, target):]
+    elif operator == "<":
+        matched = keys[:bisect.bisect_left(values, target)]
+    else:
+        matched = keys[:bisect.bisect_right(values, target)]
+    v2docs = metas[key]
+    ids = []
+    for v in matched:
+        ids.extend(v2docs[v])
+    return ids
+
+
 def meta_filter(metas: dict, filters: list[dict], logic: str = "and"):
     doc_ids = set([])
 
@@ -144,8 +266,11 @@ def meta_filter(metas: dict, filters: list[dict], logic: str = "and"):
             # Key not found in metas: treat as no match
             ids = []
         else:
-            v2docs = metas[k]
-            ids = filter_out(v2docs, f["op"], f["value"])
+            ids = None
+            if isinstance(metas, FlattenedMeta) and f["op"] in [">", "<", "≥", "≤"]:
+                ids = _range_filter(metas, k, f["op"], f["value"])
+            if ids is None:
+                ids = filter_out(metas[k], f["op"], f["value"])
 
         if not doc_ids:
             doc_ids = set(ids)
@@ -0,0 +1,96 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from collections.abc import Sequence
+
+from PIL import Image
+
+
+class PageImageStore(Sequence):
+    """
+    A list of rendered page images which keeps at most `max_resident` of them decoded in memory.
+
+    The least recently used pages are spilled losslessly to a temporary directory and decoded again
+    on access, so downstream code indexing `page_images[i]` keeps working unchanged.
+    """
+
+    def __init__(self, max_resident: int):
+        self.max_resident = max(1, int(max_resident))
+        self._resident = OrderedDict()
+        self._spilled = set()
+        self._count = 0
+        self._dir = None
+        self._lock = threading.Lock()
+
+    def _path(self, idx: int) -> str:
+        return os.path.join(self._dir, f"{idx}.png")
+
+    def _evict(self):
+        while len(self._resident) > self.max_resident:
+            idx, img = self._resident.popitem(last=False)
+            if idx in self._spilled:
+                continue
+            if not self._dir:
+                self._dir = tempfile.mkdtemp(prefix="ragflow_pages_")
+            img.save(self._path(idx), format="PNG", compress_level=1)
+            self._spilled.add(idx)
+
+    def append(self, img: Image.Image):
+        with self._lock:
+            self._resident[self._count] = img
+            self._count += 1
+            self._evict()
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(self._count))]
+        if idx < 0:
+            idx += self._count
+        if idx < 0 or idx >= self._count:
+            raise IndexError("page image index out of range")
+        with self._lock:
+            img = self._resident.get(idx)
+            if img is not None:
+                self._resident.move_to_end(idx)
+                return img
+            with Image.open(self._path(idx)) as f:
+                img = f.copy()
+            self._resident[idx] = img
+            self._evict()
+            return img
+
+    def close(self):
+        with self._lock:
+            self._resident.clear()
+            self._spilled.clear()
+            if self._dir:
+                shutil.rmtree(self._dir, ignore_errors=True)
+                self._dir = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            logging.exception("PageImageStore close")
@@ -38,6 +38,7 @@ from sklearn.metrics import silhouette_score
 
 from common.file_utils import get_project_base_directory
 from common.misc_utils import pip_install_torch
+from deepdoc.parser.page_image_store import PageImageStore
 from deepdoc.vision import OCR, AscendLayoutRecognizer, LayoutRecognizer, Recognizer, TableStructureRecognizer
 from rag.nlp import rag_tokenizer
 from rag.prompts.generator import vision_llm_describe_prompt
@@ -48,6 +49,10 @@ from common import settings
 from common.misc_utils import thread_pool_exec
 
 LOCK_KEY_pdfplumber = "global_shared_lock_pdfplumber"
+# Maximum number of decoded page images kept in memory by RAGFlowPdfParser; 0 keeps every page.
+PDF_MAX_RESIDENT_PAGES = int(os.environ.get("PDF_MAX_RESIDENT_PAGES", "0"))
+# Number of pages whose text crops are recognized together in one cross-page OCR batch.
+OCR_PAGE_BATCH = max(1, int(os.environ.get("OCR_PAGE_BATCH", "4")))
 if LOCK_KEY_pdfplumber not in sys.modules:
     sys.modules[LOCK_KEY_pdfplumber] = threading.Lock()
 
@@ -190,6 +195,23 @@ class RAGFlowPdfParser:
                     arr[j + 1] = tmp
         return arr
 
+    def _extract_page_chars(self, pages, page_from):
+        """The colored chars of each page; empty lists if they can't be extracted."""
+        try:
+            return [[c for c in page.dedupe_chars().chars if self._has_color(c)] for page in pages]
+        except Exception as e:
+            logging.warning(f"Failed to extract characters for pages {page_from}-{page_from + len(pages)}: {str(e)}")
+            return [[] for _ in pages]
+
+    @staticmethod
+    def _is_english_chars(page_chars, page_count):
+        """Whether more than half of the pages show 30 latin characters in a row in a sample of their chars."""
+        votes = [
+            re.search(r"[ a-zA-Z0-9,/¸;:'\[\]\(\)!@#$%^&*\"?<>._-]{30,}", "".join(random.choices([c["text"] for c in chars], k=min(100, len(chars)))))
+            for chars in page_chars
+        ]
+        return sum([1 if e else 0 for e in votes]) > page_count / 2
+
     def _has_color(self, o):
         if o.get("ncs", "") == "DeviceGray":
             if o["stroking_color"] and o["stroking_color"][0] == 1 and o["non_stroking_color"] and o["non_stroking_color"][0] == 1:
@@ -582,15 +604,37 @@ class RAGFlowPdfParser:
 
             logging.info(f"Added {added} OCR results from rotated table {table_index}")
 
-    def __ocr(self, pagenum, img, chars, ZM=3, device_id: int | None = None):
+    def __ocr(self, pagenums, imgs, chars_list, ZM=3, device_id: int | None = None):
+        """
+        OCR a group of pages. Text lines are detected page by page, but the ones without embedded
+        chars are recognized together in one cross-page batch. Returns the boxes of every page.
+        """
+        pages = [self.__ocr_detect(pagenum, img, chars, ZM, device_id) for pagenum, img, chars in zip(pagenums, imgs, chars_list)]
+
+        start = timer()
+        boxes_to_reg = [b for bxs in pages for b in bxs if "box_image" in b]
+        texts = self.ocr.recognize_batch([b["box_image"] for b in boxes_to_reg], device_id)
+        for i in range(len(boxes_to_reg)):
+            boxes_to_reg[i]["text"] = texts[i]
+            del boxes_to_reg[i]["box_image"]
+        logging.info(f"__ocr recognize {len(boxes_to_reg)} boxes of {len(pagenums)} pages cost {timer() - start}s")
+
+        res = []
+        for pagenum, bxs in zip(pagenums, pages):
+            bxs = [b for b in bxs if b["text"]]
+            if self.mean_height[pagenum - 1] == 0 and bxs:
+                self.mean_height[pagenum - 1] = np.median([b["bottom"] - b["top"] for b in bxs])
+            res.append(bxs)
+        return res
+
+    def __ocr_detect(self, pagenum, img, chars, ZM=3, device_id: int | None = None):
         start = timer()
         bxs = self.ocr.detect(np.array(img), device_id)
         logging.info(f"__ocr detecting boxes of a image cost ({timer() - start}s)")
 
         start = timer()
         if not bxs:
-            self.boxes.append([])
-            return
+            return []
         bxs = [(line[0], line[1][0]) for line in bxs]
         bxs = Recognizer.sort_Y_firstly(
             [
@@ -628,24 +672,13 @@ class RAGFlowPdfParser:
             del b["chars"]
 
         logging.info(f"__ocr sorting {len(chars)} chars cost {timer() - start}s")
-        start = timer()
-        boxes_to_reg = []
         img_np = np.array(img)
         for b in bxs:
             if not b["text"]:
                 left, right, top, bott = b["x0"] * ZM, b["x1"] * ZM, b["top"] * ZM, b["bottom"] * ZM
                 b["box_image"] = self.ocr.get_rotate_crop_image(img_np, np.array([[left, top], [right, top], [right, bott], [left, bott]], dtype=np.float32))
-                boxes_to_reg.append(b)
             del b["txt"]
-        texts = self.ocr.recognize_batch([b["box_image"] for b in boxes_to_reg], device_id)
-        for i in range(len(boxes_to_reg)):
-            boxes_to_reg[i]["text"] = texts[i]
-            del boxes_to_reg[i]["box_image"]
-        logging.info(f"__ocr recognize {len(bxs)} boxes cost {timer() - start}s")
-        bxs = [b for b in bxs if b["text"]]
-        if self.mean_height[pagenum - 1] == 0:
-            self.mean_height[pagenum - 1] = np.median([b["bottom"] - b["top"] for b in bxs])
-        self.boxes.append(bxs)
+        return bxs
 
     def _layouts_rec(self, ZM, drop=True):
         assert len(self.page_images) == len(self.boxes)
@@ -1387,24 +1420,32 @@ class RAGFlowPdfParser:
         self.page_cum_height = [0]
         self.page_layout = []
         self.page_from = page_from
+        if isinstance(getattr(self, "page_images", None), PageImageStore):
+            self.page_images.close()
+        # With a page budget, pages are rasterized and OCRed window by window and only
+        # PDF_MAX_RESIDENT_PAGES decoded page images stay in memory; the rest are spilled to disk.
+        streaming = PDF_MAX_RESIDENT_PAGES > 0
+        self.page_images = PageImageStore(PDF_MAX_RESIDENT_PAGES) if streaming else []
+        page_count = 0
         start = timer()
         try:
             with sys.modules[LOCK_KEY_pdfplumber]:
                 with pdfplumber.open(fnm) if isinstance(fnm, str) else pdfplumber.open(BytesIO(fnm)) as pdf:
                     self.pdf = pdf
-                    self.page_images = [p.to_image(resolution=72 * zoomin, antialias=True).annotated for i, p in enumerate(self.pdf.pages[page_from:page_to])]
-
-                    try:
-                        self.page_chars = [[c for c in page.dedupe_chars().chars if self._has_color(c)] for page in self.pdf.pages[page_from:page_to]]
-                    except Exception as e:
-                        logging.warning(f"Failed to extract characters for pages {page_from}-{page_to}: {str(e)}")
-                        self.page_chars = [[] for _ in range(page_to - page_from)]  # If failed to extract, using empty list instead.
+                    page_count = len(self.pdf.pages[page_from:page_to])
+                    if not streaming:
+                        self.page_images = [p.to_image(resolution=72 * zoomin, antialias=True).annotated for i, p in enumerate(self.pdf.pages[page_from:page_to])]
+                        self.page_chars = self._extract_page_chars(self.pdf.pages[page_from:page_to], page_from)
+                    else:
+                        # Extracted window by window along with the images, see __streaming_ocr_launcher.
+                        self.page_chars = [[] for _ in range(page_count)]
 
                     self.total_page = len(self.pdf.pages)
 
         except Exception as e:
             logging.exception(f"RAGFlowPdfParser __images__, exception: {e}")
         logging.info(f"__images__ dedupe_chars cost {timer() - start}s")
+        has_chars = any([c for c in self.page_chars])
 
         self.outlines = []
         try:
@@ -1429,37 +1470,34 @@ class RAGFlowPdfParser:
             logging.warning("Miss outlines")
 
         logging.debug("Images converted.")
-        self.is_english = [
-            re.search(r"[ a-zA-Z0-9,/¸;:'\[\]\(\)!@#$%^&*\"?<>._-]{30,}", "".join(random.choices([c["text"] for c in self.page_chars[i]], k=min(100, len(self.page_chars[i])))))
-            for i in range(len(self.page_chars))
-        ]
-        if sum([1 if e else 0 for e in self.is_english]) > len(self.page_images) / 2:
-            self.is_english = True
-        else:
-            self.is_english = False
-
-        async def __img_ocr(i, id, img, chars, limiter):
-            j = 0
-            while j + 1 < len(chars):
-                if (
-                    chars[j]["text"]
-                    and chars[j + 1]["text"]
-                    and re.match(r"[0-9a-zA-Z,.:;!%]+", chars[j]["text"] + chars[j + 1]["text"])
-                    and chars[j + 1]["x0"] - chars[j]["x1"] >= min(chars[j + 1]["width"], chars[j]["width"]) / 2
-                ):
-                    chars[j]["text"] += " "
-                j += 1
+        # When streaming, decided on the first window, the only pages whose chars are known before OCR.
+        self.is_english = False if streaming else self._is_english_chars(self.page_chars, page_count)
+
+        async def __img_ocr(i, id, imgs, chars_list, limiter):
+            for chars in chars_list:
+                j = 0
+                while j + 1 < len(chars):
+                    if (
+                        chars[j]["text"]
+                        and chars[j + 1]["text"]
+                        and re.match(r"[0-9a-zA-Z,.:;!%]+", chars[j]["text"] + chars[j + 1]["text"])
+                        and chars[j + 1]["x0"] - chars[j]["x1"] >= min(chars[j + 1]["width"], chars[j]["width"]) / 2
+                    ):
+                        chars[j]["text"] += " "
+                    j += 1
 
+            pagenums = list(range(i + 1, i + 1 + len(imgs)))
             if limiter:
                 async with limiter:
-                    await thread_pool_exec(self.__ocr, i + 1, img, chars, zoomin, id)
+                    bxs = await thread_pool_exec(self.__ocr, pagenums, imgs, chars_list, zoomin, id)
             else:
-                self.__ocr(i + 1, img, chars, zoomin, id)
+                bxs = self.__ocr(pagenums, imgs, chars_list, zoomin, id)
 
-            if callback and i % 6 == 5:
-                callback((i + 1) * 0.6 / len(self.page_images))
+            if callback and (i + len(imgs)) // 6 > i // 6:
+                callback((i + len(imgs)) * 0.6 / page_count)
+            return bxs
 
-        async def __img_ocr_launcher():
+        async def __img_ocr_launcher(offset, page_images):
             def __ocr_preprocess():
                 chars = self.page_chars[i] if not self.is_english else []
                 self.mean_height.append(np.median(sorted([c["height"] for c in chars])) if chars else 0)
@@ -1467,20 +1505,27 @@ class RAGFlowPdfParser:
                 self.page_cum_height.append(img.size[1] / zoomin)
                 return chars
 
+            # Pages are OCRed in groups of OCR_PAGE_BATCH so that text recognition runs full batches across pages.
+            groups = []
+            for i, img in enumerate(page_images, start=offset):
+                chars = __ocr_preprocess()
+                if (i - offset) % OCR_PAGE_BATCH == 0:
+                    groups.append((i, [], []))
+                groups[-1][1].append(img)
+                groups[-1][2].append(chars)
+
             if self.parallel_limiter:
                 tasks = []
 
-                for i, img in enumerate(self.page_images):
-                    chars = __ocr_preprocess()
-
-                    semaphore = self.parallel_limiter[i % settings.PARALLEL_DEVICES]
+                for g, (i, imgs, chars_list) in enumerate(groups):
+                    semaphore = self.parallel_limiter[g % settings.PARALLEL_DEVICES]
 
-                    async def wrapper(i=i, img=img, chars=chars, semaphore=semaphore):
-                        await __img_ocr(
+                    async def wrapper(i=i, g=g, imgs=imgs, chars_list=chars_list, semaphore=semaphore):
+                        return await __img_ocr(
                             i,
-                            i % settings.PARALLEL_DEVICES,
-                            img,
-                            chars,
+                            g % settings.PARALLEL_DEVICES,
+                            imgs,
+                            chars_list,
                             semaphore,
                         )
 
@@ -1488,7 +1533,7 @@ class RAGFlowPdfParser:
                     await asyncio.sleep(0)
 
                 try:
-                    await asyncio.gather(*tasks, return_exceptions=False)
+                    results = await asyncio.gather(*tasks, return_exceptions=False)
                 except Exception as e:
                     logging.error(f"Error in OCR: {e}")
                     for t in tasks:
@@ -1497,17 +1542,49 @@ class RAGFlowPdfParser:
                     raise
 
             else:
-                for i, img in enumerate(self.page_images):
-                    chars = __ocr_preprocess()
-                    await __img_ocr(i, 0, img, chars, None)
+                results = []
+                for i, imgs, chars_list in groups:
+                    results.append(await __img_ocr(i, 0, imgs, chars_list, None))
+
+            # Keep self.boxes in page order whatever order the groups finished in.
+            for bxs in results:
+                self.boxes.extend(bxs)
+
+        async def __streaming_ocr_launcher():
+            nonlocal has_chars
+            window = PDF_MAX_RESIDENT_PAGES
+            # One document for every window: reopening would parse the file's xref and page tree again each time.
+            with sys.modules[LOCK_KEY_pdfplumber]:
+                pdf = pdfplumber.open(fnm) if isinstance(fnm, str) else pdfplumber.open(BytesIO(fnm))
+            try:
+                for offset in range(0, page_count, window):
+                    with sys.modules[LOCK_KEY_pdfplumber]:
+                        pages = pdf.pages[page_from + offset:page_from + min(offset + window, page_count)]
+                        page_images = [p.to_image(resolution=72 * zoomin, antialias=True).annotated for p in pages]
+                        window_chars = self._extract_page_chars(pages, page_from + offset)
+                        # Drop the layout objects parsed for the window; the open document would keep them otherwise.
+                        for p in pages:
+                            p.close()
+                    self.page_chars[offset:offset + len(pages)] = window_chars
+                    if offset == 0:
+                        self.is_english = self._is_english_chars(window_chars, len(pages))
+                    has_chars = has_chars or any(window_chars)
+                    await __img_ocr_launcher(offset, page_images)
+                    for i, img in enumerate(page_images, start=offset):
+                        self.page_images.append(img)
+                        # Chars are merged into boxes by now and are not needed any more.
+                        self.page_chars[i] = []
+                    self.lefted_chars = []
+            finally:
+                pdf.close()
 
         start = timer()
 
-        asyncio.run(__img_ocr_launcher())
+        asyncio.run(__streaming_ocr_launcher() if streaming else __img_ocr_launcher(0, self.page_images))
 
         logging.info(f"__images__ {len(self.page_images)} pages cost {timer() - start}s")
 
-        if not self.is_english and not any([c for c in self.page_chars]) and self.boxes:
+        if not self.is_english and not has_chars and self.boxes:
             bxes = [b for bxs in self.boxes for b in bxs]
             self.is_english = re.search(r"[ \na-zA-Z0-9,/¸;:'\[\]\(\)!@#$%^&*\"?<>._-]{30,}", "".join([b["text"] for b in random.choices(bxes, k=min(30, len(bxes)))]))
 
@@ -342,16 +342,16 @@ class AscendLayoutRecognizer(Recognizer):
 
         assert len(image_list) == len(ocr_res)
 
-        images = [np.array(im) if not isinstance(im, np.ndarray) else im for im in image_list]
         layouts_all_pages = []  # list of list[{"type","score","bbox":[x1,y1,x2,y2]}]
 
         conf_thr = max(thr, 0.08)
 
-        batch_loop_cnt = math.ceil(float(len(images)) / batch_size)
+        # Convert batch by batch so that only one batch of decoded pages is held as arrays at a time.
+        batch_loop_cnt = math.ceil(float(len(image_list)) / batch_size)
         for bi in range(batch_loop_cnt):
             s = bi * batch_size
-            e = min((bi + 1) * batch_size, len(images))
-            batch_images = images[s:e]
+            e = min((bi + 1) * batch_size, len(image_list))
+            batch_images = [np.array(im) if not isinstance(im, np.ndarray) else im for im in image_list[s:e]]
 
             inputs_list = self.preprocess(batch_images)
             logging.debug("preprocess done")
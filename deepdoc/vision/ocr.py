@@ -139,7 +139,10 @@ def load_model(model_dir, nm, device_id: int | None = None):
 class TextRecognizer:
     def __init__(self, model_dir, device_id: int | None = None):
         self.rec_image_shape = [int(v) for v in "3, 48, 320".split(",")]
-        self.rec_batch_num = 16
+        self.rec_batch_num = int(os.environ.get("OCR_REC_BATCH_NUM", "16"))
+        # Padded batch widths are rounded up to multiples of this width/height ratio, so that
+        # onnxruntime only ever sees a handful of input shapes.
+        self.rec_wh_ratio_step = float(os.environ.get("OCR_REC_WH_RATIO_STEP", "2"))
         postprocess_params = {
             'name': 'CTCLabelDecode',
             "character_dict_path": os.path.join(model_dir, "ocr.res"),
@@ -366,31 +369,50 @@ class TextRecognizer:
             del self.predictor
         gc.collect()
 
+    def _bucket_wh_ratio(self, wh_ratio):
+        step = self.rec_wh_ratio_step
+        return math.ceil(wh_ratio / step) * step if step > 0 else wh_ratio
+
+    def _shape_batches(self, width_list):
+        """
+        Split the crops, sorted by aspect ratio, into batches of at most `rec_batch_num` crops
+        whose padded width is less than twice the width of the narrowest one in the batch.
+        """
+        imgC, imgH, imgW = self.rec_image_shape[:3]
+        min_ratio = imgW / imgH
+        indices = np.argsort(np.array(width_list))
+        batches = []
+        batch = []
+        for idx in indices:
+            ratio = max(min_ratio, width_list[idx])
+            if batch and (len(batch) >= self.rec_batch_num or
+                          self._bucket_wh_ratio(ratio) > 2 * max(min_ratio, width_list[batch[0]])):
+                batches.append(batch)
+                batch = []
+            batch.append(idx)
+        if batch:
+            batches.append(batch)
+        return batches
+
     def __call__(self, img_list):
         img_num = len(img_list)
         # Calculate the aspect ratio of all text bars
         width_list = []
         for img in img_list:
             width_list.append(img.shape[1] / float(img.shape[0]))
-        # Sorting can speed up the recognition process
-        indices = np.argsort(np.array(width_list))
         rec_res = [['', 0.0]] * img_num
-        batch_num = self.rec_batch_num
         st = time.time()
 
-        for beg_img_no in range(0, img_num, batch_num):
-            end_img_no = min(img_num, beg_img_no + batch_num)
-            norm_img_batch = []
+        # Sorting by aspect ratio and bucketing the padded width keeps batches full and shapes few.
+        for batch in self._shape_batches(width_list):
             imgC, imgH, imgW = self.rec_image_shape[:3]
             max_wh_ratio = imgW / imgH
-            # max_wh_ratio = 0
-            for ino in range(beg_img_no, end_img_no):
-                h, w = img_list[indices[ino]].shape[0:2]
-                wh_ratio = w * 1.0 / h
-                max_wh_ratio = max(max_wh_ratio, wh_ratio)
-            for ino in range(beg_img_no, end_img_no):
-                norm_img = self.resize_norm_img(img_list[indices[ino]],
-                                                max_wh_ratio)
+            for ino in batch:
+                max_wh_ratio = max(max_wh_ratio, width_list[ino])
+            max_wh_ratio = self._bucket_wh_ratio(max_wh_ratio)
+            norm_img_batch = []
+            for ino in batch:
+                norm_img = self.resize_norm_img(img_list[ino], max_wh_ratio)
                 norm_img = norm_img[np.newaxis, :]
                 norm_img_batch.append(norm_img)
             norm_img_batch = np.concatenate(norm_img_batch)
@@ -409,7 +431,7 @@ class TextRecognizer:
             preds = outputs[0]
             rec_result = self.postprocess_op(preds)
             for rno in range(len(rec_result)):
-                rec_res[indices[beg_img_no + rno]] = rec_result[rno]
+                rec_res[batch[rno]] = rec_result[rno]
 
         return rec_res, time.time() - st
 
@@ -702,6 +724,8 @@ class OCR:
     def recognize_batch(self, img_list, device_id: int | None = None):
         if device_id is None:
             device_id = 0
+        if not img_list:
+            return []
         rec_res, elapse = self.text_recognizer[device_id](img_list)
         texts = []
         for i in range(len(rec_res)):
@@ -414,18 +414,12 @@ class Recognizer:
 
     def __call__(self, image_list, thr=0.7, batch_size=16):
         res = []
-        images = []
-        for i in range(len(image_list)):
-            if not isinstance(image_list[i], np.ndarray):
-                images.append(np.array(image_list[i]))
-            else:
-                images.append(image_list[i])
-
-        batch_loop_cnt = math.ceil(float(len(images)) / batch_size)
+        # Convert batch by batch so that only one batch of decoded pages is held as arrays at a time.
+        batch_loop_cnt = math.ceil(float(len(image_list)) / batch_size)
         for i in range(batch_loop_cnt):
             start_index = i * batch_size
-            end_index = min((i + 1) * batch_size, len(images))
-            batch_image_list = images[start_index:end_index]
+            end_index = min((i + 1) * batch_size, len(image_list))
+            batch_image_list = [img if isinstance(img, np.ndarray) else np.array(img) for img in image_list[start_index:end_index]]
             inputs = self.preprocess(batch_image_list)
             logging.debug("preprocess")
             for ins in inputs:
@@ -588,16 +588,15 @@ class TableStructureRecognizer(Recognizer):
         device_id = int(os.getenv("ASCEND_LAYOUT_RECOGNIZER_DEVICE_ID", 0))
         session = InferSession(device_id=device_id, model_path=model_file_path)
 
-        images = [np.array(im) if not isinstance(im, np.ndarray) else im for im in image_list]
         results = []
 
         conf_thr = max(thr, 0.08)
 
-        batch_loop_cnt = math.ceil(float(len(images)) / batch_size)
+        batch_loop_cnt = math.ceil(float(len(image_list)) / batch_size)
         for bi in range(batch_loop_cnt):
             s = bi * batch_size
-            e = min((bi + 1) * batch_size, len(images))
-            batch_images = images[s:e]
+            e = min((bi + 1) * batch_size, len(image_list))
+            batch_images = [np.array(im) if not isinstance(im, np.ndarray) else im for im in image_list[s:e]]
 
             inputs_list = self.preprocess(batch_images)
             for ins in inputs_list:
@@ -16,20 +16,24 @@
 import asyncio
 import json
 import logging
+import os
 from collections import defaultdict
 from copy import deepcopy
 import json_repair
 import pandas as pd
 
-from common.misc_utils import get_uuid
+from common.misc_utils import get_uuid, thread_pool_exec
 from rag.graphrag.query_analyze_prompt import PROMPTS
-from rag.graphrag.utils import get_entity_type2samples, get_llm_cache, set_llm_cache, get_relation
+from rag.graphrag.utils import get_entity_type2samples, get_llm_cache, set_llm_cache, get_relations
 from common.token_utils import num_tokens_from_string
 
 from rag.nlp.search import Dealer, index_name
 from common.float_utils import get_float
 from common import settings
-from common.doc_store.doc_store_base import OrderByExpr
+from common.doc_store.doc_store_base import MatchDenseExpr, OrderByExpr
+
+# Most entities of the requested types a graph retrieval fetches to boost the others.
+KG_TYPE_ENTITY_LIMIT = int(os.environ.get("KG_TYPE_ENTITY_LIMIT", "1024"))
 
 
 class KGSearch(Dealer):
@@ -105,29 +109,33 @@ class KGSearch(Dealer):
             }
         return res
 
-    def get_relevant_ents_by_keywords(self, keywords, filters, idxnms, kb_ids, emb_mdl, sim_thr=0.3, N=56):
+    async def get_relevant_ents_by_keywords(self, keywords, filters, idxnms, kb_ids, emb_mdl, sim_thr=0.3, N=56,
+                                            match_dense=None):
         if not keywords:
             return {}
         filters = deepcopy(filters)
         filters["knowledge_graph_kwd"] = "entity"
-        matchDense = self.get_vector(", ".join(keywords), emb_mdl, 1024, sim_thr)
-        es_res = self.dataStore.search(["content_with_weight", "entity_kwd", "rank_flt"], [], filters, [matchDense],
-                                       OrderByExpr(), 0, N,
-                                       idxnms, kb_ids)
+        if match_dense is None:
+            match_dense = await self.get_vector(", ".join(keywords), emb_mdl, 1024, sim_thr)
+        es_res = await thread_pool_exec(self.dataStore.search, ["content_with_weight", "entity_kwd", "rank_flt"], [],
+                                        filters, [match_dense], OrderByExpr(), 0, N, idxnms, kb_ids)
         return self._ent_info_from_(es_res, sim_thr)
 
-    def get_relevant_relations_by_txt(self, txt, filters, idxnms, kb_ids, emb_mdl, sim_thr=0.3, N=56):
+    async def get_relevant_relations_by_txt(self, txt, filters, idxnms, kb_ids, emb_mdl, sim_thr=0.3, N=56,
+                                            match_dense=None):
         if not txt:
             return {}
         filters = deepcopy(filters)
         filters["knowledge_graph_kwd"] = "relation"
-        matchDense = self.get_vector(txt, emb_mdl, 1024, sim_thr)
-        es_res = self.dataStore.search(
+        if match_dense is None:
+            match_dense = await self.get_vector(txt, emb_mdl, 1024, sim_thr)
+        es_res = await thread_pool_exec(
+            self.dataStore.search,
             ["content_with_weight", "_score", "from_entity_kwd", "to_entity_kwd", "weight_int"],
-            [], filters, [matchDense], OrderByExpr(), 0, N, idxnms, kb_ids)
+            [], filters, [match_dense], OrderByExpr(), 0, N, idxnms, kb_ids)
         return self._relation_info_from_(es_res, sim_thr)
 
-    def get_relevant_ents_by_types(self, types, filters, idxnms, kb_ids, N=56):
+    async def get_relevant_ents_by_types(self, types, filters, idxnms, kb_ids, N=KG_TYPE_ENTITY_LIMIT):
         if not types:
             return {}
         filters = deepcopy(filters)
@@ -135,10 +143,25 @@ class KGSearch(Dealer):
         filters["entity_type_kwd"] = types
         ordr = OrderByExpr()
         ordr.desc("rank_flt")
-        es_res = self.dataStore.search(["entity_kwd", "rank_flt"], [], filters, [], ordr, 0, N,
-                                       idxnms, kb_ids)
+        # Only the names are used, to boost entities and relations found by the other searches.
+        es_res = await thread_pool_exec(self.dataStore.search, ["entity_kwd", "rank_flt"], [], filters, [], ordr, 0, N,
+                                        idxnms, kb_ids)
         return self._ent_info_from_(es_res, 0)
 
+    async def _query_vectors(self, txts, emb_mdl, similarities):
+        """Dense match expressions of `txts`; each distinct text is embedded once, all of them concurrently."""
+        uniq = list(dict.fromkeys(t for t in txts if t))
+        vecs = dict(zip(uniq, await asyncio.gather(*[self.get_vector(t, emb_mdl, 1024) for t in uniq])))
+        res = []
+        for t, sim in zip(txts, similarities):
+            if t not in vecs:
+                res.append(None)
+                continue
+            m = vecs[t]
+            res.append(MatchDenseExpr(m.vector_column_name, m.embedding_data, m.embedding_data_type, m.distance_type,
+                                      m.topn, {"similarity": sim}))
+        return res
+
     async def retrieval(self, question: str,
                tenant_ids: str | list[str],
                kb_ids: list[str],
@@ -166,9 +189,15 @@ class KGSearch(Dealer):
             ents = [qst]
             pass
 
-        ents_from_query = self.get_relevant_ents_by_keywords(ents, filters, idxnms, kb_ids, emb_mdl, ent_sim_threshold)
-        ents_from_types = self.get_relevant_ents_by_types(ty_kwds, filters, idxnms, kb_ids, 10000)
-        rels_from_txt = self.get_relevant_relations_by_txt(qst, filters, idxnms, kb_ids, emb_mdl, rel_sim_threshold)
+        ent_vec, rel_vec = await self._query_vectors([", ".join(ents) if ents else "", qst], emb_mdl,
+                                                     [ent_sim_threshold, rel_sim_threshold])
+        ents_from_query, ents_from_types, rels_from_txt = await asyncio.gather(
+            self.get_relevant_ents_by_keywords(ents, filters, idxnms, kb_ids, emb_mdl, ent_sim_threshold,
+                                               match_dense=ent_vec),
+            self.get_relevant_ents_by_types(ty_kwds, filters, idxnms, kb_ids),
+            self.get_relevant_relations_by_txt(qst, filters, idxnms, kb_ids, emb_mdl, rel_sim_threshold,
+                                               match_dense=rel_vec),
+        )
         nhop_pathes = defaultdict(dict)
         for _, ent in ents_from_query.items():
             nhops = ent.get("n_hop_ents", [])
@@ -239,13 +268,12 @@ class KGSearch(Dealer):
                 ents = ents[:-1]
                 break
 
+        missing = [(f, t) for (f, t), rel in rels_from_txt if not rel.get("description")]
+        found = await get_relations(tenant_ids, kb_ids, missing) if missing else {}
         for (f, t), rel in rels_from_txt:
             if not rel.get("description"):
-                for tid in tenant_ids:
-                    rela = await get_relation(tid, kb_ids, f, t)
-                    if rela:
-                        break
-                else:
+                rela = found.get(tuple(sorted([f, t])))
+                if not rela:
                     continue
                 rel["description"] = rela["description"]
             desc = rel["description"]
@@ -276,7 +304,7 @@ class KGSearch(Dealer):
         return {
                 "chunk_id": get_uuid(),
                 "content_ltks": "",
-                "content_with_weight": ents + relas + self._community_retrieval_([n for n, _ in ents_from_query], filters, kb_ids, idxnms,
+                "content_with_weight": ents + relas + await self._community_retrieval_([n for n, _ in ents_from_query], filters, kb_ids, idxnms,
                                                         comm_topn, max_token),
                 "doc_id": "",
                 "docnm_kwd": "Related content in Knowledge Graph",
@@ -290,7 +318,7 @@ class KGSearch(Dealer):
                 "positions": [],
             }
 
-    def _community_retrieval_(self, entities, condition, kb_ids, idxnms, topn, max_token):
+    async def _community_retrieval_(self, entities, condition, kb_ids, idxnms, topn, max_token):
         ## Community retrieval
         fields = ["docnm_kwd", "content_with_weight"]
         odr = OrderByExpr()
@@ -298,8 +326,8 @@ class KGSearch(Dealer):
         fltr = deepcopy(condition)
         fltr["knowledge_graph_kwd"] = "community_report"
         fltr["entities_kwd"] = entities
-        comm_res = self.dataStore.search(fields, [], fltr, [],
-                                         OrderByExpr(), 0, topn, idxnms, kb_ids)
+        comm_res = await thread_pool_exec(self.dataStore.search, fields, [], fltr, [],
+                                          OrderByExpr(), 0, topn, idxnms, kb_ids)
         comm_res_fields = self.dataStore.get_fields(comm_res, fields)
         txts = []
         for ii, (_, row) in enumerate(comm_res_fields.items()):
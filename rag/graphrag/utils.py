@@ -10,25 +10,30 @@ Reference:
 """
 
 import asyncio
+import base64
 import dataclasses
 import html
 import json
 import logging
 import os
 import re
+import threading
 import time
+import zlib
 from collections import defaultdict
 from hashlib import md5
 from typing import Any, Callable, Set, Tuple
 
 import networkx as nx
 import numpy as np
+import ormsgpack
 import xxhash
 from networkx.readwrite import json_graph
 
 from common.misc_utils import get_uuid
 from common.connection_utils import timeout
 from rag.nlp import rag_tokenizer, search
+from rag.utils.embedding_cache import model_key, pack_vector, unpack_vector
 from rag.utils.redis_conn import REDIS_CONN
 from common import settings
 from common.doc_store.doc_store_base import OrderByExpr
@@ -39,6 +44,18 @@ ErrorHandlerFn = Callable[[BaseException | None, str | None, dict | None], None]
 
 chat_limiter = asyncio.Semaphore(int(os.environ.get("MAX_CONCURRENT_CHATS", 10)))
 
+# The global graph is persisted as one "graph" manifest plus this many "graph_shard" records.
+GRAPH_SHARD_NUM = int(os.environ.get("GRAPH_SHARD_NUM", "32"))
+GRAPH_INSERT_BULK_SIZE = int(os.environ.get("GRAPH_INSERT_BULK_SIZE", "64"))
+# Graph shards and subgraphs are stored msgpack-encoded and compressed unless the doc store analyzes the content field.
+GRAPH_SNAPSHOT_COMPRESS = int(os.environ.get("GRAPH_SNAPSHOT_COMPRESS", "0" if settings.DOC_ENGINE_INFINITY else "1"))
+GRAPH_SNAPSHOT_JSON = "gsnap1:"
+GRAPH_SNAPSHOT_PACKED = "gsnap1z:"
+
+EMBED_CACHE_DTYPE = "<f4"
+EMBED_CACHE_STATS = {"hits": 0, "misses": 0}
+_embed_cache_stats_lock = threading.Lock()
+
 
 @dataclasses.dataclass
 class GraphChange:
@@ -111,26 +128,73 @@ def set_llm_cache(llmnm, txt, v, history, genconf):
     REDIS_CONN.set(k, v.encode("utf-8"), 24 * 3600)
 
 
-def get_embed_cache(llmnm, txt):
+def _embed_cache_key(llmnm, txt):
     hasher = xxhash.xxh64()
     hasher.update(str(llmnm).encode("utf-8"))
     hasher.update(str(txt).encode("utf-8"))
+    # Prefixed so that legacy JSON-encoded entries are never read as packed floats.
+    return "graph_embd:" + hasher.hexdigest()
 
-    k = hasher.hexdigest()
-    bin = REDIS_CONN.get(k)
-    if not bin:
+
+def get_embed_cache_many(llmnm, txts: list[str]) -> list[np.ndarray | None]:
+    """Fetch the cached embeddings of `txts` with a single MGET; misses are None. `llmnm` is a `model_key`."""
+    if not txts:
+        return []
+    if not llmnm:
+        return [None] * len(txts)
+    res = []
+    for bin in REDIS_CONN.mget_bin([_embed_cache_key(llmnm, t) for t in txts]):
+        res.append(unpack_vector(bin, EMBED_CACHE_DTYPE) if bin else None)
+    hits = sum(1 for v in res if v is not None)
+    with _embed_cache_stats_lock:
+        EMBED_CACHE_STATS["hits"] += hits
+        EMBED_CACHE_STATS["misses"] += len(res) - hits
+    return res
+
+
+def set_embed_cache_many(llmnm, txts: list[str], arrs):
+    assert len(txts) == len(arrs)
+    if not txts or not llmnm:
         return
-    return np.array(json.loads(bin))
+    REDIS_CONN.mset_bin({_embed_cache_key(llmnm, t): pack_vector(a, EMBED_CACHE_DTYPE) for t, a in zip(txts, arrs)},
+                        24 * 3600)
+
+
+def get_embed_cache(llmnm, txt):
+    return get_embed_cache_many(llmnm, [txt])[0]
 
 
 def set_embed_cache(llmnm, txt, arr):
-    hasher = xxhash.xxh64()
-    hasher.update(str(llmnm).encode("utf-8"))
-    hasher.update(str(txt).encode("utf-8"))
+    set_embed_cache_many(llmnm, [txt], [arr])
+
+
+async def embed_with_cache(embd_mdl, keys: list[str], txts: list[str] | None = None) -> list[np.ndarray]:
+    """
+    Embeddings of `txts` (defaults to `keys`) cached under `keys`.
+    Misses are encoded in batches of EMBEDDING_BATCH_SIZE.
+    """
+    if txts is None:
+        txts = keys
+    ebds = await thread_pool_exec(get_embed_cache_many, model_key(embd_mdl), keys)
+    miss_idx = [i for i, e in enumerate(ebds) if e is None]
+    enable_timeout_assertion = os.environ.get("ENABLE_TIMEOUT_ASSERTION")
+    for b in range(0, len(miss_idx), settings.EMBEDDING_BATCH_SIZE):
+        batch_idx = miss_idx[b: b + settings.EMBEDDING_BATCH_SIZE]
+        async with chat_limiter:
+            timeout = 3 if enable_timeout_assertion else 30000000
+            vts, _ = await asyncio.wait_for(
+                thread_pool_exec(embd_mdl.encode, [txts[i] for i in batch_idx]),
+                timeout=timeout
+            )
+        for i, v in zip(batch_idx, vts):
+            ebds[i] = v
+        await thread_pool_exec(set_embed_cache_many, model_key(embd_mdl), [keys[i] for i in batch_idx], vts)
+    return ebds
 
-    k = hasher.hexdigest()
-    arr = json.dumps(arr.tolist() if isinstance(arr, np.ndarray) else arr)
-    REDIS_CONN.set(k, arr.encode("utf-8"), 24 * 3600)
+
+def get_embed_cache_stats() -> dict:
+    with _embed_cache_stats_lock:
+        return dict(EMBED_CACHE_STATS)
 
 
 def get_tags_from_cache(kb_ids):
@@ -297,7 +361,7 @@ def chunk_id(chunk):
     return xxhash.xxh64((chunk["content_with_weight"] + chunk["kb_id"]).encode("utf-8")).hexdigest()
 
 
-async def graph_node_to_chunk(kb_id, embd_mdl, ent_name, meta, chunks):
+async def graph_node_to_chunk(kb_id, embd_mdl, ent_name, meta, chunks, ebd=None):
     global chat_limiter
     enable_timeout_assertion = os.environ.get("ENABLE_TIMEOUT_ASSERTION")
     chunk = {
@@ -314,7 +378,8 @@ async def graph_node_to_chunk(kb_id, embd_mdl, ent_name, meta, chunks):
         "available_int": 0,
     }
     chunk["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(chunk["content_ltks"])
-    ebd = get_embed_cache(embd_mdl.llm_name, ent_name)
+    if ebd is None:
+        ebd = get_embed_cache(model_key(embd_mdl), ent_name)
     if ebd is None:
         async with chat_limiter:
             timeout = 3 if enable_timeout_assertion else 30000000
@@ -323,7 +388,7 @@ async def graph_node_to_chunk(kb_id, embd_mdl, ent_name, meta, chunks):
                 timeout=timeout
             )
         ebd = ebd[0]
-        set_embed_cache(embd_mdl.llm_name, ent_name, ebd)
+        set_embed_cache(model_key(embd_mdl), ent_name, ebd)
     assert ebd is not None
     chunk["q_%d_vec" % len(ebd)] = ebd
     chunks.append(chunk)
@@ -351,7 +416,49 @@ async def get_relation(tenant_id, kb_id, from_ent_name, to_ent_name, size=1):
     return res
 
 
-async def graph_edge_to_chunk(kb_id, embd_mdl, from_ent_name, to_ent_name, meta, chunks):
+async def get_relations(tenant_ids, kb_ids, pairs) -> dict:
+    """
+    Fetch the stored metadata of many relations with a single search.
+
+    Returns a dict keyed by the sorted (from, to) entity pair; pairs which are not found are absent.
+    """
+    wanted = {tuple(sorted(p)) for p in pairs}
+    if not wanted:
+        return {}
+    if isinstance(tenant_ids, str):
+        tenant_ids = tenant_ids.split(",")
+    if isinstance(kb_ids, str):
+        kb_ids = [kb_ids]
+    ents = sorted({e for p in wanted for e in p})
+    fields = ["content_with_weight", "from_entity_kwd", "to_entity_kwd"]
+    condition = {
+        "knowledge_graph_kwd": ["relation"],
+        "from_entity_kwd": ents,
+        "to_entity_kwd": ents,
+    }
+    res = await thread_pool_exec(
+        settings.docStoreConn.search,
+        fields, [], condition, [], OrderByExpr(),
+        0, min(10000, max(64, len(ents) * len(ents))), [search.index_name(tid) for tid in tenant_ids], kb_ids
+    )
+    rels = {}
+    for row in settings.docStoreConn.get_fields(res, fields).values():
+        f, t = row.get("from_entity_kwd"), row.get("to_entity_kwd")
+        if isinstance(f, list):
+            f = f[0]
+        if isinstance(t, list):
+            t = t[0]
+        pair = tuple(sorted([f, t]))
+        if pair not in wanted or pair in rels:
+            continue
+        try:
+            rels[pair] = json.loads(row["content_with_weight"])
+        except Exception:
+            continue
+    return rels
+
+
+async def graph_edge_to_chunk(kb_id, embd_mdl, from_ent_name, to_ent_name, meta, chunks, ebd=None):
     enable_timeout_assertion = os.environ.get("ENABLE_TIMEOUT_ASSERTION")
     chunk = {
         "id": get_uuid(),
@@ -368,7 +475,8 @@ async def graph_edge_to_chunk(kb_id, embd_mdl, from_ent_name, to_ent_name, meta,
     }
     chunk["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(chunk["content_ltks"])
     txt = f"{from_ent_name}->{to_ent_name}"
-    ebd = get_embed_cache(embd_mdl.llm_name, txt)
+    if ebd is None:
+        ebd = get_embed_cache(model_key(embd_mdl), txt)
     if ebd is None:
         async with chat_limiter:
             timeout = 3 if enable_timeout_assertion else 300000000
@@ -380,7 +488,7 @@ async def graph_edge_to_chunk(kb_id, embd_mdl, from_ent_name, to_ent_name, meta,
                 timeout=timeout
             )
         ebd = ebd[0]
-        set_embed_cache(embd_mdl.llm_name, txt, ebd)
+        set_embed_cache(model_key(embd_mdl), txt, ebd)
     assert ebd is not None
     chunk["q_%d_vec" % len(ebd)] = ebd
     chunks.append(chunk)
@@ -423,7 +531,7 @@ async def get_graph(tenant_id, kb_id, exclude_rebuild=None):
         for id in res.ids:
             try:
                 if res.field[id]["removed_kwd"] == "N":
-                    g = json_graph.node_link_graph(json.loads(res.field[id]["content_with_weight"]), edges="edges")
+                    g = await _load_graph(tenant_id, kb_id, json.loads(res.field[id]["content_with_weight"]))
                     if "source_id" not in g.graph:
                         g.graph["source_id"] = res.field[id]["source_id"]
                 else:
@@ -435,17 +543,266 @@ async def get_graph(tenant_id, kb_id, exclude_rebuild=None):
     return result
 
 
+def _graph_record_id(kb_id, kind, key=""):
+    return xxhash.xxh64(f"{kb_id}:{kind}:{key}".encode("utf-8")).hexdigest()
+
+
+def _graph_shard_of(node, shard_num):
+    return xxhash.xxh32_intdigest(str(node).encode("utf-8")) % shard_num
+
+
+def _shard_node_attrs(attrs):
+    # PageRank changes on every node whenever the graph changes, so it is kept in the manifest instead.
+    # rank is the node degree, changed by edges of other shards or sources; it is recomputed when the graph is loaded.
+    return {k: v for k, v in attrs.items() if k not in ("pagerank", "rank")}
+
+
+def _columns(items, attrs_list):
+    """Columnar table of attribute dicts; a missing attribute is stored as None."""
+    names = sorted({k for attrs in attrs_list for k in attrs})
+    return {"keys": items, "attrs": {k: [attrs.get(k) for attrs in attrs_list] for k in names}}
+
+
+def dump_graph_snapshot(graph_attrs: dict, nodes: list[tuple], edges: list[tuple]) -> str:
+    """
+    Serialize (part of) a graph as columnar node and edge tables. With GRAPH_SNAPSHOT_COMPRESS the
+    tables are msgpack-encoded and zlib-compressed, otherwise they are kept as JSON.
+    """
+    data = {
+        "graph": graph_attrs,
+        "nodes": _columns([n for n, _ in nodes], [attrs for _, attrs in nodes]),
+        "edges": _columns([[f, t] for f, t, _ in edges], [attrs for _, _, attrs in edges]),
+    }
+    if GRAPH_SNAPSHOT_COMPRESS:
+        return GRAPH_SNAPSHOT_PACKED + base64.b64encode(zlib.compress(ormsgpack.packb(data, option=ormsgpack.OPT_SERIALIZE_NUMPY), 6)).decode("ascii")
+    return GRAPH_SNAPSHOT_JSON + json.dumps(data, ensure_ascii=False)
+
+
+def load_graph_snapshot(content: str):
+    """
+    Parse a graph snapshot, or legacy node-link JSON, into (graph attributes, nodes, edges).
+    Nodes and edges are generators of (node, attrs) and (source, target, attrs) built lazily from the tables.
+    """
+    if content.startswith(GRAPH_SNAPSHOT_PACKED):
+        data = ormsgpack.unpackb(zlib.decompress(base64.b64decode(content[len(GRAPH_SNAPSHOT_PACKED):])))
+    elif content.startswith(GRAPH_SNAPSHOT_JSON):
+        data = json.loads(content[len(GRAPH_SNAPSHOT_JSON):])
+    else:
+        data = json.loads(content)
+        edge_key = "edges" if "edges" in data else "links"
+        nodes = ((d["id"], {k: v for k, v in d.items() if k != "id"}) for d in data.get("nodes", []))
+        edges = ((d["source"], d["target"], {k: v for k, v in d.items() if k not in ("source", "target")}) for d in data.get(edge_key, []))
+        return data.get("graph", {}), nodes, edges
+
+    def rows(table):
+        names = list(table["attrs"].keys())
+        columns = [table["attrs"][k] for k in names]
+        for i, key in enumerate(table["keys"]):
+            yield key, {k: col[i] for k, col in zip(names, columns) if col[i] is not None}
+
+    nodes = ((n, attrs) for n, attrs in rows(data["nodes"]))
+    edges = ((f, t, attrs) for (f, t), attrs in rows(data["edges"]))
+    return data.get("graph", {}), nodes, edges
+
+
+def _graph_shards(graph: nx.Graph, shard_num: int) -> tuple[list[str], list[str]]:
+    """
+    The serialized shards of a graph and their digests. A digest covers only the shard's own nodes
+    and edges, in name order, so that a shard is rewritten only when one of them changed.
+    """
+    shards = [([], []) for _ in range(shard_num)]
+    for n, attrs in graph.nodes(data=True):
+        shards[_graph_shard_of(n, shard_num)][0].append((n, _shard_node_attrs(attrs)))
+    for f, t, attrs in graph.edges(data=True):
+        f, t = get_from_to(f, t)
+        shards[_graph_shard_of(f, shard_num)][1].append((f, t, attrs))
+    contents, digests = [], []
+    for nodes, edges in shards:
+        nodes.sort(key=lambda n: n[0])
+        edges.sort(key=lambda e: (e[0], e[1]))
+        contents.append(dump_graph_snapshot({}, nodes, edges))
+        digests.append(_digest(json.dumps([nodes, edges], ensure_ascii=False, sort_keys=True, default=str)))
+    return contents, digests
+
+
+def _set_node_ranks(nodes: list[dict], edges: list[dict]):
+    degree = defaultdict(int)
+    for e in edges:
+        degree[e["source"]] += 1
+        degree[e["target"]] += 1
+    for n in nodes:
+        n["rank"] = degree.get(n["id"], 0)
+
+
+def _graph_subgraphs(graph: nx.Graph) -> dict[str, str]:
+    """Serialized subgraph of every source, built from a source -> nodes index in one pass over the graph."""
+    source_nodes = defaultdict(list)
+    for n, attrs in graph.nodes(data=True):
+        for source in attrs.get("source_id", []):
+            source_nodes[source].append(n)
+
+    subgraphs = {}
+    for source in graph.graph.get("source_id", []):
+        # In name order, as shards: the content, and so its digest, must not depend on the order the graph was loaded in.
+        nodes = sorted(source_nodes.get(source, []))
+        node_set = set(nodes)
+        edges = []
+        for n in nodes:
+            for nbr, attrs in graph.adj[n].items():
+                if nbr in node_set and (n < nbr or n == nbr):
+                    edges.append((n, nbr, attrs))
+        edges.sort(key=lambda e: (e[0], e[1]))
+        subgraphs[source] = dump_graph_snapshot(
+            {"source_id": [source]},
+            [(n, {**_shard_node_attrs(graph.nodes[n]), "source_id": [source]}) for n in nodes],
+            edges,
+        )
+    return subgraphs
+
+
+def _digest(content: str) -> str:
+    return xxhash.xxh64(content.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+async def _get_graph_shards(tenant_id, kb_id, persist: dict) -> list[str]:
+    flds = ["content_with_weight"]
+    res = await thread_pool_exec(
+        settings.docStoreConn.search,
+        flds, [], {"kb_id": kb_id, "knowledge_graph_kwd": ["graph_shard"]},
+        [], OrderByExpr(), 0, persist["shard_num"], search.index_name(tenant_id), [kb_id]
+    )
+    return [d["content_with_weight"] for d in settings.docStoreConn.get_fields(res, flds).values()]
+
+
+async def assemble_graph_data(tenant_id, kb_id, data: dict) -> dict:
+    """
+    Turn the content of a "graph" record into complete node-link data. Sharded graphs keep their
+    nodes and edges in "graph_shard" records and the PageRank of nodes in the manifest.
+    """
+    persist = data.pop("persist", None)
+    if not persist:
+        return data
+    pagerank = persist.get("pagerank", {})
+    nodes, edges = [], []
+    for content in await _get_graph_shards(tenant_id, kb_id, persist):
+        _, shard_nodes, shard_edges = load_graph_snapshot(content)
+        for n, attrs in shard_nodes:
+            if n in pagerank:
+                attrs["pagerank"] = pagerank[n]
+            nodes.append({**attrs, "id": n})
+        edges.extend({**attrs, "source": f, "target": t} for f, t, attrs in shard_edges)
+    _set_node_ranks(nodes, edges)
+    data["nodes"] = nodes
+    data["edges"] = edges
+    return data
+
+
+async def _load_graph(tenant_id, kb_id, data: dict) -> nx.Graph:
+    persist = data.pop("persist", None)
+    if not persist:
+        return json_graph.node_link_graph(data, edges="edges")
+    graph = nx.Graph()
+    graph.graph.update(data.get("graph", {}))
+    for content in await _get_graph_shards(tenant_id, kb_id, persist):
+        _, nodes, edges = load_graph_snapshot(content)
+        graph.add_nodes_from(nodes)
+        graph.add_edges_from(edges)
+    nx.set_node_attributes(graph, {n: pr for n, pr in persist.get("pagerank", {}).items() if n in graph}, "pagerank")
+    nx.set_node_attributes(graph, {n: int(d) for n, d in graph.degree}, "rank")
+    graph.graph["persist"] = persist
+    return graph
+
+
+async def _persist_graph(tenant_id: str, kb_id: str, graph: nx.Graph, callback):
+    """
+    Write the "graph" manifest, its shards and the per-source subgraphs. Only the shards and
+    subgraphs whose content differs from what the previous call persisted are rewritten.
+    """
+    prev = graph.graph.pop("persist", None)
+    full = not prev or prev.get("shard_num") != GRAPH_SHARD_NUM
+    graph_attrs = dict(graph.graph)
+
+    shards, shard_digests = await thread_pool_exec(_graph_shards, graph, GRAPH_SHARD_NUM)
+    subgraphs = await thread_pool_exec(_graph_subgraphs, graph)
+    persist = {
+        "shard_num": GRAPH_SHARD_NUM,
+        "shard_digests": shard_digests,
+        "subgraph_digests": {source: _digest(sg) for source, sg in subgraphs.items()},
+        "pagerank": {n: attrs["pagerank"] for n, attrs in graph.nodes(data=True) if "pagerank" in attrs},
+    }
+
+    if full:
+        dirty_shards = list(range(GRAPH_SHARD_NUM))
+        dirty_sources = list(subgraphs.keys())
+        await thread_pool_exec(
+            settings.docStoreConn.delete,
+            {"knowledge_graph_kwd": ["graph", "graph_shard", "subgraph"]},
+            search.index_name(tenant_id),
+            kb_id
+        )
+    else:
+        dirty_shards = [i for i, dg in enumerate(persist["shard_digests"]) if dg != prev["shard_digests"][i]]
+        prev_sources = prev.get("subgraph_digests", {})
+        dirty_sources = [source for source, dg in persist["subgraph_digests"].items() if prev_sources.get(source) != dg]
+        removed_sources = [source for source in prev_sources if source not in persist["subgraph_digests"]]
+        ids = [_graph_record_id(kb_id, "graph")]
+        ids += [_graph_record_id(kb_id, "graph_shard", i) for i in dirty_shards]
+        ids += [_graph_record_id(kb_id, "subgraph", source) for source in removed_sources]
+        await thread_pool_exec(settings.docStoreConn.delete, {"id": ids}, search.index_name(tenant_id), kb_id)
+        # Deleting by source also drops the raw subgraph written at extraction time for new sources.
+        if dirty_sources:
+            await thread_pool_exec(
+                settings.docStoreConn.delete,
+                {"knowledge_graph_kwd": ["subgraph"], "source_id": dirty_sources},
+                search.index_name(tenant_id),
+                kb_id
+            )
+
+    manifest = {"directed": False, "multigraph": False, "graph": graph_attrs, "nodes": [], "edges": [], "persist": persist}
+    chunks = [
+        {
+            "id": _graph_record_id(kb_id, "graph"),
+            "content_with_weight": json.dumps(manifest, ensure_ascii=False),
+            "knowledge_graph_kwd": "graph",
+            "kb_id": kb_id,
+            "source_id": graph_attrs.get("source_id", []),
+            "available_int": 0,
+            "removed_kwd": "N",
+        }
+    ]
+    for i in dirty_shards:
+        chunks.append(
+            {
+                "id": _graph_record_id(kb_id, "graph_shard", i),
+                "content_with_weight": shards[i],
+                "knowledge_graph_kwd": "graph_shard",
+                "kb_id": kb_id,
+                "available_int": 0,
+                "removed_kwd": "N",
+            }
+        )
+    for source in dirty_sources:
+        chunks.append(
+            {
+                "id": _graph_record_id(kb_id, "subgraph", source),
+                "content_with_weight": subgraphs[source],
+                "knowledge_graph_kwd": "subgraph",
+                "kb_id": kb_id,
+                "source_id": [source],
+                "available_int": 0,
+                "removed_kwd": "N",
+            }
+        )
+    graph.graph["persist"] = persist
+    if callback:
+        callback(msg=f"set_graph rewrites {len(dirty_shards)}/{GRAPH_SHARD_NUM} graph shards and {len(dirty_sources)}/{len(subgraphs)} subgraphs.")
+    return chunks
+
+
 async def set_graph(tenant_id: str, kb_id: str, embd_mdl, graph: nx.Graph, change: GraphChange, callback):
     global chat_limiter
     start = asyncio.get_running_loop().time()
 
-    await thread_pool_exec(
-        settings.docStoreConn.delete,
-        {"knowledge_graph_kwd": ["graph", "subgraph"]},
-        search.index_name(tenant_id),
-        kb_id
-    )
-
     if change.removed_nodes:
         await thread_pool_exec(
             settings.docStoreConn.delete,
@@ -483,44 +840,18 @@ async def set_graph(tenant_id: str, kb_id: str, embd_mdl, graph: nx.Graph, chang
         callback(msg=f"set_graph removed {len(change.removed_nodes)} nodes and {len(change.removed_edges)} edges from index in {now - start:.2f}s.")
     start = now
 
-    chunks = [
-        {
-            "id": get_uuid(),
-            "content_with_weight": json.dumps(nx.node_link_data(graph, edges="edges"), ensure_ascii=False),
-            "knowledge_graph_kwd": "graph",
-            "kb_id": kb_id,
-            "source_id": graph.graph.get("source_id", []),
-            "available_int": 0,
-            "removed_kwd": "N",
-        }
-    ]
-
-    # generate updated subgraphs
-    for source in graph.graph["source_id"]:
-        subgraph = graph.subgraph([n for n in graph.nodes if source in graph.nodes[n]["source_id"]]).copy()
-        subgraph.graph["source_id"] = [source]
-        for n in subgraph.nodes:
-            subgraph.nodes[n]["source_id"] = [source]
-        chunks.append(
-            {
-                "id": get_uuid(),
-                "content_with_weight": json.dumps(nx.node_link_data(subgraph, edges="edges"), ensure_ascii=False),
-                "knowledge_graph_kwd": "subgraph",
-                "kb_id": kb_id,
-                "source_id": [source],
-                "available_int": 0,
-                "removed_kwd": "N",
-            }
-        )
+    chunks = await _persist_graph(tenant_id, kb_id, graph, callback)
 
+    nodes = list(change.added_updated_nodes)
+    node_ebds = await embed_with_cache(embd_mdl, nodes)
+    if callback:
+        callback(msg=f"Get embedding of nodes: {len(nodes)}")
     tasks = []
-    for ii, node in enumerate(change.added_updated_nodes):
+    for node, ebd in zip(nodes, node_ebds):
         node_attrs = graph.nodes[node]
         tasks.append(asyncio.create_task(
-            graph_node_to_chunk(kb_id, embd_mdl, node, node_attrs, chunks)
+            graph_node_to_chunk(kb_id, embd_mdl, node, node_attrs, chunks, ebd)
         ))
-        if ii % 100 == 9 and callback:
-            callback(msg=f"Get embedding of nodes: {ii}/{len(change.added_updated_nodes)}")
     try:
         await asyncio.gather(*tasks, return_exceptions=False)
     except Exception as e:
@@ -530,16 +861,24 @@ async def set_graph(tenant_id: str, kb_id: str, embd_mdl, graph: nx.Graph, chang
         await asyncio.gather(*tasks, return_exceptions=True)
         raise
 
-    tasks = []
-    for ii, (from_node, to_node) in enumerate(change.added_updated_edges):
+    edges = []
+    for from_node, to_node in change.added_updated_edges:
         edge_attrs = graph.get_edge_data(from_node, to_node)
         if not edge_attrs:
             continue
+        edges.append((from_node, to_node, edge_attrs))
+    edge_ebds = await embed_with_cache(
+        embd_mdl,
+        [f"{f}->{t}" for f, t, _ in edges],
+        [f"{f}->{t}: {attrs['description']}" for f, t, attrs in edges]
+    )
+    if callback:
+        callback(msg=f"Get embedding of edges: {len(edges)}")
+    tasks = []
+    for (from_node, to_node, edge_attrs), ebd in zip(edges, edge_ebds):
         tasks.append(asyncio.create_task(
-            graph_edge_to_chunk(kb_id, embd_mdl, from_node, to_node, edge_attrs, chunks)
+            graph_edge_to_chunk(kb_id, embd_mdl, from_node, to_node, edge_attrs, chunks, ebd)
         ))
-        if ii % 100 == 9 and callback:
-            callback(msg=f"Get embedding of edges: {ii}/{len(change.added_updated_edges)}")
     try:
         await asyncio.gather(*tasks, return_exceptions=False)
     except Exception as e:
@@ -551,13 +890,14 @@ async def set_graph(tenant_id: str, kb_id: str, embd_mdl, graph: nx.Graph, chang
 
     now = asyncio.get_running_loop().time()
     if callback:
-        callback(msg=f"set_graph converted graph change to {len(chunks)} chunks in {now - start:.2f}s.")
+        stats = get_embed_cache_stats()
+        callback(msg=f"set_graph converted graph change to {len(chunks)} chunks in {now - start:.2f}s, embedding cache hits {stats['hits']}, misses {stats['misses']}.")
     start = now
 
     enable_timeout_assertion = os.environ.get("ENABLE_TIMEOUT_ASSERTION")
-    es_bulk_size = 4
+    es_bulk_size = GRAPH_INSERT_BULK_SIZE
     for b in range(0, len(chunks), es_bulk_size):
-        timeout = 3 if enable_timeout_assertion else 30000000
+        timeout = 3 + es_bulk_size // 2 if enable_timeout_assertion else 30000000
         doc_store_result = await asyncio.wait_for(
             thread_pool_exec(
                 settings.docStoreConn.insert,
@@ -567,7 +907,7 @@ async def set_graph(tenant_id: str, kb_id: str, embd_mdl, graph: nx.Graph, chang
             ),
             timeout=timeout
         )
-        if b % 100 == es_bulk_size and callback:
+        if b % (es_bulk_size * 25) == 0 and callback:
             callback(msg=f"Insert chunks: {b}/{len(chunks)}")
         if doc_store_result:
             error_message = f"Insert chunk error: {doc_store_result}, please check log file and Elasticsearch/Infinity status!"
@@ -650,6 +990,7 @@ def flat_uniq_list(arr, key):
 
 async def rebuild_graph(tenant_id, kb_id, exclude_rebuild=None):
     graph = nx.Graph()
+    sources = []
     flds = ["knowledge_graph_kwd", "content_with_weight", "source_id"]
     bs = 256
     for i in range(0, 1024 * bs, bs):
@@ -672,17 +1013,21 @@ async def rebuild_graph(tenant_id, kb_id, exclude_rebuild=None):
             elif exclude_rebuild in d["source_id"]:
                 continue
 
-            next_graph = json_graph.node_link_graph(json.loads(d["content_with_weight"]), edges="edges")
-            merged_graph = nx.compose(graph, next_graph)
-            merged_source = {n: graph.nodes[n]["source_id"] + next_graph.nodes[n]["source_id"] for n in graph.nodes & next_graph.nodes}
-            nx.set_node_attributes(merged_graph, merged_source, "source_id")
-            if "source_id" in graph.graph:
-                merged_graph.graph["source_id"] = graph.graph["source_id"] + next_graph.graph["source_id"]
-            else:
-                merged_graph.graph["source_id"] = next_graph.graph["source_id"]
-            graph = merged_graph
+            # Merge in place: the accumulated graph is never copied, source_id lists of shared nodes are unioned.
+            graph_attrs, nodes, edges = load_graph_snapshot(d["content_with_weight"])
+            for n, attrs in nodes:
+                node = graph.nodes[n] if graph.has_node(n) else None
+                if node is None:
+                    graph.add_node(n, **attrs)
+                    continue
+                source_id = node.get("source_id", []) + attrs.get("source_id", [])
+                node.update(attrs)
+                node["source_id"] = source_id
+            graph.add_edges_from(edges)
+            sources.extend(graph_attrs.get("source_id", []))
 
     if len(graph.nodes) == 0:
         return None
-    graph.graph["source_id"] = sorted(graph.graph["source_id"])
+    nx.set_node_attributes(graph, {n: int(d) for n, d in graph.degree}, "rank")
+    graph.graph["source_id"] = sorted(sources)
     return graph
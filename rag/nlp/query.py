@@ -182,6 +182,8 @@ class FulltextQueryer(QueryBase):
         return np.array(sims[0]) * vtweight + np.array(tksim) * tkweight, tksim, sims[0]
 
     def token_similarity(self, atks, btkss):
+        import numpy as np
+
         def to_dict(tks):
             if isinstance(tks, str):
                 tks = tks.split()
@@ -194,9 +196,28 @@ class FulltextQueryer(QueryBase):
                     d[t+_t] += max(c, _c) * 0.6
             return d
 
-        atks = to_dict(atks)
-        btkss = [to_dict(tks) for tks in btkss]
-        return [self.similarity(atks, btks) for btks in btkss]
+        def terms(tks):
+            # Same keys as to_dict(); `similarity` only checks whether a query term occurs in the
+            # candidate, so candidate term weights are never needed.
+            if isinstance(tks, str):
+                tks = tks.split()
+            for i, t in enumerate(tks):
+                yield t
+                if i+1 < len(tks):
+                    yield t+tks[i+1]
+
+        qtwt = to_dict(atks)
+        vocab = {t: i for i, t in enumerate(qtwt.keys())}
+        qvec = np.fromiter(qtwt.values(), dtype=np.float64, count=len(qtwt))
+        # (candidate, query term) pairs of the terms occurring in each candidate, each counted once.
+        rows, indices = [], []
+        for r, tks in enumerate(btkss):
+            occurring = {vocab[t] for t in terms(tks) if t in vocab}
+            rows.extend([r] * len(occurring))
+            indices.extend(occurring)
+        sims = np.bincount(np.asarray(rows, dtype=np.int64), weights=qvec[np.asarray(indices, dtype=np.int64)],
+                           minlength=len(btkss))
+        return ((sims + 1e-9) / (qvec.sum() + 1e-9)).tolist()
 
     def similarity(self, qtwt, dtwt):
         if isinstance(dtwt, type("")):
@@ -14,22 +14,49 @@
 #  limitations under the License.
 #
 
+import os
+
 import infinity.rag_tokenizer
+from common.cache_utils import LRUCache
+
+# The same question and chunk strings are tokenized repeatedly while building and reranking a query.
+TOKENIZE_CACHE_SIZE = int(os.environ.get("TOKENIZE_CACHE_SIZE", "16384"))
+TOKENIZE_CACHE_MAX_LEN = int(os.environ.get("TOKENIZE_CACHE_MAX_LEN", "4096"))
+
+
 class RagTokenizer(infinity.rag_tokenizer.RagTokenizer):
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._tokenize_cache = LRUCache(TOKENIZE_CACHE_SIZE)
+        self._fine_grained_cache = LRUCache(TOKENIZE_CACHE_SIZE)
+
     def tokenize(self, line: str) -> str:
         from common import settings # moved from the top of the file to avoid circular import
         if settings.DOC_ENGINE_INFINITY:
             return line
-        else:
+        if len(line) > TOKENIZE_CACHE_MAX_LEN:
             return super().tokenize(line)
+        res = self._tokenize_cache.get(line)
+        if res is None:
+            res = super().tokenize(line)
+            self._tokenize_cache.set(line, res)
+        return res
 
     def fine_grained_tokenize(self, tks: str) -> str:
         from common import settings # moved from the top of the file to avoid circular import
         if settings.DOC_ENGINE_INFINITY:
             return tks
-        else:
+        if len(tks) > TOKENIZE_CACHE_MAX_LEN:
             return super().fine_grained_tokenize(tks)
+        res = self._fine_grained_cache.get(tks)
+        if res is None:
+            res = super().fine_grained_tokenize(tks)
+            self._fine_grained_cache.set(tks, res)
+        return res
+
+    def cache_stats(self) -> dict:
+        return {"tokenize": self._tokenize_cache.stats(), "fine_grained_tokenize": self._fine_grained_cache.stats()}
 
 
 def is_chinese(s):
@@ -55,3 +82,4 @@ tag = tokenizer.tag
 freq = tokenizer.freq
 tradi2simp = tokenizer._tradi2simp
 strQ2B = tokenizer._strQ2B
+cache_stats = tokenizer.cache_stats
@@ -0,0 +1,140 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Caches used by rag.nlp.search.Dealer.
+
+- Query vectors, keyed by (embedding model, normalized question), live in an in-process LRU
+  backed by Redis so that all API workers share them.
+- Retrieval results live in a short-TTL in-process LRU. Their keys embed a per-KB version number
+  kept in Redis; bumping it with `invalidate_kbs` makes every cached result of that KB unreachable
+  in all processes.
+"""
+
+import copy
+import json
+import logging
+import os
+import re
+
+import numpy as np
+import xxhash
+
+from common.cache_utils import LRUCache
+# The module rather than REDIS_CONN: redis_conn imports common.settings, which imports this module
+# through rag.nlp.search.
+from rag.utils import redis_conn
+
+QUERY_VECTOR_CACHE_SIZE = int(os.environ.get("QUERY_VECTOR_CACHE_SIZE", "4096"))
+QUERY_VECTOR_CACHE_REDIS = int(os.environ.get("QUERY_VECTOR_CACHE_REDIS", "1"))
+QUERY_VECTOR_CACHE_TTL = int(os.environ.get("QUERY_VECTOR_CACHE_TTL", str(24 * 3600)))
+# Seconds a retrieval result stays cached; 0 disables the result cache.
+RETRIEVAL_CACHE_TTL = int(os.environ.get("RETRIEVAL_CACHE_TTL", "60"))
+RETRIEVAL_CACHE_SIZE = int(os.environ.get("RETRIEVAL_CACHE_SIZE", "1024"))
+
+_KB_VERSION_PREFIX = "retrieval_cache:kb_ver:"
+
+query_vectors = LRUCache(QUERY_VECTOR_CACHE_SIZE)
+retrievals = LRUCache(RETRIEVAL_CACHE_SIZE, ttl=RETRIEVAL_CACHE_TTL)
+
+
+def normalize_question(question: str) -> str:
+    return re.sub(r"\s+", " ", str(question)).strip()
+
+
+def _query_vector_key(model_name, question) -> str:
+    return "qvec:" + xxhash.xxh3_128(f"{model_name}\n{normalize_question(question)}".encode("utf-8")).hexdigest()
+
+
+def get_query_vector(model_name, question) -> list[float] | None:
+    if not model_name:
+        return None
+    k = _query_vector_key(model_name, question)
+    vec = query_vectors.get(k)
+    if vec is not None or not QUERY_VECTOR_CACHE_REDIS:
+        return vec
+    bin = redis_conn.REDIS_CONN.mget_bin([k])[0]
+    if not bin:
+        return None
+    vec = np.frombuffer(bin, dtype="<f4").tolist()
+    query_vectors.set(k, vec)
+    return vec
+
+
+def set_query_vector(model_name, question, vec: list[float]):
+    if not model_name:
+        return
+    k = _query_vector_key(model_name, question)
+    query_vectors.set(k, vec)
+    if QUERY_VECTOR_CACHE_REDIS:
+        redis_conn.REDIS_CONN.mset_bin({k: np.asarray(vec, dtype="<f4").tobytes()}, QUERY_VECTOR_CACHE_TTL)
+
+
+def _kb_versions(kb_ids: list[str]) -> list[str] | None:
+    """Current versions of the KBs, or None if they can't be read (results must not be cached then)."""
+    if not redis_conn.REDIS_CONN.REDIS:
+        return None
+    try:
+        vers = redis_conn.REDIS_CONN.REDIS.mget([_KB_VERSION_PREFIX + kb_id for kb_id in kb_ids])
+    except Exception as e:
+        logging.warning(f"retrieval_cache get KB versions got exception: {e}")
+        return None
+    return [v or "0" for v in vers]
+
+
+def retrieval_key(kb_ids: list[str], **params) -> str | None:
+    """Key of a retrieval result, or None if the result must not be cached."""
+    if not RETRIEVAL_CACHE_TTL or not kb_ids:
+        return None
+    kb_ids = sorted(kb_ids)
+    vers = _kb_versions(kb_ids)
+    if vers is None:
+        return None
+    params["question"] = normalize_question(params.get("question", ""))
+    payload = json.dumps({"kb_ids": kb_ids, "versions": vers, **params}, sort_keys=True, ensure_ascii=False, default=str)
+    return xxhash.xxh3_128(payload.encode("utf-8")).hexdigest()
+
+
+def get_retrieval(key: str | None) -> dict | None:
+    if not key:
+        return None
+    ranks = retrievals.get(key)
+    # Callers decorate the returned chunks in place.
+    return copy.deepcopy(ranks) if ranks is not None else None
+
+
+def set_retrieval(key: str | None, ranks: dict):
+    if key:
+        retrievals.set(key, copy.deepcopy(ranks))
+
+
+def invalidate_kbs(kb_ids: str | list[str] | None):
+    """Make every cached retrieval result touching these KBs stale, in all processes."""
+    if not kb_ids or not redis_conn.REDIS_CONN.REDIS:
+        return
+    if isinstance(kb_ids, str):
+        kb_ids = [kb_ids]
+    try:
+        pipe = redis_conn.REDIS_CONN.REDIS.pipeline(transaction=False)
+        for kb_id in set(kb_ids):
+            pipe.incr(_KB_VERSION_PREFIX + kb_id)
+        pipe.execute()
+    except Exception as e:
+        logging.warning(f"retrieval_cache invalidate {kb_ids} got exception: {e}")
+
+
+def get_stats() -> dict:
+    return {"query_vectors": query_vectors.stats(), "retrievals": retrievals.stats()}
@@ -20,7 +20,7 @@ import math
 from collections import OrderedDict, defaultdict
 from dataclasses import dataclass
 
-from rag.nlp import rag_tokenizer, query
+from rag.nlp import rag_tokenizer, query, retrieval_cache
 import numpy as np
 from common.doc_store.doc_store_base import MatchDenseExpr, FusionExpr, OrderByExpr, DocStoreConnection
 from common.string_utils import remove_redundant_spaces
@@ -50,12 +50,18 @@ class Dealer:
         group_docs: list[list] | None = None
 
     async def get_vector(self, txt, emb_mdl, topk=10, similarity=0.1):
-        qv, _ = await thread_pool_exec(emb_mdl.encode_queries, txt)
-        shape = np.array(qv).shape
-        if len(shape) > 1:
-            raise Exception(
-                f"Dealer.get_vector returned array's shape {shape} doesn't match expectation(exact one dimension).")
-        embedding_data = [get_float(v) for v in qv]
+        # Not at module level: embedding_cache imports redis_conn, which imports common.settings, which imports this module.
+        from rag.utils.embedding_cache import model_key
+        embedding_data = await thread_pool_exec(retrieval_cache.get_query_vector, model_key(emb_mdl), txt)
+        if embedding_data is None:
+            qv, _ = await thread_pool_exec(emb_mdl.encode_queries, txt)
+            shape = np.array(qv).shape
+            if len(shape) > 1:
+                raise Exception(
+                    f"Dealer.get_vector returned array's shape {shape} doesn't match expectation(exact one dimension).")
+            embedding_data = [get_float(v) for v in qv]
+            # Keyed again: the dimension may only be known now that the model has encoded.
+            await thread_pool_exec(retrieval_cache.set_query_vector, model_key(emb_mdl), txt, embedding_data)
         vector_column_name = f"q_{len(embedding_data)}_vec"
         return MatchDenseExpr(vector_column_name, embedding_data, 'float', 'cosine', topk, {"similarity": similarity})
 
@@ -380,6 +386,38 @@ class Dealer:
         if not question:
             return ranks
 
+        from rag.utils.embedding_cache import model_key
+        embd_key = model_key(embd_mdl) if embd_mdl else None
+        # A model not identified yet could be another deployment under the same name: don't cache.
+        cache_key = None if embd_mdl and not embd_key else await thread_pool_exec(
+            retrieval_cache.retrieval_key,
+            kb_ids,
+            question=question,
+            embd_mdl=embd_key,
+            tenant_ids=tenant_ids,
+            page=page,
+            page_size=page_size,
+            similarity_threshold=similarity_threshold,
+            vector_similarity_weight=vector_similarity_weight,
+            top=top,
+            doc_ids=doc_ids,
+            aggs=aggs,
+            rerank_mdl=getattr(rerank_mdl, "llm_name", None) if rerank_mdl else None,
+            highlight=highlight,
+            rank_feature=rank_feature,
+        )
+        cached = retrieval_cache.get_retrieval(cache_key)
+        if cached is not None:
+            return cached
+        ranks = await self._retrieval(question, embd_mdl, tenant_ids, kb_ids, page, page_size, similarity_threshold,
+                                      vector_similarity_weight, top, doc_ids, aggs, rerank_mdl, highlight, rank_feature)
+        retrieval_cache.set_retrieval(cache_key, ranks)
+        return ranks
+
+    async def _retrieval(self, question, embd_mdl, tenant_ids, kb_ids, page, page_size, similarity_threshold,
+                         vector_similarity_weight, top, doc_ids, aggs, rerank_mdl, highlight, rank_feature):
+        ranks = {"total": 0, "chunks": [], "doc_aggs": {}}
+
         # Ensure RERANK_LIMIT is multiple of page_size
         RERANK_LIMIT = math.ceil(64 / page_size) * page_size if page_size > 1 else 1
         RERANK_LIMIT = max(30, RERANK_LIMIT)
@@ -21,8 +21,11 @@ import re
 import os
 import numpy as np
 from rag.nlp import rag_tokenizer
+from common.cache_utils import LRUCache
 from common.file_utils import get_project_base_directory
 
+TERM_WEIGHT_CACHE_SIZE = int(os.environ.get("TERM_WEIGHT_CACHE_SIZE", "65536"))
+
 
 class Dealer:
     def __init__(self):
@@ -88,6 +91,8 @@ class Dealer:
             self.df = load_dict(os.path.join(fnm, "term.freq"))
         except Exception:
             logging.warning("Load term.freq FAIL!")
+        # Unnormalized weight of a token; it only depends on the token and the static dictionaries above.
+        self._token_weights = LRUCache(TERM_WEIGHT_CACHE_SIZE)
 
     def pretoken(self, txt, num=False, stpwd=True):
         patt = [
@@ -224,23 +229,23 @@ class Dealer:
         def idf(s, N):
             return math.log10(10 + ((N - s + 0.5) / (s + 0.5)))
 
+        def weight(t):
+            w = self._token_weights.get(t)
+            if w is None:
+                w = (0.3 * idf(freq(t), 10000000) + 0.7 * idf(df(t), 1000000000)) * (ner(t) * postag(t))
+                self._token_weights.set(t, w)
+            return w
+
         tw = []
         if not preprocess:
-            idf1 = np.array([idf(freq(t), 10000000) for t in tks])
-            idf2 = np.array([idf(df(t), 1000000000) for t in tks])
-            wts = (0.3 * idf1 + 0.7 * idf2) * \
-                  np.array([ner(t) * postag(t) for t in tks])
-            wts = [s for s in wts]
-            tw = list(zip(tks, wts))
+            tw = [(t, weight(t)) for t in tks]
         else:
             for tk in tks:
                 tt = self.token_merge(self.pretoken(tk, True))
-                idf1 = np.array([idf(freq(t), 10000000) for t in tt])
-                idf2 = np.array([idf(df(t), 1000000000) for t in tt])
-                wts = (0.3 * idf1 + 0.7 * idf2) * \
-                      np.array([ner(t) * postag(t) for t in tt])
-                wts = [s for s in wts]
-                tw.extend(zip(tt, wts))
+                tw.extend([(t, weight(t)) for t in tt])
 
         S = np.sum([s for _, s in tw])
         return [(t, s / S) for t, s in tw]
+
+    def cache_stats(self) -> dict:
+        return self._token_weights.stats()
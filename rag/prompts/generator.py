@@ -164,6 +164,7 @@ CROSS_LANGUAGES_USER_PROMPT_TEMPLATE = load_prompt("cross_languages_user_prompt"
 FULL_QUESTION_PROMPT_TEMPLATE = load_prompt("full_question_prompt")
 KEYWORD_PROMPT_TEMPLATE = load_prompt("keyword_prompt")
 QUESTION_PROMPT_TEMPLATE = load_prompt("question_prompt")
+CHUNK_ENRICHMENT_PROMPT_TEMPLATE = load_prompt("chunk_enrichment_prompt")
 VISION_LLM_DESCRIBE_PROMPT = load_prompt("vision_llm_describe_prompt")
 VISION_LLM_FIGURE_DESCRIBE_PROMPT = load_prompt("vision_llm_figure_describe_prompt")
 VISION_LLM_FIGURE_DESCRIBE_PROMPT_WITH_CONTEXT = load_prompt("vision_llm_figure_describe_prompt_with_context")
@@ -280,8 +281,8 @@ async def cross_languages(tenant_id, llm_id, query, languages=[]):
 async def content_tagging(chat_mdl, content, all_tags, examples, topn=3):
     template = PROMPT_JINJA_ENV.from_string(CONTENT_TAGGING_PROMPT_TEMPLATE)
 
-    for ex in examples:
-        ex["tags_json"] = json.dumps(ex[TAG_FLD], indent=2, ensure_ascii=False)
+    # Copies: the examples are shared by the chunks of a task.
+    examples = [{**ex, "tags_json": json.dumps(ex[TAG_FLD], indent=2, ensure_ascii=False)} for ex in examples]
 
     rendered_prompt = template.render(
         topn=topn,
@@ -319,6 +320,77 @@ async def content_tagging(chat_mdl, content, all_tags, examples, topn=3):
     return res
 
 
+async def chunk_enrichment(chat_mdl, content, keywords_topn=0, questions_topn=0, metadata_schema=None,
+                           all_tags=None, examples=None, tags_topn=3) -> dict:
+    """
+    The keywords, questions, metadata and tags of `content` in a single call, in the formats returned by
+    `keyword_extraction`, `question_proposal`, `gen_metadata` and `content_tagging`. Only the requested
+    fields are asked for, and only those the model answered are returned.
+    """
+    fields = []
+    if keywords_topn:
+        fields.append("keywords")
+    if questions_topn:
+        fields.append("questions")
+    if metadata_schema:
+        metadata_schema = _metadata_schema_for_prompt(metadata_schema)
+        fields.append("metadata")
+    if all_tags:
+        examples = [{**ex, "tags_json": json.dumps(ex[TAG_FLD], indent=2, ensure_ascii=False)} for ex in examples or []]
+        fields.append("tags")
+
+    template = PROMPT_JINJA_ENV.from_string(CHUNK_ENRICHMENT_PROMPT_TEMPLATE)
+    rendered_prompt = template.render(
+        content=content,
+        keywords_topn=keywords_topn,
+        questions_topn=questions_topn,
+        metadata_schema=metadata_schema,
+        all_tags=all_tags,
+        examples=examples or [],
+        tags_topn=tags_topn,
+        fields=fields,
+    )
+
+    msg = [{"role": "system", "content": rendered_prompt}, {"role": "user", "content": "Output: "}]
+    _, msg = message_fit_in(msg, chat_mdl.max_length)
+    ans = await chat_mdl.async_chat(rendered_prompt, msg[1:], {"temperature": 0.2})
+    if isinstance(ans, tuple):
+        ans = ans[0]
+    ans = re.sub(r"(^.*</think>|```json\n|```\n*$)", "", ans, flags=re.DOTALL)
+    if ans.find("**ERROR**") >= 0:
+        return {}
+    try:
+        obj = json_repair.loads(ans)
+    except Exception:
+        logging.exception(f"Loading json failure: {ans}")
+        return {}
+    if not isinstance(obj, dict):
+        return {}
+
+    def as_list(v):
+        if isinstance(v, str):
+            return [v]
+        return [str(i) for i in v if not isinstance(i, (list, dict))] if isinstance(v, list) else None
+
+    res = {}
+    if "keywords" in fields and as_list(obj.get("keywords")) is not None:
+        res["keywords"] = ",".join(as_list(obj["keywords"]))
+    if "questions" in fields and as_list(obj.get("questions")) is not None:
+        res["questions"] = "\n".join(as_list(obj["questions"]))
+    if "metadata" in fields and isinstance(obj.get("metadata"), dict):
+        res["metadata"] = json.dumps(obj["metadata"], ensure_ascii=False)
+    if "tags" in fields and isinstance(obj.get("tags"), dict):
+        tags = {}
+        for k, v in obj["tags"].items():
+            try:
+                if int(v) > 0:
+                    tags[str(k)] = int(v)
+            except Exception:
+                pass
+        res["tags"] = tags
+    return res
+
+
 def vision_llm_describe_prompt(page=None) -> str:
     template = PROMPT_JINJA_ENV.from_string(VISION_LLM_DESCRIBE_PROMPT)
 
@@ -887,13 +959,18 @@ async def relevant_chunks_with_toc(query: str, toc: list[dict], chat_mdl, topn:
 
 
 META_DATA = load_prompt("meta_data")
-async def gen_metadata(chat_mdl, schema: dict, content: str):
-    template = PROMPT_JINJA_ENV.from_string(META_DATA)
+def _metadata_schema_for_prompt(schema: dict) -> dict:
     for k, desc in schema["properties"].items():
         if "enum" in desc and not desc.get("enum"):
             del desc["enum"]
         if desc.get("enum"):
             desc["description"] += "\n** Extracted values must strictly match the given list specified by `enum`. **"
+    return schema
+
+
+async def gen_metadata(chat_mdl, schema: dict, content: str):
+    template = PROMPT_JINJA_ENV.from_string(META_DATA)
+    schema = _metadata_schema_for_prompt(schema)
     system_prompt = template.render(content=content, schema=schema)
     user_prompt = "Output: "
     _, msg = message_fit_in(form_message(system_prompt, user_prompt), chat_mdl.max_length)
@@ -15,11 +15,11 @@
 #
 import asyncio
 import logging
+import os
 import re
 
 import numpy as np
-import umap
-from sklearn.mixture import GaussianMixture
+import xxhash
 
 from api.db.services.task_service import has_canceled
 from common.connection_utils import timeout
@@ -33,6 +33,14 @@ from rag.graphrag.utils import (
     set_llm_cache,
 )
 from common.misc_utils import thread_pool_exec
+from rag.utils import raptor_cluster
+from rag.utils.embedding_cache import model_key
+
+# Share of a layer's nodes which may be removed, or added without fitting an existing cluster, before
+# an incremental run re-clusters that layer and the ones above it.
+RAPTOR_DRIFT_THRESHOLD = float(os.environ.get("RAPTOR_DRIFT_THRESHOLD", "0.2"))
+# Minimum cosine similarity of a new node to a cluster centroid for it to count as a good fit.
+RAPTOR_ASSIGN_MIN_SIMILARITY = float(os.environ.get("RAPTOR_ASSIGN_MIN_SIMILARITY", "0.5"))
 
 
 class RecursiveAbstractiveProcessing4TreeOrganizedRetrieval:
@@ -86,133 +94,215 @@ class RecursiveAbstractiveProcessing4TreeOrganizedRetrieval:
 
     @timeout(20)
     async def _embedding_encode(self, txt):
-        response = await thread_pool_exec(get_embed_cache, self._embd_model.llm_name, txt)
+        response = await thread_pool_exec(get_embed_cache, model_key(self._embd_model), txt)
         if response is not None:
             return response
         embds, _ = await thread_pool_exec(self._embd_model.encode, [txt])
         if len(embds) < 1 or len(embds[0]) < 1:
             raise Exception("Embedding error: ")
         embds = embds[0]
-        await thread_pool_exec(set_embed_cache, self._embd_model.llm_name, txt, embds)
+        await thread_pool_exec(set_embed_cache, model_key(self._embd_model), txt, embds)
         return embds
 
     def _get_optimal_clusters(self, embeddings: np.ndarray, random_state: int, task_id: str = ""):
-        max_clusters = min(self._max_cluster, len(embeddings))
-        n_clusters = np.arange(1, max_clusters)
-        bics = []
-        for n in n_clusters:
-            self._check_task_canceled(task_id, "get optimal clusters")
-
-            gm = GaussianMixture(n_components=n, random_state=random_state)
-            gm.fit(embeddings)
-            bics.append(gm.bic(embeddings))
-        optimal_clusters = n_clusters[np.argmin(bics)]
-        return optimal_clusters
+        n_clusters, _ = raptor_cluster.optimal_gmm(
+            embeddings, min(self._max_cluster, len(embeddings)), random_state,
+            should_stop=lambda: self._check_task_canceled(task_id, "get optimal clusters"),
+        )
+        return n_clusters
 
-    async def __call__(self, chunks, random_state, callback=None, task_id: str = ""):
-        if len(chunks) <= 1:
-            return []
-        chunks = [(s, a) for s, a in chunks if s and a is not None and len(a) > 0]
-        layers = [(0, len(chunks))]
-        start, end = 0, len(chunks)
+    @timeout(60 * 20)
+    async def _summarize(self, texts: list[str], callback=None, task_id: str = ""):
+        """Summary text and embedding of a cluster, or None if it had to be skipped."""
+        self._check_task_canceled(task_id, "summarization")
 
-        @timeout(60 * 20)
-        async def summarize(ck_idx: list[int]):
-            nonlocal chunks
+        len_per_chunk = int((self._llm_model.max_length - self._max_token) / len(texts))
+        cluster_content = "\n".join([truncate(t, max(1, len_per_chunk)) for t in texts])
+        try:
+            async with chat_limiter:
+                self._check_task_canceled(task_id, "before LLM call")
 
-            self._check_task_canceled(task_id, "summarization")
+                cnt = await self._chat(
+                    "You're a helpful assistant.",
+                    [
+                        {
+                            "role": "user",
+                            "content": self._prompt.format(cluster_content=cluster_content),
+                        }
+                    ],
+                    {"max_tokens": max(self._max_token, 512)},  # fix issue:  #10235
+                )
+                cnt = re.sub(
+                    "(······\n由于长度的原因，回答被截断了，要继续吗？|For the content length reason, it stopped, continue?)",
+                    "",
+                    cnt,
+                )
+                logging.debug(f"SUM: {cnt}")
 
-            texts = [chunks[i][0] for i in ck_idx]
-            len_per_chunk = int((self._llm_model.max_length - self._max_token) / len(texts))
-            cluster_content = "\n".join([truncate(t, max(1, len_per_chunk)) for t in texts])
-            try:
-                async with chat_limiter:
-                    self._check_task_canceled(task_id, "before LLM call")
-
-                    cnt = await self._chat(
-                        "You're a helpful assistant.",
-                        [
-                            {
-                                "role": "user",
-                                "content": self._prompt.format(cluster_content=cluster_content),
-                            }
-                        ],
-                        {"max_tokens": max(self._max_token, 512)},  # fix issue:  #10235
-                    )
-                    cnt = re.sub(
-                        "(······\n由于长度的原因，回答被截断了，要继续吗？|For the content length reason, it stopped, continue?)",
-                        "",
-                        cnt,
-                    )
-                    logging.debug(f"SUM: {cnt}")
-
-                    self._check_task_canceled(task_id, "before embedding")
-
-                    embds = await self._embedding_encode(cnt)
-                    chunks.append((cnt, embds))
-            except TaskCanceledException:
-                raise
-            except Exception as exc:
-                self._error_count += 1
-                warn_msg = f"[RAPTOR] Skip cluster ({len(ck_idx)} chunks) due to error: {exc}"
-                logging.warning(warn_msg)
-                if callback:
-                    callback(msg=warn_msg)
-                if self._error_count >= self._max_errors:
-                    raise RuntimeError(f"RAPTOR aborted after {self._error_count} errors. Last error: {exc}") from exc
-
-        labels = []
-        while end - start > 1:
+                self._check_task_canceled(task_id, "before embedding")
+
+                embds = await self._embedding_encode(cnt)
+                return cnt, embds
+        except TaskCanceledException:
+            raise
+        except Exception as exc:
+            self._error_count += 1
+            warn_msg = f"[RAPTOR] Skip cluster ({len(texts)} chunks) due to error: {exc}"
+            logging.warning(warn_msg)
+            if callback:
+                callback(msg=warn_msg)
+            if self._error_count >= self._max_errors:
+                raise RuntimeError(f"RAPTOR aborted after {self._error_count} errors. Last error: {exc}") from exc
+            return None
+
+    async def _cluster(self, embeddings, random_state: int, task_id: str = "") -> list[list[int]]:
+        """Clusters of one layer, as lists of indices into `embeddings`."""
+        return await raptor_cluster.cluster_layer_async(
+            embeddings, random_state, self._max_cluster, self._threshold,
+            should_stop=lambda: self._check_task_canceled(task_id, "get optimal clusters"),
+        )
+
+    @staticmethod
+    def _centroid(embeddings) -> np.ndarray:
+        c = np.mean(np.asarray(embeddings, dtype=np.float32), axis=0)
+        return c / (np.linalg.norm(c) or 1.)
+
+    def _assign(self, prev_layer: list[dict], layer_ids: list[str], nodes: dict, replaced: dict):
+        """
+        Fit the nodes of a layer into the clusters it had last time.
+
+        New nodes join the cluster with the closest centroid. Returns None if the layer drifted too far
+        and has to be clustered again: the removed nodes plus the new nodes which fit no cluster well
+        exceed RAPTOR_DRIFT_THRESHOLD of the nodes the layer had. Summaries re-generated in the layer
+        below replace their old versions and don't count as drift.
+        """
+        current = set(layer_ids)
+        clusters, prev_members = [], set()
+        for cl in prev_layer:
+            members = [replaced.get(m, m) for m in cl["members"]]
+            prev_members.update(members)
+            kept = [m for m in members if m in current]
+            clusters.append({
+                "members": kept,
+                "old": cl["id"],
+                "changed": len(kept) != len(members) or any(m in replaced for m in cl["members"]),
+            })
+        if not clusters:
+            return None
+
+        removed = len(prev_members - current)
+        added = [m for m in layer_ids if m not in prev_members]
+        poor = 0
+        if added:
+            centroids = np.asarray([cl["centroid"] for cl in prev_layer], dtype=np.float32)
+            embds = np.asarray([nodes[m][1] for m in added], dtype=np.float32)
+            if embds.shape[1] != centroids.shape[1]:
+                return None
+            embds /= np.maximum(np.linalg.norm(embds, axis=1, keepdims=True), 1e-12)
+            sims = embds @ centroids.T
+            for m, row in zip(added, sims):
+                best = int(np.argmax(row))
+                if row[best] < RAPTOR_ASSIGN_MIN_SIMILARITY:
+                    poor += 1
+                clusters[best]["members"].append(m)
+                clusters[best]["changed"] = True
+
+        drift = (removed + poor) / max(1, len(prev_members))
+        if drift > RAPTOR_DRIFT_THRESHOLD:
+            logging.info(f"RAPTOR layer drifted {drift:.2f} > {RAPTOR_DRIFT_THRESHOLD}, re-clustering")
+            return None
+        return [cl for cl in clusters if cl["members"]]
+
+    async def build(self, chunks, ids, random_state, callback=None, task_id: str = "",
+                    tree: dict | None = None, summaries: dict | None = None, node_id=None):
+        """
+        Build the summary tree over `chunks`, a list of (text, embedding) identified by `ids`.
+
+        With the `tree` of a previous run and its existing `summaries` ({id: (text, embedding)}), each
+        layer keeps its previous clusters, new nodes are assigned to them, and only clusters whose
+        membership changed are summarized again. A layer is clustered from scratch when there is no
+        previous tree for it or it drifted too far, see `_assign`.
+
+        Returns the summary nodes of the tree as (id, text, embedding, is_new) and the tree to persist.
+        """
+        summaries = summaries or {}
+        node_id = node_id or (lambda txt: xxhash.xxh64(txt.encode("utf-8")).hexdigest())
+        nodes = {i: ck for i, ck in zip(ids, chunks)}
+        layer_ids = list(nodes.keys())
+        prev_layers = (tree or {}).get("layers", [])
+        layers, out = [], []
+        replaced = {}
+        depth = 0
+        while len(layer_ids) > 1:
             self._check_task_canceled(task_id, "layer processing")
 
-            embeddings = [embd for _, embd in chunks[start:end]]
-            if len(embeddings) == 2:
-                await summarize([start, start + 1])
-                if callback:
-                    callback(msg="Cluster one layer: {} -> {}".format(end - start, len(chunks) - end))
-                labels.extend([0, 0])
-                layers.append((end, len(chunks)))
-                start = end
-                end = len(chunks)
-                continue
-
-            n_neighbors = int((len(embeddings) - 1) ** 0.8)
-            reduced_embeddings = umap.UMAP(
-                n_neighbors=max(2, n_neighbors),
-                n_components=min(12, len(embeddings) - 2),
-                metric="cosine",
-            ).fit_transform(embeddings)
-            n_clusters = self._get_optimal_clusters(reduced_embeddings, random_state, task_id=task_id)
-            if n_clusters == 1:
-                lbls = [0 for _ in range(len(reduced_embeddings))]
-            else:
-                gm = GaussianMixture(n_components=n_clusters, random_state=random_state)
-                gm.fit(reduced_embeddings)
-                probs = gm.predict_proba(reduced_embeddings)
-                lbls = [np.where(prob > self._threshold)[0] for prob in probs]
-                lbls = [lbl[0] if isinstance(lbl, np.ndarray) else lbl for lbl in lbls]
+            clusters = None
+            if depth < len(prev_layers) and (depth == 0 or replaced is not None):
+                clusters = self._assign(prev_layers[depth], layer_ids, nodes, replaced)
+            if clusters is None:
+                # Layers above a re-clustered one are re-clustered too.
+                replaced = None
+                embeddings = [nodes[i][1] for i in layer_ids]
+                clusters = [{"members": [layer_ids[i] for i in c], "old": None, "changed": True}
+                            for c in await self._cluster(embeddings, random_state, task_id)]
 
             tasks = []
-            for c in range(n_clusters):
-                ck_idx = [i + start for i in range(len(lbls)) if lbls[i] == c]
-                assert len(ck_idx) > 0
+            for cl in clusters:
                 self._check_task_canceled(task_id, "before cluster processing")
-                tasks.append(asyncio.create_task(summarize(ck_idx)))
+                if cl["changed"] or cl["old"] not in summaries:
+                    tasks.append(asyncio.create_task(self._summarize([nodes[m][0] for m in cl["members"]], callback, task_id)))
+                else:
+                    tasks.append(None)
             try:
-                await asyncio.gather(*tasks, return_exceptions=False)
+                results = await asyncio.gather(*[t for t in tasks if t], return_exceptions=False)
             except Exception as e:
                 logging.error(f"Error in RAPTOR cluster processing: {e}")
                 for t in tasks:
-                    t.cancel()
-                await asyncio.gather(*tasks, return_exceptions=True)
+                    if t:
+                        t.cancel()
+                await asyncio.gather(*[t for t in tasks if t], return_exceptions=True)
                 raise
 
-            assert len(chunks) - end == n_clusters, "{} vs. {}".format(len(chunks) - end, n_clusters)
-            labels.extend(lbls)
-            layers.append((end, len(chunks)))
+            results = iter(results)
+            layer, next_ids, next_replaced = [], [], {}
+            for cl, t in zip(clusters, tasks):
+                if t is None:
+                    sid = cl["old"]
+                    cnt, embds = summaries[sid]
+                    is_new = False
+                else:
+                    res = next(results)
+                    if res is None:
+                        continue
+                    cnt, embds = res
+                    sid = node_id(cnt)
+                    is_new = True
+                    if cl["old"] and cl["old"] != sid:
+                        next_replaced[cl["old"]] = sid
+                if sid in nodes:
+                    continue
+                nodes[sid] = (cnt, embds)
+                next_ids.append(sid)
+                out.append((sid, cnt, embds, is_new))
+                layer.append({
+                    "id": sid,
+                    "members": cl["members"],
+                    "centroid": self._centroid([nodes[m][1] for m in cl["members"]]).tolist(),
+                })
+
             if callback:
-                callback(msg="Cluster one layer: {} -> {}".format(end - start, len(chunks) - end))
-            start = end
-            end = len(chunks)
+                callback(msg="Cluster one layer: {} -> {}".format(len(layer_ids), len(next_ids)))
+            layers.append(layer)
+            layer_ids = next_ids
+            if replaced is not None:
+                replaced = next_replaced
+            depth += 1
+
+        return out, {"layers": layers}
 
-        return chunks
+    async def __call__(self, chunks, random_state, callback=None, task_id: str = ""):
+        if len(chunks) <= 1:
+            return []
+        chunks = [(s, a) for s, a in chunks if s and a is not None and len(a) > 0]
+        nodes, _ = await self.build(chunks, [str(i) for i in range(len(chunks))], random_state, callback, task_id)
+        return chunks + [(cnt, embds) for _, cnt, embds, _ in nodes]
@@ -34,18 +34,20 @@ from api.db import PIPELINE_SPECIAL_PROGRESS_FREEZE_TASK_TYPES
 from api.db.services.knowledgebase_service import KnowledgebaseService
 from api.db.services.pipeline_operation_log_service import PipelineOperationLogService
 from api.db.joint_services.memory_message_service import handle_save_to_memory_task
-from common.connection_utils import timeout
+from common.connection_utils import timeout, get_timeout_stats
 from common.metadata_utils import turn2jsonschema, update_metadata_to
 from rag.utils.base64_image import image2id
+from rag.utils import chunk_pool, embedding_cache, parse_cache, raptor_tree, storage_cache
 from rag.utils.raptor_utils import should_skip_raptor, get_skip_reason
 from common.log_utils import init_root_logger
 from common.config_utils import show_configs
 from rag.graphrag.general.index import run_graphrag_for_kb
 from rag.graphrag.utils import get_llm_cache, set_llm_cache, get_tags_from_cache, set_tags_to_cache
 from rag.prompts.generator import keyword_extraction, question_proposal, content_tagging, run_toc_from_text, \
-    gen_metadata
+    gen_metadata, chunk_enrichment
 import logging
 import os
+from collections import deque
 from datetime import datetime
 import json
 import xxhash
@@ -63,13 +65,14 @@ from common.constants import LLMType, ParserType, PipelineTaskType
 from api.db.services.document_service import DocumentService
 from api.db.services.doc_metadata_service import DocMetadataService
 from api.db.services.llm_service import LLMBundle
-from api.db.services.task_service import TaskService, has_canceled, CANVAS_DEBUG_DOC_ID, GRAPH_RAPTOR_FAKE_DOC_ID
+from api.db.services.task_service import TaskService, has_canceled, canceled_tasks, CANVAS_DEBUG_DOC_ID, \
+    GRAPH_RAPTOR_FAKE_DOC_ID
 from api.db.services.file2document_service import File2DocumentService
 from common.versions import get_ragflow_version
 from api.db.db_models import close_connection
 from rag.app import laws, paper, presentation, manual, qa, table, book, resume, picture, naive, one, audio, \
     email, tag
-from rag.nlp import search, rag_tokenizer, add_positions
+from rag.nlp import search, rag_tokenizer, add_positions, retrieval_cache
 from rag.raptor import RecursiveAbstractiveProcessing4TreeOrganizedRetrieval as Raptor
 from common.token_utils import num_tokens_from_string, truncate
 from rag.utils.redis_conn import REDIS_CONN, RedisDistributedLock
@@ -119,15 +122,31 @@ DONE_TASKS = 0
 FAILED_TASKS = 0
 
 CURRENT_TASKS = {}
+# Claimed tasks waiting for a free slot, filled by collect() in batches.
+PREFETCHED_TASKS = deque()
 
 MAX_CONCURRENT_TASKS = int(os.environ.get('MAX_CONCURRENT_TASKS', "5"))
 MAX_CONCURRENT_CHUNK_BUILDERS = int(os.environ.get('MAX_CONCURRENT_CHUNK_BUILDERS', "1"))
 MAX_CONCURRENT_MINIO = int(os.environ.get('MAX_CONCURRENT_MINIO', '10'))
+# Messages claimed per poll of the task queues; 1 claims one task at a time.
+TASK_PREFETCH = max(1, int(os.environ.get('TASK_PREFETCH', str(MAX_CONCURRENT_TASKS))))
+# Share of each poll per queue priority, as "priority:weight,..."; the rest goes to the higher priorities.
+TASK_QUEUE_WEIGHTS = {
+    settings.get_svr_queue_name(int(p)): int(w)
+    for p, w in (item.split(":") for item in os.environ.get('TASK_QUEUE_WEIGHTS', "1:3,0:1").split(",") if item)
+}
 task_limiter = asyncio.Semaphore(MAX_CONCURRENT_TASKS)
-chunk_limiter = asyncio.Semaphore(MAX_CONCURRENT_CHUNK_BUILDERS)
+# With a chunker process pool, up to one document per worker is chunked at once.
+chunk_limiter = asyncio.Semaphore(max(MAX_CONCURRENT_CHUNK_BUILDERS, chunk_pool.CHUNK_PROCESSES))
 embed_limiter = asyncio.Semaphore(MAX_CONCURRENT_CHUNK_BUILDERS)
 minio_limiter = asyncio.Semaphore(MAX_CONCURRENT_MINIO)
 kg_limiter = asyncio.Semaphore(2)
+# Embedding batches of one task in flight at once, all under the task's embed_limiter slot.
+EMBEDDING_CONCURRENCY = int(os.environ.get('EMBEDDING_CONCURRENCY', "2"))
+# Batch sizes grow while a batch takes less than half of this many seconds and shrink above it.
+EMBEDDING_BATCH_TARGET_SECONDS = float(os.environ.get('EMBEDDING_BATCH_TARGET_SECONDS', "10"))
+# Generate the missing keywords, questions, metadata and tags of a chunk with one LLM call; 0 uses one call per field.
+CHUNK_ENRICHMENT_FUSED = int(os.environ.get('CHUNK_ENRICHMENT_FUSED', "1"))
 WORKER_HEARTBEAT_TIMEOUT = int(os.environ.get('WORKER_HEARTBEAT_TIMEOUT', '120'))
 stop_event = threading.Event()
 
@@ -173,72 +192,307 @@ def set_progress(task_id, from_page=0, to_page=-1, prog=None, msg="Processing...
         logging.exception(f"set_progress({task_id}), progress: {prog}, progress_msg: {msg}, got exception: {e}")
 
 
-async def collect():
-    global CONSUMER_NAME, DONE_TASKS, FAILED_TASKS
+def _prefetch_quotas(n: int, queue_names: list[str]) -> list[int]:
+    """Split `n` reads across the queues by TASK_QUEUE_WEIGHTS, handing any remainder to the higher priorities."""
+    weights = [TASK_QUEUE_WEIGHTS.get(q, 1) for q in queue_names]
+    total = sum(weights) or 1
+    quotas = [n * w // total for w in weights]
+    for i in range(n - sum(quotas)):
+        quotas[i % len(quotas)] += 1
+    return quotas
+
+
+def _claim(redis_msgs) -> list:
+    """Resolve the tasks of the messages with one query and one cancellation check; drop the unusable ones."""
+    global FAILED_TASKS
+
+    msgs = []
+    for redis_msg in redis_msgs:
+        msg = redis_msg.get_message()
+        if not msg:
+            logging.error(f"collect got empty message of {redis_msg.get_msg_id()}")
+            redis_msg.ack()
+            continue
+        msgs.append((redis_msg, msg))
+
+    def is_plain(msg):
+        return msg.get("doc_id", "") not in [GRAPH_RAPTOR_FAKE_DOC_ID, CANVAS_DEBUG_DOC_ID] and \
+            msg.get("task_type") != PipelineTaskType.MEMORY.lower()
+
+    plain_tasks = TaskService.get_tasks_by_ids([msg["id"] for _, msg in msgs if is_plain(msg)])
+
+    claimed = []
+    for redis_msg, msg in msgs:
+        if msg.get("doc_id", "") in [GRAPH_RAPTOR_FAKE_DOC_ID, CANVAS_DEBUG_DOC_ID]:
+            task = msg
+            if task["task_type"] in PIPELINE_SPECIAL_PROGRESS_FREEZE_TASK_TYPES:
+                task = TaskService.get_task(msg["id"], msg["doc_ids"])
+                if task:
+                    task["doc_id"] = msg["doc_id"]
+                    task["doc_ids"] = msg.get("doc_ids", []) or []
+        elif msg.get("task_type") == PipelineTaskType.MEMORY.lower():
+            _, task_obj = TaskService.get_by_id(msg["id"])
+            task = task_obj.to_dict()
+        else:
+            task = plain_tasks.get(msg["id"])
+            task = dict(task) if task else None
+        claimed.append((redis_msg, msg, task))
+
+    canceled = canceled_tasks([task["id"] for _, _, task in claimed if task])
+    res = []
+    for redis_msg, msg, task in claimed:
+        if not task or task["id"] in canceled:
+            state = "is unknown" if not task else "has been cancelled"
+            FAILED_TASKS += 1
+            logging.warning(f"collect task {msg['id']} {state}")
+            redis_msg.ack()
+            continue
+
+        task_type = msg.get("task_type", "")
+        task["task_type"] = task_type
+        if task_type[:8] == "dataflow":
+            task["tenant_id"] = msg["tenant_id"]
+            task["dataflow_id"] = msg["dataflow_id"]
+            task["kb_id"] = msg.get("kb_id", "")
+        if task_type[:6] == "memory":
+            task["memory_id"] = msg["memory_id"]
+            task["source_id"] = msg["source_id"]
+            task["message_dict"] = msg["message_dict"]
+        res.append((redis_msg, task))
+    return res
+
+
+def _prefetch():
+    """
+    Claim up to TASK_PREFETCH messages, and no more than there are free task slots, so that other
+    executors can take the rest: first this consumer's unacknowledged ones, then new ones by priority.
+    """
     global UNACKED_ITERATOR
 
+    limit = max(1, min(TASK_PREFETCH, MAX_CONCURRENT_TASKS - len(CURRENT_TASKS)))
     svr_queue_names = settings.get_svr_queue_names()
-    redis_msg = None
+    redis_msgs = []
+    if not UNACKED_ITERATOR:
+        UNACKED_ITERATOR = REDIS_CONN.get_unacked_iterator(svr_queue_names, SVR_CONSUMER_GROUP_NAME, CONSUMER_NAME)
+    for redis_msg in UNACKED_ITERATOR:
+        redis_msgs.append(redis_msg)
+        if len(redis_msgs) >= limit:
+            break
+
+    n = limit - len(redis_msgs)
+    if n > 0:
+        quotas = _prefetch_quotas(n, svr_queue_names)
+        batch = REDIS_CONN.queue_consumer_batch(list(zip(svr_queue_names, quotas)), SVR_CONSUMER_GROUP_NAME,
+                                                CONSUMER_NAME)
+        redis_msgs.extend(batch)
+        # Queues which filled their quota may hold more; they get the rest in priority order.
+        got = {q: 0 for q in svr_queue_names}
+        for redis_msg in batch:
+            got[redis_msg.get_queue_name()] += 1
+        for q, quota in zip(svr_queue_names, quotas):
+            left = limit - len(redis_msgs)
+            if left <= 0:
+                break
+            if got[q] >= quota:
+                redis_msgs.extend(REDIS_CONN.queue_consumer_batch([(q, left)], SVR_CONSUMER_GROUP_NAME, CONSUMER_NAME))
+    return redis_msgs
+
+
+async def collect():
     try:
-        if not UNACKED_ITERATOR:
-            UNACKED_ITERATOR = REDIS_CONN.get_unacked_iterator(svr_queue_names, SVR_CONSUMER_GROUP_NAME, CONSUMER_NAME)
-        try:
-            redis_msg = next(UNACKED_ITERATOR)
-        except StopIteration:
-            for svr_queue_name in svr_queue_names:
-                redis_msg = REDIS_CONN.queue_consumer(svr_queue_name, SVR_CONSUMER_GROUP_NAME, CONSUMER_NAME)
-                if redis_msg:
-                    break
+        if not PREFETCHED_TASKS:
+            PREFETCHED_TASKS.extend(_claim(_prefetch()))
     except Exception as e:
         logging.exception(f"collect got exception: {e}")
         return None, None
 
-    if not redis_msg:
-        return None, None
-    msg = redis_msg.get_message()
-    if not msg:
-        logging.error(f"collect got empty message of {redis_msg.get_msg_id()}")
-        redis_msg.ack()
+    if not PREFETCHED_TASKS:
         return None, None
+    return PREFETCHED_TASKS.popleft()
 
-    canceled = False
-    if msg.get("doc_id", "") in [GRAPH_RAPTOR_FAKE_DOC_ID, CANVAS_DEBUG_DOC_ID]:
-        task = msg
-        if task["task_type"] in PIPELINE_SPECIAL_PROGRESS_FREEZE_TASK_TYPES:
-            task = TaskService.get_task(msg["id"], msg["doc_ids"])
-            if task:
-                task["doc_id"] = msg["doc_id"]
-                task["doc_ids"] = msg.get("doc_ids", []) or []
-    elif msg.get("task_type") == PipelineTaskType.MEMORY.lower():
-        _, task_obj = TaskService.get_by_id(msg["id"])
-        task = task_obj.to_dict()
-    else:
-        task = TaskService.get_task(msg["id"])
 
-    if task:
-        canceled = has_canceled(task["id"])
-    if not task or canceled:
-        state = "is unknown" if not task else "has been cancelled"
-        FAILED_TASKS += 1
-        logging.warning(f"collect task {msg['id']} {state}")
-        redis_msg.ack()
-        return None, None
-
-    task_type = msg.get("task_type", "")
-    task["task_type"] = task_type
-    if task_type[:8] == "dataflow":
-        task["tenant_id"] = msg["tenant_id"]
-        task["dataflow_id"] = msg["dataflow_id"]
-        task["kb_id"] = msg.get("kb_id", "")
-    if task_type[:6] == "memory":
-        task["memory_id"] = msg["memory_id"]
-        task["source_id"] = msg["source_id"]
-        task["message_dict"] = msg["message_dict"]
-    return redis_msg, task
+def _release_prefetched():
+    """Put the claimed tasks which never got a slot back on their queues, for the other executors to take."""
+    while PREFETCHED_TASKS:
+        redis_msg, task = PREFETCHED_TASKS.popleft()
+        REDIS_CONN.requeue_msg(redis_msg.get_queue_name(), SVR_CONSUMER_GROUP_NAME, redis_msg.get_msg_id())
+        logging.info(f"released prefetched task {task['id']}")
 
 
 async def get_storage_binary(bucket, name):
-    return await thread_pool_exec(settings.STORAGE_IMPL.get, bucket, name)
+    def read():
+        # Reading all of it, a plain get is a single request; only the disk cache is worth going through.
+        if not isinstance(settings.STORAGE_IMPL, storage_cache.ReadThroughCache):
+            return settings.STORAGE_IMPL.get(bucket, name)
+        stream = settings.STORAGE_IMPL.open_stream(bucket, name)
+        if stream is None:
+            return None
+        with stream:
+            return stream.read()
+
+    return await thread_pool_exec(read)
+
+
+async def enrich_chunks(task, docs, progress_callback) -> bool:
+    """
+    Generate the keywords, questions, metadata and tags of the chunks, as configured.
+
+    Each field is cached on its own in the LLM cache, so changing one setting only regenerates that field.
+    The fields of a chunk missing from the cache are generated together by one call (CHUNK_ENRICHMENT_FUSED),
+    falling back to the prompt of each field for those the call did not answer. Tagging matches the chunk's
+    keywords against the tag KBs, so when keywords are generated too, tags come in a second pass.
+
+    Returns False if the task was canceled.
+    """
+    parser_config = task["parser_config"]
+    # field -> (history, genconf) of its LLM cache key
+    specs = {}
+    if parser_config.get("auto_keywords", 0):
+        specs["keywords"] = ("keywords", {"topn": parser_config["auto_keywords"]})
+    if parser_config.get("auto_questions", 0):
+        specs["questions"] = ("question", {"topn": parser_config["auto_questions"]})
+    if parser_config.get("enable_metadata", False) and parser_config.get("metadata"):
+        specs["metadata"] = ("metadata", parser_config["metadata"])
+    tag_kb_ids = task["kb_parser_config"].get("tag_kb_ids", [])
+    if not specs and not tag_kb_ids:
+        return True
+
+    st = timer()
+    progress_callback(msg="Start to generate {} for every chunk ...".format(
+        ", ".join(list(specs) + (["tags"] if tag_kb_ids else []))))
+    chat_mdl = LLMBundle(task["tenant_id"], LLMType.CHAT, llm_name=task["llm_id"], lang=task["language"])
+    canceled = False
+
+    def is_canceled():
+        nonlocal canceled
+        if not canceled and has_canceled(task["id"]):
+            progress_callback(-1, msg="Task has been canceled.")
+            canceled = True
+        return canceled
+
+    examples = []
+    all_tags = None
+    topn_tags = task["kb_parser_config"].get("topn_tags", 3)
+    S = 1000
+    if tag_kb_ids:
+        all_tags = get_tags_from_cache(tag_kb_ids)
+        if not all_tags:
+            all_tags = settings.retriever.all_tags_in_portion(task["tenant_id"], tag_kb_ids, S)
+            set_tags_to_cache(tag_kb_ids, all_tags)
+        else:
+            all_tags = json.loads(all_tags)
+        specs["tags"] = (all_tags, {"topn": topn_tags})
+
+    def picked_examples():
+        picked = random.choices(examples, k=2) if len(examples) > 2 else list(examples)
+        if not picked:
+            picked.append({"content": "This is an example", TAG_FLD: {'example': 1}})
+        return picked
+
+    async def generate(field, content):
+        if field == "keywords":
+            return await keyword_extraction(chat_mdl, content, parser_config["auto_keywords"])
+        if field == "questions":
+            return await question_proposal(chat_mdl, content, parser_config["auto_questions"])
+        if field == "metadata":
+            return await gen_metadata(chat_mdl, turn2jsonschema(parser_config["metadata"]), content)
+        tags = await content_tagging(chat_mdl, content, all_tags, picked_examples(), topn_tags)
+        return json.dumps(tags) if tags else None
+
+    def apply(field, d, value):
+        if field == "keywords":
+            d["important_kwd"] = value.split(",")
+            d["important_tks"] = rag_tokenizer.tokenize(" ".join(d["important_kwd"]))
+        elif field == "questions":
+            d["question_kwd"] = value.split("\n")
+            d["question_tks"] = rag_tokenizer.tokenize("\n".join(d["question_kwd"]))
+        elif field == "metadata":
+            d["metadata_obj"] = value
+        else:
+            d[TAG_FLD] = json.loads(value)
+
+    async def enrich(d, fields):
+        content = d["content_with_weight"]
+        values = {}
+        missing = []
+        for field in fields:
+            cached = get_llm_cache(chat_mdl.llm_name, content, *specs[field])
+            if cached:
+                apply(field, d, cached)
+            else:
+                missing.append(field)
+        if not missing or is_canceled():
+            return
+
+        if CHUNK_ENRICHMENT_FUSED and len(missing) > 1:
+            async with chat_limiter:
+                fused = await chunk_enrichment(
+                    chat_mdl,
+                    content,
+                    keywords_topn=parser_config["auto_keywords"] if "keywords" in missing else 0,
+                    questions_topn=parser_config["auto_questions"] if "questions" in missing else 0,
+                    metadata_schema=turn2jsonschema(parser_config["metadata"]) if "metadata" in missing else None,
+                    all_tags=all_tags if "tags" in missing else None,
+                    examples=picked_examples() if "tags" in missing else None,
+                    tags_topn=topn_tags,
+                )
+            if fused.get("tags") is not None:
+                fused["tags"] = json.dumps(fused["tags"]) if fused["tags"] else None
+            values.update(fused)
+
+        async def generate_one(field):
+            async with chat_limiter:
+                values[field] = await generate(field, content)
+
+        await asyncio.gather(*[generate_one(f) for f in missing if f not in values])
+        for field, value in values.items():
+            if value:
+                set_llm_cache(chat_mdl.llm_name, content, value, *specs[field])
+                apply(field, d, value)
+
+    async def run_all(docs_fields):
+        tasks = [asyncio.create_task(enrich(d, fields)) for d, fields in docs_fields if fields]
+        try:
+            await asyncio.gather(*tasks, return_exceptions=False)
+        except Exception as e:
+            logging.error("Error in enrich_chunks", exc_info=e)
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    async def docs_to_tag():
+        if is_canceled():
+            return set()
+        res = []
+        for d in docs:
+            if await thread_pool_exec(settings.retriever.tag_content, task["tenant_id"], tag_kb_ids, d, all_tags,
+                                      topn_tags=topn_tags, S=S) and len(d[TAG_FLD]) > 0:
+                examples.append({"content": d["content_with_weight"], TAG_FLD: d[TAG_FLD]})
+            else:
+                res.append(id(d))
+        return set(res)
+
+    fields = [f for f in specs if f != "tags"]
+    to_tag = set()
+    if tag_kb_ids and "keywords" not in specs:
+        to_tag = await docs_to_tag()
+    await run_all([(d, fields + (["tags"] if id(d) in to_tag else [])) for d in docs])
+    if tag_kb_ids and "keywords" in specs and not canceled:
+        to_tag = await docs_to_tag()
+        await run_all([(d, ["tags"]) for d in docs if id(d) in to_tag])
+
+    if "metadata" in specs:
+        metadata = {}
+        for d in docs:
+            metadata = update_metadata_to(metadata, d.pop("metadata_obj", None))
+        if metadata:
+            existing_meta = DocMetadataService.get_document_metadata(task["doc_id"])
+            existing_meta = existing_meta if isinstance(existing_meta, dict) else {}
+            metadata = update_metadata_to(metadata, existing_meta)
+            DocMetadataService.update_document_metadata(task["doc_id"], metadata)
+    progress_callback(msg="Enrichment of {} chunks completed in {:.2f}s".format(len(docs), timer() - st))
+    return not canceled
 
 
 @timeout(60 * 80, 1)
@@ -267,27 +521,38 @@ async def build_chunks(task, progress_callback):
         logging.exception("Chunking {}/{} got exception".format(task["location"], task["name"]))
         raise
 
-    try:
-        async with chunk_limiter:
-            cks = await thread_pool_exec(
-                chunker.chunk,
-                task["name"],
-                binary=binary,
-                from_page=task["from_page"],
-                to_page=task["to_page"],
-                lang=task["language"],
-                callback=progress_callback,
-                kb_id=task["kb_id"],
-                parser_config=task["parser_config"],
-                tenant_id=task["tenant_id"],
-            )
-        logging.info("Chunking({}) {}/{} done".format(timer() - st, task["location"], task["name"]))
-    except TaskCanceledException:
-        raise
-    except Exception as e:
-        progress_callback(-1, "Internal server error while chunking: %s" % str(e).replace("'", ""))
-        logging.exception("Chunking {}/{} got exception".format(task["location"], task["name"]))
-        raise
+    parse_cache_key = await thread_pool_exec(parse_cache.cache_key, binary, task["parser_id"], task["parser_config"],
+                                             name=task["name"], from_page=task["from_page"], to_page=task["to_page"],
+                                             lang=task["language"], img2txt_id=task.get("img2txt_id"),
+                                             asr_id=task.get("asr_id"))
+    cks = await thread_pool_exec(parse_cache.get, parse_cache_key)
+    if cks is not None:
+        progress_callback(msg="Reused the cached parsing result of an identical file.")
+        logging.info("Chunking({}) {}/{} reused parse cache {}".format(timer() - st, task["location"], task["name"], parse_cache_key))
+    else:
+        try:
+            async with chunk_limiter:
+                cks = await chunk_pool.chunk(
+                    chunker,
+                    task["name"],
+                    binary=binary,
+                    from_page=task["from_page"],
+                    to_page=task["to_page"],
+                    lang=task["language"],
+                    callback=progress_callback,
+                    kb_id=task["kb_id"],
+                    parser_config=task["parser_config"],
+                    tenant_id=task["tenant_id"],
+                )
+            logging.info("Chunking({}) {}/{} done".format(timer() - st, task["location"], task["name"]))
+        except TaskCanceledException:
+            raise
+        except Exception as e:
+            progress_callback(-1, "Internal server error while chunking: %s" % str(e).replace("'", ""))
+            logging.exception("Chunking {}/{} got exception".format(task["location"], task["name"]))
+            raise
+        # Must be stored before the chunk images are uploaded and closed.
+        await thread_pool_exec(parse_cache.put, parse_cache_key, cks)
 
     docs = []
     doc = {
@@ -339,183 +604,17 @@ async def build_chunks(task, progress_callback):
     el = timer() - st
     logging.info("MINIO PUT({}) cost {:.3f} s".format(task["name"], el))
 
-    if task["parser_config"].get("auto_keywords", 0):
-        st = timer()
-        progress_callback(msg="Start to generate keywords for every chunk ...")
-        chat_mdl = LLMBundle(task["tenant_id"], LLMType.CHAT, llm_name=task["llm_id"], lang=task["language"])
-
-        async def doc_keyword_extraction(chat_mdl, d, topn):
-            cached = get_llm_cache(chat_mdl.llm_name, d["content_with_weight"], "keywords", {"topn": topn})
-            if not cached:
-                if has_canceled(task["id"]):
-                    progress_callback(-1, msg="Task has been canceled.")
-                    return
-                async with chat_limiter:
-                    cached = await keyword_extraction(chat_mdl, d["content_with_weight"], topn)
-                set_llm_cache(chat_mdl.llm_name, d["content_with_weight"], cached, "keywords", {"topn": topn})
-            if cached:
-                d["important_kwd"] = cached.split(",")
-                d["important_tks"] = rag_tokenizer.tokenize(" ".join(d["important_kwd"]))
-            return
-
-        tasks = []
-        for d in docs:
-            tasks.append(
-                asyncio.create_task(doc_keyword_extraction(chat_mdl, d, task["parser_config"]["auto_keywords"])))
-        try:
-            await asyncio.gather(*tasks, return_exceptions=False)
-        except Exception as e:
-            logging.error("Error in doc_keyword_extraction: {}".format(e))
-            for t in tasks:
-                t.cancel()
-            await asyncio.gather(*tasks, return_exceptions=True)
-            raise
-        progress_callback(msg="Keywords generation {} chunks completed in {:.2f}s".format(len(docs), timer() - st))
-
-    if task["parser_config"].get("auto_questions", 0):
-        st = timer()
-        progress_callback(msg="Start to generate questions for every chunk ...")
-        chat_mdl = LLMBundle(task["tenant_id"], LLMType.CHAT, llm_name=task["llm_id"], lang=task["language"])
-
-        async def doc_question_proposal(chat_mdl, d, topn):
-            cached = get_llm_cache(chat_mdl.llm_name, d["content_with_weight"], "question", {"topn": topn})
-            if not cached:
-                if has_canceled(task["id"]):
-                    progress_callback(-1, msg="Task has been canceled.")
-                    return
-                async with chat_limiter:
-                    cached = await question_proposal(chat_mdl, d["content_with_weight"], topn)
-                set_llm_cache(chat_mdl.llm_name, d["content_with_weight"], cached, "question", {"topn": topn})
-            if cached:
-                d["question_kwd"] = cached.split("\n")
-                d["question_tks"] = rag_tokenizer.tokenize("\n".join(d["question_kwd"]))
-
-        tasks = []
-        for d in docs:
-            tasks.append(
-                asyncio.create_task(doc_question_proposal(chat_mdl, d, task["parser_config"]["auto_questions"])))
-        try:
-            await asyncio.gather(*tasks, return_exceptions=False)
-        except Exception as e:
-            logging.error("Error in doc_question_proposal", exc_info=e)
-            for t in tasks:
-                t.cancel()
-            await asyncio.gather(*tasks, return_exceptions=True)
-            raise
-        progress_callback(msg="Question generation {} chunks completed in {:.2f}s".format(len(docs), timer() - st))
-
-    if task["parser_config"].get("enable_metadata", False) and task["parser_config"].get("metadata"):
-        st = timer()
-        progress_callback(msg="Start to generate meta-data for every chunk ...")
-        chat_mdl = LLMBundle(task["tenant_id"], LLMType.CHAT, llm_name=task["llm_id"], lang=task["language"])
-
-        async def gen_metadata_task(chat_mdl, d):
-            cached = get_llm_cache(chat_mdl.llm_name, d["content_with_weight"], "metadata",
-                                   task["parser_config"]["metadata"])
-            if not cached:
-                if has_canceled(task["id"]):
-                    progress_callback(-1, msg="Task has been canceled.")
-                    return
-                async with chat_limiter:
-                    cached = await gen_metadata(chat_mdl,
-                                                turn2jsonschema(task["parser_config"]["metadata"]),
-                                                d["content_with_weight"])
-                set_llm_cache(chat_mdl.llm_name, d["content_with_weight"], cached, "metadata",
-                              task["parser_config"]["metadata"])
-            if cached:
-                d["metadata_obj"] = cached
-
-        tasks = []
-        for d in docs:
-            tasks.append(asyncio.create_task(gen_metadata_task(chat_mdl, d)))
-        try:
-            await asyncio.gather(*tasks, return_exceptions=False)
-        except Exception as e:
-            logging.error("Error in doc_question_proposal", exc_info=e)
-            for t in tasks:
-                t.cancel()
-            await asyncio.gather(*tasks, return_exceptions=True)
-            raise
-        metadata = {}
-        for doc in docs:
-            metadata = update_metadata_to(metadata, doc["metadata_obj"])
-            del doc["metadata_obj"]
-        if metadata:
-            existing_meta = DocMetadataService.get_document_metadata(task["doc_id"])
-            existing_meta = existing_meta if isinstance(existing_meta, dict) else {}
-            metadata = update_metadata_to(metadata, existing_meta)
-            DocMetadataService.update_document_metadata(task["doc_id"], metadata)
-        progress_callback(msg="Question generation {} chunks completed in {:.2f}s".format(len(docs), timer() - st))
-
-    if task["kb_parser_config"].get("tag_kb_ids", []):
-        progress_callback(msg="Start to tag for every chunk ...")
-        kb_ids = task["kb_parser_config"]["tag_kb_ids"]
-        tenant_id = task["tenant_id"]
-        topn_tags = task["kb_parser_config"].get("topn_tags", 3)
-        S = 1000
-        st = timer()
-        examples = []
-        all_tags = get_tags_from_cache(kb_ids)
-        if not all_tags:
-            all_tags = settings.retriever.all_tags_in_portion(tenant_id, kb_ids, S)
-            set_tags_to_cache(kb_ids, all_tags)
-        else:
-            all_tags = json.loads(all_tags)
-
-        chat_mdl = LLMBundle(task["tenant_id"], LLMType.CHAT, llm_name=task["llm_id"], lang=task["language"])
-
-        docs_to_tag = []
-        for d in docs:
-            task_canceled = has_canceled(task["id"])
-            if task_canceled:
-                progress_callback(-1, msg="Task has been canceled.")
-                return None
-            if settings.retriever.tag_content(tenant_id, kb_ids, d, all_tags, topn_tags=topn_tags, S=S) and len(
-                    d[TAG_FLD]) > 0:
-                examples.append({"content": d["content_with_weight"], TAG_FLD: d[TAG_FLD]})
-            else:
-                docs_to_tag.append(d)
-
-        async def doc_content_tagging(chat_mdl, d, topn_tags):
-            cached = get_llm_cache(chat_mdl.llm_name, d["content_with_weight"], all_tags, {"topn": topn_tags})
-            if not cached:
-                if has_canceled(task["id"]):
-                    progress_callback(-1, msg="Task has been canceled.")
-                    return
-                picked_examples = random.choices(examples, k=2) if len(examples) > 2 else examples
-                if not picked_examples:
-                    picked_examples.append({"content": "This is an example", TAG_FLD: {'example': 1}})
-                async with chat_limiter:
-                    cached = await content_tagging(
-                        chat_mdl,
-                        d["content_with_weight"],
-                        all_tags,
-                        picked_examples,
-                        topn_tags,
-                    )
-                if cached:
-                    cached = json.dumps(cached)
-            if cached:
-                set_llm_cache(chat_mdl.llm_name, d["content_with_weight"], cached, all_tags, {"topn": topn_tags})
-                d[TAG_FLD] = json.loads(cached)
-
-        tasks = []
-        for d in docs_to_tag:
-            tasks.append(asyncio.create_task(doc_content_tagging(chat_mdl, d, topn_tags)))
-        try:
-            await asyncio.gather(*tasks, return_exceptions=False)
-        except Exception as e:
-            logging.error("Error tagging docs: {}".format(e))
-            for t in tasks:
-                t.cancel()
-            await asyncio.gather(*tasks, return_exceptions=True)
-            raise
-        progress_callback(msg="Tagging {} chunks completed in {:.2f}s".format(len(docs), timer() - st))
+    if not await enrich_chunks(task, docs, progress_callback):
+        return None
 
     return docs
 
 
-def build_TOC(task, docs, progress_callback):
+def build_TOC(task, docs, progress_callback, vectors_ready: threading.Event | None = None):
+    """
+    The TOC chunk of `docs`, or None. It copies the last chunk, vector included, so with `vectors_ready`
+    the copy waits for that event while the LLM part runs alongside the embedding.
+    """
     progress_callback(msg="Start to generate table of content ...")
     chat_mdl = LLMBundle(task["tenant_id"], LLMType.CHAT, llm_name=task["llm_id"], lang=task["language"])
     docs = sorted(docs, key=lambda d: (
@@ -550,6 +649,8 @@ def build_TOC(task, docs, progress_callback):
             logging.exception(f"Index {ii}: Unexpected error - {e}")
 
     if toc:
+        if vectors_ready:
+            vectors_ready.wait()
         d = copy.deepcopy(docs[-1])
         d["content_with_weight"] = json.dumps(toc, ensure_ascii=False)
         d["toc_kwd"] = "toc"
@@ -567,9 +668,93 @@ def init_kb(row, vector_size: int):
     return settings.docStoreConn.create_idx(idxnm, row.get("kb_id", ""), vector_size, parser_id)
 
 
-async def embedding(docs, mdl, parser_config=None, callback=None):
+class EmbeddingProgress:
+    """
+    Tracks how many leading docs already have their vectors, so that `insert_chunks` can
+    write them to the doc store while later embedding batches are still running.
+    """
+
+    def __init__(self, total):
+        self.total = total
+        self.ready = 0
+        self._done = [False] * total
+        self._error = None
+        self._changed = asyncio.Event()
+
+    def mark(self, idxs):
+        for i in idxs:
+            self._done[i] = True
+        while self.ready < self.total and self._done[self.ready]:
+            self.ready += 1
+        self._changed.set()
+
+    def fail(self, error):
+        self._error = error
+        self._changed.set()
+
+    async def wait_for(self, n):
+        while True:
+            if self._error:
+                raise self._error
+            if self.ready >= min(n, self.total):
+                return
+            self._changed.clear()
+            await self._changed.wait()
+
+
+class AdaptiveBatchSize:
+    """
+    Embedding batch sizing driven by observed latency and token counts.
+
+    The number of texts per batch doubles while batches come back well under the target latency
+    and halves when they exceed it. A batch never carries more (estimated) tokens than a batch of
+    `initial` full-length texts would.
+    """
+
+    def __init__(self, initial, max_length, target_seconds=EMBEDDING_BATCH_TARGET_SECONDS):
+        self.size = max(1, initial)
+        self.max_size = self.size * 4
+        self.max_tokens = self.size * max(1, max_length)
+        self.target_seconds = target_seconds
+        self.tokens_per_char = 0.5
+
+    def next_end(self, txts, beg):
+        end, tokens = beg, 0
+        while end < len(txts) and end - beg < self.size:
+            tokens += len(txts[end]) * self.tokens_per_char
+            if end > beg and tokens > self.max_tokens:
+                break
+            end += 1
+        return end
+
+    def observe(self, txts, elapsed, tokens):
+        chars = sum(len(t) for t in txts)
+        if tokens and chars:
+            self.tokens_per_char = 0.8 * self.tokens_per_char + 0.2 * tokens / chars
+        if elapsed > self.target_seconds:
+            self.size = max(1, self.size // 2)
+        elif elapsed < self.target_seconds / 2 and len(txts) >= self.size:
+            self.size = min(self.max_size, self.size * 2)
+
+
+async def embedding(docs, mdl, parser_config=None, callback=None, progress=None):
+    """
+    Embed docs in place. Cached vectors are used directly; the rest is encoded in adaptively
+    sized batches, EMBEDDING_CONCURRENCY at a time. Each finished doc is reported to `progress`.
+    """
     if parser_config is None:
         parser_config = {}
+    try:
+        # One slot per task: its batch workers share it.
+        async with embed_limiter:
+            return await _embedding(docs, mdl, parser_config, callback, progress)
+    except BaseException as e:
+        if progress:
+            progress.fail(e if isinstance(e, Exception) else Exception("Embedding was cancelled."))
+        raise
+
+
+async def _embedding(docs, mdl, parser_config, callback, progress):
     tts, cnts = [], []
     for d in docs:
         tts.append(d.get("docnm_kwd", "Title"))
@@ -582,42 +767,84 @@ async def embedding(docs, mdl, parser_config=None, callback=None):
         cnts.append(c)
 
     tk_count = 0
-    if len(tts) == len(cnts):
-        vts, c = await thread_pool_exec(mdl.encode, tts[0:1])
-        tts = np.tile(vts[0], (len(cnts), 1))
-        tk_count += c
+    title_vec = None
+    model_key = embedding_cache.model_key(mdl)
+    if tts:
+        title_vec = (await thread_pool_exec(embedding_cache.get_many, model_key, tts[0:1]))[0]
+        if title_vec is None:
+            vts, c = await thread_pool_exec(mdl.encode, tts[0:1])
+            title_vec = vts[0]
+            tk_count += c
+            await thread_pool_exec(embedding_cache.set_many, model_key, tts[0:1], [title_vec])
+        title_vec = np.asarray(title_vec, dtype=np.float32)
 
-    @timeout(60)
-    def batch_encode(txts):
-        nonlocal mdl
-        return mdl.encode([truncate(c, mdl.max_length - 10) for c in txts])
-
-    cnts_ = np.array([])
-    for i in range(0, len(cnts), settings.EMBEDDING_BATCH_SIZE):
-        async with embed_limiter:
-            vts, c = await thread_pool_exec(batch_encode, cnts[i: i + settings.EMBEDDING_BATCH_SIZE])
-        if len(cnts_) == 0:
-            cnts_ = vts
-        else:
-            cnts_ = np.concatenate((cnts_, vts), axis=0)
-        tk_count += c
-        callback(prog=0.7 + 0.2 * (i + 1) / len(cnts), msg="")
-    cnts = cnts_
     filename_embd_weight = parser_config.get("filename_embd_weight", 0.1)  # due to the db support none value
     if not filename_embd_weight:
         filename_embd_weight = 0.1
     title_w = float(filename_embd_weight)
-    if tts.ndim == 2 and cnts.ndim == 2 and tts.shape == cnts.shape:
-        vects = title_w * tts + (1 - title_w) * cnts
-    else:
-        vects = cnts
-
-    assert len(vects) == len(docs)
-    vector_size = 0
-    for i, d in enumerate(docs):
-        v = vects[i].tolist()
-        vector_size = len(v)
-        d["q_%d_vec" % len(v)] = v
+
+    # Vectors are written into one preallocated array as batches finish, in whatever order.
+    vects = None
+
+    def write(idxs, vts):
+        nonlocal vects
+        if vects is None:
+            vects = np.empty((len(docs), len(vts[0])), dtype=np.float32)
+        vects[idxs] = vts
+        for i in idxs:
+            v = vects[i]
+            if title_vec is not None and title_vec.shape == v.shape:
+                v = title_w * title_vec + (1 - title_w) * v
+            docs[i]["q_%d_vec" % len(v)] = v.tolist()
+        if progress:
+            progress.mark(idxs)
+
+    @timeout(60)
+    def batch_encode(txts):
+        nonlocal mdl
+        return mdl.encode(txts)
+
+    # Only texts whose (model, truncated text) pair is not cached are sent to the model.
+    txts = [truncate(c, mdl.max_length - 10) for c in cnts]
+    cached = await thread_pool_exec(embedding_cache.get_many, model_key, txts)
+    hit_idx = [i for i, v in enumerate(cached) if v is not None]
+    miss_idx = [i for i, v in enumerate(cached) if v is None]
+    if hit_idx:
+        logging.info("Embedding cache hit {}/{} chunks".format(len(hit_idx), len(txts)))
+        write(hit_idx, np.stack([cached[i] for i in hit_idx]))
+
+    miss_txts = [txts[i] for i in miss_idx]
+    batch_size = AdaptiveBatchSize(settings.EMBEDDING_BATCH_SIZE, mdl.max_length)
+    cursor = 0
+    done = 0
+
+    async def encode_worker():
+        nonlocal cursor, done, tk_count
+        while cursor < len(miss_idx):
+            beg = cursor
+            cursor = batch_size.next_end(miss_txts, beg)
+            batch_idx = miss_idx[beg:cursor]
+            batch_txts = miss_txts[beg:cursor]
+            st = timer()
+            vts, c = await thread_pool_exec(batch_encode, batch_txts)
+            batch_size.observe(batch_txts, timer() - st, c)
+            write(batch_idx, vts)
+            tk_count += c
+            done += len(batch_idx)
+            callback(prog=0.7 + 0.2 * done / len(miss_idx), msg="")
+            await thread_pool_exec(embedding_cache.set_many, model_key, batch_txts, vts)
+
+    tasks = [asyncio.create_task(encode_worker()) for _ in range(max(1, EMBEDDING_CONCURRENCY))]
+    try:
+        await asyncio.gather(*tasks, return_exceptions=False)
+    except Exception as e:
+        logging.error(f"Embedding got exception: {e}")
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+    vector_size = vects.shape[1] if vects is not None else 0
     return tk_count, vector_size
 
 
@@ -768,12 +995,42 @@ async def run_raptor_for_kb(row, kb_parser_config, chat_mdl, embd_mdl, vector_si
 
     raptor_config = kb_parser_config.get("raptor", {})
     vctr_nm = "q_%d_vec" % vector_size
+    # The same model name may be served elsewhere with other vectors: a tree is only reused for the same served model.
+    embd_key = embedding_cache.model_key(embd_mdl) or f"{embd_mdl.llm_name}|{vector_size}"
+    tree_digest = raptor_tree.tree_digest(raptor_config, embd_key, chat_mdl.llm_name)
 
     res = []
     tk_count = 0
     max_errors = int(os.environ.get("RAPTOR_MAX_ERRORS", 3))
 
-    async def generate(chunks, did):
+    def summary_id(content):
+        return xxhash.xxh64((content + str(fake_doc_id)).encode("utf-8")).hexdigest()
+
+    def list_chunks(doc_id, leaves, summaries, max_count=1024):
+        """
+        Collect the chunks of a document into `leaves` and, when RAPTOR_INCREMENTAL is on, its RAPTOR summaries
+        into `summaries`; otherwise summaries are leaves like any chunk. Returns the number skipped.
+        """
+        skipped = 0
+        fields = ["content_with_weight", vctr_nm]
+        if raptor_tree.RAPTOR_INCREMENTAL:
+            fields.append("raptor_kwd")
+        for d in settings.retriever.chunk_list(doc_id, row["tenant_id"], [str(row["kb_id"])],
+                                               max_count=max_count,
+                                               fields=fields,
+                                               sort_by_position=True):
+            # Skip chunks that don't have the required vector field (may have been indexed with different embedding model)
+            if vctr_nm not in d or d[vctr_nm] is None:
+                skipped += 1
+                logging.warning(f"RAPTOR: Chunk missing vector field '{vctr_nm}' in doc {doc_id}, skipping")
+                continue
+            if raptor_tree.RAPTOR_INCREMENTAL and d.get("raptor_kwd"):
+                summaries[d["id"]] = (d["content_with_weight"], np.array(d[vctr_nm]))
+                continue
+            leaves.append((d["id"], d["content_with_weight"], np.array(d[vctr_nm])))
+        return skipped
+
+    async def generate(leaves, did, summaries):
         nonlocal tk_count, res
         raptor = Raptor(
             raptor_config.get("max_cluster", 64),
@@ -784,8 +1041,15 @@ async def run_raptor_for_kb(row, kb_parser_config, chat_mdl, embd_mdl, vector_si
             raptor_config["threshold"],
             max_errors=max_errors,
         )
-        original_length = len(chunks)
-        chunks = await raptor(chunks, kb_parser_config["raptor"]["random_seed"], callback, row["id"])
+        leaves = [(i, s, a) for i, s, a in leaves if s and a is not None and len(a) > 0]
+        if len(leaves) <= 1:
+            return
+        tree = None
+        if raptor_tree.RAPTOR_INCREMENTAL and summaries:
+            tree = await thread_pool_exec(raptor_tree.load, row["kb_id"], did, tree_digest)
+        nodes, tree = await raptor.build([(s, a) for _, s, a in leaves], [i for i, _, _ in leaves],
+                                         kb_parser_config["raptor"]["random_seed"], callback, row["id"],
+                                         tree=tree, summaries=summaries, node_id=summary_id)
         doc = {
             "doc_id": did,
             "kb_id": [str(row["kb_id"])],
@@ -796,9 +1060,11 @@ async def run_raptor_for_kb(row, kb_parser_config, chat_mdl, embd_mdl, vector_si
         if row["pagerank"]:
             doc[PAGERANK_FLD] = int(row["pagerank"])
 
-        for content, vctr in chunks[original_length:]:
+        for sid, content, vctr, is_new in nodes:
+            if not is_new:
+                continue
             d = copy.deepcopy(doc)
-            d["id"] = xxhash.xxh64((content + str(fake_doc_id)).encode("utf-8")).hexdigest()
+            d["id"] = sid
             d["create_time"] = str(datetime.now()).replace("T", " ")[:19]
             d["create_timestamp_flt"] = datetime.now().timestamp()
             d[vctr_nm] = vctr.tolist()
@@ -808,43 +1074,38 @@ async def run_raptor_for_kb(row, kb_parser_config, chat_mdl, embd_mdl, vector_si
             res.append(d)
             tk_count += num_tokens_from_string(content)
 
+        if not raptor_tree.RAPTOR_INCREMENTAL:
+            return
+        kept = {sid for sid, _, _, _ in nodes}
+        stale = [sid for sid in summaries if sid not in kept]
+        if stale:
+            await thread_pool_exec(settings.docStoreConn.delete, {"id": stale, "doc_id": did},
+                                   search.index_name(row["tenant_id"]), row["kb_id"])
+            retrieval_cache.invalidate_kbs(row["kb_id"])
+        await thread_pool_exec(raptor_tree.save, row["kb_id"], did, tree_digest, tree)
+        reused = len(nodes) - sum(1 for n in nodes if n[3])
+        callback(msg=f"RAPTOR reused {reused} summaries, generated {len(nodes) - reused}, removed {len(stale)}.")
+
     if raptor_config.get("scope", "file") == "file":
         for x, doc_id in enumerate(doc_ids):
-            chunks = []
-            skipped_chunks = 0
-            for d in settings.retriever.chunk_list(doc_id, row["tenant_id"], [str(row["kb_id"])],
-                                                   fields=["content_with_weight", vctr_nm],
-                                                   sort_by_position=True):
-                # Skip chunks that don't have the required vector field (may have been indexed with different embedding model)
-                if vctr_nm not in d or d[vctr_nm] is None:
-                    skipped_chunks += 1
-                    logging.warning(f"RAPTOR: Chunk missing vector field '{vctr_nm}' in doc {doc_id}, skipping")
-                    continue
-                chunks.append((d["content_with_weight"], np.array(d[vctr_nm])))
-            
+            chunks, summaries = [], {}
+            skipped_chunks = await thread_pool_exec(list_chunks, doc_id, chunks, summaries)
+
             if skipped_chunks > 0:
                 callback(msg=f"[WARN] Skipped {skipped_chunks} chunks without vector field '{vctr_nm}' for doc {doc_id}. Consider re-parsing the document with the current embedding model.")
-            
+
             if not chunks:
                 logging.warning(f"RAPTOR: No valid chunks with vectors found for doc {doc_id}")
                 callback(msg=f"[WARN] No valid chunks with vectors found for doc {doc_id}, skipping")
                 continue
-                
-            await generate(chunks, doc_id)
+
+            await generate(chunks, doc_id, summaries)
             callback(prog=(x + 1.) / len(doc_ids))
     else:
-        chunks = []
+        chunks, summaries = [], {}
         skipped_chunks = 0
         for doc_id in doc_ids:
-            for d in settings.retriever.chunk_list(doc_id, row["tenant_id"], [str(row["kb_id"])],
-                                                   fields=["content_with_weight", vctr_nm],
-                                                   sort_by_position=True):
-                # Skip chunks that don't have the required vector field
-                if vctr_nm not in d or d[vctr_nm] is None:
-                    skipped_chunks += 1
-                    logging.warning(f"RAPTOR: Chunk missing vector field '{vctr_nm}' in doc {doc_id}, skipping")
-                    continue
-                chunks.append((d["content_with_weight"], np.array(d[vctr_nm])))
+            skipped_chunks += await thread_pool_exec(list_chunks, doc_id, chunks, {})
 
         if skipped_chunks > 0:
             callback(msg=f"[WARN] Skipped {skipped_chunks} chunks without vector field '{vctr_nm}'. Consider re-parsing documents with the current embedding model.")
@@ -854,7 +1115,9 @@ async def run_raptor_for_kb(row, kb_parser_config, chat_mdl, embd_mdl, vector_si
             callback(msg=f"[ERROR] No valid chunks with vectors found. Please ensure documents are parsed with the current embedding model (vector size: {vector_size}).")
             return res, tk_count
 
-        await generate(chunks, fake_doc_id)
+        if raptor_tree.RAPTOR_INCREMENTAL:
+            await thread_pool_exec(list_chunks, fake_doc_id, [], summaries, 10000)
+        await generate(chunks, fake_doc_id, summaries)
 
     return res, tk_count
 
@@ -868,7 +1131,18 @@ async def delete_image(kb_id, chunk_id):
         raise
 
 
-async def insert_chunks(task_id, task_tenant_id, task_dataset_id, chunks, progress_callback):
+async def _rollback_chunks(task_id, task_tenant_id, task_dataset_id, chunk_ids):
+    """Deletes the chunks a task inserted before its embedding failed."""
+    if not chunk_ids:
+        return
+    try:
+        await thread_pool_exec(settings.docStoreConn.delete, {"id": chunk_ids}, search.index_name(task_tenant_id), task_dataset_id)
+        TaskService.update_chunk_ids(task_id, "")
+    except Exception as e:
+        logging.exception(f"Rolling back the chunks of task {task_id} got exception: {e}")
+
+
+async def insert_chunks(task_id, task_tenant_id, task_dataset_id, chunks, progress_callback, embedded=None):
     """
     Insert chunks into document store (Elasticsearch OR Infinity).
 
@@ -878,6 +1152,7 @@ async def insert_chunks(task_id, task_tenant_id, task_dataset_id, chunks, progre
         task_dataset_id: Dataset/knowledge base ID
         chunks: List of chunk dictionaries to insert
         progress_callback: Callback function for progress updates
+        embedded: Optional EmbeddingProgress; each bulk is inserted as soon as its chunks are embedded
     """
     mothers = []
     mother_ids = set([])
@@ -910,6 +1185,14 @@ async def insert_chunks(task_id, task_tenant_id, task_dataset_id, chunks, progre
             return False
 
     for b in range(0, len(chunks), settings.DOC_BULK_SIZE):
+        if embedded:
+            try:
+                await embedded.wait_for(b + settings.DOC_BULK_SIZE)
+            except Exception:
+                # Don't leave the document half indexed: the chunks inserted so far go, with their mothers.
+                await _rollback_chunks(task_id, task_tenant_id, task_dataset_id,
+                                       [m["id"] for m in mothers] + [ck["id"] for ck in chunks[:b]])
+                raise
         doc_store_result = await thread_pool_exec(settings.docStoreConn.insert, chunks[b:b + settings.DOC_BULK_SIZE],
                                                    search.index_name(task_tenant_id), task_dataset_id, )
         task_canceled = has_canceled(task_id)
@@ -943,6 +1226,7 @@ async def insert_chunks(task_id, task_tenant_id, task_dataset_id, chunks, progre
                 raise
             progress_callback(-1, msg=f"Chunk updates failed since task {task_id} is unknown.")
             return False
+    retrieval_cache.invalidate_kbs(task_dataset_id)
     return True
 
 
@@ -973,6 +1257,7 @@ async def do_handle_task(task):
     task_parser_config = task["parser_config"]
     task_start_ts = timer()
     toc_thread = None
+    embedding_task = None
     executor = concurrent.futures.ThreadPoolExecutor()
 
     # prepare the progress callback function
@@ -1114,35 +1399,56 @@ async def do_handle_task(task):
             progress_callback(1., msg=f"No chunk built from {task_document_name}")
             return
         progress_callback(msg="Generate {} chunks".format(len(chunks)))
-        start_ts = timer()
-        try:
-            token_count, vector_size = await embedding(chunks, embedding_model, task_parser_config, progress_callback)
-        except TaskCanceledException:
-            raise
-        except Exception as e:
-            error_message = "Generate embedding error:{}".format(str(e))
-            progress_callback(-1, error_message)
-            logging.exception(error_message)
-            token_count = 0
-            raise
-        progress_message = "Embedding chunks ({:.2f}s)".format(timer() - start_ts)
-        logging.info(progress_message)
-        progress_callback(msg=progress_message)
+        # Set once the embedding has stopped writing vectors into the chunks, however it ended.
+        vectors_ready = threading.Event()
         if task["parser_id"].lower() == "naive" and task["parser_config"].get("toc_extraction", False):
-            toc_thread = executor.submit(build_TOC, task, chunks, progress_callback)
+            toc_thread = executor.submit(build_TOC, task, chunks, progress_callback, vectors_ready)
+
+        # Chunks are inserted bulk by bulk while later embedding batches are still running.
+        embedded = EmbeddingProgress(len(chunks))
+
+        async def _embed_chunks():
+            start_ts = timer()
+            try:
+                res = await embedding(chunks, embedding_model, task_parser_config, progress_callback, embedded)
+            except TaskCanceledException:
+                raise
+            except Exception as e:
+                error_message = "Generate embedding error:{}".format(str(e))
+                progress_callback(-1, error_message)
+                logging.exception(error_message)
+                raise
+            progress_message = "Embedding chunks ({:.2f}s)".format(timer() - start_ts)
+            logging.info(progress_message)
+            progress_callback(msg=progress_message)
+            return res
+
+        embedding_task = asyncio.create_task(_embed_chunks())
 
     chunk_count = len(set([chunk["id"] for chunk in chunks]))
     start_ts = timer()
 
-    async def _maybe_insert_chunks(_chunks):
+    async def _maybe_insert_chunks(_chunks, _embedded=None):
         if has_canceled(task_id):
             progress_callback(-1, msg="Task has been canceled.")
             return False
-        insert_result = await insert_chunks(task_id, task_tenant_id, task_dataset_id, _chunks, progress_callback)
+        insert_result = await insert_chunks(task_id, task_tenant_id, task_dataset_id, _chunks, progress_callback, _embedded)
         return bool(insert_result)
 
     try:
-        if not await _maybe_insert_chunks(chunks):
+        if embedding_task:
+            try:
+                inserted = await _maybe_insert_chunks(chunks, embedded)
+                if inserted:
+                    token_count, vector_size = await embedding_task
+            finally:
+                if not embedding_task.done():
+                    embedding_task.cancel()
+                await asyncio.gather(embedding_task, return_exceptions=True)
+                vectors_ready.set()
+            if not inserted:
+                return
+        elif not await _maybe_insert_chunks(chunks):
             return
         if has_canceled(task_id):
             progress_callback(-1, msg="Task has been canceled.")
@@ -1192,6 +1498,7 @@ async def do_handle_task(task):
                         search.index_name(task_tenant_id),
                         task_dataset_id,
                     )
+                    retrieval_cache.invalidate_kbs(task_dataset_id)
             except Exception as e:
                 logging.exception(
                     f"Remove doc({task_doc_id}) from docStore failed when task({task_id}) canceled, exception: {e}")
@@ -1290,6 +1597,8 @@ async def report_status():
             "done": DONE_TASKS,
             "failed": FAILED_TASKS,
             "current": current,
+            "embedding_cache": embedding_cache.get_stats(),
+            "timeouts": get_timeout_stats(),
         })
 
         # Report heartbeat to Redis
@@ -1367,6 +1676,7 @@ async def main():
     logging.info(f'RAGFlow version: {get_ragflow_version()}')
     show_configs()
     settings.init_settings()
+    settings.STORAGE_IMPL = storage_cache.wrap(settings.STORAGE_IMPL)
     settings.check_and_install_torch()
     logging.info(f'default embedding config: {settings.EMBEDDING_CFG}')
     settings.print_rag_settings()
@@ -1393,6 +1703,7 @@ async def main():
         for t in tasks:
             t.cancel()
         await asyncio.gather(*tasks, return_exceptions=True)
+        _release_prefetched()
         report_task.cancel()
         await asyncio.gather(report_task, return_exceptions=True)
     logging.error("BUG!!! You should not reach here!!!")
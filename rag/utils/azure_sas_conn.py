@@ -19,12 +19,16 @@ import os
 import time
 from io import BytesIO
 from common.decorator import singleton
+from azure.core.exceptions import HttpResponseError
 from azure.storage.blob import ContainerClient
 from common import settings
+from rag.utils.storage_base import StorageBase
 
 
 @singleton
-class RAGFlowAzureSasBlob:
+class RAGFlowAzureSasBlob(StorageBase):
+    ranged_reads = True
+
     def __init__(self):
         self.conn = None
         self.container_url = os.getenv('CONTAINER_URL', settings.AZURE["container_url"])
@@ -77,6 +81,43 @@ class RAGFlowAzureSasBlob:
                 time.sleep(1)
         return
 
+    def get_range(self, bucket, fnm, offset, length, tenant_id=None):
+        """Up to `length` bytes of an object from `offset`; a negative `offset` counts from the end."""
+        try:
+            if offset < 0:
+                size = self.conn.get_blob_client(fnm).get_blob_properties().size
+                offset = max(0, size + offset)
+                length = min(length, size - offset)
+            if length <= 0:
+                return b""
+            return self.conn.download_blob(fnm, offset=offset, length=length).readall()
+        except HttpResponseError as e:
+            # Reading past the end of an object.
+            if e.status_code == 416:
+                return b""
+            logging.exception(f"fail get {bucket}/{fnm} from {offset}")
+        except Exception:
+            logging.exception(f"fail get {bucket}/{fnm} from {offset}")
+            self.__open__()
+        return None
+
+    def stat(self, bucket, fnm, tenant_id=None):
+        try:
+            r = self.conn.get_blob_client(fnm).get_blob_properties()
+            return {"size": r.size, "etag": r.etag}
+        except Exception:
+            logging.exception(f"fail stat {bucket}/{fnm}")
+            return None
+
+    def rm_many(self, items, tenant_id=None):
+        names = [fnm for _, fnm in items]
+        # At most 256 blobs per batch request.
+        for i in range(0, len(names), 256):
+            try:
+                self.conn.delete_blobs(*names[i:i + 256], raise_on_any_failure=False)
+            except Exception:
+                logging.exception(f"Fail rm {len(names[i:i + 256])} blobs")
+
     def obj_exist(self, bucket, fnm):
         try:
             return self.conn.get_blob_client(fnm).exists()
@@ -18,13 +18,17 @@ import logging
 import os
 import time
 from common.decorator import singleton
+from azure.core.exceptions import HttpResponseError
 from azure.identity import ClientSecretCredential, AzureAuthorityHosts
 from azure.storage.filedatalake import FileSystemClient
 from common import settings
+from rag.utils.storage_base import StorageBase
 
 
 @singleton
-class RAGFlowAzureSpnBlob:
+class RAGFlowAzureSpnBlob(StorageBase):
+    ranged_reads = True
+
     def __init__(self):
         self.conn = None
         self.account_url = os.getenv('ACCOUNT_URL', settings.AZURE["account_url"])
@@ -90,6 +94,35 @@ class RAGFlowAzureSpnBlob:
                 time.sleep(1)
         return None
 
+    def get_range(self, bucket, fnm, offset, length, tenant_id=None):
+        """Up to `length` bytes of an object from `offset`; a negative `offset` counts from the end."""
+        try:
+            client = self.conn.get_file_client(fnm)
+            if offset < 0:
+                size = client.get_file_properties().size
+                offset = max(0, size + offset)
+                length = min(length, size - offset)
+            if length <= 0:
+                return b""
+            return client.download_file(offset=offset, length=length).readall()
+        except HttpResponseError as e:
+            # Reading past the end of an object.
+            if e.status_code == 416:
+                return b""
+            logging.exception(f"fail get {bucket}/{fnm} from {offset}")
+        except Exception:
+            logging.exception(f"fail get {bucket}/{fnm} from {offset}")
+            self.__open__()
+        return None
+
+    def stat(self, bucket, fnm, tenant_id=None):
+        try:
+            r = self.conn.get_file_client(fnm).get_file_properties()
+            return {"size": r.size, "etag": r.etag}
+        except Exception:
+            logging.exception(f"fail stat {bucket}/{fnm}")
+            return None
+
     def obj_exist(self, bucket, fnm):
         try:
             client = self.conn.get_file_client(fnm)
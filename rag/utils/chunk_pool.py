@@ -0,0 +1,124 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Process pool running chunkers out of the task executor's process.
+
+Parsing is CPU-bound and, in threads, competes for the GIL with the executor's event loop and
+heartbeat. With CHUNK_PROCESSES > 0, `chunk` runs chunkers in that many spawned worker processes
+instead. Workers are long-lived: each initializes the settings once and, with CHUNK_PROCESS_PRELOAD,
+loads the OCR, layout and table structure models before its first task.
+
+The file is handed to a worker through shared memory, and the chunks come back in the compact form of
+the parse cache (JPEG images, compressed pickle). The progress callback must be picklable, such as a
+partial of a module-level function; it is called in the worker.
+"""
+
+import asyncio
+import importlib
+import logging
+import multiprocessing
+import os
+import pickle
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.shared_memory import SharedMemory
+
+from common.misc_utils import thread_pool_exec
+
+# Worker processes running chunkers; 0 runs them in the thread pool instead.
+CHUNK_PROCESSES = int(os.environ.get("CHUNK_PROCESSES", "0"))
+CHUNK_PROCESS_PRELOAD = int(os.environ.get("CHUNK_PROCESS_PRELOAD", "1"))
+# Tasks after which a worker is replaced, to bound the memory parsers leak; 0 keeps workers.
+CHUNK_PROCESS_MAX_TASKS = int(os.environ.get("CHUNK_PROCESS_MAX_TASKS", "0"))
+
+_pool = None
+
+
+def _init_worker(log_name: str, preload: bool):
+    from common import settings
+    from common.log_utils import init_root_logger
+
+    init_root_logger(log_name)
+    settings.init_settings()
+    if not preload:
+        return
+    try:
+        from deepdoc.vision import OCR, LayoutRecognizer, TableStructureRecognizer
+
+        OCR()
+        LayoutRecognizer("layout")
+        TableStructureRecognizer()
+    except Exception as e:
+        logging.warning(f"Chunker worker failed to preload models: {e}")
+
+
+def _read_shared(name: str, size: int) -> bytes:
+    # Workers share the parent's resource tracker, so attaching does not make them own the segment.
+    shm = SharedMemory(name=name)
+    try:
+        return bytes(shm.buf[:size])
+    finally:
+        shm.close()
+
+
+def _run_chunker(module: str, filename: str, shm_name: str | None, size: int, kwargs: dict) -> bytes:
+    from rag.utils import parse_cache
+
+    binary = _read_shared(shm_name, size) if shm_name else b""
+    cks = importlib.import_module(module).chunk(filename, binary=binary, **kwargs)
+    return parse_cache.dumps(cks)
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # Spawned rather than forked: the executor process runs threads and holds connections.
+        _pool = ProcessPoolExecutor(
+            max_workers=CHUNK_PROCESSES,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(f"chunker_{os.getpid()}", bool(CHUNK_PROCESS_PRELOAD)),
+            max_tasks_per_child=CHUNK_PROCESS_MAX_TASKS or None,
+        )
+    return _pool
+
+
+async def chunk(chunker, filename: str, binary: bytes, **kwargs) -> list[dict]:
+    """`chunker.chunk(filename, binary=binary, **kwargs)` in a worker process, or in a thread if disabled."""
+    if CHUNK_PROCESSES <= 0:
+        return await thread_pool_exec(chunker.chunk, filename, binary=binary, **kwargs)
+
+    global _pool
+    shm = None
+    try:
+        if binary:
+            shm = SharedMemory(create=True, size=len(binary))
+            shm.buf[:len(binary)] = binary
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(_get_pool(), _run_chunker, chunker.__name__, filename,
+                                          shm.name if shm else None, len(binary or b""), kwargs)
+    except BrokenProcessPool:
+        logging.exception("Chunker worker process died, restarting the pool")
+        _pool = None
+        raise
+    finally:
+        if shm:
+            shm.close()
+            shm.unlink()
+    # Produced by our own worker, so any class may be loaded, unlike parse cache entries.
+    return pickle.loads(zlib.decompress(data))
@@ -0,0 +1,140 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Content-addressed cache of chunk embeddings.
+
+Vectors are keyed by (embedding model, xxhash of the text actually sent to the model) and stored
+in Redis as packed little-endian floats. The set of cached keys is tracked in a sorted set scored
+by last access time so the cache stays bounded with LRU eviction.
+
+The cache shares the Redis of the task queue, so it is off unless EMBEDDING_CACHE_ENABLED=1.
+
+A model is identified by `model_key`, not by its name alone: the same name may be served by
+another factory, endpoint or tenant, with another dimension.
+"""
+
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+import xxhash
+
+from rag.utils.redis_conn import REDIS_CONN
+
+EMBEDDING_CACHE_ENABLED = int(os.environ.get("EMBEDDING_CACHE_ENABLED", "0"))
+# Maximum number of vectors kept. Each takes dimension * 4 bytes in Redis (2 with float16), plus its
+# key: 20k 1024-dim float32 vectors take ~80MB. Size Redis' maxmemory for it before raising this.
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", "20000"))
+EMBEDDING_CACHE_TTL = int(os.environ.get("EMBEDDING_CACHE_TTL", str(7 * 24 * 3600)))
+# "float32" or "float16"; float16 halves the footprint at a small precision cost.
+EMBEDDING_CACHE_DTYPE = os.environ.get("EMBEDDING_CACHE_DTYPE", "float32").lower()
+
+_DTYPES = {"float32": "<f4", "float16": "<f2"}
+_LRU_KEY = "embd_cache:lru"
+
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+
+
+def _dtype() -> str:
+    return _DTYPES.get(EMBEDDING_CACHE_DTYPE, _DTYPES["float32"])
+
+
+# Dimension last seen per served model, so that a model object built per request is keyed before it has encoded.
+_dims = {}
+
+
+def model_key(mdl) -> str | None:
+    """
+    Factory, endpoint, tenant, name and dimension of an embedding model. None, bypassing the cache,
+    until the model, or another object serving the same model in this process, has encoded once.
+    """
+    name = getattr(mdl, "llm_name", None)
+    if not name:
+        return None
+    parts = [getattr(mdl, "llm_factory", None), getattr(mdl, "api_base", None), getattr(mdl, "tenant_id", None), name]
+    served = "|".join("" if p is None else str(p) for p in parts)
+    dim = getattr(mdl, "vector_size", None)
+    if dim:
+        _dims[served] = dim
+    else:
+        dim = _dims.get(served)
+    if not dim:
+        return None
+    return f"{served}|{dim}"
+
+
+def cache_key(model_name: str, txt: str) -> str:
+    # The dtype is part of the key so that switching EMBEDDING_CACHE_DTYPE never misreads old entries.
+    model_hash = xxhash.xxh64(str(model_name).encode("utf-8")).hexdigest()
+    txt_hash = xxhash.xxh3_128(str(txt).encode("utf-8", "surrogatepass")).hexdigest()
+    return f"embd_cache:{_dtype()[1:]}:{model_hash}:{txt_hash}"
+
+
+def pack_vector(vec, dtype: str | None = None) -> bytes:
+    return np.asarray(vec, dtype=dtype or _dtype()).tobytes()
+
+
+def unpack_vector(data: bytes, dtype: str | None = None) -> np.ndarray:
+    return np.frombuffer(data, dtype=dtype or _dtype()).astype(np.float32)
+
+
+def get_many(model_name: str, txts: list[str]) -> list[np.ndarray | None]:
+    """Return the cached vector of every text, or None for misses, in one Redis round trip."""
+    if not EMBEDDING_CACHE_ENABLED or not model_name or not txts:
+        return [None] * len(txts)
+    keys = [cache_key(model_name, t) for t in txts]
+    raw = REDIS_CONN.mget_bin(keys, lru_key=_LRU_KEY, lru_score=time.time())
+    res = []
+    for data in raw:
+        if not data:
+            res.append(None)
+            continue
+        try:
+            res.append(unpack_vector(data))
+        except ValueError:
+            res.append(None)
+    hits = sum(1 for v in res if v is not None)
+    with _stats_lock:
+        _stats["hits"] += hits
+        _stats["misses"] += len(res) - hits
+    return res
+
+
+def set_many(model_name: str, txts: list[str], vecs) -> bool:
+    if not EMBEDDING_CACHE_ENABLED or not model_name or not txts:
+        return False
+    assert len(txts) == len(vecs)
+    mapping = {cache_key(model_name, t): pack_vector(v) for t, v in zip(txts, vecs)}
+    return REDIS_CONN.mset_bin(mapping, EMBEDDING_CACHE_TTL, lru_key=_LRU_KEY, lru_score=time.time(),
+                               lru_capacity=EMBEDDING_CACHE_MAX_ENTRIES)
+
+
+def get_stats() -> dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    total = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / total if total else 0.0
+    return stats
+
+
+def log_stats():
+    stats = get_stats()
+    logging.info("Embedding cache: hits={} misses={} hit_rate={:.2%}".format(stats["hits"], stats["misses"],
+                                                                             stats["hit_rate"]))
@@ -16,12 +16,17 @@
 
 import logging
 from common.crypto_utils import CryptoUtil
+from rag.utils.storage_base import StorageBase
 
 
 # from common.decorator import singleton
 
-class EncryptedStorageWrapper:
-    """Encrypted storage wrapper that wraps existing storage implementations to provide transparent encryption"""
+class EncryptedStorageWrapper(StorageBase):
+    """Encrypted storage wrapper that wraps existing storage implementations to provide transparent encryption
+
+    Ranges of the plaintext can't be read from the ciphertext, so get_range and open_stream decrypt the whole
+    object, and `stat` is left unknown so that plaintext is not cached on disk.
+    """
 
     def __init__(self, storage_impl, algorithm="aes-256-cbc", key=None, iv=None):
         """
@@ -237,6 +242,18 @@ class EncryptedStorageWrapper:
         self.encryption_enabled = True
         logging.info("Encryption enabled")
 
+    def rm_many(self, items, tenant_id=None):
+        """
+        Delete several objects (same as original storage implementation, no decryption needed)
+
+        Args:
+            items: (bucket, file name) of each object
+            tenant_id: Tenant ID (optional)
+        """
+        if hasattr(self.storage_impl, "rm_many"):
+            return self.storage_impl.rm_many(items)
+        return super().rm_many(items, tenant_id)
+
     def disable_encryption(self):
         """Disable encryption"""
         self.encryption_enabled = False
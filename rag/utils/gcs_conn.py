@@ -18,13 +18,16 @@ import time
 import datetime
 from io import BytesIO
 from google.cloud import storage
-from google.api_core.exceptions import NotFound
+from google.api_core.exceptions import NotFound, RequestRangeNotSatisfiable
 from common.decorator import singleton
 from common import settings
+from rag.utils.storage_base import StorageBase
 
 
 @singleton
-class RAGFlowGCS:
+class RAGFlowGCS(StorageBase):
+    ranged_reads = True
+
     def __init__(self):
         self.client = None
         self.bucket_name = None
@@ -113,6 +116,48 @@ class RAGFlowGCS:
                 time.sleep(1)
         return None
 
+    def get_range(self, bucket, filename, offset, length, tenant_id=None):
+        """Up to `length` bytes of an object from `offset`; a negative `offset` counts from the end."""
+        try:
+            bucket_obj = self.client.bucket(self.bucket_name)
+            blob_path = self._get_blob_path(bucket, filename)
+            if offset < 0:
+                blob = bucket_obj.get_blob(blob_path)
+                if blob is None:
+                    raise NotFound(blob_path)
+                offset = max(0, blob.size + offset)
+                length = min(length, blob.size - offset)
+            else:
+                blob = bucket_obj.blob(blob_path)
+            if length <= 0:
+                return b""
+            # `end` is inclusive.
+            return blob.download_as_bytes(start=offset, end=offset + length - 1)
+        except RequestRangeNotSatisfiable:
+            return b""
+        except NotFound:
+            logging.warning(f"File not found {bucket}/{filename} in {self.bucket_name}")
+        except Exception:
+            logging.exception(f"Fail to get {bucket}/{filename} from {offset}")
+            self.__open__()
+        return None
+
+    def stat(self, bucket, filename, tenant_id=None):
+        try:
+            blob = self.client.bucket(self.bucket_name).get_blob(self._get_blob_path(bucket, filename))
+            return {"size": blob.size, "etag": blob.etag} if blob else None
+        except Exception:
+            logging.exception(f"Fail to stat {bucket}/{filename}")
+            return None
+
+    def rm_many(self, items, tenant_id=None):
+        try:
+            bucket_obj = self.client.bucket(self.bucket_name)
+            blob_paths = [self._get_blob_path(bucket, fnm) for bucket, fnm in items]
+            bucket_obj.delete_blobs(blob_paths, on_error=lambda blob: None)
+        except Exception:
+            logging.exception(f"Fail to remove {len(items)} objects")
+
     def obj_exist(self, bucket, filename, tenant_id=None):
         # RENAMED PARAMETER: bucket_name -> bucket
         try:
@@ -18,14 +18,18 @@ import logging
 import time
 from minio import Minio
 from minio.commonconfig import CopySource
+from minio.deleteobjects import DeleteObject
 from minio.error import S3Error, ServerError, InvalidResponseError
 from io import BytesIO
 from common.decorator import singleton
 from common import settings
+from rag.utils.storage_base import StorageBase
 
 
 @singleton
-class RAGFlowMinio:
+class RAGFlowMinio(StorageBase):
+    ranged_reads = True
+
     def __init__(self):
         self.conn = None
         # Use `or None` to convert empty strings to None, ensuring single-bucket
@@ -160,6 +164,56 @@ class RAGFlowMinio:
                 time.sleep(1)
         return
 
+    @use_default_bucket
+    @use_prefix_path
+    def get_range(self, bucket, filename, offset, length, tenant_id=None):
+        """Up to `length` bytes of an object from `offset`; a negative `offset` counts from the end."""
+        try:
+            if offset < 0:
+                size = self.conn.stat_object(bucket, filename).size
+                offset = max(0, size + offset)
+                length = min(length, size - offset)
+            if length <= 0:
+                return b""
+            r = self.conn.get_object(bucket, filename, offset=offset, length=length)
+            try:
+                return r.read()
+            finally:
+                r.close()
+                r.release_conn()
+        except S3Error as e:
+            # Reading past the end of an object.
+            if e.code == "InvalidRange":
+                return b""
+            logging.exception(f"Fail to get {bucket}/{filename} from {offset}")
+        except Exception:
+            logging.exception(f"Fail to get {bucket}/{filename} from {offset}")
+            self.__open__()
+        return
+
+    @use_default_bucket
+    @use_prefix_path
+    def stat(self, bucket, filename, tenant_id=None):
+        try:
+            r = self.conn.stat_object(bucket, filename)
+            return {"size": r.size, "etag": r.etag}
+        except Exception:
+            logging.exception(f"Fail to stat {bucket}/{filename}")
+            return None
+
+    def rm_many(self, items, tenant_id=None):
+        by_bucket = {}
+        for bucket, fnm in items:
+            bucket, fnm = self._resolve_bucket_and_path(bucket, fnm)
+            by_bucket.setdefault(bucket, []).append(DeleteObject(fnm))
+        for bucket, objects in by_bucket.items():
+            try:
+                # Deletion is lazy: the errors must be iterated for the requests to be sent.
+                for err in self.conn.remove_objects(bucket, objects):
+                    logging.error(f"Fail to remove {bucket}/{err.name}: {err.message}")
+            except Exception:
+                logging.exception(f"Fail to remove {len(objects)} objects from {bucket}")
+
     @use_default_bucket
     @use_prefix_path
     def obj_exist(self, bucket, filename, tenant_id=None):
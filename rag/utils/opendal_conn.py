@@ -6,6 +6,7 @@ from urllib.parse import quote_plus
 
 from common.config_utils import get_base_config
 from common.decorator import singleton
+from rag.utils.storage_base import StorageBase
 
 CREATE_TABLE_SQL = """
 CREATE TABLE IF NOT EXISTS `{}` (
@@ -63,7 +64,7 @@ def get_opendal_config():
 
 
 @singleton
-class OpenDALStorage:
+class OpenDALStorage(StorageBase):
     def __init__(self):
         self._kwargs = get_opendal_config()
         self._scheme = self._kwargs.get('scheme', 'mysql')
@@ -91,6 +92,15 @@ class OpenDALStorage:
     def scan(self, bucket, fnm, tenant_id=None):
         return self._operator.scan(f"{bucket}/{fnm}")
 
+    def stat(self, bucket, fnm, tenant_id=None):
+        try:
+            meta = self._operator.stat(f"{bucket}/{fnm}")
+            etag = getattr(meta, "etag", None)
+            return {"size": meta.content_length, "etag": etag} if etag else None
+        except Exception:
+            logging.exception(f"Fail to stat {bucket}/{fnm}")
+            return None
+
     def obj_exist(self, bucket, fnm, tenant_id=None):
         return self._operator.exists(f"{bucket}/{fnm}")
 
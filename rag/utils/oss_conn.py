@@ -20,10 +20,13 @@ import time
 from io import BytesIO
 from common.decorator import singleton
 from common import settings
+from rag.utils.storage_base import StorageBase
 
 
 @singleton
-class RAGFlowOSS:
+class RAGFlowOSS(StorageBase):
+    ranged_reads = True
+
     def __init__(self):
         self.conn = None
         self.oss_config = settings.OSS
@@ -155,6 +158,56 @@ class RAGFlowOSS:
                 time.sleep(1)
         return None
 
+    @use_prefix_path
+    @use_default_bucket
+    def get_range(self, bucket, fnm, offset, length, tenant_id=None):
+        """Up to `length` bytes of an object from `offset`; a negative `offset` counts from the end."""
+        if length <= 0:
+            return b""
+        byte_range = f"bytes={offset}" if offset < 0 else f"bytes={offset}-{offset + length - 1}"
+        try:
+            r = self.conn.get_object(Bucket=bucket, Key=fnm, Range=byte_range)
+            return r['Body'].read()[:length]
+        except ClientError as e:
+            # Reading past the end of an object.
+            if e.response['Error']['Code'] == 'InvalidRange':
+                return b""
+            logging.exception(f"fail get {bucket}/{fnm} {byte_range}")
+        except Exception:
+            logging.exception(f"fail get {bucket}/{fnm} {byte_range}")
+            self.__open__()
+        return None
+
+    @use_prefix_path
+    @use_default_bucket
+    def stat(self, bucket, fnm, tenant_id=None):
+        try:
+            r = self.conn.head_object(Bucket=bucket, Key=fnm)
+            return {"size": r['ContentLength'], "etag": r['ETag']}
+        except Exception:
+            logging.exception(f"fail stat {bucket}/{fnm}")
+            return None
+
+    @use_prefix_path
+    @use_default_bucket
+    def _location(self, bucket, fnm):
+        return bucket, fnm
+
+    def rm_many(self, items, tenant_id=None):
+        by_bucket = {}
+        for bucket, fnm in items:
+            bucket, fnm = self._location(bucket, fnm)
+            by_bucket.setdefault(bucket, []).append({'Key': fnm})
+        for bucket, keys in by_bucket.items():
+            # At most 1000 keys per request.
+            for i in range(0, len(keys), 1000):
+                try:
+                    r = self.conn.delete_objects(Bucket=bucket, Delete={'Objects': keys[i:i + 1000], 'Quiet': True})
+                    for err in r.get('Errors', []):
+                        logging.error(f"Fail rm {bucket}/{err.get('Key')}: {err.get('Message')}")
+                except Exception:
+                    logging.exception(f"Fail rm {len(keys[i:i + 1000])} objects from {bucket}")
+
     @use_prefix_path
     @use_default_bucket
     def obj_exist(self, bucket, fnm, tenant_id=None):
@@ -0,0 +1,444 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Page and row counts of stored files from ranged reads.
+
+Splitting a document into tasks only needs its page or row count, which the parsers get by loading the
+whole file. These counters read only the parts holding it, through `read(offset, length)`, where a
+negative `offset` counts from the end of the file:
+
+- PDF: the trailer and cross-reference sections from the end of the file, then the catalog and the
+  root of the page tree, whose /Count is the number of pages. Cross-reference streams and object
+  streams are supported.
+- XLSX: the zip central directory, then the head of each worksheet up to its <dimension>.
+
+They return None for anything they do not handle (encrypted PDFs, unsupported filters, zip64, sheets
+without a reliable dimension) or once PAGE_COUNT_MAX_READ_BYTES have been read; callers then fall back
+to the parsers.
+"""
+
+import logging
+import os
+import re
+import struct
+import zlib
+
+PAGE_COUNT_MAX_READ_BYTES = int(os.environ.get("PAGE_COUNT_MAX_READ_BYTES", str(4 * 1024 * 1024)))
+
+_PDF_TAIL = 16 * 1024
+_ZIP_TAIL = 64 * 1024 + 22
+_CHUNK = 16 * 1024
+# Above this, openpyxl-based counting trims trailing blank rows which the dimension still covers.
+_XLSX_EXACT_ROWS = 10000
+
+
+class _TooLarge(Exception):
+    pass
+
+
+class _Reader:
+    def __init__(self, read, max_bytes):
+        self._read = read
+        self.left = max_bytes
+
+    def __call__(self, offset: int, length: int) -> bytes:
+        if length > self.left:
+            raise _TooLarge()
+        self.left -= length
+        return self._read(offset, length) or b""
+
+
+class _Buffer:
+    """Bytes of the file from `offset`, read on demand."""
+
+    def __init__(self, read: _Reader, offset: int):
+        self.read = read
+        self.offset = offset
+        self.data = b""
+        self.eof = False
+
+    def need(self, end: int) -> bool:
+        while len(self.data) < end and not self.eof:
+            chunk = self.read(self.offset + len(self.data), max(_CHUNK, end - len(self.data)))
+            self.eof = not chunk
+            self.data += chunk
+        return len(self.data) >= end
+
+
+def bytes_reader(binary: bytes):
+    """A `read(offset, length)` over bytes in memory."""
+    def read(offset, length):
+        if offset < 0:
+            offset = max(0, len(binary) + offset)
+        return binary[offset:offset + length]
+    return read
+
+
+def pdf_page_number(read, max_bytes: int | None = None) -> int | None:
+    try:
+        return _PdfCounter(_Reader(read, max_bytes or PAGE_COUNT_MAX_READ_BYTES)).count()
+    except Exception as e:
+        logging.debug(f"Ranged PDF page count failed: {e!r}")
+        return None
+
+
+def xlsx_row_number(read, max_bytes: int | None = None) -> int | None:
+    try:
+        return _xlsx_row_number(_Reader(read, max_bytes or PAGE_COUNT_MAX_READ_BYTES))
+    except Exception as e:
+        logging.debug(f"Ranged XLSX row count failed: {e!r}")
+        return None
+
+
+_WS = b" \t\r\n\f\x00"
+_STARTXREF = re.compile(rb"startxref\s+(\d+)")
+_OBJ = re.compile(rb"\s*(\d+)\s+(\d+)\s+obj")
+_NUMBER = re.compile(rb"\s*(\d+)(?:\s+(\d+)\s+R)?")
+_SUBSECTION = re.compile(rb"\s*(\d+)\s+(\d+)")
+_ENTRY = re.compile(rb"\s*(\d+)\s+(\d+)\s+([nf])")
+
+
+def _key(name: bytes) -> bytes:
+    return rb"/" + name + rb"(?![^" + re.escape(_WS) + rb"/\[\]<>()])"
+
+
+def _ref(d: bytes, name: bytes) -> int | None:
+    m = re.search(_key(name) + rb"\s*(\d+)\s+(\d+)\s+R", d)
+    return int(m.group(1)) if m else None
+
+
+def _int(d: bytes, name: bytes) -> int | None:
+    m = re.search(_key(name) + rb"\s*(\d+)(?!\d)(?!\s+\d+\s+R)", d)
+    return int(m.group(1)) if m else None
+
+
+def _ints(d: bytes, name: bytes) -> list[int] | None:
+    m = re.search(_key(name) + rb"\s*\[([^\]]*)\]", d)
+    return [int(v) for v in m.group(1).split()] if m else None
+
+
+def _names(d: bytes, name: bytes) -> list[bytes]:
+    m = re.search(_key(name) + rb"\s*(\[[^\]]*\]|/[^" + re.escape(_WS) + rb"/\[\]<>()]+)", d)
+    return re.findall(rb"/([^" + re.escape(_WS) + rb"/\[\]<>()]+)", m.group(1)) if m else []
+
+
+def _skip_ws(buf: _Buffer, pos: int) -> int:
+    while buf.need(pos + 1) and buf.data[pos] in _WS:
+        pos += 1
+    return pos
+
+
+def _dict(buf: _Buffer, pos: int) -> tuple[bytes, bytes, int]:
+    """The dictionary at `pos`: its text, its text without nested dictionaries and strings, and its end."""
+    pos = _skip_ws(buf, pos)
+    buf.need(pos + 2)
+    if buf.data[pos:pos + 2] != b"<<":
+        raise ValueError("dictionary expected")
+    start, i, depth = pos, pos, 0
+    top = bytearray()
+    while True:
+        if not buf.need(i + 2):
+            raise ValueError("unterminated dictionary")
+        c = buf.data[i:i + 1]
+        if buf.data[i:i + 2] == b"<<":
+            depth += 1
+            i += 2
+            continue
+        if buf.data[i:i + 2] == b">>":
+            depth -= 1
+            i += 2
+            if depth == 0:
+                return bytes(buf.data[start:i]), bytes(top), i
+            continue
+        if c == b"(":
+            nested = 0
+            while True:
+                if not buf.need(i + 1):
+                    raise ValueError("unterminated string")
+                c = buf.data[i:i + 1]
+                if c == b"\\":
+                    i += 2
+                    continue
+                i += 1
+                if c == b"(":
+                    nested += 1
+                elif c == b")":
+                    nested -= 1
+                    if nested == 0:
+                        break
+            top += b" "
+            continue
+        if c == b"<":
+            end = buf.data.find(b">", i)
+            while end < 0 and buf.need(len(buf.data) + 1):
+                end = buf.data.find(b">", i)
+            if end < 0:
+                raise ValueError("unterminated hex string")
+            i = end + 1
+            top += b" "
+            continue
+        if depth == 1:
+            top += c
+        i += 1
+
+
+def _unpredict(data: bytes, parms: bytes) -> bytes:
+    predictor = _int(parms, b"Predictor") or 1
+    if predictor == 1:
+        return data
+    if predictor < 10:
+        raise ValueError(f"unsupported predictor {predictor}")
+    bpp = max(1, (_int(parms, b"Colors") or 1) * (_int(parms, b"BitsPerComponent") or 8) // 8)
+    columns = (_int(parms, b"Columns") or 1) * bpp
+    out = bytearray()
+    prev = bytearray(columns)
+    for i in range(0, len(data) - columns, columns + 1):
+        kind, row = data[i], bytearray(data[i + 1:i + 1 + columns])
+        for j in range(len(row)):
+            left = row[j - bpp] if j >= bpp else 0
+            up = prev[j]
+            if kind == 1:
+                row[j] = (row[j] + left) & 0xFF
+            elif kind == 2:
+                row[j] = (row[j] + up) & 0xFF
+            elif kind == 3:
+                row[j] = (row[j] + (left + up) // 2) & 0xFF
+            elif kind == 4:
+                up_left = prev[j - bpp] if j >= bpp else 0
+                p = left + up - up_left
+                pa, pb, pc = abs(p - left), abs(p - up), abs(p - up_left)
+                row[j] = (row[j] + (left if pa <= pb and pa <= pc else up if pb <= pc else up_left)) & 0xFF
+        out += row
+        prev = row
+    return bytes(out)
+
+
+class _PdfCounter:
+    def __init__(self, read: _Reader):
+        self.read = read
+        # Object number -> (offset,) for objects in the file, (stream object number, index) in object streams.
+        self.xref = {}
+        self.object_streams = {}
+
+    def count(self) -> int | None:
+        m = list(_STARTXREF.finditer(self.read(-_PDF_TAIL, _PDF_TAIL)))
+        if not m:
+            return None
+        offset, seen, root = int(m[-1].group(1)), set(), None
+        while offset is not None and offset not in seen:
+            seen.add(offset)
+            trailer = self._load_xref(offset)
+            if re.search(_key(b"Encrypt"), trailer):
+                return None
+            root = root or _ref(trailer, b"Root")
+            # Hybrid files list their compressed objects in a stream besides the table.
+            stream = _int(trailer, b"XRefStm")
+            if stream is not None and stream not in seen:
+                seen.add(stream)
+                self._load_xref(stream)
+            offset = _int(trailer, b"Prev")
+        if root is None:
+            return None
+        pages = _ref(self._object(root), b"Pages")
+        if pages is None:
+            return None
+        d = self._object(pages)
+        count = _int(d, b"Count")
+        if count is None and _ref(d, b"Count") is not None:
+            count = int(self._object(_ref(d, b"Count")).split()[0])
+        return count
+
+    def _load_xref(self, offset: int) -> bytes:
+        buf = _Buffer(self.read, offset)
+        pos = _skip_ws(buf, 0)
+        buf.need(pos + 4)
+        if buf.data[pos:pos + 4] != b"xref":
+            d, data = self._stream(buf, pos)
+            self._load_xref_stream(d, data)
+            return d
+        pos += 4
+        while True:
+            pos = _skip_ws(buf, pos)
+            buf.need(pos + 7)
+            if buf.data[pos:pos + 7] == b"trailer":
+                return _dict(buf, pos + 7)[1]
+            buf.need(pos + 64)
+            m = _SUBSECTION.match(buf.data, pos)
+            if not m:
+                raise ValueError("bad xref subsection")
+            start, num = int(m.group(1)), int(m.group(2))
+            pos = m.end()
+            buf.need(pos + 20 * num + 64)
+            for i in range(num):
+                m = _ENTRY.match(buf.data, pos)
+                if not m:
+                    raise ValueError("bad xref entry")
+                pos = m.end()
+                if m.group(3) == b"n":
+                    self.xref.setdefault(start + i, (int(m.group(1)),))
+
+    def _load_xref_stream(self, d: bytes, data: bytes):
+        w = _ints(d, b"W")
+        if not w or len(w) != 3:
+            raise ValueError("bad xref stream")
+        index = _ints(d, b"Index") or [0, _int(d, b"Size") or 0]
+        row, pos = sum(w), 0
+
+        def field(width):
+            nonlocal pos
+            v = int.from_bytes(data[pos:pos + width], "big")
+            pos += width
+            return v
+
+        for start, num in zip(index[::2], index[1::2]):
+            for i in range(num):
+                if pos + row > len(data):
+                    return
+                kind = field(w[0]) if w[0] else 1
+                a, b = field(w[1]), field(w[2])
+                if kind == 1:
+                    self.xref.setdefault(start + i, (a,))
+                elif kind == 2:
+                    self.xref.setdefault(start + i, (a, b))
+
+    def _stream(self, buf: _Buffer, pos: int) -> tuple[bytes, bytes]:
+        """The dictionary (with nested ones) and the decoded data of the stream object at `pos`."""
+        buf.need(pos + 64)
+        m = _OBJ.match(buf.data, pos)
+        if not m:
+            raise ValueError("object expected")
+        raw, top, pos = _dict(buf, m.end())
+        length = _int(top, b"Length")
+        pos = _skip_ws(buf, pos)
+        buf.need(pos + 6)
+        if length is None or buf.data[pos:pos + 6] != b"stream":
+            raise ValueError("stream with a direct length expected")
+        pos += 6
+        buf.need(pos + 2)
+        pos += 2 if buf.data[pos:pos + 2] == b"\r\n" else 1
+        if not buf.need(pos + length):
+            raise ValueError("truncated stream")
+        data = buf.data[pos:pos + length]
+        filters = _names(top, b"Filter")
+        if any(f not in [b"FlateDecode", b"Fl"] for f in filters):
+            raise ValueError(f"unsupported filters {filters}")
+        if filters:
+            data = zlib.decompress(data)
+        parms = re.search(_key(b"DecodeParms") + rb"\s*\[?\s*<<(.*?)>>", raw, re.S)
+        if parms:
+            data = _unpredict(data, parms.group(1))
+        return top, data
+
+    def _object(self, num: int) -> bytes:
+        """The top level of dictionary object `num`, or the text of any other object."""
+        entry = self.xref.get(num)
+        if entry is None:
+            raise ValueError(f"object {num} not found")
+        if len(entry) == 1:
+            buf = _Buffer(self.read, entry[0])
+            buf.need(64)
+            m = _OBJ.match(buf.data)
+            if not m or int(m.group(1)) != num:
+                raise ValueError(f"object {num} not at its offset")
+            pos = _skip_ws(buf, m.end())
+            buf.need(pos + 2)
+            if buf.data[pos:pos + 2] == b"<<":
+                return _dict(buf, pos)[1]
+            buf.need(pos + 64)
+            return _NUMBER.match(buf.data, pos).group(0)
+
+        stream, index = entry
+        if stream not in self.object_streams:
+            if len(self.xref.get(stream, ())) != 1:
+                raise ValueError(f"object stream {stream} not found")
+            self.object_streams[stream] = self._stream(_Buffer(self.read, self.xref[stream][0]), 0)
+        d, data = self.object_streams[stream]
+        first, n = _int(d, b"First"), _int(d, b"N")
+        header = [int(v) for v in data[:first].split()][:2 * n]
+        offsets = dict(zip(header[::2], header[1::2]))
+        if num not in offsets:
+            raise ValueError(f"object {num} not in object stream {stream}")
+        buf = _Buffer(lambda offset, length: b"", 0)
+        buf.data, buf.eof = data[first + offsets[num]:], True
+        pos = _skip_ws(buf, 0)
+        if buf.data[pos:pos + 2] == b"<<":
+            return _dict(buf, pos)[1]
+        return _NUMBER.match(buf.data, pos).group(0)
+
+
+_DIMENSION = re.compile(rb"<(?:\w+:)?dimension\s+ref=\"([^\"]*)\"")
+_SHEET_DATA = re.compile(rb"<(?:\w+:)?sheetData[\s>/]")
+_WORKSHEET = re.compile(r"xl/worksheets/[^/]+\.xml")
+
+
+def _xlsx_row_number(read: _Reader) -> int | None:
+    tail = read(-_ZIP_TAIL, _ZIP_TAIL)
+    i = tail.rfind(b"PK\x05\x06")
+    if i < 0 or len(tail) < i + 22:
+        return None
+    entries, cd_size, cd_offset = struct.unpack("<10xHII", tail[i:i + 20])
+    if 0xFFFFFFFF in [cd_size, cd_offset] or entries == 0xFFFF:
+        return None
+    cd = read(cd_offset, cd_size)
+
+    sheets, pos = [], 0
+    for _ in range(entries):
+        if cd[pos:pos + 4] != b"PK\x01\x02":
+            return None
+        method, comp_size, name_len, extra_len, comment_len, local_offset = \
+            struct.unpack("<10xH8xI4xHHH8xI", cd[pos:pos + 46])
+        name = cd[pos + 46:pos + 46 + name_len].decode("utf-8", errors="replace")
+        pos += 46 + name_len + extra_len + comment_len
+        if _WORKSHEET.fullmatch(name):
+            sheets.append((method, comp_size, local_offset))
+    if not sheets:
+        return None
+
+    total = 0
+    for method, comp_size, local_offset in sheets:
+        rows = _sheet_rows(read, method, comp_size, local_offset)
+        if rows is None:
+            return None
+        total += rows
+    return total
+
+
+def _sheet_rows(read: _Reader, method: int, comp_size: int, local_offset: int) -> int | None:
+    header = read(local_offset, 30)
+    if header[:4] != b"PK\x03\x04" or method not in [0, 8]:
+        return None
+    name_len, extra_len = struct.unpack("<HH", header[26:30])
+    start = local_offset + 30 + name_len + extra_len
+    decompressor = zlib.decompressobj(-15) if method == 8 else None
+    xml, done = b"", 0
+    while done < comp_size:
+        chunk = read(start + done, min(_CHUNK, comp_size - done))
+        if not chunk:
+            return None
+        done += len(chunk)
+        xml += decompressor.decompress(chunk) if decompressor else chunk
+        m = _DIMENSION.search(xml)
+        if m:
+            # A single cell is what some writers put regardless of the content, so it is not trusted.
+            ref = m.group(1).decode()
+            if ":" not in ref:
+                return None
+            rows = int(re.sub(r"[^0-9]", "", ref.split(":")[1]) or 0)
+            return rows if rows <= _XLSX_EXACT_ROWS else None
+        if _SHEET_DATA.search(xml):
+            return None
+    return None
@@ -0,0 +1,151 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Persistent cache of chunker outputs in object storage.
+
+An entry is addressed by the content hash and name of the file, the parser id, a digest of the parts
+of parser_config which affect chunking, the page range and language, the tenant's image-to-text and
+speech-to-text models, plus the versions of RAGFlow and of the deepdoc models. Uploading an
+identical file to another knowledge base, or re-running a document after changing its embedding
+model, therefore skips parsing entirely.
+
+The cache is off unless PARSE_CACHE_ENABLED is set, as entries are never evicted: the bucket is
+expected to have a lifecycle rule. Parsers with side effects besides their chunks, or whose output
+is mostly model-generated, are never cached.
+
+Chunk images are stored JPEG-encoded; `image2id` accepts them as bytes.
+"""
+
+import json
+import logging
+import os
+import pickle
+import zlib
+from io import BytesIO
+
+import xxhash
+
+from api.utils.configs import restricted_loads
+from common import settings
+from common.file_utils import get_project_base_directory
+from common.versions import get_ragflow_version
+
+PARSE_CACHE_ENABLED = int(os.environ.get("PARSE_CACHE_ENABLED", "0"))
+PARSE_CACHE_BUCKET = os.environ.get("PARSE_CACHE_BUCKET", "ragflow-parse-cache")
+# Entries larger than this (compressed) are not stored.
+PARSE_CACHE_MAX_BYTES = int(os.environ.get("PARSE_CACHE_MAX_BYTES", str(128 * 1024 * 1024)))
+PARSE_CACHE_FORMAT = 1
+
+# parser_config entries which are only used after chunking and must not split the cache.
+_POST_CHUNKING_KEYS = {
+    "raptor",
+    "graphrag",
+    "auto_keywords",
+    "auto_questions",
+    "enable_metadata",
+    "metadata",
+    "tag_kb_ids",
+    "topn_tags",
+    "filename_embd_weight",
+}
+
+# table and resume update the document's parser_config (field_map); picture and audio are model output.
+_UNCACHED_PARSERS = {"table", "resume", "picture", "audio"}
+
+_model_versions = None
+
+
+def _get_model_versions() -> str:
+    global _model_versions
+    if _model_versions is None:
+        hasher = xxhash.xxh64()
+        model_dir = os.path.join(get_project_base_directory(), "rag/res/deepdoc")
+        if os.path.isdir(model_dir):
+            for nm in sorted(os.listdir(model_dir)):
+                path = os.path.join(model_dir, nm)
+                if os.path.isfile(path):
+                    hasher.update(f"{nm}:{os.path.getsize(path)};".encode("utf-8"))
+        _model_versions = f"{get_ragflow_version()}:{hasher.hexdigest()}"
+    return _model_versions
+
+
+def config_digest(parser_id: str, parser_config: dict, **params) -> str:
+    cfg = {k: v for k, v in (parser_config or {}).items() if k not in _POST_CHUNKING_KEYS}
+    payload = json.dumps({"parser_id": str(parser_id).lower(), "parser_config": cfg, **params},
+                         sort_keys=True, ensure_ascii=False, default=str)
+    return xxhash.xxh64(payload.encode("utf-8")).hexdigest()
+
+
+def cache_key(binary: bytes, parser_id: str, parser_config: dict, **params) -> str | None:
+    """`params` must hold everything else the chunks depend on: file name, pages, language and models."""
+    if not PARSE_CACHE_ENABLED or not binary or str(parser_id).lower() in _UNCACHED_PARSERS:
+        return None
+    file_hash = xxhash.xxh3_128(binary).hexdigest()
+    digest = config_digest(parser_id, parser_config, models=_get_model_versions(), fmt=PARSE_CACHE_FORMAT, **params)
+    return f"{file_hash}-{digest}"
+
+
+def _encode_image(img):
+    if img is None or isinstance(img, bytes):
+        return img
+    if img.mode in ("RGBA", "P"):
+        img = img.convert("RGB")
+    with BytesIO() as buf:
+        img.save(buf, format="JPEG")
+        return buf.getvalue()
+
+
+def dumps(chunks: list[dict]) -> bytes:
+    cks = []
+    for ck in chunks:
+        if ck.get("image") is not None:
+            ck = {**ck, "image": _encode_image(ck["image"])}
+        cks.append(ck)
+    return zlib.compress(pickle.dumps(cks, protocol=pickle.HIGHEST_PROTOCOL), 1)
+
+
+def loads(data: bytes) -> list[dict]:
+    # Only builtins and numpy may be instantiated from a cache entry.
+    return restricted_loads(zlib.decompress(data))
+
+
+def get(key: str | None) -> list[dict] | None:
+    if not key:
+        return None
+    try:
+        if not settings.STORAGE_IMPL.obj_exist(PARSE_CACHE_BUCKET, key):
+            return None
+        data = settings.STORAGE_IMPL.get(PARSE_CACHE_BUCKET, key)
+        return loads(data) if data else None
+    except Exception as e:
+        logging.warning(f"parse_cache get {key} got exception: {e}")
+        return None
+
+
+def put(key: str | None, chunks: list[dict]) -> bool:
+    if not key or not chunks:
+        return False
+    try:
+        data = dumps(chunks)
+        if len(data) > PARSE_CACHE_MAX_BYTES:
+            logging.info(f"parse_cache skip {key}: {len(data)} bytes exceeds PARSE_CACHE_MAX_BYTES")
+            return False
+        settings.STORAGE_IMPL.put(PARSE_CACHE_BUCKET, key, data)
+        return True
+    except Exception as e:
+        logging.warning(f"parse_cache put {key} got exception: {e}")
+        return False
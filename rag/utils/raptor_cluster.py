@@ -0,0 +1,224 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Clustering of one RAPTOR layer: UMAP reduction, then a Gaussian mixture whose size is chosen by BIC.
+
+The number of clusters is searched coarse-to-fine. BIC is evaluated on an evenly spaced grid, then
+between the best point and its neighbours until they are adjacent. This takes about
+RAPTOR_CLUSTER_COARSE_POINTS + 2 * log2(max_cluster / RAPTOR_CLUSTER_COARSE_POINTS) fits instead of
+max_cluster. The mixture fitted during the search is reused for the labels instead of being fitted
+again. On large layers, the mixtures start from mini-batch k-means centers.
+
+The work is CPU-bound, so `cluster_layer_async` runs it in a small process pool. A pool whose worker
+died is dropped and the layer clustered in a thread; the next layer starts a new pool.
+
+Run this module to compare the clusterings with the exhaustive search.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import umap
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.mixture import GaussianMixture
+
+from common.misc_utils import thread_pool_exec
+
+# "coarse" for the coarse-to-fine search, "full" to fit every candidate size.
+RAPTOR_CLUSTER_SEARCH = os.environ.get("RAPTOR_CLUSTER_SEARCH", "coarse")
+RAPTOR_CLUSTER_COARSE_POINTS = int(os.environ.get("RAPTOR_CLUSTER_COARSE_POINTS", "8"))
+# Layers with at least this many nodes initialize the mixtures with mini-batch k-means; 0 disables it.
+RAPTOR_MINIBATCH_KMEANS_MIN_SIZE = int(os.environ.get("RAPTOR_MINIBATCH_KMEANS_MIN_SIZE", "2000"))
+# Worker processes clustering layers; 0 clusters in the executor's thread pool instead.
+RAPTOR_CLUSTER_PROCESSES = int(os.environ.get("RAPTOR_CLUSTER_PROCESSES", "1"))
+# Seconds between two polls for cancellation while a layer is clustered in a process.
+RAPTOR_CLUSTER_POLL_SECONDS = float(os.environ.get("RAPTOR_CLUSTER_POLL_SECONDS", "1"))
+
+_pool = None
+
+
+def _fit_gmm(X: np.ndarray, n: int, random_state: int, kmeans_init: bool) -> GaussianMixture:
+    means_init = None
+    if kmeans_init and n > 1:
+        means_init = MiniBatchKMeans(n_clusters=n, random_state=random_state, n_init=3,
+                                     batch_size=1024).fit(X).cluster_centers_
+    gm = GaussianMixture(n_components=n, random_state=random_state, means_init=means_init)
+    gm.fit(X)
+    return gm
+
+
+def optimal_gmm(X: np.ndarray, max_clusters: int, random_state: int, search: str | None = None,
+                kmeans_init: bool | None = None, should_stop=None) -> tuple[int, GaussianMixture]:
+    """The number of clusters in [1, max_clusters) with the lowest BIC, and the mixture fitted for it."""
+    search = search or RAPTOR_CLUSTER_SEARCH
+    if kmeans_init is None:
+        kmeans_init = bool(RAPTOR_MINIBATCH_KMEANS_MIN_SIZE) and len(X) >= RAPTOR_MINIBATCH_KMEANS_MIN_SIZE
+    hi = max(1, max_clusters - 1)
+    fits = {}
+
+    def evaluate(n):
+        if n in fits:
+            return
+        if should_stop:
+            should_stop()
+        gm = _fit_gmm(X, n, random_state, kmeans_init)
+        fits[n] = (gm.bic(X), gm)
+
+    def best():
+        # Ties go to the fewer clusters, as np.argmin over the full range does.
+        return min(fits, key=lambda n: (fits[n][0], n))
+
+    if search == "full" or hi <= RAPTOR_CLUSTER_COARSE_POINTS:
+        for n in range(1, hi + 1):
+            evaluate(n)
+    else:
+        for n in sorted(set(np.linspace(1, hi, RAPTOR_CLUSTER_COARSE_POINTS).round().astype(int).tolist())):
+            evaluate(n)
+        while True:
+            done = sorted(fits)
+            i = done.index(best())
+            left = done[i - 1] if i > 0 else done[i]
+            right = done[i + 1] if i + 1 < len(done) else done[i]
+            todo = {(left + done[i]) // 2, (done[i] + right + 1) // 2} - set(fits)
+            if not todo:
+                break
+            for n in sorted(todo):
+                evaluate(n)
+
+    n = best()
+    return n, fits[n][1]
+
+
+def cluster_layer(embeddings, random_state: int, max_cluster: int, threshold: float,
+                  search: str | None = None, kmeans_init: bool | None = None, should_stop=None) -> list[list[int]]:
+    """Clusters of one layer, as lists of indices into `embeddings`."""
+    if len(embeddings) == 2:
+        return [[0, 1]]
+
+    n_neighbors = int((len(embeddings) - 1) ** 0.8)
+    reduced_embeddings = umap.UMAP(
+        n_neighbors=max(2, n_neighbors),
+        n_components=min(12, len(embeddings) - 2),
+        metric="cosine",
+    ).fit_transform(embeddings)
+    n_clusters, gm = optimal_gmm(reduced_embeddings, min(max_cluster, len(embeddings)), random_state,
+                                 search=search, kmeans_init=kmeans_init, should_stop=should_stop)
+    if n_clusters == 1:
+        lbls = [0 for _ in range(len(reduced_embeddings))]
+    else:
+        probs = gm.predict_proba(reduced_embeddings)
+        lbls = [np.where(prob > threshold)[0] for prob in probs]
+        lbls = [lbl[0] if isinstance(lbl, np.ndarray) else lbl for lbl in lbls]
+
+    clusters = [[i for i in range(len(lbls)) if lbls[i] == c] for c in range(n_clusters)]
+    return [c for c in clusters if c]
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # Spawned rather than forked: the executor process runs threads and holds connections.
+        _pool = ProcessPoolExecutor(max_workers=RAPTOR_CLUSTER_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def _drop_pool(pool: ProcessPoolExecutor):
+    """Shuts `pool` down, stopping its workers where Python can, unless it was already replaced."""
+    global _pool
+    if _pool is pool:
+        _pool = None
+    terminate = getattr(pool, "terminate_workers", None)
+    if terminate:
+        terminate()
+    else:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def cluster_layer_async(embeddings, random_state: int, max_cluster: int, threshold: float,
+                              should_stop=None) -> list[list[int]]:
+    """
+    `cluster_layer` off the event loop. `should_stop` is polled between fits in a thread, and every
+    RAPTOR_CLUSTER_POLL_SECONDS while a process clusters; when it raises, the pool is dropped.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if RAPTOR_CLUSTER_PROCESSES <= 0 or len(embeddings) <= 2:
+        return await thread_pool_exec(cluster_layer, embeddings, random_state, max_cluster, threshold,
+                                      should_stop=should_stop)
+    if should_stop:
+        should_stop()
+    loop = asyncio.get_running_loop()
+    pool = None
+    try:
+        pool = _get_pool()
+        future = loop.run_in_executor(pool, cluster_layer, embeddings, random_state, max_cluster, threshold)
+        while not future.done():
+            await asyncio.wait([future], timeout=RAPTOR_CLUSTER_POLL_SECONDS)
+            if should_stop and not future.done():
+                try:
+                    should_stop()
+                except BaseException:
+                    future.cancel()
+                    _drop_pool(pool)
+                    raise
+        return future.result()
+    except BrokenProcessPool as e:
+        logging.warning(f"RAPTOR clustering process died ({e}), clustering in a thread")
+        _drop_pool(pool)
+    except (OSError, RuntimeError) as e:
+        logging.warning(f"RAPTOR clustering in a process failed ({e}), clustering in a thread")
+    return await thread_pool_exec(cluster_layer, embeddings, random_state, max_cluster, threshold,
+                                  should_stop=should_stop)
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from sklearn.metrics import adjusted_rand_score
+
+    parser = argparse.ArgumentParser(description="Compare RAPTOR cluster-count searches.")
+    parser.add_argument("-n", "--num", type=int, default=3000, help="Number of embeddings")
+    parser.add_argument("-k", "--topics", type=int, default=24, help="Number of true topics")
+    parser.add_argument("-d", "--dim", type=int, default=256)
+    parser.add_argument("--max_cluster", type=int, default=64)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    centers = rng.randn(args.topics, args.dim)
+    truth = rng.randint(0, args.topics, size=args.num)
+    X = (centers[truth] + 0.6 * rng.randn(args.num, args.dim)).astype(np.float32)
+    reduced = umap.UMAP(n_neighbors=int((len(X) - 1) ** 0.8), n_components=12, metric="cosine",
+                        random_state=0).fit_transform(X)
+    max_clusters = min(args.max_cluster, len(X))
+
+    results = {}
+    for name, search, kmeans_init in [("full", "full", False), ("coarse", "coarse", False),
+                                      ("coarse+kmeans", "coarse", True)]:
+        st = time.perf_counter()
+        n, gm = optimal_gmm(reduced, max_clusters, 0, search=search, kmeans_init=kmeans_init)
+        elapsed = time.perf_counter() - st
+        results[name] = (n, gm.predict(reduced), elapsed, gm.bic(reduced))
+
+    ref = results["full"][1]
+    for name, (n, labels, elapsed, bic) in results.items():
+        print(f"{name:>14}: n={n:>3}, BIC {bic:12.1f}, {elapsed:7.2f}s, "
+              f"ARI vs full {adjusted_rand_score(ref, labels):.3f}, ARI vs truth {adjusted_rand_score(truth, labels):.3f}")
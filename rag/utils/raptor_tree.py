@@ -0,0 +1,84 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Persistent RAPTOR summary trees, used to rebuild RAPTOR incrementally.
+
+A tree records, layer by layer, the clusters of the previous run: the ids of their members (chunks
+for the first layer, summaries of the layer below otherwise), the id of their summary and their
+centroid. It is stored in object storage per knowledge base and RAPTOR document, together with a
+digest of the settings it was built with; a tree built with other settings is ignored. Trees are
+deleted with their documents, their KB or its RAPTOR summaries.
+"""
+
+import json
+import logging
+import os
+import zlib
+
+import xxhash
+
+from common import settings
+
+RAPTOR_INCREMENTAL = int(os.environ.get("RAPTOR_INCREMENTAL", "1"))
+RAPTOR_TREE_BUCKET = os.environ.get("RAPTOR_TREE_BUCKET", "ragflow-raptor-tree")
+RAPTOR_TREE_FORMAT = 1
+
+
+def tree_digest(raptor_config: dict, embd_key: str, llm_name: str) -> str:
+    """Digest of what a tree depends on; `embd_key` is the embedding_cache.model_key of the embedding model."""
+    cfg = {k: raptor_config.get(k) for k in ["prompt", "max_token", "threshold", "max_cluster", "random_seed", "scope"]}
+    payload = json.dumps({"raptor": cfg, "embd": embd_key, "llm": llm_name, "fmt": RAPTOR_TREE_FORMAT},
+                         sort_keys=True, ensure_ascii=False, default=str)
+    return xxhash.xxh64(payload.encode("utf-8")).hexdigest()
+
+
+def _key(kb_id: str, doc_id: str) -> str:
+    return f"{kb_id}-{doc_id}"
+
+
+def load(kb_id: str, doc_id: str, digest: str) -> dict | None:
+    key = _key(kb_id, doc_id)
+    try:
+        if not settings.STORAGE_IMPL.obj_exist(RAPTOR_TREE_BUCKET, key):
+            return None
+        tree = json.loads(zlib.decompress(settings.STORAGE_IMPL.get(RAPTOR_TREE_BUCKET, key)))
+    except Exception as e:
+        logging.warning(f"raptor_tree load {key} got exception: {e}")
+        return None
+    if tree.get("digest") != digest:
+        return None
+    return tree
+
+
+def save(kb_id: str, doc_id: str, digest: str, tree: dict):
+    key = _key(kb_id, doc_id)
+    try:
+        data = zlib.compress(json.dumps({**tree, "digest": digest}, ensure_ascii=False).encode("utf-8"), 1)
+        settings.STORAGE_IMPL.put(RAPTOR_TREE_BUCKET, key, data)
+    except Exception as e:
+        logging.warning(f"raptor_tree save {key} got exception: {e}")
+
+
+def delete(kb_id: str, doc_ids: str | list[str]):
+    """Drop the trees of these documents of a KB, when their documents or RAPTOR summaries are deleted."""
+    if isinstance(doc_ids, str):
+        doc_ids = [doc_ids]
+    keys = [_key(kb_id, doc_id) for doc_id in doc_ids]
+    try:
+        settings.STORAGE_IMPL.rm_many([(RAPTOR_TREE_BUCKET, key) for key in keys])
+    except Exception as e:
+        logging.warning(f"raptor_tree delete {kb_id} got exception: {e}")
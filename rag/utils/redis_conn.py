@@ -56,6 +56,9 @@ class RedisMsg:
     def get_msg_id(self):
         return self.__msg_id
 
+    def get_queue_name(self):
+        return self.__queue_name
+
 
 @singleton
 class RedisDB:
@@ -113,7 +116,10 @@ class RedisDB:
 
     def __init__(self):
         self.REDIS = None
+        self.REDIS_BIN = None
         self.config = REDIS
+        # (queue, group) pairs known to exist, so reads need not check the group first.
+        self._consumer_groups = set()
         self.__open__()
 
     def register_scripts(self) -> None:
@@ -138,6 +144,8 @@ class RedisDB:
                 conn_params["password"] = password
 
             self.REDIS = redis.StrictRedis(**conn_params)
+            # Raw client for values which are not UTF-8 text, e.g. packed vectors.
+            self.REDIS_BIN = redis.StrictRedis(**{**conn_params, "decode_responses": False})
 
             self.register_scripts()
         except Exception as e:
@@ -188,6 +196,51 @@ class RedisDB:
             logging.warning("RedisDB.get " + str(k) + " got exception: " + str(e))
             self.__open__()
 
+    def mget_bin(self, keys: list[str], lru_key: str | None = None, lru_score: float | None = None) -> list[bytes | None]:
+        """
+        Fetch raw byte values of `keys` in one round trip.
+        If `lru_key` is given, the scores of the keys already present in that sorted set are bumped to `lru_score`.
+        """
+        if not self.REDIS_BIN or not keys:
+            return [None] * len(keys)
+        try:
+            pipe = self.REDIS_BIN.pipeline(transaction=False)
+            pipe.mget(keys)
+            if lru_key:
+                pipe.zadd(lru_key, {k: lru_score for k in keys}, xx=True)
+            return pipe.execute()[0]
+        except Exception as e:
+            logging.warning(f"RedisDB.mget_bin {len(keys)} keys got exception: {e}")
+            self.__open__()
+        return [None] * len(keys)
+
+    def mset_bin(self, mapping: dict[str, bytes], exp=3600, lru_key: str | None = None,
+                 lru_score: float | None = None, lru_capacity: int = 0) -> bool:
+        """
+        Store raw byte values in one pipelined round trip.
+        If `lru_key` is given, the keys are recorded in that sorted set and, once it holds more than
+        `lru_capacity` members, the least recently used ones are evicted.
+        """
+        if not self.REDIS_BIN or not mapping:
+            return False
+        try:
+            pipe = self.REDIS_BIN.pipeline(transaction=False)
+            for k, v in mapping.items():
+                pipe.set(k, v, exp)
+            if lru_key:
+                pipe.zadd(lru_key, {k: lru_score for k in mapping})
+                pipe.zcard(lru_key)
+            res = pipe.execute()
+            if lru_key and lru_capacity > 0 and res[-1] > lru_capacity:
+                evicted = self.REDIS_BIN.zpopmin(lru_key, res[-1] - lru_capacity)
+                if evicted:
+                    self.REDIS_BIN.delete(*[k for k, _ in evicted])
+            return True
+        except Exception as e:
+            logging.warning(f"RedisDB.mset_bin {len(mapping)} keys got exception: {e}")
+            self.__open__()
+        return False
+
     def set_obj(self, k, obj, exp=3600):
         try:
             self.REDIS.set(k, json.dumps(obj, ensure_ascii=False), exp)
@@ -360,23 +413,44 @@ class RedisDB:
                 self.__open__()
         return False
 
+    def queue_product_batch(self, queue, messages: list) -> bool:
+        """Add several messages to a queue in one round trip, all or none of them."""
+        if not messages:
+            return True
+        for _ in range(3):
+            try:
+                pipe = self.REDIS.pipeline(transaction=True)
+                for message in messages:
+                    pipe.xadd(queue, {"message": json.dumps(message)})
+                pipe.execute()
+                return True
+            except Exception as e:
+                logging.exception(
+                    "RedisDB.queue_product_batch " + str(queue) + " got exception: " + str(e)
+                )
+                self.__open__()
+        return False
+
+    def _ensure_consumer_group(self, queue_name, group_name):
+        if (queue_name, group_name) in self._consumer_groups:
+            return
+        try:
+            self.REDIS.xgroup_create(queue_name, group_name, id="0", mkstream=True)
+        except redis.exceptions.ResponseError as e:
+            if "busygroup" not in str(e).lower():
+                raise
+        self._consumer_groups.add((queue_name, group_name))
+
+    def _forget_consumer_group(self, queue_name, group_name, e: Exception):
+        # The stream or its group was deleted since it was cached.
+        if "nogroup" in str(e).lower():
+            self._consumer_groups.discard((queue_name, group_name))
+
     def queue_consumer(self, queue_name, group_name, consumer_name, msg_id=b">") -> RedisMsg:
         """https://redis.io/docs/latest/commands/xreadgroup/"""
         for _ in range(3):
             try:
-
-                try:
-                    group_info = self.REDIS.xinfo_groups(queue_name)
-                    if not any(gi["name"] == group_name for gi in group_info):
-                        self.REDIS.xgroup_create(queue_name, group_name, id="0", mkstream=True)
-                except redis.exceptions.ResponseError as e:
-                    if "no such key" in str(e).lower():
-                        self.REDIS.xgroup_create(queue_name, group_name, id="0", mkstream=True)
-                    elif "busygroup" in str(e).lower():
-                        logging.warning("Group already exists, continue.")
-                        pass
-                    else:
-                        raise
+                self._ensure_consumer_group(queue_name, group_name)
 
                 args = {
                     "groupname": group_name,
@@ -395,6 +469,7 @@ class RedisDB:
                 res = RedisMsg(self.REDIS, queue_name, group_name, msg_id, payload)
                 return res
             except Exception as e:
+                self._forget_consumer_group(queue_name, group_name, e)
                 if str(e) == 'no such key':
                     pass
                 else:
@@ -407,6 +482,36 @@ class RedisDB:
                     self.__open__()
         return None
 
+    def queue_consumer_batch(self, queue_counts: list[tuple[str, int]], group_name, consumer_name) -> list[RedisMsg]:
+        """
+        Read new messages from several queues in one round trip, up to the given count per queue,
+        without blocking. Messages are returned in the order of the queues.
+        """
+        queue_counts = [(q, n) for q, n in queue_counts if n > 0]
+        if not queue_counts:
+            return []
+        try:
+            for queue_name, _ in queue_counts:
+                self._ensure_consumer_group(queue_name, group_name)
+            pipe = self.REDIS.pipeline(transaction=False)
+            for queue_name, count in queue_counts:
+                pipe.xreadgroup(groupname=group_name, consumername=consumer_name, count=count,
+                                streams={queue_name: ">"})
+            res = []
+            for (queue_name, _), messages in zip(queue_counts, pipe.execute(raise_on_error=False)):
+                if isinstance(messages, Exception):
+                    self._forget_consumer_group(queue_name, group_name, messages)
+                    logging.warning(f"RedisDB.queue_consumer_batch {queue_name} got exception: {messages}")
+                    continue
+                for _, element_list in messages or []:
+                    for msg_id, payload in element_list:
+                        res.append(RedisMsg(self.REDIS, queue_name, group_name, msg_id, payload))
+            return res
+        except Exception as e:
+            logging.exception(f"RedisDB.queue_consumer_batch got exception: {e}")
+            self.__open__()
+        return []
+
     def get_unacked_iterator(self, queue_names: list[str], group_name, consumer_name):
         try:
             for queue_name in queue_names:
@@ -451,6 +556,7 @@ class RedisDB:
                 if messages:
                     self.REDIS.xadd(queue, messages[0][1])
                     self.REDIS.xack(queue, group_name, msg_id)
+                return
             except Exception as e:
                 logging.warning(
                     "RedisDB.get_pending_msg " + str(queue) + " got exception: " + str(e)
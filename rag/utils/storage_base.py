@@ -0,0 +1,105 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Ranged, streaming and batched operations shared by the storage backends.
+
+The defaults here are built on each backend's `get`, `put` and `rm`. Backends override them with
+native requests where their service has them:
+
+- `get_range` reads part of an object. Backends reading only those bytes set `ranged_reads`; the
+  default downloads the whole object and slices it.
+- `open_stream` returns a file-like object reading an object in STORAGE_STREAM_CHUNK_SIZE ranged
+  reads, or over a full download without `ranged_reads`.
+- `put_many` and `rm_many` run STORAGE_BATCH_CONCURRENCY requests at once, unless the service has
+  a batch request.
+- `stat` returns the size and ETag of an object, or None when the backend cannot tell.
+"""
+
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+STORAGE_STREAM_CHUNK_SIZE = int(os.environ.get("STORAGE_STREAM_CHUNK_SIZE", str(8 * 1024 * 1024)))
+STORAGE_BATCH_CONCURRENCY = int(os.environ.get("STORAGE_BATCH_CONCURRENCY", "8"))
+
+
+class RangedStream(io.RawIOBase):
+    """A read-only file over `storage.get_range`, fetching ahead in chunks."""
+
+    def __init__(self, storage, bucket, fnm, chunk_size: int | None = None):
+        self.storage = storage
+        self.bucket = bucket
+        self.fnm = fnm
+        self.chunk_size = chunk_size or STORAGE_STREAM_CHUNK_SIZE
+        self.pos = 0
+        self.buf = b""
+        self.eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if not self.buf and not self.eof:
+            data = self.storage.get_range(self.bucket, self.fnm, self.pos, self.chunk_size)
+            if data is None:
+                raise IOError(f"Can't read {self.bucket}/{self.fnm} from {self.pos}")
+            self.buf = data
+            self.pos += len(data)
+            self.eof = len(data) < self.chunk_size
+        n = min(len(b), len(self.buf))
+        b[:n] = self.buf[:n]
+        self.buf = self.buf[n:]
+        return n
+
+
+class StorageBase:
+    ranged_reads = False
+
+    def get_range(self, bucket, fnm, offset, length, tenant_id=None):
+        """Up to `length` bytes of an object from `offset`; a negative `offset` counts from the end."""
+        binary = self.get(bucket, fnm)
+        if binary is None:
+            return None
+        if offset < 0:
+            offset = max(0, len(binary) + offset)
+        return binary[offset:offset + length]
+
+    def open_stream(self, bucket, fnm, tenant_id=None):
+        """A binary file-like object reading an object; None if it can't be read."""
+        if self.ranged_reads:
+            return io.BufferedReader(RangedStream(self, bucket, fnm), buffer_size=64 * 1024)
+        binary = self.get(bucket, fnm)
+        return io.BytesIO(binary) if binary is not None else None
+
+    def stat(self, bucket, fnm, tenant_id=None):
+        """{"size": ..., "etag": ...} of an object, or None if unknown."""
+        return None
+
+    def put_many(self, items: list[tuple], tenant_id=None) -> list:
+        """`put` of each (bucket, fnm, binary) of `items`; the results in the same order."""
+        return self._map(lambda item: self.put(*item), items)
+
+    def rm_many(self, items: list[tuple], tenant_id=None):
+        """`rm` of each (bucket, fnm) of `items`."""
+        self._map(lambda item: self.rm(*item), items)
+
+    @staticmethod
+    def _map(func, items: list) -> list:
+        if len(items) <= 1 or STORAGE_BATCH_CONCURRENCY <= 1:
+            return [func(item) for item in items]
+        with ThreadPoolExecutor(max_workers=min(STORAGE_BATCH_CONCURRENCY, len(items))) as pool:
+            return list(pool.map(func, items))
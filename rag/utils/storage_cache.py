@@ -0,0 +1,209 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Read-through cache of stored objects on local disk.
+
+A document split into page ranges is read once per task. With STORAGE_CACHE_MAX_BYTES > 0, the task
+executor keeps the objects it reads in STORAGE_CACHE_DIR, so that a node downloads each file once.
+The directory may be shared by the executors of a node.
+
+Entries are stored under the object's name and ETag, which is checked with a `stat` request on every
+read: an object overwritten under the same name is downloaded again, and writes through the cache
+drop their entries. Objects whose storage can't tell their ETag, or larger than an eighth of the
+cache, are not cached. The least recently read entries are removed once the cache is over its size.
+"""
+
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import threading
+
+from rag.utils.storage_base import StorageBase
+
+STORAGE_CACHE_DIR = os.environ.get("STORAGE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "ragflow_storage_cache"))
+# 0 disables the cache.
+STORAGE_CACHE_MAX_BYTES = int(os.environ.get("STORAGE_CACHE_MAX_BYTES", "0"))
+
+
+class ReadThroughCache(StorageBase):
+    def __init__(self, storage_impl, directory: str = STORAGE_CACHE_DIR, max_bytes: int = STORAGE_CACHE_MAX_BYTES):
+        self.storage_impl = storage_impl
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._locks = [threading.Lock() for _ in range(64)]
+        self._evict_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(size for _, size, _ in self._entries())
+
+    def __getattr__(self, name):
+        # Everything not cached goes to the storage.
+        return getattr(self.storage_impl, name)
+
+    @property
+    def ranged_reads(self):
+        return getattr(self.storage_impl, "ranged_reads", False)
+
+    def _object_dir(self, bucket, fnm) -> str:
+        return os.path.join(self.directory, hashlib.sha256(f"{bucket}/{fnm}".encode("utf-8")).hexdigest())
+
+    def _path(self, bucket, fnm) -> str | None:
+        """The entry of the current version of an object, or None if it isn't to be cached."""
+        stat = self.storage_impl.stat(bucket, fnm) if hasattr(self.storage_impl, "stat") else None
+        if not stat or not stat.get("etag") or (stat.get("size") or 0) > self.max_bytes // 8:
+            return None
+        etag = hashlib.sha256(str(stat["etag"]).encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self._object_dir(bucket, fnm), etag)
+
+    def _entries(self) -> list[tuple[float, int, str]]:
+        entries = []
+        for d in os.scandir(self.directory):
+            if not d.is_dir():
+                continue
+            try:
+                for e in os.scandir(d.path):
+                    st = e.stat()
+                    entries.append((st.st_mtime, st.st_size, e.path))
+            except OSError:
+                continue
+        return entries
+
+    def _open(self, path: str):
+        try:
+            f = open(path, "rb")
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return f
+
+    def _remove(self, path: str):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            self._size -= size
+            os.rmdir(os.path.dirname(path))
+        except OSError:
+            pass
+
+    def _invalidate(self, bucket, fnm):
+        object_dir = self._object_dir(bucket, fnm)
+        try:
+            names = os.listdir(object_dir)
+        except OSError:
+            return
+        for name in names:
+            self._remove(os.path.join(object_dir, name))
+
+    def _store(self, path: str, binary: bytes):
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(binary)
+            os.replace(tmp, path)
+            self._size += len(binary)
+        except OSError as e:
+            logging.warning(f"Fail to cache {path}: {e}")
+            return
+        # Older versions of the object.
+        for name in os.listdir(os.path.dirname(path)):
+            if name != os.path.basename(path):
+                self._remove(os.path.join(os.path.dirname(path), name))
+        if self._size > self.max_bytes:
+            self._evict()
+
+    def _evict(self):
+        with self._evict_lock:
+            entries = self._entries()
+            self._size = sum(size for _, size, _ in entries)
+            # Down to 90% so as not to evict on every store.
+            for _, _, path in sorted(entries):
+                if self._size <= self.max_bytes * 0.9:
+                    break
+                self._remove(path)
+
+    def get(self, bucket, fnm, *args, **kwargs):
+        path = self._path(bucket, fnm)
+        if path is None:
+            return self.storage_impl.get(bucket, fnm, *args, **kwargs)
+        return self._read_through(path, bucket, fnm, *args, **kwargs)
+
+    def _read_through(self, path, bucket, fnm, *args, **kwargs):
+        # Concurrent tasks of the same file wait for one download.
+        with self._locks[hash(path) % len(self._locks)]:
+            f = self._open(path)
+            if f:
+                with f:
+                    return f.read()
+            binary = self.storage_impl.get(bucket, fnm, *args, **kwargs)
+            if binary is not None:
+                self._store(path, binary)
+            return binary
+
+    def get_range(self, bucket, fnm, offset, length, *args, **kwargs):
+        # Served from the cache if the object is there, but not added to it.
+        path = self._path(bucket, fnm)
+        f = self._open(path) if path else None
+        if not f:
+            return self.storage_impl.get_range(bucket, fnm, offset, length, *args, **kwargs)
+        with f:
+            f.seek(offset if offset >= 0 else max(0, os.fstat(f.fileno()).st_size + offset))
+            return f.read(length)
+
+    def open_stream(self, bucket, fnm, *args, **kwargs):
+        # Objects small enough to be cached are read through the cache, as by `get`.
+        path = self._path(bucket, fnm)
+        if path is None:
+            return self.storage_impl.open_stream(bucket, fnm, *args, **kwargs)
+        f = self._open(path)
+        if f:
+            return f
+        binary = self._read_through(path, bucket, fnm, *args, **kwargs)
+        return io.BytesIO(binary) if binary is not None else None
+
+    def put(self, bucket, fnm, binary, *args, **kwargs):
+        self._invalidate(bucket, fnm)
+        return self.storage_impl.put(bucket, fnm, binary, *args, **kwargs)
+
+    def rm(self, bucket, fnm, *args, **kwargs):
+        self._invalidate(bucket, fnm)
+        return self.storage_impl.rm(bucket, fnm, *args, **kwargs)
+
+    def put_many(self, items, *args, **kwargs):
+        for bucket, fnm, _ in items:
+            self._invalidate(bucket, fnm)
+        return self.storage_impl.put_many(items, *args, **kwargs)
+
+    def rm_many(self, items, *args, **kwargs):
+        for bucket, fnm in items:
+            self._invalidate(bucket, fnm)
+        return self.storage_impl.rm_many(items, *args, **kwargs)
+
+
+def wrap(storage_impl):
+    """`storage_impl` behind a read-through cache if STORAGE_CACHE_MAX_BYTES is set."""
+    if STORAGE_CACHE_MAX_BYTES <= 0:
+        return storage_impl
+    try:
+        return ReadThroughCache(storage_impl)
+    except OSError as e:
+        logging.warning(f"Storage cache disabled, {STORAGE_CACHE_DIR} can't be used: {e}")
+        return storage_impl
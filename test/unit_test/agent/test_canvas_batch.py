@@ -0,0 +1,214 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Unit tests for running the components of a canvas as a dependency graph.
+"""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+canvas_module = pytest.importorskip("agent.canvas")
+Canvas = canvas_module.Canvas
+
+
+class FakeComponent:
+    """Sleeps for `delay` seconds; its inputs reference the outputs of the components in `refs`."""
+
+    def __init__(self, cpn_id, events, component_name="Fake", delay=0.05, refs=()):
+        self._id = cpn_id
+        self.component_name = component_name
+        self.events = events
+        self.delay = delay
+        self.refs = refs
+        self._outputs = {}
+
+    def reset(self, *args):
+        self._outputs = {}
+
+    def get_input_elements(self):
+        return {f"{ref}@content": {"_cpn_id": ref} for ref in self.refs}
+
+    def get_input(self):
+        return {}
+
+    def get_input_values(self):
+        return {}
+
+    async def _invoke_async(self, **kwargs):
+        self.events.append(("start", self._id, self.component_name))
+        await asyncio.sleep(self.delay)
+        self.events.append(("end", self._id, self.component_name))
+        self._outputs["content"] = self._id
+
+    async def invoke_async(self, **kwargs):
+        self._outputs["_created_time"] = time.perf_counter()
+        await self._invoke_async(**kwargs)
+
+    def output(self, key=None):
+        return self._outputs.get(key) if key else self._outputs
+
+    def set_output(self, key, value):
+        self._outputs[key] = value
+
+    def error(self):
+        return None
+
+    def get_parent(self):
+        return None
+
+    def get_param(self, name):
+        return None
+
+    def thoughts(self):
+        return ""
+
+
+def _canvas(components, downstream=None):
+    """
+    A canvas whose begin component leads to `components` (id: (FakeComponent kwargs)), or to those of
+    them no other component leads to when `downstream` (id: [ids]) is given.
+    """
+    events = []
+    downstream = downstream or {}
+    canvas = Canvas.__new__(Canvas)
+    targets = {d for ds in downstream.values() for d in ds}
+    canvas.components = {"begin": {"obj": FakeComponent("begin", events, "Begin", delay=0), "upstream": [],
+                                   "downstream": [c for c in components if c not in targets]}}
+    for cpn_id, kwargs in components.items():
+        canvas.components[cpn_id] = {"obj": FakeComponent(cpn_id, events, **kwargs), "downstream": downstream.get(cpn_id, []),
+                                     "upstream": [u for u, ds in downstream.items() if cpn_id in ds] or ["begin"]}
+    canvas._names = {cpn_id: cpn_id for cpn_id in canvas.components}
+    canvas.path, canvas.history, canvas.retrieval, canvas.memory = [], [], [], []
+    canvas.globals = {"sys.query": "", "sys.user_id": "", "sys.conversation_turns": 0, "sys.files": [], "sys.history": []}
+    canvas.variables = {}
+    canvas.error = ""
+    canvas.task_id = "task"
+    canvas._tenant_id = "tenant"
+    canvas._thread_pool = ThreadPoolExecutor(max_workers=2)
+    return canvas, events
+
+
+async def _run(canvas):
+    return [ev async for ev in canvas.run(query="hi")]
+
+
+def _max_running(events, component_name=None):
+    running = peak = 0
+    for kind, _, name in events:
+        if component_name and name != component_name:
+            continue
+        running += 1 if kind == "start" else -1
+        peak = max(peak, running)
+    return peak
+
+
+@pytest.fixture(autouse=True)
+def not_canceled(monkeypatch):
+    monkeypatch.setattr(canvas_module, "has_canceled", lambda task_id: False)
+
+
+class TestScheduling:
+    @pytest.mark.asyncio
+    async def test_dependent_component_waits(self):
+        canvas, events = _canvas({"a": {"delay": 0.1}, "b": {}, "c": {"refs": ("a",)}})
+        await _run(canvas)
+        order = [(kind, cpn_id) for kind, cpn_id, _ in events if cpn_id != "begin"]
+        # b does not wait for a; c starts once a has finished.
+        assert order.index(("start", "b")) < order.index(("end", "a"))
+        assert order.index(("end", "a")) < order.index(("start", "c"))
+        assert canvas.path == ["begin", "a", "b", "c"]
+
+    @pytest.mark.asyncio
+    async def test_reference_to_a_later_component_drops_it(self):
+        canvas, events = _canvas({"c": {"refs": ("a",)}, "a": {}})
+        await _run(canvas)
+        assert "c" not in {cpn_id for _, cpn_id, _ in events}
+        assert canvas.path == ["begin", "a"]
+
+    @pytest.mark.asyncio
+    async def test_limit_per_component_type(self, monkeypatch):
+        monkeypatch.setattr(canvas_module, "AGENT_COMPONENT_CONCURRENCY", {"retrieval": 2})
+        components = {f"r{i}": {"component_name": "Retrieval"} for i in range(5)}
+        components.update({f"o{i}": {} for i in range(3)})
+        canvas, events = _canvas(components)
+        await _run(canvas)
+        assert _max_running(events, "Retrieval") == 2
+        # Other types only share the batch limit.
+        assert _max_running(events, "Fake") == 3
+
+    @pytest.mark.asyncio
+    async def test_waiting_for_type_limit_holds_no_batch_slot(self, monkeypatch):
+        monkeypatch.setattr(canvas_module, "AGENT_MAX_CONCURRENT_COMPONENTS", 2)
+        monkeypatch.setattr(canvas_module, "AGENT_COMPONENT_CONCURRENCY", {"retrieval": 1})
+        components = {f"r{i}": {"component_name": "Retrieval"} for i in range(3)}
+        components["o"] = {}
+        canvas, events = _canvas(components)
+        await _run(canvas)
+        order = [(kind, cpn_id) for kind, cpn_id, _ in events]
+        assert order.index(("start", "o")) < order.index(("end", "r0"))
+
+    @pytest.mark.asyncio
+    async def test_batch_limit(self, monkeypatch):
+        monkeypatch.setattr(canvas_module, "AGENT_MAX_CONCURRENT_COMPONENTS", 2)
+        canvas, events = _canvas({f"o{i}": {} for i in range(5)})
+        await _run(canvas)
+        assert _max_running(events) == 2
+        assert len([e for e in events if e[0] == "end"]) == 6
+
+    @pytest.mark.asyncio
+    async def test_critical_path_timing(self):
+        canvas, _ = _canvas({"a": {"delay": 0.1}, "b": {"delay": 0.05}, "c": {"delay": 0.05, "refs": ("a",)}})
+        events = await _run(canvas)
+        timing = {ev["data"]["component_id"]: ev["data"]["timing"] for ev in events if ev["event"] == "node_finished"}
+        assert timing["c"]["critical_path"] == ["begin", "a", "c"]
+        assert timing["b"]["critical_path"] == ["begin", "b"]
+        assert timing["c"]["critical_path_time"] >= 0.15
+        assert timing["c"]["queued_time"] < 0.05
+        assert timing["a"]["run_time"] >= 0.1
+
+        finished = next(ev for ev in events if ev["event"] == "workflow_finished")
+        assert finished["data"]["critical_path"]["critical_path"] == ["begin", "a", "c"]
+
+    @pytest.mark.asyncio
+    async def test_queued_time_under_type_limit(self, monkeypatch):
+        monkeypatch.setattr(canvas_module, "AGENT_COMPONENT_CONCURRENCY", {"retrieval": 1})
+        canvas, _ = _canvas({"r0": {"component_name": "Retrieval", "delay": 0.1},
+                             "r1": {"component_name": "Retrieval", "delay": 0.1}})
+        events = await _run(canvas)
+        timing = {ev["data"]["component_id"]: ev["data"]["timing"] for ev in events if ev["event"] == "node_finished"}
+        assert max(timing["r0"]["queued_time"], timing["r1"]["queued_time"]) >= 0.1
+
+    @pytest.mark.asyncio
+    async def test_branches_of_different_depths_overlap(self):
+        # begin -> a (slow), begin -> b -> d: d does not wait for the level of a.
+        canvas, events = _canvas({"a": {"delay": 0.2}, "b": {}, "d": {}}, downstream={"b": ["d"]})
+        await _run(canvas)
+        order = [(kind, cpn_id) for kind, cpn_id, _ in events]
+        assert order.index(("end", "d")) < order.index(("end", "a"))
+
+    @pytest.mark.asyncio
+    async def test_join_runs_once_after_its_running_upstreams(self):
+        # begin -> a -> j, begin -> b (slow) -> j
+        canvas, events = _canvas({"a": {}, "b": {"delay": 0.15}, "j": {}}, downstream={"a": ["j"], "b": ["j"]})
+        await _run(canvas)
+        order = [(kind, cpn_id) for kind, cpn_id, _ in events]
+        assert order.count(("start", "j")) == 1
+        assert order.index(("end", "b")) < order.index(("start", "j"))
+        assert canvas.path == ["begin", "a", "b", "j"]
@@ -0,0 +1,199 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Unit tests for storing conversation messages and references as one row per item, on SQLite.
+"""
+
+import pytest
+
+pytest.importorskip("api.db.services.conversation_service")
+
+from peewee import SqliteDatabase  # noqa: E402
+
+from api.db import db_models  # noqa: E402
+from api.db.db_models import Conversation, ConversationMessage  # noqa: E402
+from api.db.services import conversation_service  # noqa: E402
+from api.db.services.conversation_service import ConversationService  # noqa: E402
+
+MODELS = [Conversation, ConversationMessage]
+
+
+@pytest.fixture(autouse=True)
+def db(monkeypatch):
+    sqlite = SqliteDatabase(":memory:")
+    # The services open and close the pooled database around each call; keep everything on SQLite instead.
+    monkeypatch.setattr(db_models.DB, "is_closed", lambda: False)
+    monkeypatch.setattr(db_models.DB, "close", lambda: None)
+    monkeypatch.setattr(db_models.DB, "atomic", sqlite.atomic)
+    with sqlite.bind_ctx(MODELS):
+        sqlite.create_tables(MODELS)
+        yield sqlite
+
+
+def _turns(n, start=0):
+    """Messages and references of `n` turns: a user and an assistant message, and one reference each."""
+    message, reference = [], []
+    for i in range(start, start + n):
+        message += [{"role": "user", "content": f"q{i}"}, {"role": "assistant", "content": f"a{i}"}]
+        reference.append({"chunks": [{"id": f"c{i}"}], "doc_aggs": []})
+    return message, reference
+
+
+def _new(conv_id="c1", turns=3):
+    message, reference = _turns(turns)
+    ConversationService.save(id=conv_id, dialog_id="d1", name="n", message=message, reference=reference)
+    return message, reference
+
+
+def _rows(conv_id="c1", kind="message"):
+    return {r.seq: r.id for r in ConversationMessage.select().where(ConversationMessage.conversation_id == conv_id,
+                                                                    ConversationMessage.kind == kind)}
+
+
+class TestRoundTrip:
+    def test_save_and_get(self):
+        message, reference = _new()
+        e, conv = ConversationService.get_by_id("c1")
+        assert e
+        assert conv.message == message and conv.reference == reference
+        assert sorted(_rows()) == list(range(6))
+        assert sorted(_rows(kind="reference")) == list(range(3))
+        # Nothing is left in the blob columns.
+        assert not Conversation.get_by_id("c1").message
+
+    def test_update_appends_a_turn(self):
+        message, reference = _new()
+        before = _rows()
+        more, more_ref = _turns(1, start=3)
+        assert ConversationService.update_by_id("c1", {"message": message + more, "reference": reference + more_ref})
+        after = _rows()
+        # Only the new turn's rows are written.
+        assert {seq: after[seq] for seq in before} == before
+        assert sorted(after) == list(range(8))
+        _, conv = ConversationService.get_by_id("c1")
+        assert conv.message == message + more and conv.reference == reference + more_ref
+
+    def test_query_hydrates_every_conversation(self):
+        _new("c1", turns=1)
+        _new("c2", turns=2)
+        convs = {c.id: c for c in ConversationService.query(dialog_id="d1")}
+        assert convs["c1"].message == _turns(1)[0]
+        assert convs["c2"].reference == _turns(2)[1]
+
+    def test_delete_removes_rows(self):
+        _new()
+        ConversationService.delete_by_id("c1")
+        assert not _rows() and not _rows(kind="reference")
+
+
+class TestSync:
+    def test_unchanged_list_writes_nothing(self):
+        message, _ = _new()
+        before = _rows()
+        ConversationService.update_by_id("c1", {"message": message})
+        assert _rows() == before
+
+    def test_changed_item_rewrites_from_there(self):
+        message, _ = _new()
+        before = _rows()
+        message = message[:3] + [{"role": "assistant", "content": "edited"}] + message[4:]
+        ConversationService.update_by_id("c1", {"message": message})
+        after = _rows()
+        assert [after[seq] == before[seq] for seq in range(6)] == [True, True, True, False, False, False]
+        assert ConversationService.get_by_id("c1")[1].message == message
+
+    def test_shortened_list_drops_the_tail(self):
+        message, _ = _new()
+        ConversationService.update_by_id("c1", {"message": message[:2]})
+        assert sorted(_rows()) == [0, 1]
+        assert ConversationService.get_by_id("c1")[1].message == message[:2]
+
+    def test_update_of_missing_conversation_writes_no_rows(self):
+        assert not ConversationService.update_by_id("nope", {"message": _turns(1)[0]})
+        assert not _rows("nope")
+
+    def test_legacy_blob_moves_to_rows(self):
+        message, reference = _turns(2)
+        Conversation.insert(id="c1", dialog_id="d1", name="n", message=message, reference=reference).execute()
+        assert ConversationService.get_by_id("c1")[1].message == message
+
+        more, more_ref = _turns(1, start=2)
+        ConversationService.update_by_id("c1", {"message": message + more, "reference": reference + more_ref})
+        assert sorted(_rows()) == list(range(6))
+        stored = Conversation.get_by_id("c1")
+        assert not stored.message and stored.reference == []
+        _, conv = ConversationService.get_by_id("c1")
+        assert conv.message == message + more and conv.reference == reference + more_ref
+
+
+class TestHistoryTurns:
+    def test_loads_the_last_turns(self):
+        turns = conversation_service.CONVERSATION_HISTORY_TURNS
+        message, reference = _new(turns=turns + 3)
+        _, conv = ConversationService.get_by_id("c1", last_turns=turns)
+        conv = conv.to_dict()
+        assert conv["message"] == message[-2 * turns:] and conv["message_offset"] == 6
+        assert conv["reference"] == reference[-turns:] and conv["reference_offset"] == 3
+
+    def test_tail_is_written_back_in_place(self):
+        message, reference = _new(turns=5)
+        _, conv = ConversationService.get_by_id("c1", last_turns=2)
+        # As async_completion writes the loaded tail back, offsets included.
+        conv = conv.to_dict()
+        more, more_ref = _turns(1, start=5)
+        conv["message"] += more
+        conv["reference"] += more_ref
+        ConversationService.update_by_id("c1", conv)
+        _, conv = ConversationService.get_by_id("c1")
+        assert conv.message == message + more
+        assert conv.reference == reference + more_ref
+
+    def test_legacy_blob_tail(self):
+        message, reference = _turns(5)
+        Conversation.insert(id="c1", dialog_id="d1", name="n", message=message, reference=reference).execute()
+        _, conv = ConversationService.get_by_id("c1", last_turns=2)
+        assert conv.message == message[-4:] and conv.to_dict()["message_offset"] == 6
+
+        # As async_completion writes the loaded tail back, offsets included.
+        conv = conv.to_dict()
+        more, more_ref = _turns(1, start=5)
+        conv["message"] += more
+        conv["reference"] += more_ref
+        ConversationService.update_by_id("c1", conv)
+        _, conv = ConversationService.get_by_id("c1")
+        # The head of the blob, which was not loaded, is kept.
+        assert conv.message == message + more
+        assert conv.reference == reference + more_ref
+
+    def test_without_messages(self):
+        _new()
+        e, conv = ConversationService.get_by_id("c1", with_messages=False)
+        assert e and conv.dialog_id == "d1"
+        assert "message" not in conv.to_dict()
+        assert ConversationService.get_by_id("nope", with_messages=False) == (False, None)
+
+
+class TestGetMessages:
+    def test_pages(self):
+        message, reference = _new(turns=4)
+        assert ConversationService.get_messages("c1", 2, 3) == (8, message[3:6])
+        assert ConversationService.get_messages("c1", 2, 3, kind="reference") == (4, reference[3:])
+
+    def test_legacy_pages(self):
+        message, _ = _turns(4)
+        Conversation.insert(id="c1", dialog_id="d1", name="n", message=message).execute()
+        assert ConversationService.get_messages("c1", 3, 3) == (8, message[6:])
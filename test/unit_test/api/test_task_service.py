@@ -0,0 +1,81 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Unit tests for receiving a batch of tasks with one query, on SQLite.
+"""
+
+import pytest
+
+pytest.importorskip("api.db.services.task_service")
+
+from peewee import SqliteDatabase  # noqa: E402
+
+from api.db import db_models  # noqa: E402
+from api.db.db_models import Document, Knowledgebase, Task, Tenant  # noqa: E402
+from api.db.services.task_service import TaskService  # noqa: E402
+
+MODELS = [Tenant, Knowledgebase, Document, Task]
+
+
+@pytest.fixture(autouse=True)
+def db(monkeypatch):
+    sqlite = SqliteDatabase(":memory:")
+    # The services open and close the pooled database around each call; keep everything on SQLite instead.
+    monkeypatch.setattr(db_models.DB, "is_closed", lambda: False)
+    monkeypatch.setattr(db_models.DB, "close", lambda: None)
+    monkeypatch.setattr(db_models.DB, "atomic", sqlite.atomic)
+    with sqlite.bind_ctx(MODELS):
+        sqlite.create_tables(MODELS)
+        Tenant.create(id="tenant", llm_id="chat", embd_id="embd", asr_id="asr", img2txt_id="img2txt",
+                      rerank_id="rerank", parser_ids="naive:General")
+        Knowledgebase.create(id="kb", tenant_id="tenant", name="kb", embd_id="embd", created_by="user")
+        Document.create(id="doc", kb_id="kb", parser_id="naive", type="pdf", created_by="user", suffix="pdf",
+                        name="a.pdf")
+        yield sqlite
+
+
+def _task(task_id, retry_count=0):
+    Task.create(id=task_id, doc_id="doc", from_page=0, to_page=10, retry_count=retry_count, progress=0,
+                progress_msg="")
+
+
+class TestGetTasksByIds:
+    def test_received_tasks_are_returned_and_marked(self):
+        _task("t1")
+        _task("t2", retry_count=2)
+        tasks = TaskService.get_tasks_by_ids(["t1", "t2"])
+        assert sorted(tasks) == ["t1", "t2"]
+        assert tasks["t1"]["tenant_id"] == "tenant" and tasks["t1"]["llm_id"] == "chat"
+        assert tasks["t1"]["kb_id"] == "kb" and tasks["t1"]["name"] == "a.pdf"
+        for task_id, retry_count in [("t1", 1), ("t2", 3)]:
+            task = Task.get_by_id(task_id)
+            assert task.retry_count == retry_count
+            assert 0 <= task.progress < 0.1 and "Task has been received." in task.progress_msg
+
+    def test_missing_tasks_are_left_out(self):
+        _task("t1")
+        assert list(TaskService.get_tasks_by_ids(["gone", "t1", "t1"])) == ["t1"]
+        assert TaskService.get_tasks_by_ids(["gone"]) == {}
+        assert TaskService.get_tasks_by_ids([]) == {}
+
+    def test_tasks_over_the_retry_limit_are_abandoned(self):
+        _task("t1")
+        _task("t2", retry_count=3)
+        assert list(TaskService.get_tasks_by_ids(["t1", "t2"])) == ["t1"]
+        task = Task.get_by_id("t2")
+        assert task.progress == -1 and task.retry_count == 4
+        assert "abandoned" in task.progress_msg
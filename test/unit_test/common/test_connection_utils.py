@@ -0,0 +1,130 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import threading
+import time
+
+import pytest
+
+from common.connection_utils import current_cancel_token, get_timeout_stats, timeout
+
+
+class TestTimeout:
+
+    def test_runs_inline_without_assertion(self, monkeypatch):
+        monkeypatch.delenv("ENABLE_TIMEOUT_ASSERTION", raising=False)
+
+        @timeout(1)
+        def which_thread():
+            return threading.current_thread()
+
+        assert which_thread() is threading.current_thread()
+
+    def test_returns_result_and_raises_errors(self, monkeypatch):
+        monkeypatch.setenv("ENABLE_TIMEOUT_ASSERTION", "1")
+
+        @timeout(1)
+        def add(a, b):
+            return a + b
+
+        @timeout(1)
+        def fail():
+            raise ValueError("boom")
+
+        assert add(1, 2) == 3
+        with pytest.raises(ValueError):
+            fail()
+
+    def test_timeout_cancels_and_counts(self, monkeypatch):
+        monkeypatch.setenv("ENABLE_TIMEOUT_ASSERTION", "1")
+        cancelled = threading.Event()
+
+        @timeout(0.05, 1)
+        def slow():
+            current_cancel_token().add_callback(cancelled.set)
+            cancelled.wait(2)
+
+        before = get_timeout_stats()
+        start = time.monotonic()
+        with pytest.raises(TimeoutError):
+            slow()
+        assert time.monotonic() - start < 1
+        assert cancelled.wait(1)
+        after = get_timeout_stats()
+        assert after["timeouts"] == before["timeouts"] + 1
+        assert after["abandoned"] == before["abandoned"] + 1
+
+    def test_nested_calls_run_inline(self, monkeypatch):
+        monkeypatch.setenv("ENABLE_TIMEOUT_ASSERTION", "1")
+
+        @timeout(1)
+        def inner():
+            return threading.current_thread()
+
+        @timeout(1)
+        def outer():
+            return threading.current_thread(), inner()
+
+        outer_thread, inner_thread = outer()
+        assert outer_thread is inner_thread
+
+    def test_nested_call_keeps_its_shorter_deadline(self, monkeypatch):
+        monkeypatch.setenv("ENABLE_TIMEOUT_ASSERTION", "1")
+        cancelled = threading.Event()
+
+        @timeout(0.05, 1)
+        def inner():
+            current_cancel_token().add_callback(cancelled.set)
+            cancelled.wait(2)
+
+        @timeout(2, 1)
+        def outer():
+            start = time.monotonic()
+            with pytest.raises(TimeoutError):
+                inner()
+            return time.monotonic() - start
+
+        assert outer() < 1
+        assert cancelled.is_set()
+
+    def test_nested_call_is_bounded_by_the_outer_deadline(self, monkeypatch):
+        monkeypatch.setenv("ENABLE_TIMEOUT_ASSERTION", "1")
+
+        @timeout(5, 1)
+        def inner():
+            return current_cancel_token().deadline
+
+        @timeout(0.5, 1)
+        def outer():
+            return current_cancel_token().deadline, inner()
+
+        outer_deadline, inner_deadline = outer()
+        assert inner_deadline <= outer_deadline
+
+    def test_nested_call_without_time_left(self, monkeypatch):
+        monkeypatch.setenv("ENABLE_TIMEOUT_ASSERTION", "1")
+
+        @timeout(1)
+        def inner():
+            return "ran"
+
+        @timeout(0.05, 1)
+        def outer():
+            current_cancel_token().deadline = time.monotonic() - 1
+            return inner()
+
+        with pytest.raises(TimeoutError):
+            outer()
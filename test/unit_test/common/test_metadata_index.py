@@ -0,0 +1,99 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import random
+
+import pytest
+
+from common.metadata_utils import FlattenedMeta, MetadataIndex, meta_filter
+
+
+def _flatten(docs):
+    meta = {}
+    for doc_id, doc_meta in docs.items():
+        for k, v in doc_meta.items():
+            meta.setdefault(k, {})
+            for vv in v if isinstance(v, list) else [v]:
+                if vv is not None:
+                    meta[k].setdefault(str(vv), []).append(doc_id)
+    return meta
+
+
+def _docs(num=200, seed=3):
+    rnd = random.Random(seed)
+    docs = {}
+    for i in range(num):
+        docs[f"doc{i}"] = {
+            "score": rnd.choice([rnd.randint(-5, 50), round(rnd.uniform(0, 10), 2)]),
+            "date": f"2024-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}",
+            "tags": rnd.sample(["a", "b", "c", "d"], rnd.randint(0, 3)),
+        }
+    return docs
+
+
+class TestMetadataIndex:
+
+    def test_matches_flattening(self):
+        docs = _docs()
+        index = MetadataIndex()
+        for doc_id, meta in docs.items():
+            index.add(doc_id, meta)
+        assert index.flatted() == _flatten(docs)
+
+    def test_update_and_remove(self):
+        docs = _docs()
+        index = MetadataIndex()
+        for doc_id, meta in docs.items():
+            index.add(doc_id, meta)
+        flatted = index.flatted()
+
+        docs["doc1"] = {"author": "alice", "tags": ["z"]}
+        index.add("doc1", docs["doc1"])
+        for doc_id in ["doc2", "doc3"]:
+            del docs[doc_id]
+            index.remove(doc_id)
+        index.remove("missing")
+
+        assert index.flatted() is not flatted
+        assert index.flatted() == _flatten(docs)
+
+    def test_removing_last_doc_drops_field(self):
+        index = MetadataIndex()
+        index.add("doc1", {"author": "alice", "empty": None})
+        assert index.flatted() == {"author": {"alice": ["doc1"]}, "empty": {}}
+        index.remove("doc1")
+        assert index.flatted() == {}
+
+
+class TestRangeFilter:
+
+    @pytest.mark.parametrize("op", [">", "<", "≥", "≤"])
+    @pytest.mark.parametrize("key,value", [("score", "7"), ("score", 2.5), ("score", "-1"), ("date", "2024-06-15")])
+    def test_matches_scan(self, op, key, value):
+        metas = _flatten(_docs())
+        filters = [{"key": key, "op": op, "value": value}]
+        assert sorted(meta_filter(FlattenedMeta(metas), filters)) == sorted(meta_filter(metas, filters))
+
+    def test_combined_with_other_filters(self):
+        metas = _flatten(_docs())
+        filters = [{"key": "score", "op": "≥", "value": "10"}, {"key": "tags", "op": "=", "value": "a"}]
+        for logic in ["and", "or"]:
+            assert sorted(meta_filter(FlattenedMeta(metas), filters, logic)) == sorted(meta_filter(metas, filters, logic))
+
+    def test_non_numeric_value_falls_back(self):
+        metas = {"name": {"alice": ["doc1"], "bob": ["doc2"]}}
+        filters = [{"key": "name", "op": ">", "value": "b"}]
+        assert meta_filter(FlattenedMeta(metas), filters) == meta_filter(metas, filters) == ["doc2"]
@@ -0,0 +1,157 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Unit tests for generating the keywords, questions and tags of chunks in one fused LLM call or in one
+call per field.
+"""
+
+import asyncio
+import copy
+import json
+
+import pytest
+
+task_executor = pytest.importorskip("rag.svr.task_executor")
+generator = pytest.importorskip("rag.prompts.generator")
+TAG_FLD = task_executor.TAG_FLD
+
+KEYWORDS = ["alpha", "beta"]
+QUESTIONS = ["What is alpha?", "Why beta?"]
+TAGS = {"science": 3, "math": 1}
+
+
+class FakeChat:
+    """Answers each prompt of the enrichment with the same keywords, questions and tags."""
+
+    llm_name = "fake-chat"
+    max_length = 8192
+
+    def __init__(self):
+        self.prompts = []
+
+    async def async_chat(self, system, history, gen_conf=None, **kwargs):
+        self.prompts.append(system)
+        if "produce all of the fields below in one JSON object" in system:
+            answer = {}
+            if "keywords" in system:
+                answer["keywords"] = KEYWORDS
+            if "questions" in system:
+                answer["questions"] = QUESTIONS
+            if "tag/label set" in system:
+                answer["tags"] = TAGS
+            return json.dumps(answer)
+        if "Extract the most important keywords" in system:
+            return ",".join(KEYWORDS)
+        if "Propose" in system:
+            return "\n".join(QUESTIONS)
+        if "Add tags" in system:
+            return json.dumps(TAGS)
+        raise AssertionError("unexpected prompt")
+
+
+class FakeRetriever:
+    def all_tags_in_portion(self, tenant_id, kb_ids, S):
+        return {"science": 0.1, "math": 0.1, "art": 0.1}
+
+    def tag_content(self, tenant_id, kb_ids, doc, all_tags, topn_tags=3, S=1000):
+        # The first chunk is tagged from the tag KBs and becomes an example for the others.
+        if doc["content_with_weight"] == "chunk 0":
+            doc[TAG_FLD] = {"art": 2}
+            return True
+        return False
+
+
+def _empty_llm_cache(monkeypatch):
+    cache = {}
+    monkeypatch.setattr(task_executor, "get_llm_cache", lambda llm, content, history, genconf: cache.get((content, str(history), str(genconf))))
+    monkeypatch.setattr(task_executor, "set_llm_cache", lambda llm, content, value, history, genconf: cache.__setitem__((content, str(history), str(genconf)), value))
+
+
+@pytest.fixture
+def chat(monkeypatch):
+    chat = FakeChat()
+    monkeypatch.setattr(task_executor, "LLMBundle", lambda *args, **kwargs: chat)
+    _empty_llm_cache(monkeypatch)
+    monkeypatch.setattr(task_executor, "get_tags_from_cache", lambda kb_ids: None)
+    monkeypatch.setattr(task_executor, "set_tags_to_cache", lambda kb_ids, tags: None)
+    monkeypatch.setattr(task_executor, "has_canceled", lambda task_id: False)
+    monkeypatch.setattr(task_executor, "chat_limiter", asyncio.Semaphore(4))
+    monkeypatch.setattr(task_executor.settings, "retriever", FakeRetriever())
+    return chat
+
+
+def _task(parser_config, tag_kb_ids=()):
+    return {"id": "t", "tenant_id": "tenant", "llm_id": "fake-chat", "language": "English",
+            "parser_config": parser_config, "kb_parser_config": {"tag_kb_ids": list(tag_kb_ids), "topn_tags": 3}}
+
+
+def _enrich(monkeypatch, task, fused):
+    monkeypatch.setattr(task_executor, "CHUNK_ENRICHMENT_FUSED", fused)
+    docs = [{"content_with_weight": f"chunk {i}"} for i in range(3)]
+    assert asyncio.run(task_executor.enrich_chunks(task, docs, lambda *args, **kwargs: None))
+    return docs
+
+
+class TestFusedEnrichment:
+    @pytest.mark.parametrize("parser_config,tag_kb_ids", [
+        ({"auto_keywords": 2, "auto_questions": 2}, ()),
+        ({"auto_questions": 2}, ("tag_kb",)),
+        ({"auto_keywords": 2, "auto_questions": 2}, ("tag_kb",)),
+    ])
+    def test_fused_matches_separate_calls(self, chat, monkeypatch, parser_config, tag_kb_ids):
+        task = _task(parser_config, tag_kb_ids)
+        fused = _enrich(monkeypatch, copy.deepcopy(task), 1)
+        fused_calls = len(chat.prompts)
+        chat.prompts.clear()
+        # Another cache, so that every field is generated again.
+        _empty_llm_cache(monkeypatch)
+        separate = _enrich(monkeypatch, copy.deepcopy(task), 0)
+        assert fused == separate
+        assert fused_calls < len(chat.prompts)
+
+        for d in fused:
+            if parser_config.get("auto_keywords"):
+                assert d["important_kwd"] == KEYWORDS
+            assert d["question_kwd"] == QUESTIONS
+            if tag_kb_ids:
+                assert d[TAG_FLD] == ({"art": 2} if d["content_with_weight"] == "chunk 0" else TAGS)
+
+    def test_cached_fields_are_not_asked_again(self, chat, monkeypatch):
+        task = _task({"auto_keywords": 2, "auto_questions": 2})
+        _enrich(monkeypatch, task, 1)
+        chat.prompts.clear()
+        docs = _enrich(monkeypatch, task, 1)
+        assert chat.prompts == []
+        assert all(d["important_kwd"] == KEYWORDS for d in docs)
+
+
+class TestExamples:
+    EXAMPLES = [{"content": "an example", TAG_FLD: {"art": 1}}]
+
+    def test_content_tagging_leaves_examples_unchanged(self):
+        examples = copy.deepcopy(self.EXAMPLES)
+        assert asyncio.run(generator.content_tagging(FakeChat(), "text", {"art": 0.1}, examples)) == TAGS
+        assert examples == self.EXAMPLES
+
+    def test_chunk_enrichment_leaves_examples_unchanged(self):
+        examples = copy.deepcopy(self.EXAMPLES)
+        chat = FakeChat()
+        res = asyncio.run(generator.chunk_enrichment(chat, "text", keywords_topn=2, all_tags={"art": 0.1}, examples=examples))
+        assert res["tags"] == TAGS
+        assert examples == self.EXAMPLES
+        # The examples still reach the prompt.
+        assert '"art": 1' in chat.prompts[0]
@@ -0,0 +1,231 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Unit tests for the pipelined embedding of the task executor: batch sizing, progress tracking,
+concurrent batches and the rollback of partially inserted documents.
+"""
+
+import asyncio
+import threading
+import time
+
+import numpy as np
+import pytest
+
+task_executor = pytest.importorskip("rag.svr.task_executor")
+AdaptiveBatchSize = task_executor.AdaptiveBatchSize
+EmbeddingProgress = task_executor.EmbeddingProgress
+
+
+class TestAdaptiveBatchSize:
+    def test_batch_is_bounded_by_size(self):
+        sizing = AdaptiveBatchSize(4, 512)
+        txts = ["short"] * 10
+        assert sizing.next_end(txts, 0) == 4
+        assert sizing.next_end(txts, 8) == 10
+
+    def test_batch_is_bounded_by_tokens(self):
+        # At most 2 full-length texts worth of tokens: 2 * 10 tokens, 15 (estimated) tokens per text.
+        sizing = AdaptiveBatchSize(2, 10)
+        sizing.size = 8
+        txts = ["x" * 30] * 5
+        assert sizing.next_end(txts, 0) == 1
+        # A single text over the budget still makes a batch.
+        assert sizing.next_end(["x" * 1000], 0) == 1
+
+    def test_grows_while_fast_up_to_four_times(self):
+        sizing = AdaptiveBatchSize(4, 512, target_seconds=10)
+        for _ in range(5):
+            sizing.observe(["t"] * sizing.size, 1, 0)
+        assert sizing.size == 16
+
+    def test_partial_batch_does_not_grow(self):
+        sizing = AdaptiveBatchSize(4, 512, target_seconds=10)
+        sizing.observe(["t"] * 2, 1, 0)
+        assert sizing.size == 4
+
+    def test_shrinks_when_slow_down_to_one(self):
+        sizing = AdaptiveBatchSize(4, 512, target_seconds=10)
+        for _ in range(4):
+            sizing.observe(["t"] * sizing.size, 11, 0)
+        assert sizing.size == 1
+
+    def test_learns_tokens_per_char(self):
+        sizing = AdaptiveBatchSize(4, 512)
+        for _ in range(30):
+            sizing.observe(["x" * 100], 1, 25)
+        assert sizing.tokens_per_char == pytest.approx(0.25, abs=0.01)
+
+
+class TestEmbeddingProgress:
+    def test_ready_counts_leading_docs(self):
+        progress = EmbeddingProgress(5)
+        progress.mark([1, 2])
+        assert progress.ready == 0
+        progress.mark([0])
+        assert progress.ready == 3
+        progress.mark([4, 3])
+        assert progress.ready == 5
+
+    @pytest.mark.asyncio
+    async def test_wait_for_returns_once_ready(self):
+        progress = EmbeddingProgress(4)
+        waiter = asyncio.create_task(progress.wait_for(2))
+        await asyncio.sleep(0)
+        progress.mark([1])
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        progress.mark([0])
+        await asyncio.wait_for(waiter, 1)
+
+    @pytest.mark.asyncio
+    async def test_wait_past_the_end(self):
+        progress = EmbeddingProgress(2)
+        progress.mark([0, 1])
+        await asyncio.wait_for(progress.wait_for(10), 1)
+
+    @pytest.mark.asyncio
+    async def test_failure_reaches_waiters(self):
+        progress = EmbeddingProgress(2)
+        waiter = asyncio.create_task(progress.wait_for(2))
+        await asyncio.sleep(0)
+        progress.fail(RuntimeError("encode failed"))
+        with pytest.raises(RuntimeError, match="encode failed"):
+            await asyncio.wait_for(waiter, 1)
+
+
+class FakeModel:
+    llm_name = None
+    max_length = 512
+
+    def __init__(self, delay=0.05, fail_on=None):
+        self.delay = delay
+        self.fail_on = fail_on
+        self.running = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def encode(self, txts):
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        try:
+            time.sleep(self.delay)
+            if self.fail_on in txts:
+                raise RuntimeError("encode failed")
+            return np.ones((len(txts), 4), dtype=np.float32), len(txts)
+        finally:
+            with self.lock:
+                self.running -= 1
+
+
+def _docs(n):
+    return [{"id": f"c{i}", "docnm_kwd": "doc", "content_with_weight": f"text {i}"} for i in range(n)]
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    monkeypatch.setattr(task_executor.embedding_cache, "get_many", lambda model_key, txts: [None] * len(txts))
+    monkeypatch.setattr(task_executor.embedding_cache, "set_many", lambda *args, **kwargs: False)
+    monkeypatch.setattr(task_executor.settings, "EMBEDDING_BATCH_SIZE", 2)
+    monkeypatch.setattr(task_executor, "EMBEDDING_CONCURRENCY", 3)
+
+
+class TestEmbedding:
+    @pytest.mark.asyncio
+    async def test_batches_of_a_task_run_concurrently(self, pipeline, monkeypatch):
+        # One slot for the whole process: the batches of a task still run side by side.
+        monkeypatch.setattr(task_executor, "embed_limiter", asyncio.Semaphore(1))
+        mdl = FakeModel()
+        docs = _docs(12)
+        progress = EmbeddingProgress(len(docs))
+        tk_count, vector_size = await task_executor.embedding(docs, mdl, callback=lambda **kwargs: None, progress=progress)
+        assert mdl.peak > 1
+        assert vector_size == 4 and tk_count == 13
+        assert progress.ready == 12
+        assert all(len(d["q_4_vec"]) == 4 for d in docs)
+
+    @pytest.mark.asyncio
+    async def test_tasks_share_the_limiter(self, pipeline, monkeypatch):
+        monkeypatch.setattr(task_executor, "embed_limiter", asyncio.Semaphore(1))
+        monkeypatch.setattr(task_executor, "EMBEDDING_CONCURRENCY", 1)
+        mdl = FakeModel()
+        await asyncio.gather(*[task_executor.embedding(_docs(4), mdl, callback=lambda **kwargs: None) for _ in range(2)])
+        assert mdl.peak == 1
+
+    @pytest.mark.asyncio
+    async def test_failure_is_reported_to_progress(self, pipeline, monkeypatch):
+        monkeypatch.setattr(task_executor, "embed_limiter", asyncio.Semaphore(1))
+        progress = EmbeddingProgress(6)
+        with pytest.raises(RuntimeError):
+            await task_executor.embedding(_docs(6), FakeModel(fail_on="text 4"), callback=lambda **kwargs: None, progress=progress)
+        with pytest.raises(RuntimeError):
+            await progress.wait_for(6)
+
+
+class FakeDocStore:
+    def __init__(self):
+        self.inserted = []
+        self.deleted = []
+
+    def insert(self, chunks, index_name, kb_id):
+        self.inserted.extend(ck["id"] for ck in chunks)
+        return []
+
+    def delete(self, condition, index_name, kb_id):
+        self.deleted.extend(condition["id"])
+        return len(condition["id"])
+
+
+class TestInsertChunks:
+    @pytest.fixture
+    def store(self, monkeypatch):
+        store = FakeDocStore()
+        monkeypatch.setattr(task_executor.settings, "docStoreConn", store)
+        monkeypatch.setattr(task_executor.settings, "DOC_BULK_SIZE", 2)
+        monkeypatch.setattr(task_executor, "has_canceled", lambda task_id: False)
+        monkeypatch.setattr(task_executor.TaskService, "update_chunk_ids", lambda task_id, ids: None)
+        monkeypatch.setattr(task_executor.retrieval_cache, "invalidate_kbs", lambda kb_ids: None)
+        return store
+
+    @pytest.mark.asyncio
+    async def test_bulks_follow_the_embedding(self, store):
+        chunks = _docs(4)
+        progress = EmbeddingProgress(4)
+        insert = asyncio.create_task(task_executor.insert_chunks("t", "tenant", "kb", chunks, lambda *a, **k: None, progress))
+        await asyncio.sleep(0.01)
+        assert store.inserted == []
+        progress.mark([0, 1])
+        await asyncio.sleep(0.01)
+        assert store.inserted == ["c0", "c1"]
+        progress.mark([2, 3])
+        assert await asyncio.wait_for(insert, 1) is True
+        assert store.inserted == ["c0", "c1", "c2", "c3"]
+
+    @pytest.mark.asyncio
+    async def test_failed_embedding_rolls_back_inserted_bulks(self, store):
+        chunks = _docs(6)
+        chunks[0]["mom"] = "the mother text"
+        progress = EmbeddingProgress(6)
+        insert = asyncio.create_task(task_executor.insert_chunks("t", "tenant", "kb", chunks, lambda *a, **k: None, progress))
+        progress.mark([0, 1, 2, 3])
+        await asyncio.sleep(0.01)
+        progress.fail(RuntimeError("encode failed"))
+        with pytest.raises(RuntimeError):
+            await asyncio.wait_for(insert, 1)
+        assert sorted(store.deleted) == sorted(store.inserted)
+        assert set(store.deleted) == {chunks[0]["mom_id"], "c0", "c1", "c2", "c3"}
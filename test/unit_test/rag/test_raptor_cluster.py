@@ -0,0 +1,116 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Unit tests for clustering RAPTOR layers in the process pool.
+"""
+
+from concurrent.futures import Executor, Future
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pytest
+
+from rag.utils import raptor_cluster
+
+
+class FakePool(Executor):
+    """Runs the work inline, fails it with `error`, or never finishes it when `hang`."""
+
+    def __init__(self, error=None, hang=False):
+        self.error = error
+        self.hang = hang
+        self.submitted = 0
+        self.shutdowns = []
+
+    def submit(self, fn, *args, **kwargs):
+        self.submitted += 1
+        future = Future()
+        if self.error:
+            future.set_exception(self.error)
+        elif not self.hang:
+            future.set_result(fn(*args, **kwargs))
+        return future
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        self.shutdowns.append(cancel_futures)
+
+
+class Stopped(Exception):
+    pass
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(raptor_cluster, "RAPTOR_CLUSTER_PROCESSES", 1)
+    monkeypatch.setattr(raptor_cluster, "RAPTOR_CLUSTER_POLL_SECONDS", 0.01)
+    monkeypatch.setattr(raptor_cluster, "cluster_layer", lambda embeddings, *args, **kwargs: [list(range(len(embeddings)))])
+    monkeypatch.setattr(raptor_cluster, "_pool", None)
+
+    def install(**kwargs):
+        raptor_cluster._pool = FakePool(**kwargs)
+        return raptor_cluster._pool
+
+    return install
+
+
+def _embeddings(n=5):
+    return np.eye(n, dtype=np.float32)
+
+
+class TestClusterLayerAsync:
+    @pytest.mark.asyncio
+    async def test_clusters_in_pool(self, pool):
+        fake = pool()
+        assert await raptor_cluster.cluster_layer_async(_embeddings(), 0, 8, 0.1) == [[0, 1, 2, 3, 4]]
+        assert fake.submitted == 1
+        assert raptor_cluster._pool is fake and fake.shutdowns == []
+
+    @pytest.mark.asyncio
+    async def test_broken_pool_dropped(self, pool):
+        fake = pool(error=BrokenProcessPool("worker died"))
+        # Clustered in a thread instead.
+        assert await raptor_cluster.cluster_layer_async(_embeddings(), 0, 8, 0.1) == [[0, 1, 2, 3, 4]]
+        assert raptor_cluster._pool is None
+        assert fake.shutdowns == [True]
+
+    @pytest.mark.asyncio
+    async def test_stop_polled_while_process_runs(self, pool):
+        fake = pool(hang=True)
+        polls = []
+
+        def should_stop():
+            polls.append(1)
+            if len(polls) > 3:
+                raise Stopped()
+
+        with pytest.raises(Stopped):
+            await raptor_cluster.cluster_layer_async(_embeddings(), 0, 8, 0.1, should_stop=should_stop)
+        assert len(polls) == 4
+        assert raptor_cluster._pool is None
+        assert fake.shutdowns == [True]
+
+    @pytest.mark.asyncio
+    async def test_stopped_before_dispatch(self, pool):
+        fake = pool()
+
+        def should_stop():
+            raise Stopped()
+
+        with pytest.raises(Stopped):
+            await raptor_cluster.cluster_layer_async(_embeddings(), 0, 8, 0.1, should_stop=should_stop)
+        assert fake.submitted == 0
+        assert raptor_cluster._pool is fake
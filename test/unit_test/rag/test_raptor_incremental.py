@@ -0,0 +1,165 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Unit tests for the incremental RAPTOR tree rebuild.
+"""
+
+import numpy as np
+import pytest
+
+from rag.raptor import RecursiveAbstractiveProcessing4TreeOrganizedRetrieval as Raptor
+
+
+def _unit(*v):
+    v = np.asarray(v, dtype=np.float32)
+    return v / np.linalg.norm(v)
+
+
+class FakeRaptor(Raptor):
+    """Summaries join their texts; layers of more than two nodes are clustered by dominant axis."""
+
+    def __init__(self):
+        super().__init__(max_cluster=8, llm_model=None, embd_model=None, prompt="{cluster_content}")
+        self.embeddings = {}
+        self.summarized = []
+
+    async def _summarize(self, texts, callback=None, task_id=""):
+        self.summarized.append(sorted(texts))
+        cnt = "(" + "+".join(sorted(texts)) + ")"
+        self.embeddings[cnt] = self._centroid([self.embeddings[t] for t in texts])
+        return cnt, self.embeddings[cnt]
+
+    async def _cluster(self, embeddings, random_state, task_id=""):
+        if len(embeddings) <= 2:
+            return [list(range(len(embeddings)))]
+        clusters = {}
+        for i, e in enumerate(embeddings):
+            clusters.setdefault(int(np.argmax(e)), []).append(i)
+        return list(clusters.values())
+
+    async def run(self, chunks: dict, tree=None, summaries=None):
+        self.embeddings.update(chunks)
+        self.summarized = []
+        return await self.build([(t, e) for t, e in chunks.items()], list(chunks.keys()), 0,
+                                tree=tree, summaries=summaries, node_id=lambda txt: txt)
+
+
+def _chunks():
+    return {
+        "a1": _unit(1, 0.1, 0), "a2": _unit(1, 0, 0.1), "a3": _unit(1, 0.05, 0.05),
+        "b1": _unit(0.1, 1, 0), "b2": _unit(0, 1, 0.1), "b3": _unit(0.05, 1, 0.05),
+    }
+
+
+def _summaries(nodes):
+    return {sid: (cnt, embds) for sid, cnt, embds, _ in nodes}
+
+
+class TestAssign:
+    @pytest.fixture
+    def prev_layer(self):
+        return [
+            {"id": "A", "members": ["a1", "a2", "a3", "a4", "a5"], "centroid": _unit(1, 0, 0).tolist()},
+            {"id": "B", "members": ["b1", "b2", "b3", "b4", "b5"], "centroid": _unit(0, 1, 0).tolist()},
+        ]
+
+    def test_new_node_joins_nearest_cluster(self, prev_layer):
+        ids = ["a1", "a2", "a3", "a4", "a5", "b1", "b2", "b3", "b4", "b5", "n"]
+        nodes = {"n": ("n", _unit(0.1, 1, 0))}
+        clusters = FakeRaptor()._assign(prev_layer, ids, nodes, {})
+        assert clusters[0] == {"members": ["a1", "a2", "a3", "a4", "a5"], "old": "A", "changed": False}
+        assert clusters[1] == {"members": ["b1", "b2", "b3", "b4", "b5", "n"], "old": "B", "changed": True}
+
+    def test_removed_node_changes_its_cluster(self, prev_layer):
+        ids = ["a1", "a2", "a3", "a4", "a5", "b1", "b2", "b3", "b4"]
+        clusters = FakeRaptor()._assign(prev_layer, ids, {}, {})
+        assert [cl["changed"] for cl in clusters] == [False, True]
+        assert clusters[1]["members"] == ["b1", "b2", "b3", "b4"]
+
+    def test_replaced_summary_is_not_drift(self, prev_layer):
+        ids = ["a1", "a2", "a3", "a4", "a5x", "b1", "b2", "b3", "b4", "b5"]
+        clusters = FakeRaptor()._assign(prev_layer, ids, {}, {"a5": "a5x"})
+        assert clusters[0] == {"members": ["a1", "a2", "a3", "a4", "a5x"], "old": "A", "changed": True}
+        assert clusters[1]["changed"] is False
+
+    def test_removals_over_threshold_recluster(self, prev_layer):
+        # 3 of 10 removed > RAPTOR_DRIFT_THRESHOLD (0.2)
+        ids = ["a1", "a2", "a3", "a4", "b1", "b2", "b3"]
+        assert FakeRaptor()._assign(prev_layer, ids, {}, {}) is None
+
+    def test_poorly_fitting_nodes_count_as_drift(self, prev_layer):
+        ids = ["a1", "a2", "a3", "a4", "a5", "b1", "b2", "b3", "b4", "b5"]
+        good = {f"g{i}": (f"g{i}", _unit(1, 0.1, 0)) for i in range(3)}
+        assert FakeRaptor()._assign(prev_layer, ids + list(good), good, {}) is not None
+        poor = {f"p{i}": (f"p{i}", _unit(0, 0, 1)) for i in range(3)}
+        assert FakeRaptor()._assign(prev_layer, ids + list(poor), poor, {}) is None
+
+    def test_other_embedding_size_reclusters(self, prev_layer):
+        ids = ["a1", "a2", "a3", "a4", "a5", "b1", "b2", "b3", "b4", "b5", "n"]
+        assert FakeRaptor()._assign(prev_layer, ids, {"n": ("n", _unit(1, 0))}, {}) is None
+
+
+class TestBuild:
+    @pytest.mark.asyncio
+    async def test_full_build(self):
+        raptor = FakeRaptor()
+        nodes, tree = await raptor.run(_chunks())
+        assert [len(layer) for layer in tree["layers"]] == [2, 1]
+        assert {sid for sid, _, _, _ in nodes} == {"(a1+a2+a3)", "(b1+b2+b3)", "((a1+a2+a3)+(b1+b2+b3))"}
+        assert all(is_new for _, _, _, is_new in nodes)
+
+    @pytest.mark.asyncio
+    async def test_unchanged_summaries_reused(self):
+        raptor = FakeRaptor()
+        nodes, tree = await raptor.run(_chunks())
+        again, again_tree = await raptor.run(_chunks(), tree, _summaries(nodes))
+        assert raptor.summarized == []
+        assert not any(is_new for _, _, _, is_new in again)
+        assert {sid for sid, _, _, _ in again} == {sid for sid, _, _, _ in nodes}
+        assert again_tree == tree
+
+    @pytest.mark.asyncio
+    async def test_only_changed_clusters_summarized(self):
+        raptor = FakeRaptor()
+        nodes, tree = await raptor.run(_chunks())
+        chunks = {**_chunks(), "b4": _unit(0.1, 1, 0.1)}
+        again, _ = await raptor.run(chunks, tree, _summaries(nodes))
+        # The B cluster and the root above it; A is reused.
+        assert raptor.summarized == [["b1", "b2", "b3", "b4"], ["(a1+a2+a3)", "(b1+b2+b3+b4)"]]
+        new = {sid for sid, _, _, is_new in again if is_new}
+        assert new == {"(b1+b2+b3+b4)", "((a1+a2+a3)+(b1+b2+b3+b4))"}
+
+    @pytest.mark.asyncio
+    async def test_drift_over_threshold_rebuilds(self):
+        raptor = FakeRaptor()
+        nodes, tree = await raptor.run(_chunks())
+        # Half the chunks removed: every layer is clustered again.
+        chunks = {k: v for k, v in _chunks().items() if k in ("a1", "a2", "b1")}
+        again, again_tree = await raptor.run(chunks, tree, _summaries(nodes))
+        assert [len(layer) for layer in again_tree["layers"]] == [2, 1]
+        assert raptor.summarized == [["a1", "a2"], ["b1"], ["(a1+a2)", "(b1)"]]
+        assert all(is_new for _, _, _, is_new in again)
+
+    @pytest.mark.asyncio
+    async def test_missing_summary_regenerated(self):
+        raptor = FakeRaptor()
+        nodes, tree = await raptor.run(_chunks())
+        summaries = _summaries(nodes)
+        del summaries["(a1+a2+a3)"]
+        again, _ = await raptor.run(_chunks(), tree, summaries)
+        assert raptor.summarized == [["a1", "a2", "a3"]]
+        assert [sid for sid, _, _, is_new in again if is_new] == ["(a1+a2+a3)"]
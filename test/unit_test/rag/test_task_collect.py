@@ -0,0 +1,200 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Unit tests for claiming tasks from the queues in batches: how many messages each poll reads per queue,
+dropping the messages whose tasks cannot run, handing out the prefetched tasks and releasing them on shutdown.
+"""
+
+import asyncio
+from collections import deque
+
+import pytest
+
+task_executor = pytest.importorskip("rag.svr.task_executor")
+settings = task_executor.settings
+
+HIGH, LOW = settings.get_svr_queue_names()
+
+
+class FakeMsg:
+    def __init__(self, queue_name, msg_id, message):
+        self.queue_name = queue_name
+        self.msg_id = msg_id
+        self.message = message
+        self.acked = False
+
+    def ack(self):
+        self.acked = True
+        return True
+
+    def get_message(self):
+        return self.message
+
+    def get_msg_id(self):
+        return self.msg_id
+
+    def get_queue_name(self):
+        return self.queue_name
+
+
+class FakeRedis:
+    """Queues of new messages, the unacknowledged messages of this consumer and the reads made."""
+
+    def __init__(self):
+        self.queues = {HIGH: deque(), LOW: deque()}
+        self.unacked = []
+        self.reads = []
+        self.requeued = []
+
+    def add(self, queue_name, *task_ids, **message):
+        for task_id in task_ids:
+            self.queues[queue_name].append(FakeMsg(queue_name, f"{task_id}-0", {"id": task_id, "doc_id": "doc", **message}))
+
+    def get_unacked_iterator(self, queue_names, group_name, consumer_name):
+        return iter(self.unacked)
+
+    def queue_consumer_batch(self, queue_counts, group_name, consumer_name):
+        self.reads.append(list(queue_counts))
+        res = []
+        for queue_name, count in queue_counts:
+            queue = self.queues[queue_name]
+            res += [queue.popleft() for _ in range(min(count, len(queue)))]
+        return res
+
+    def requeue_msg(self, queue, group_name, msg_id):
+        self.requeued.append((queue, msg_id))
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    redis = FakeRedis()
+    monkeypatch.setattr(task_executor, "REDIS_CONN", redis)
+    monkeypatch.setattr(task_executor, "UNACKED_ITERATOR", None)
+    monkeypatch.setattr(task_executor, "PREFETCHED_TASKS", deque())
+    monkeypatch.setattr(task_executor, "CURRENT_TASKS", {})
+    monkeypatch.setattr(task_executor, "MAX_CONCURRENT_TASKS", 5)
+    monkeypatch.setattr(task_executor, "TASK_PREFETCH", 5)
+    monkeypatch.setattr(task_executor, "TASK_QUEUE_WEIGHTS", {HIGH: 3, LOW: 1})
+    monkeypatch.setattr(task_executor, "FAILED_TASKS", 0)
+    return redis
+
+
+@pytest.fixture
+def tasks(monkeypatch):
+    """Task rows by ID, and the IDs of the canceled ones."""
+    rows, canceled = {}, set()
+    monkeypatch.setattr(task_executor.TaskService, "get_tasks_by_ids",
+                        lambda task_ids: {i: {"id": i, "doc_id": "doc"} for i in task_ids if i in rows})
+    monkeypatch.setattr(task_executor, "canceled_tasks", lambda task_ids: canceled & set(task_ids))
+
+    def add(*task_ids):
+        rows.update({i: True for i in task_ids})
+    add.canceled = canceled
+    return add
+
+
+def _ids(redis_msgs):
+    return [m.get_message()["id"] for m in redis_msgs]
+
+
+class TestPrefetch:
+    def test_partial_batch_takes_what_is_there(self, redis):
+        redis.add(HIGH, "h1")
+        redis.add(LOW, "l1")
+        assert _ids(task_executor._prefetch()) == ["h1", "l1"]
+        # Five reads split 4:1; the low queue filled its quota and is asked for the rest, in vain.
+        assert redis.reads == [[(HIGH, 4), (LOW, 1)], [(LOW, 3)]]
+
+    def test_full_queue_takes_the_unused_quota(self, redis):
+        redis.add(HIGH, *[f"h{i}" for i in range(10)])
+        assert _ids(task_executor._prefetch()) == ["h0", "h1", "h2", "h3", "h4"]
+        assert redis.reads == [[(HIGH, 4), (LOW, 1)], [(HIGH, 1)]]
+
+    def test_empty_queues(self, redis):
+        assert task_executor._prefetch() == []
+        assert redis.reads == [[(HIGH, 4), (LOW, 1)]]
+
+    def test_bounded_by_free_slots(self, redis):
+        task_executor.CURRENT_TASKS.update({f"busy{i}": {} for i in range(4)})
+        redis.add(HIGH, "h1", "h2")
+        redis.add(LOW, "l1")
+        assert _ids(task_executor._prefetch()) == ["h1"]
+        assert redis.reads == [[(HIGH, 1), (LOW, 0)]]
+
+    def test_unacked_messages_come_first(self, redis):
+        redis.unacked = [FakeMsg(LOW, "u1-0", {"id": "u1"}), FakeMsg(HIGH, "u2-0", {"id": "u2"})]
+        redis.add(HIGH, "h1", "h2", "h3", "h4")
+        assert _ids(task_executor._prefetch()) == ["u1", "u2", "h1", "h2", "h3"]
+        assert redis.reads == [[(HIGH, 3), (LOW, 0)]]
+
+
+class TestClaim:
+    def test_missing_task_is_acked_and_dropped(self, redis, tasks):
+        tasks("t1", "t3")
+        redis.add(HIGH, "t1", "t2", "t3")
+        msgs = list(redis.queues[HIGH])
+        claimed = task_executor._claim(msgs)
+        assert [task["id"] for _, task in claimed] == ["t1", "t3"]
+        assert [m.acked for m in msgs] == [False, True, False]
+        assert task_executor.FAILED_TASKS == 1
+
+    def test_canceled_task_is_acked_and_dropped(self, redis, tasks):
+        tasks("t1", "t2")
+        tasks.canceled.add("t2")
+        redis.add(HIGH, "t1", "t2")
+        msgs = list(redis.queues[HIGH])
+        assert [task["id"] for _, task in task_executor._claim(msgs)] == ["t1"]
+        assert [m.acked for m in msgs] == [False, True]
+
+    def test_empty_message_is_acked(self, tasks):
+        empty = FakeMsg(HIGH, "e-0", None)
+        assert task_executor._claim([empty]) == []
+        assert empty.acked
+
+    def test_claimed_tasks_carry_the_message_fields(self, redis, tasks):
+        tasks("t1")
+        redis.add(HIGH, "t1", task_type="dataflow", tenant_id="tenant", dataflow_id="flow")
+        [(redis_msg, task)] = task_executor._claim(list(redis.queues[HIGH]))
+        assert redis_msg.get_msg_id() == "t1-0"
+        assert (task["task_type"], task["tenant_id"], task["dataflow_id"], task["kb_id"]) == ("dataflow", "tenant", "flow", "")
+
+
+class TestCollect:
+    def test_tasks_are_handed_out_from_one_poll(self, redis, tasks):
+        tasks("t1", "t2", "t3")
+        redis.add(HIGH, "t1", "t2")
+        redis.add(LOW, "t3")
+        got = [asyncio.run(task_executor.collect())[1]["id"] for _ in range(3)]
+        assert got == ["t1", "t2", "t3"]
+        assert len(redis.reads) == 2
+        # The next call polls again and finds nothing.
+        assert asyncio.run(task_executor.collect()) == (None, None)
+        assert len(redis.reads) == 3
+
+    def test_poll_error_collects_nothing(self, redis, monkeypatch):
+        def broken(*args):
+            raise ConnectionError("redis is gone")
+        monkeypatch.setattr(redis, "queue_consumer_batch", broken)
+        assert asyncio.run(task_executor.collect()) == (None, None)
+
+    def test_shutdown_requeues_the_prefetched_tasks(self, redis, tasks):
+        tasks("t1", "t2", "t3")
+        redis.add(HIGH, "t1", "t2", "t3")
+        assert asyncio.run(task_executor.collect())[1]["id"] == "t1"
+        task_executor._release_prefetched()
+        assert not task_executor.PREFETCHED_TASKS
+        assert redis.requeued == [(HIGH, "t2-0"), (HIGH, "t3-0")]
@@ -0,0 +1,139 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Unit tests for running chunkers in worker processes: the file through shared memory, the chunks back,
+replacing a broken pool and releasing the shared memory segments.
+"""
+
+import asyncio
+import importlib
+import multiprocessing
+import textwrap
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.shared_memory import SharedMemory
+
+import pytest
+
+chunk_pool = pytest.importorskip("rag.utils.chunk_pool")
+
+FAKE_CHUNKER = textwrap.dedent('''
+    import os
+
+
+    def chunk(filename, binary=None, die=False, fail=False, **kwargs):
+        if die:
+            os._exit(1)
+        if fail:
+            raise ValueError("cannot parse " + filename)
+        return [{"docnm_kwd": filename, "size": len(binary), "head": binary[:4], "tail": binary[-4:],
+                 "pid": os.getpid(), **kwargs}]
+''')
+
+
+@pytest.fixture
+def chunker(tmp_path, monkeypatch):
+    """A chunker module the spawned workers can import."""
+    (tmp_path / "fake_chunker.py").write_text(FAKE_CHUNKER)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    return importlib.import_module("fake_chunker")
+
+
+@pytest.fixture
+def pool(chunker, monkeypatch):
+    """One spawned worker, without the settings and models a real worker initializes."""
+    pools = []
+
+    def get_pool():
+        if chunk_pool._pool is None:
+            chunk_pool._pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+            pools.append(chunk_pool._pool)
+        return chunk_pool._pool
+
+    monkeypatch.setattr(chunk_pool, "CHUNK_PROCESSES", 1)
+    monkeypatch.setattr(chunk_pool, "_pool", None)
+    monkeypatch.setattr(chunk_pool, "_get_pool", get_pool)
+    yield pools
+    for p in pools:
+        p.shutdown(wait=True, cancel_futures=True)
+
+
+@pytest.fixture
+def segments(monkeypatch):
+    """The names of the shared memory segments chunk_pool creates."""
+    names = []
+
+    class RecordingSharedMemory(SharedMemory):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            if kwargs.get("create"):
+                names.append(self.name)
+
+    monkeypatch.setattr(chunk_pool, "SharedMemory", RecordingSharedMemory)
+    return names
+
+
+def _released(name):
+    try:
+        SharedMemory(name=name).close()
+    except FileNotFoundError:
+        return True
+    return False
+
+
+class TestChunkPool:
+    def test_round_trip_through_shared_memory(self, chunker, pool, segments):
+        binary = bytes(range(256)) * 4096
+        cks = asyncio.run(chunk_pool.chunk(chunker, "a.pdf", binary, lang="English"))
+        assert cks[0]["docnm_kwd"] == "a.pdf" and cks[0]["lang"] == "English"
+        assert cks[0]["size"] == len(binary)
+        assert (cks[0]["head"], cks[0]["tail"]) == (binary[:4], binary[-4:])
+        assert len(segments) == 1 and _released(segments[0])
+
+    def test_workers_are_reused(self, chunker, pool):
+        pids = {asyncio.run(chunk_pool.chunk(chunker, "a.txt", b"text"))[0]["pid"] for _ in range(3)}
+        assert len(pids) == 1 and len(pool) == 1
+
+    def test_empty_file_needs_no_segment(self, chunker, pool, segments):
+        cks = asyncio.run(chunk_pool.chunk(chunker, "empty.txt", b""))
+        assert cks[0]["size"] == 0
+        assert segments == []
+
+    def test_chunker_error_is_raised_and_segment_released(self, chunker, pool, segments):
+        with pytest.raises(ValueError, match="cannot parse bad.txt"):
+            asyncio.run(chunk_pool.chunk(chunker, "bad.txt", b"text", fail=True))
+        assert _released(segments[0])
+        # The worker survives a chunker error.
+        assert asyncio.run(chunk_pool.chunk(chunker, "a.txt", b"text"))[0]["size"] == 4
+        assert len(pool) == 1
+
+    def test_dead_worker_replaces_the_pool(self, chunker, pool, segments):
+        first = asyncio.run(chunk_pool.chunk(chunker, "a.txt", b"text"))[0]["pid"]
+        with pytest.raises(BrokenProcessPool):
+            asyncio.run(chunk_pool.chunk(chunker, "crash.txt", b"text", die=True))
+        assert chunk_pool._pool is None
+        assert all(_released(name) for name in segments)
+        # The next document gets a new pool and worker.
+        cks = asyncio.run(chunk_pool.chunk(chunker, "a.txt", b"text"))
+        assert cks[0]["pid"] != first
+        assert len(pool) == 2
+
+    def test_disabled_runs_in_a_thread(self, chunker, monkeypatch, segments):
+        monkeypatch.setattr(chunk_pool, "CHUNK_PROCESSES", 0)
+        monkeypatch.setattr(chunk_pool, "_get_pool", lambda: pytest.fail("no pool when disabled"))
+        cks = asyncio.run(chunk_pool.chunk(chunker, "a.txt", b"text"))
+        assert cks[0]["size"] == 4 and segments == []
@@ -0,0 +1,87 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Unit tests for the content-addressed embedding cache.
+"""
+
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from rag.utils import embedding_cache
+
+
+class FakeRedis:
+    def __init__(self):
+        self.store = {}
+
+    def mget_bin(self, keys, lru_key=None, lru_score=None):
+        return [self.store.get(k) for k in keys]
+
+    def mset_bin(self, mapping, exp=3600, lru_key=None, lru_score=None, lru_capacity=0):
+        self.store.update(mapping)
+        return True
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(embedding_cache, "REDIS_CONN", fake)
+    monkeypatch.setattr(embedding_cache, "EMBEDDING_CACHE_ENABLED", 1)
+    return fake
+
+
+class TestEmbeddingCache:
+    def test_pack_roundtrip(self):
+        v = np.random.rand(1024)
+        out = embedding_cache.unpack_vector(embedding_cache.pack_vector(v))
+        assert out.dtype == np.float32
+        assert np.allclose(out, v, atol=1e-6)
+
+    def test_key_depends_on_model_and_text(self):
+        k = embedding_cache.cache_key("bge-m3", "hello")
+        assert k == embedding_cache.cache_key("bge-m3", "hello")
+        assert k != embedding_cache.cache_key("bge-m3", "hello!")
+        assert k != embedding_cache.cache_key("text-embedding-3", "hello")
+
+    def test_model_key_identifies_served_model(self):
+        def mdl(**kw):
+            attrs = {"llm_name": "bge-m3", "llm_factory": "Ollama", "api_base": "http://a:11434",
+                     "tenant_id": "t1", "vector_size": 1024, **kw}
+            return SimpleNamespace(**attrs)
+
+        k = embedding_cache.model_key(mdl())
+        assert k == embedding_cache.model_key(mdl())
+        assert k != embedding_cache.model_key(mdl(llm_factory="OpenAI-API-Compatible"))
+        assert k != embedding_cache.model_key(mdl(api_base="http://b:11434"))
+        assert k != embedding_cache.model_key(mdl(tenant_id="t2"))
+        assert k != embedding_cache.model_key(mdl(vector_size=768))
+        # The dimension is unknown until a model serving the same deployment has encoded.
+        assert embedding_cache.model_key(mdl(llm_name="never-encoded", vector_size=None)) is None
+        assert embedding_cache.model_key(mdl(vector_size=None)) == embedding_cache.model_key(mdl(vector_size=768))
+
+    def test_only_misses_are_none(self, fake_redis):
+        embedding_cache.set_many("m", ["a", "b"], np.ones((2, 4)))
+        res = embedding_cache.get_many("m", ["a", "c", "b"])
+        assert res[1] is None
+        assert np.allclose(res[0], 1) and np.allclose(res[2], 1)
+
+    def test_no_model_name_bypasses_cache(self, fake_redis):
+        assert embedding_cache.set_many(None, ["a"], np.ones((1, 4))) is False
+        assert embedding_cache.get_many(None, ["a"]) == [None]
+        assert fake_redis.store == {}
@@ -0,0 +1,71 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import random
+import string
+from itertools import combinations
+
+import pytest
+
+from rag.graphrag.entity_blocking import candidate_pairs, is_similar_name
+
+
+def _names(num=300, seed=7):
+    rnd = random.Random(seed)
+    cjk = [chr(c) for c in range(0x4e00, 0x4e00 + 60)]
+    names = set()
+    for _ in range(num):
+        alphabet = cjk if rnd.random() < 0.4 else string.ascii_lowercase[:8] + " "
+        base = "".join(rnd.choices(alphabet, k=rnd.randint(1, 9))).strip()
+        if not base:
+            continue
+        names.add(base)
+        noisy = list(base)
+        noisy[rnd.randrange(len(noisy))] = rnd.choice(alphabet)
+        names.add("".join(noisy).strip())
+    return sorted(n for n in names if n)
+
+
+class TestCandidatePairs:
+
+    def test_prefix_matches_exhaustive(self):
+        names = _names()
+        exhaustive = [p for p in combinations(names, 2) if is_similar_name(*p)]
+        blocked = [p for p in candidate_pairs(names, method="prefix") if is_similar_name(*p)]
+        assert blocked == exhaustive
+        assert len(candidate_pairs(names, method="prefix")) < len(names) * (len(names) - 1) // 2
+
+    def test_anchors(self):
+        names = _names()
+        anchors = set(names[::5])
+        for method in ["all", "prefix", "minhash"]:
+            for a, b in candidate_pairs(names, anchors, method=method):
+                assert a in anchors or b in anchors
+                assert names.index(a) < names.index(b)
+        exhaustive = [p for p in combinations(names, 2)
+                      if (p[0] in anchors or p[1] in anchors) and is_similar_name(*p)]
+        assert [p for p in candidate_pairs(names, anchors, method="prefix") if is_similar_name(*p)] == exhaustive
+
+    def test_minhash_recall(self):
+        names = _names()
+        exhaustive = {p for p in combinations(names, 2) if is_similar_name(*p)}
+        found = {p for p in candidate_pairs(names, method="minhash", bands=64, rows=1) if is_similar_name(*p)}
+        assert found <= exhaustive
+        assert len(found) >= 0.9 * len(exhaustive)
+
+    def test_unknown_method(self):
+        with pytest.raises(ValueError):
+            candidate_pairs(["a", "b"], method="nope")
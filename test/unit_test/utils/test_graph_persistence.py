@@ -0,0 +1,256 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Unit tests for the columnar snapshots a knowledge graph is stored as, and for persisting it as a
+manifest, shards and per-source subgraphs.
+"""
+
+import asyncio
+import json
+
+import networkx as nx
+import pytest
+from networkx.readwrite import json_graph
+
+graph_utils = pytest.importorskip("rag.graphrag.utils")
+
+
+def _graph():
+    graph = nx.Graph(source_id=["d1", "d2"])
+    graph.add_node("A", entity_type="PERSON", description="a", source_id=["d1"], rank=2, pagerank=0.5)
+    graph.add_node("B", entity_type="ORG", description="b", source_id=["d1", "d2"], rank=2, pagerank=0.3)
+    graph.add_node("C", entity_type="ORG", description="c", source_id=["d2"], rank=2, pagerank=0.2)
+    graph.add_edge("A", "B", weight=2, description="ab", keywords=["k"], source_id=["d1"])
+    graph.add_edge("B", "C", weight=1, description="bc", keywords=[], source_id=["d2"])
+    graph.add_edge("A", "C", weight=1, description="ac", keywords=[], source_id=["d1", "d2"])
+    return graph
+
+
+def _load(content):
+    graph_attrs, nodes, edges = graph_utils.load_graph_snapshot(content)
+    return graph_attrs, dict(nodes), {(f, t): attrs for f, t, attrs in edges}
+
+
+class TestSnapshot:
+    @pytest.mark.parametrize("compress", [0, 1])
+    def test_round_trip(self, monkeypatch, compress):
+        monkeypatch.setattr(graph_utils, "GRAPH_SNAPSHOT_COMPRESS", compress)
+        graph = _graph()
+        content = graph_utils.dump_graph_snapshot(dict(graph.graph), list(graph.nodes(data=True)), list(graph.edges(data=True)))
+        graph_attrs, nodes, edges = _load(content)
+        assert graph_attrs == graph.graph
+        assert nodes == dict(graph.nodes(data=True))
+        assert edges == {(f, t): attrs for f, t, attrs in graph.edges(data=True)}
+
+    def test_missing_attributes_stay_missing(self):
+        content = graph_utils.dump_graph_snapshot({}, [("A", {"description": "a"}), ("B", {"entity_type": "ORG"})], [])
+        _, nodes, _ = _load(content)
+        assert nodes == {"A": {"description": "a"}, "B": {"entity_type": "ORG"}}
+
+    def test_legacy_node_link(self):
+        graph = _graph()
+        _, nodes, edges = _load(json.dumps(json_graph.node_link_data(graph, edges="edges")))
+        assert nodes == dict(graph.nodes(data=True))
+        assert len(edges) == 3
+
+    def test_subgraphs_keep_neither_rank_nor_pagerank(self):
+        graph = _graph()
+        subgraphs = graph_utils._graph_subgraphs(graph)
+        assert set(subgraphs) == {"d1", "d2"}
+        graph_attrs, nodes, edges = _load(subgraphs["d2"])
+        assert graph_attrs == {"source_id": ["d2"]}
+        assert set(nodes) == {"B", "C"}
+        assert all("rank" not in attrs and "pagerank" not in attrs for attrs in nodes.values())
+        assert all(attrs["source_id"] == ["d2"] for attrs in nodes.values())
+        assert list(edges) == [("B", "C")]
+        # Unchanged by a change of degree from another source.
+        graph.add_edge("A", "B2", weight=1, description="", keywords=[], source_id=["d1"])
+        graph.nodes["B2"].update(description="", source_id=["d1"])
+        assert graph_utils._graph_subgraphs(graph)["d2"] == subgraphs["d2"]
+
+
+class FakeDocStore:
+    """Records by id; supports the conditions the graph persistence deletes and searches with."""
+
+    def __init__(self):
+        self.records = {}
+        self.deleted = []
+
+    def insert(self, chunks):
+        for ck in chunks:
+            self.records[ck["id"]] = ck
+
+    @staticmethod
+    def _match(record, condition):
+        for k, v in condition.items():
+            values = v if isinstance(v, list) else [v]
+            field = record.get(k)
+            fields = field if isinstance(field, list) else [field]
+            if not set(values) & set(fields):
+                return False
+        return True
+
+    def delete(self, condition, index_name, kb_id):
+        ids = [i for i, r in self.records.items() if self._match(r, condition)]
+        for i in ids:
+            del self.records[i]
+        self.deleted.append(condition)
+        return len(ids)
+
+    def search(self, fields, highlight, condition, match_exprs, order_by, offset, limit, index_names, kb_ids):
+        return [r for r in self.records.values() if self._match(r, condition)][offset:offset + limit]
+
+    def get_fields(self, res, fields):
+        return {r["id"]: {f: r.get(f) for f in fields} for r in res}
+
+    def kinds(self, kind):
+        return {i: r for i, r in self.records.items() if r["knowledge_graph_kwd"] == kind}
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = FakeDocStore()
+    monkeypatch.setattr(graph_utils.settings, "docStoreConn", store)
+    monkeypatch.setattr(graph_utils, "GRAPH_SHARD_NUM", 4)
+    return store
+
+
+def _persist(store, graph):
+    """Persist as set_graph does; returns the ids of the records written."""
+    chunks = asyncio.run(graph_utils._persist_graph("tenant", "kb", graph, None))
+    store.insert(chunks)
+    return {ck["id"] for ck in chunks}
+
+
+def _manifest(store):
+    (record,) = store.kinds("graph").values()
+    return json.loads(record["content_with_weight"])
+
+
+def _shard_ids(*indexes):
+    return {graph_utils._graph_record_id("kb", "graph_shard", i) for i in indexes}
+
+
+class TestPersistGraph:
+    def test_first_write_is_full(self, store):
+        graph = _graph()
+        written = _persist(store, graph)
+        assert store.deleted == [{"knowledge_graph_kwd": ["graph", "graph_shard", "subgraph"]}]
+        assert len(store.kinds("graph_shard")) == 4
+        assert {r["source_id"][0] for r in store.kinds("subgraph").values()} == {"d1", "d2"}
+        assert written == set(store.records)
+        # The manifest holds no node or edge, only what locates them.
+        manifest = _manifest(store)
+        assert manifest["nodes"] == [] and manifest["edges"] == []
+        assert manifest["persist"]["pagerank"] == {"A": 0.5, "B": 0.3, "C": 0.2}
+
+    def test_unchanged_graph_rewrites_only_the_manifest(self, store):
+        graph = _graph()
+        _persist(store, graph)
+        store.deleted.clear()
+        written = _persist(store, graph)
+        assert written == {graph_utils._graph_record_id("kb", "graph")}
+        assert store.deleted == [{"id": [graph_utils._graph_record_id("kb", "graph")]}]
+
+    def test_pagerank_or_rank_change_rewrites_no_shard(self, store):
+        graph = _graph()
+        _persist(store, graph)
+        graph.nodes["A"]["pagerank"] = 0.9
+        graph.nodes["A"]["rank"] = 7
+        written = _persist(store, graph)
+        assert written == {graph_utils._graph_record_id("kb", "graph")}
+        assert _manifest(store)["persist"]["pagerank"]["A"] == 0.9
+
+    def test_changed_node_rewrites_its_shard_and_sources(self, store):
+        graph = _graph()
+        _persist(store, graph)
+        before = dict(store.records)
+        graph.nodes["C"]["description"] = "changed"
+        written = _persist(store, graph)
+        shard = _shard_ids(graph_utils._graph_shard_of("C", 4))
+        subgraph = {graph_utils._graph_record_id("kb", "subgraph", "d2")}
+        assert written == {graph_utils._graph_record_id("kb", "graph")} | shard | subgraph
+        # The other records are left as they were.
+        assert {i: r for i, r in store.records.items() if i not in written} == {i: r for i, r in before.items() if i not in written}
+
+    def test_removed_source_deletes_its_subgraph(self, store):
+        graph = _graph()
+        _persist(store, graph)
+        graph.remove_node("C")
+        graph.nodes["B"]["source_id"] = ["d1"]
+        graph.edges["A", "B"]["source_id"] = ["d1"]
+        graph.graph["source_id"] = ["d1"]
+        _persist(store, graph)
+        assert {r["source_id"][0] for r in store.kinds("subgraph").values()} == {"d1"}
+        assert len(store.kinds("graph_shard")) == 4
+        assert graph_utils._graph_record_id("kb", "subgraph", "d2") in {i for cond in store.deleted for i in cond.get("id", [])}
+
+    def test_dirty_shards_are_deleted_before_rewrite(self, store):
+        graph = _graph()
+        _persist(store, graph)
+        store.deleted.clear()
+        graph.add_node("D", entity_type="ORG", description="d", source_id=["d1"])
+        written = _persist(store, graph)
+        shard = _shard_ids(graph_utils._graph_shard_of("D", 4))
+        assert shard <= written
+        assert shard <= set(store.deleted[0]["id"])
+
+    def test_new_shard_number_rewrites_everything(self, store, monkeypatch):
+        graph = _graph()
+        _persist(store, graph)
+        monkeypatch.setattr(graph_utils, "GRAPH_SHARD_NUM", 2)
+        _persist(store, graph)
+        assert store.deleted[-1] == {"knowledge_graph_kwd": ["graph", "graph_shard", "subgraph"]}
+        assert len(store.kinds("graph_shard")) == 2
+
+
+class TestLoadGraph:
+    def _load(self, store):
+        return asyncio.run(graph_utils._load_graph("tenant", "kb", _manifest(store)))
+
+    def test_round_trip(self, store):
+        graph = _graph()
+        _persist(store, graph)
+        loaded = self._load(store)
+        assert loaded.graph["source_id"] == ["d1", "d2"]
+        assert dict(loaded.nodes(data=True)) == dict(graph.nodes(data=True))
+        assert {tuple(sorted((f, t))): a for f, t, a in loaded.edges(data=True)} == \
+            {tuple(sorted((f, t))): a for f, t, a in graph.edges(data=True)}
+
+    def test_load_persist_load(self, store):
+        _persist(store, _graph())
+        loaded = self._load(store)
+        loaded.nodes["A"]["description"] = "changed"
+        written = _persist(store, loaded)
+        assert written == {graph_utils._graph_record_id("kb", "graph")} | \
+            _shard_ids(graph_utils._graph_shard_of("A", 4)) | \
+            {graph_utils._graph_record_id("kb", "subgraph", "d1")}
+        again = self._load(store)
+        assert again.nodes["A"]["description"] == "changed"
+        assert dict(again.nodes(data=True)) == dict(loaded.nodes(data=True))
+
+    def test_rank_is_recomputed(self, store):
+        graph = _graph()
+        graph.nodes["A"]["rank"] = 100
+        _persist(store, graph)
+        assert self._load(store).nodes["A"]["rank"] == 2
+
+    def test_legacy_node_link_graph(self):
+        graph = _graph()
+        data = json_graph.node_link_data(graph, edges="edges")
+        loaded = asyncio.run(graph_utils._load_graph("tenant", "kb", data))
+        assert dict(loaded.nodes(data=True)) == dict(graph.nodes(data=True))
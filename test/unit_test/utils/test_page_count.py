@@ -0,0 +1,265 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Unit tests for the page and row counts from ranged reads.
+"""
+
+import io
+import random
+import zipfile
+import zlib
+
+import pytest
+
+from rag.utils.page_count import bytes_reader, pdf_page_number, xlsx_row_number
+
+
+def _pdf(pages: int, extra: bytes = b"", padding: int = 0) -> bytes:
+    """A PDF with a cross-reference table, and a comment of `padding` bytes before its objects."""
+    objs = [
+        b"<< /Type /Catalog /Outlines << /Count 99 >> /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % (3 + i) for i in range(pages)) +
+        b"] /Resources << /Count 7 >> /Count %d >>" % pages,
+    ] + [b"<< /Type /Page /Parent 2 0 R /Title (a >> b) >>"] * pages
+    out, offsets = bytearray(b"%PDF-1.4\n%" + b"x" * padding + b"\n"), []
+    for i, obj in enumerate(objs):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % (i + 1) + obj + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objs) + 1)
+    out += b"".join(b"%010d 00000 n \n" % o for o in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R %s>>\nstartxref\n%d\n%%%%EOF\n" % (len(objs) + 1, extra, xref)
+    return bytes(out)
+
+
+def _incremental(pdf: bytes, pages: int) -> bytes:
+    """`pdf` with its page tree root replaced by an incremental update."""
+    prev = int(pdf.rsplit(b"startxref", 1)[1].split()[0])
+    out = bytearray(pdf)
+    offset = len(out)
+    out += b"2 0 obj\n<< /Type /Pages /Kids [] /Count %d >>\nendobj\n" % pages
+    xref = len(out)
+    out += b"xref\n2 1\n%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size 3 /Root 1 0 R /Prev %d >>\nstartxref\n%d\n%%%%EOF\n" % (prev, xref)
+    return bytes(out)
+
+
+def _png_up(rows: list[bytes]) -> bytes:
+    out, prev = bytearray(), bytes(len(rows[0]))
+    for row in rows:
+        out += b"\x02" + bytes((a - b) & 0xFF for a, b in zip(row, prev))
+        prev = row
+    return bytes(out)
+
+
+def _compressed_pdf(pages: int) -> bytes:
+    """A PDF with a cross-reference stream, and the catalog and page tree root in an object stream."""
+    inner = [b"<< /Type /Catalog /Pages 2 0 R >>", b"<< /Type /Pages /Kids [] /Count 3 0 R >>", b"%d" % pages]
+    header, body = [], b""
+    for i, obj in enumerate(inner):
+        header.append(b"%d %d" % (i + 1, len(body)))
+        body += obj + b" "
+    header = b" ".join(header) + b" "
+    data = zlib.compress(header + body)
+
+    out = bytearray(b"%PDF-1.5\n")
+    objstm = len(out)
+    out += b"4 0 obj\n<< /Type /ObjStm /N 3 /First %d /Filter /FlateDecode /Length %d >>\nstream\n" % (
+        len(header), len(data)) + data + b"\nendstream\nendobj\n"
+    xref = len(out)
+    rows = [bytes([0, 0, 0, 255])] + [bytes([2, 0, 4, i]) for i in range(3)] + \
+           [bytes([1, objstm >> 8, objstm & 0xFF, 0]), bytes([1, xref >> 8, xref & 0xFF, 0])]
+    data = zlib.compress(_png_up(rows))
+    out += b"5 0 obj\n<< /Type /XRef /Size 6 /W [1 2 1] /Root 1 0 R /Filter [/FlateDecode] " \
+           b"/DecodeParms << /Predictor 12 /Columns 4 >> /Length %d >>\nstream\r\n" % len(data)
+    out += data + b"\nendstream\nendobj\nstartxref\n%d\n%%%%EOF\n" % xref
+    return bytes(out)
+
+
+def _reportlab_pdf(pages: int) -> bytes:
+    canvas = pytest.importorskip("reportlab.pdfgen.canvas")
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf)
+    for i in range(pages):
+        c.drawString(72, 720, f"Page {i + 1}")
+        c.showPage()
+    c.save()
+    return buf.getvalue()
+
+
+def _pypdf_incremental(pdf: bytes, pages: int) -> bytes:
+    """`pdf` with `pages` pages appended by a pypdf incremental update, which writes a cross-reference stream."""
+    pypdf = pytest.importorskip("pypdf")
+    writer = pypdf.PdfWriter(io.BytesIO(pdf), incremental=True)
+    writer.append(pypdf.PdfReader(io.BytesIO(_reportlab_pdf(pages))))
+    buf = io.BytesIO()
+    writer.write(buf)
+    return buf.getvalue()
+
+
+def _object_streams(pdf: bytes) -> bytes:
+    """`pdf` rewritten with its objects other than streams in an object stream, indexed by a cross-reference stream."""
+    pypdf = pytest.importorskip("pypdf")
+    reader = pypdf.PdfReader(io.BytesIO(pdf))
+    size = reader.trailer["/Size"]
+    streams, packed = {}, {}
+    for num in range(1, size):
+        obj = reader.get_object(num)
+        if obj is None:
+            continue
+        buf = io.BytesIO()
+        obj.write_to_stream(buf)
+        (streams if isinstance(obj, pypdf.generic.StreamObject) else packed)[num] = buf.getvalue()
+
+    out = bytearray(b"%PDF-1.5\n")
+    entries = {0: (0, 0, 65535)}
+    for num, data in streams.items():
+        entries[num] = (1, len(out), 0)
+        out += b"%d 0 obj\n" % num + data + b"\nendobj\n"
+
+    objstm, xref = size, size + 1
+    header, body = [], b""
+    for i, (num, data) in enumerate(packed.items()):
+        header.append(b"%d %d" % (num, len(body)))
+        body += data + b"\n"
+        entries[num] = (2, objstm, i)
+    header = b" ".join(header) + b"\n"
+    data = zlib.compress(header + body)
+    entries[objstm] = (1, len(out), 0)
+    out += b"%d 0 obj\n<< /Type /ObjStm /N %d /First %d /Filter /FlateDecode /Length %d >>\nstream\n" % (
+        objstm, len(packed), len(header), len(data)) + data + b"\nendstream\nendobj\n"
+
+    entries[xref] = (1, len(out), 0)
+    data = zlib.compress(b"".join(
+        bytes([t]) + a.to_bytes(4, "big") + b.to_bytes(2, "big")
+        for t, a, b in (entries.get(num, (0, 0, 0)) for num in range(xref + 1))))
+    root = reader.trailer.raw_get("/Root")
+    out += b"%d 0 obj\n<< /Type /XRef /Size %d /W [1 4 2] /Root %d %d R /Filter /FlateDecode /Length %d >>\nstream\n" % (
+        xref, xref + 1, root.idnum, root.generation, len(data)) + data + b"\nendstream\nendobj\n"
+    out += b"startxref\n%d\n%%%%EOF\n" % entries[xref][1]
+    return bytes(out)
+
+
+def _xlsx(dimensions: list[str | None], compression=zipfile.ZIP_DEFLATED) -> bytes:
+    rnd = random.Random(0)
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", compression) as zf:
+        zf.writestr("[Content_Types].xml", "<Types/>")
+        zf.writestr("xl/workbook.xml", "<workbook/>")
+        for i, dim in enumerate(dimensions):
+            rows = "".join(f'<row r="{r}"><c r="A{r}"><v>{rnd.getrandbits(128):x}</v></c></row>'
+                           for r in range(1, 2000))
+            dim = f'<dimension ref="{dim}"/>' if dim else ""
+            zf.writestr(f"xl/worksheets/sheet{i + 1}.xml",
+                        f'<worksheet xmlns="x"><sheetPr/>{dim}<sheetData>{rows}</sheetData></worksheet>')
+    return buf.getvalue()
+
+
+class _CountingReader:
+    def __init__(self, binary):
+        self.read = bytes_reader(binary)
+        self.bytes = 0
+
+    def __call__(self, offset, length):
+        data = self.read(offset, length)
+        self.bytes += len(data)
+        return data
+
+
+class TestPdfPageNumber:
+
+    @pytest.mark.parametrize("pages", [0, 1, 37])
+    def test_xref_table(self, pages):
+        assert pdf_page_number(bytes_reader(_pdf(pages))) == pages
+
+    def test_incremental_update(self):
+        assert pdf_page_number(bytes_reader(_incremental(_pdf(5), 8))) == 8
+
+    def test_xref_and_object_streams(self):
+        assert pdf_page_number(bytes_reader(_compressed_pdf(12))) == 12
+
+    def test_reads_only_the_tail_and_objects(self):
+        reader = _CountingReader(_pdf(3, padding=2_000_000))
+        assert pdf_page_number(reader) == 3
+        assert reader.bytes < 100_000
+
+    @pytest.mark.parametrize("pdf", [
+        _pdf(3, extra=b"/Encrypt 9 0 R "),
+        _pdf(3).replace(b"startxref", b"startxrex"),
+        b"not a pdf",
+    ])
+    def test_unsupported(self, pdf):
+        assert pdf_page_number(bytes_reader(pdf)) is None
+
+    def test_read_budget(self):
+        assert pdf_page_number(bytes_reader(_pdf(3)), max_bytes=1024) is None
+
+
+class TestPdfPageNumberOfGeneratedFiles:
+    """PDFs written by reportlab and pypdf: the count must match the parser's."""
+
+    @pytest.fixture(scope="class")
+    def total_page_number(self):
+        return pytest.importorskip("deepdoc.parser").PdfParser.total_page_number
+
+    @pytest.mark.parametrize("pages", [1, 9, 150])
+    def test_xref_table(self, total_page_number, pages):
+        pdf = _reportlab_pdf(pages)
+        assert pdf_page_number(bytes_reader(pdf)) == total_page_number("", pdf) == pages
+
+    def test_incremental_update(self, total_page_number):
+        original = _reportlab_pdf(4)
+        pdf = _pypdf_incremental(original, 3)
+        assert pdf.startswith(original) and b"/XRef" in pdf[len(original):]
+        assert pdf_page_number(bytes_reader(pdf)) == total_page_number("", pdf) == 7
+
+    @pytest.mark.parametrize("pages", [1, 150])
+    def test_object_streams(self, total_page_number, pages):
+        pdf = _object_streams(_reportlab_pdf(pages))
+        assert b"/ObjStm" in pdf and b"\nxref" not in pdf
+        assert pdf_page_number(bytes_reader(pdf)) == total_page_number("", pdf) == pages
+
+    def test_incremental_update_of_object_streams(self, total_page_number):
+        pdf = _pypdf_incremental(_object_streams(_reportlab_pdf(5)), 2)
+        assert pdf_page_number(bytes_reader(pdf)) == total_page_number("", pdf) == 7
+
+    def test_repeated_incremental_updates(self, total_page_number):
+        pdf = _pypdf_incremental(_pypdf_incremental(_reportlab_pdf(2), 1), 3)
+        assert pdf.count(b"%%EOF") == 3
+        assert pdf_page_number(bytes_reader(pdf)) == total_page_number("", pdf) == 6
+
+
+class TestXlsxRowNumber:
+
+    def test_sums_sheets(self):
+        assert xlsx_row_number(bytes_reader(_xlsx(["A1:C1999", "B2:D40"]))) == 2039
+
+    def test_stored(self):
+        assert xlsx_row_number(bytes_reader(_xlsx(["A1:C1999"], zipfile.ZIP_STORED))) == 1999
+
+    def test_reads_only_the_directory_and_sheet_heads(self):
+        binary = _xlsx(["A1:C1999"] * 4)
+        reader = _CountingReader(binary)
+        assert xlsx_row_number(reader) == 4 * 1999
+        assert reader.bytes < len(binary)
+
+    @pytest.mark.parametrize("dimensions", [["A1"], [None], ["A1:C20000"], ["A1:C10", None]])
+    def test_unreliable_dimension(self, dimensions):
+        assert xlsx_row_number(bytes_reader(_xlsx(dimensions))) is None
+
+    def test_not_a_zip(self):
+        assert xlsx_row_number(bytes_reader(b"a,b\n1,2\n")) is None
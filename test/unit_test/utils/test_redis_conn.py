@@ -0,0 +1,136 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Unit tests for reading several task queues in one round trip, and putting a claimed message back on its queue.
+"""
+
+import json
+
+import pytest
+
+pytest.importorskip("common.settings")
+redis_conn = pytest.importorskip("rag.utils.redis_conn")
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.reads = []
+
+    def xreadgroup(self, groupname, consumername, count, streams):
+        self.reads.append((list(streams)[0], count))
+
+    def execute(self, raise_on_error=True):
+        self.client.round_trips += 1
+        res = []
+        for queue_name, count in self.reads:
+            if queue_name in self.client.broken:
+                res.append(Exception("NOGROUP No such key or consumer group"))
+                continue
+            stream = self.client.streams.get(queue_name, [])
+            delivered = self.client.delivered.get(queue_name, 0)
+            entries = stream[delivered:delivered + count]
+            self.client.delivered[queue_name] = delivered + len(entries)
+            res.append([[queue_name, entries]] if entries else [])
+        return res
+
+
+class FakeClient:
+    """Streams of (message ID, payload), read by a single consumer group."""
+
+    def __init__(self):
+        self.streams = {}
+        self.delivered = {}
+        self.groups = []
+        self.broken = set()
+        self.round_trips = 0
+        self.acked = []
+
+    def add(self, queue_name, *task_ids):
+        stream = self.streams.setdefault(queue_name, [])
+        for task_id in task_ids:
+            stream.append((f"{len(stream)}-0", {"message": json.dumps({"id": task_id})}))
+
+    def xgroup_create(self, queue_name, group_name, id="0", mkstream=False):
+        self.groups.append(queue_name)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def xrange(self, queue_name, start, end):
+        return [e for e in self.streams.get(queue_name, []) if start <= e[0] <= end]
+
+    def xadd(self, queue_name, payload):
+        self.add(queue_name, json.loads(payload["message"])["id"])
+
+    def xack(self, queue_name, group_name, msg_id):
+        self.acked.append((queue_name, msg_id))
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    conn = object.__new__(type(redis_conn.REDIS_CONN))
+    conn.REDIS = FakeClient()
+    conn._consumer_groups = set()
+    monkeypatch.setattr(conn, "__open__", lambda: None)
+    return conn
+
+
+def _read(conn, queue_counts):
+    return [(m.get_queue_name(), m.get_message()["id"]) for m in conn.queue_consumer_batch(queue_counts, "group", "consumer")]
+
+
+class TestQueueConsumerBatch:
+    def test_reads_every_queue_in_one_round_trip(self, conn):
+        conn.REDIS.add("q1", "a", "b", "c")
+        conn.REDIS.add("q0", "d", "e")
+        assert _read(conn, [("q1", 2), ("q0", 2)]) == [("q1", "a"), ("q1", "b"), ("q0", "d"), ("q0", "e")]
+        assert conn.REDIS.round_trips == 1
+
+    def test_partial_batch(self, conn):
+        conn.REDIS.add("q1", "a")
+        assert _read(conn, [("q1", 4), ("q0", 1)]) == [("q1", "a")]
+        assert _read(conn, [("q1", 4), ("q0", 1)]) == []
+
+    def test_zero_counts_are_not_read(self, conn):
+        conn.REDIS.add("q0", "a")
+        assert _read(conn, [("q1", 0), ("q0", 0)]) == []
+        assert conn.REDIS.round_trips == 0
+        assert conn.REDIS.groups == []
+
+    def test_consumer_groups_are_created_once(self, conn):
+        _read(conn, [("q1", 1), ("q0", 1)])
+        _read(conn, [("q1", 1), ("q0", 1)])
+        assert conn.REDIS.groups == ["q1", "q0"]
+
+    def test_broken_queue_does_not_hide_the_others(self, conn):
+        conn.REDIS.add("q1", "a")
+        conn.REDIS.add("q0", "b")
+        conn.REDIS.broken.add("q1")
+        assert _read(conn, [("q1", 1), ("q0", 1)]) == [("q0", "b")]
+        # The group of the broken queue is created again on the next read.
+        conn.REDIS.broken.clear()
+        assert _read(conn, [("q1", 1), ("q0", 1)]) == [("q1", "a")]
+        assert conn.REDIS.groups == ["q1", "q0", "q1"]
+
+
+class TestRequeue:
+    def test_message_is_added_once_and_acked(self, conn):
+        conn.REDIS.add("q0", "a")
+        conn.requeue_msg("q0", "group", "0-0")
+        assert [json.loads(payload["message"])["id"] for _, payload in conn.REDIS.streams["q0"]] == ["a", "a"]
+        assert conn.REDIS.acked == [("q0", "0-0")]
@@ -0,0 +1,259 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Unit tests for the ranged reads and stat of the storage backends, against mocked clients.
+
+Each fake client serves its service's range semantics over in-memory objects, so the tests check how
+a backend translates negative offsets and reads past the end of an object into requests.
+"""
+
+import hashlib
+import inspect
+
+import pytest
+
+DATA = b"0123456789"
+ETAG = hashlib.md5(DATA).hexdigest()
+
+
+def _backend(factory, **attrs):
+    """An instance of the @singleton class behind `factory`, without connecting to the service."""
+    cls = inspect.getclosurevars(factory).nonlocals["cls"]
+    obj = cls.__new__(cls)
+    obj.__dict__.update(attrs)
+    obj.__open__ = lambda: None
+    return obj
+
+
+def _http_range(header: str, size: int) -> tuple[int, int] | None:
+    """[start, end) of an HTTP Range header over `size` bytes; None if it can't be satisfied."""
+    spec = header.removeprefix("bytes=")
+    if spec.startswith("-"):
+        return max(0, size + int(spec)), size
+    start, _, end = spec.partition("-")
+    if int(start) >= size:
+        return None
+    return int(start), min(size, int(end) + 1) if end else size
+
+
+class FakeError(Exception):
+    def __init__(self, code=None, status_code=None):
+        super().__init__(code or status_code)
+        self.code = code
+        self.status_code = status_code
+        self.response = {"Error": {"Code": code}}
+
+
+class _Body:
+    def __init__(self, data):
+        self.data = data
+        self.closed = False
+
+    def read(self):
+        return self.data
+
+    readall = read
+
+    def close(self):
+        self.closed = True
+
+    def release_conn(self):
+        pass
+
+
+# Minio
+
+
+class FakeMinio:
+    def __init__(self, objects):
+        self.objects = objects
+        self.requests = []
+
+    def stat_object(self, bucket, name):
+        if (bucket, name) not in self.objects:
+            raise FakeError("NoSuchKey")
+        return type("Stat", (), {"size": len(self.objects[(bucket, name)]), "etag": ETAG})
+
+    def get_object(self, bucket, name, offset=0, length=0):
+        self.requests.append((offset, length))
+        data = self.objects[(bucket, name)]
+        if offset >= len(data):
+            raise FakeError("InvalidRange")
+        return _Body(data[offset:offset + length] if length else data[offset:])
+
+
+# S3 and OSS
+
+
+class FakeS3:
+    def __init__(self, objects):
+        self.objects = objects
+        self.requests = []
+
+    def get_object(self, Bucket, Key, Range=None):
+        self.requests.append(Range)
+        data = self.objects[(Bucket, Key)]
+        span = _http_range(Range, len(data))
+        if span is None:
+            raise FakeError("InvalidRange")
+        return {"Body": _Body(data[span[0]:span[1]])}
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise FakeError("404")
+        return {"ContentLength": len(self.objects[(Bucket, Key)]), "ETag": ETAG}
+
+
+# Azure
+
+
+class FakeAzureBlob:
+    def __init__(self, objects, name):
+        self.objects = objects
+        self.name = name
+
+    def _data(self):
+        if self.name not in self.objects:
+            raise FakeError(status_code=404)
+        return self.objects[self.name]
+
+    def properties(self):
+        return type("Properties", (), {"size": len(self._data()), "etag": ETAG})
+
+    get_blob_properties = get_file_properties = properties
+
+    def download(self, offset=None, length=None):
+        data = self._data()
+        if offset >= len(data):
+            raise FakeError(status_code=416)
+        return _Body(data[offset:offset + length])
+
+    download_file = download
+
+
+class FakeAzureContainer:
+    def __init__(self, objects):
+        self.objects = objects
+
+    def get_blob_client(self, name):
+        return FakeAzureBlob(self.objects, name)
+
+    get_file_client = get_blob_client
+
+    def download_blob(self, name, offset=None, length=None):
+        return FakeAzureBlob(self.objects, name).download(offset, length)
+
+
+# GCS
+
+
+class FakeGCSBlob:
+    def __init__(self, objects, path):
+        self.objects = objects
+        self.path = path
+        self.size = len(objects.get(path, b""))
+        self.etag = ETAG
+
+    def download_as_bytes(self, start=None, end=None):
+        if self.path not in self.objects:
+            raise FakeNotFound(self.path)
+        data = self.objects[self.path]
+        if start >= len(data):
+            raise FakeRangeNotSatisfiable(self.path)
+        return data[start:end + 1]
+
+
+class FakeGCSBucket:
+    def __init__(self, objects):
+        self.objects = objects
+
+    def blob(self, path):
+        return FakeGCSBlob(self.objects, path)
+
+    def get_blob(self, path):
+        return FakeGCSBlob(self.objects, path) if path in self.objects else None
+
+
+class FakeNotFound(Exception):
+    pass
+
+
+class FakeRangeNotSatisfiable(Exception):
+    pass
+
+
+@pytest.fixture(params=["minio", "s3", "oss", "azure_sas", "azure_spn", "gcs"])
+def storage(request, monkeypatch):
+    """A backend over one object "b/f" holding DATA, through a fake client."""
+    # The connectors import common.settings, which imports them back: it must be loaded first.
+    pytest.importorskip("common.settings")
+    if request.param == "minio":
+        conn = pytest.importorskip("rag.utils.minio_conn")
+        monkeypatch.setattr(conn, "S3Error", FakeError)
+        return _backend(conn.RAGFlowMinio, bucket=None, prefix_path=None, conn=FakeMinio({("b", "f"): DATA}))
+    if request.param in ("s3", "oss"):
+        conn = pytest.importorskip(f"rag.utils.{request.param}_conn")
+        monkeypatch.setattr(conn, "ClientError", FakeError)
+        client = FakeS3({("b", "f"): DATA})
+        if request.param == "s3":
+            return _backend(conn.RAGFlowS3, bucket=None, prefix_path=None, conn=[client])
+        return _backend(conn.RAGFlowOSS, bucket=None, prefix_path=None, conn=client)
+    if request.param == "azure_sas":
+        conn = pytest.importorskip("rag.utils.azure_sas_conn")
+        monkeypatch.setattr(conn, "HttpResponseError", FakeError)
+        return _backend(conn.RAGFlowAzureSasBlob, conn=FakeAzureContainer({"f": DATA}))
+    if request.param == "azure_spn":
+        conn = pytest.importorskip("rag.utils.azure_spn_conn")
+        monkeypatch.setattr(conn, "HttpResponseError", FakeError)
+        return _backend(conn.RAGFlowAzureSpnBlob, conn=FakeAzureContainer({"f": DATA}))
+    conn = pytest.importorskip("rag.utils.gcs_conn")
+    monkeypatch.setattr(conn, "NotFound", FakeNotFound)
+    monkeypatch.setattr(conn, "RequestRangeNotSatisfiable", FakeRangeNotSatisfiable)
+    client = type("Client", (), {"bucket": lambda self, name: FakeGCSBucket({"b/f": DATA})})()
+    return _backend(conn.RAGFlowGCS, bucket_name="main", client=client)
+
+
+class TestBackendRanges:
+    def test_reads_range(self, storage):
+        assert storage.get_range("b", "f", 0, 4) == b"0123"
+        assert storage.get_range("b", "f", 2, 3) == b"234"
+
+    def test_negative_offset_counts_from_end(self, storage):
+        assert storage.get_range("b", "f", -4, 2) == b"67"
+        assert storage.get_range("b", "f", -4, 10) == b"6789"
+
+    def test_negative_offset_before_start(self, storage):
+        assert storage.get_range("b", "f", -20, 3) == b"012"
+
+    def test_range_over_end_is_short(self, storage):
+        assert storage.get_range("b", "f", 8, 10) == b"89"
+
+    def test_range_past_end_is_empty(self, storage):
+        assert storage.get_range("b", "f", 10, 5) == b""
+        assert storage.get_range("b", "f", 20, 5) == b""
+
+    def test_empty_range(self, storage):
+        assert storage.get_range("b", "f", 3, 0) == b""
+
+    def test_stream_reads_whole_object(self, storage, monkeypatch):
+        monkeypatch.setattr("rag.utils.storage_base.STORAGE_STREAM_CHUNK_SIZE", 4)
+        assert storage.ranged_reads is True
+        assert storage.open_stream("b", "f", tenant_id="t").read() == DATA
+
+    def test_stat(self, storage):
+        assert storage.stat("b", "f", tenant_id="t") == {"size": len(DATA), "etag": ETAG}
+        assert storage.stat("b", "missing") is None
@@ -0,0 +1,171 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+"""
+Unit tests for the storage defaults and the read-through cache.
+"""
+
+import hashlib
+
+import pytest
+
+from rag.utils.storage_base import StorageBase
+from rag.utils.storage_cache import ReadThroughCache
+
+
+class MemoryStorage(StorageBase):
+    def __init__(self, etags: bool = True):
+        self.objects = {}
+        self.etags = etags
+        self.gets = 0
+
+    def put(self, bucket, fnm, binary, tenant_id=None):
+        self.objects[(bucket, fnm)] = binary
+        return True
+
+    def rm(self, bucket, fnm, tenant_id=None):
+        self.objects.pop((bucket, fnm), None)
+
+    def get(self, bucket, fnm, tenant_id=None):
+        self.gets += 1
+        return self.objects.get((bucket, fnm))
+
+    def stat(self, bucket, fnm, tenant_id=None):
+        binary = self.objects.get((bucket, fnm))
+        if binary is None or not self.etags:
+            return None
+        return {"size": len(binary), "etag": hashlib.md5(binary).hexdigest()}
+
+
+class RangedMemoryStorage(MemoryStorage):
+    ranged_reads = True
+
+    def __init__(self):
+        super().__init__()
+        self.ranges = []
+
+    def get_range(self, bucket, fnm, offset, length, tenant_id=None):
+        self.ranges.append((offset, length))
+        return self.objects[(bucket, fnm)][offset:offset + length]
+
+
+class TestStorageBase:
+    def test_get_range_slices_object(self):
+        storage = MemoryStorage()
+        storage.put("b", "f", b"0123456789")
+        assert storage.get_range("b", "f", 2, 3) == b"234"
+        assert storage.get_range("b", "f", -4, 2) == b"67"
+        assert storage.get_range("b", "f", 8, 10) == b"89"
+        assert storage.get_range("b", "missing", 0, 1) is None
+
+    def test_open_stream_reads_whole_object(self):
+        storage = MemoryStorage()
+        storage.put("b", "f", b"abc")
+        assert storage.open_stream("b", "f").read() == b"abc"
+        assert storage.open_stream("b", "missing") is None
+
+    def test_open_stream_reads_in_ranges(self, monkeypatch):
+        monkeypatch.setattr("rag.utils.storage_base.STORAGE_STREAM_CHUNK_SIZE", 4)
+        storage = RangedMemoryStorage()
+        storage.put("b", "f", b"0123456789")
+        assert storage.open_stream("b", "f").read() == b"0123456789"
+        assert storage.ranges == [(0, 4), (4, 4), (8, 4)]
+        assert storage.gets == 0
+
+    def test_put_many_and_rm_many(self):
+        storage = MemoryStorage()
+        items = [("b", f"f{i}", bytes([i])) for i in range(20)]
+        assert storage.put_many(items) == [True] * 20
+        assert storage.get("b", "f7") == b"\x07"
+        storage.rm_many([("b", f"f{i}") for i in range(10)])
+        assert sorted(fnm for _, fnm in storage.objects) == sorted(f"f{i}" for i in range(10, 20))
+
+
+class TestReadThroughCache:
+    @pytest.fixture
+    def storage(self):
+        return MemoryStorage()
+
+    @pytest.fixture
+    def cache(self, storage, tmp_path):
+        return ReadThroughCache(storage, directory=str(tmp_path), max_bytes=8000)
+
+    def test_downloads_once(self, storage, cache):
+        storage.put("b", "f", b"x" * 100)
+        assert cache.get("b", "f") == b"x" * 100
+        assert cache.get("b", "f") == b"x" * 100
+        assert cache.get_range("b", "f", 10, 5) == b"x" * 5
+        with cache.open_stream("b", "f") as f:
+            assert f.read() == b"x" * 100
+        assert storage.gets == 1
+
+    def test_stream_reads_through(self, storage, cache):
+        storage.put("b", "f", b"x" * 100)
+        with cache.open_stream("b", "f") as f:
+            assert f.read() == b"x" * 100
+        with cache.open_stream("b", "f") as f:
+            assert f.read() == b"x" * 100
+        assert cache.get("b", "f") == b"x" * 100
+        assert storage.gets == 1
+        assert cache.open_stream("b", "missing") is None
+
+    def test_new_version_downloaded_again(self, storage, cache, tmp_path):
+        storage.put("b", "f", b"old")
+        cache.get("b", "f")
+        # Overwritten behind the cache.
+        storage.put("b", "f", b"new")
+        assert cache.get("b", "f") == b"new"
+        assert storage.gets == 2
+        assert len([p for p in tmp_path.rglob("*") if p.is_file()]) == 1
+
+    def test_writes_invalidate(self, storage, cache, tmp_path):
+        cache.put("b", "f", b"one")
+        cache.get("b", "f")
+        cache.put("b", "f", b"two")
+        assert not [p for p in tmp_path.rglob("*") if p.is_file()]
+        assert cache.get("b", "f") == b"two"
+        cache.rm_many([("b", "f")])
+        assert not [p for p in tmp_path.rglob("*") if p.is_file()]
+        assert cache.get("b", "f") is None
+
+    def test_evicts_least_recently_read(self, storage, cache, tmp_path):
+        for i in range(10):
+            storage.put("b", f"f{i}", bytes([i]) * 1000)
+            cache.get("b", f"f{i}")
+        assert sum(p.stat().st_size for p in tmp_path.rglob("*") if p.is_file()) <= 8000
+        storage.gets = 0
+        cache.get("b", "f9")
+        assert storage.gets == 0
+        cache.get("b", "f0")
+        assert storage.gets == 1
+
+    def test_large_objects_not_cached(self, storage, cache):
+        storage.put("b", "f", b"x" * 2000)
+        cache.get("b", "f")
+        cache.get("b", "f")
+        assert storage.gets == 2
+
+    def test_without_etag_not_cached(self, tmp_path):
+        storage = MemoryStorage(etags=False)
+        cache = ReadThroughCache(storage, directory=str(tmp_path), max_bytes=8000)
+        storage.put("b", "f", b"abc")
+        assert cache.get("b", "f") == b"abc"
+        assert cache.get("b", "f") == b"abc"
+        assert storage.gets == 2
+
+    def test_delegates_other_methods(self, storage, cache):
+        assert cache.ranged_reads is False
+        assert cache.objects is storage.objects